@@ -1,6 +1,12 @@
-import cirq
 import numpy as np
 import itertools
+from concurrent.futures import ProcessPoolExecutor
+from tool.lazy import lazy_import
+
+# simulator backends are imported on first use
+cirq = lazy_import('cirq')
+qsimcirq = lazy_import('qsimcirq')
+sympy = lazy_import('sympy')
 
 def init_qubits(num_qubits):
     num_data,num_syndrome,num_flag = num_qubits
@@ -96,6 +102,118 @@ def create_qsim_circuit(num_qubits,gate_seq,noise_model=None,readout_noise=None,
 
     return circuit,q
 
+# cirq.Gate subclass of symbolic_channel, defined on first use so that cirq stays lazily imported
+_symbolic_channel_type = []
+
+def symbolic_channel(channel,strength,num_qubits=1):
+    '''
+    Noise channel with a symbolic strength, resolved into channel(value) by cirq.resolve_parameters
+    (the cirq channels reject sympy probabilities), so that a noisy circuit is built once for a whole sweep
+    Input:
+        channel: channel constructor taking the strength, e.g. cirq.depolarize or cirq.bit_flip
+        strength: sympy expression, symbol name or number
+    Output:
+        gate: single-qubit gate, usable as a noise model gate or readout noise
+    '''
+    if not _symbolic_channel_type:
+        class SymbolicChannel(cirq.Gate):
+            def __init__(self,channel,strength,num_qubits):
+                self.channel,self.strength,self._n = channel,strength,num_qubits
+            def _num_qubits_(self):
+                return self._n
+            def _is_parameterized_(self):
+                return cirq.is_parameterized(self.strength)
+            def _parameter_names_(self):
+                return cirq.parameter_names(self.strength)
+            def _resolve_parameters_(self,resolver,recursive):
+                value = resolver.value_of(self.strength,recursive)
+                if cirq.is_parameterized(value):
+                    return SymbolicChannel(self.channel,value,self._n)
+                return self.channel(float(value)) if self._n == 1 else self.channel(float(value),self._n)
+            def _value_equality_values_(self):
+                return self.channel,self.strength,self._n
+            def __eq__(self,other):
+                return isinstance(other,SymbolicChannel) and self._value_equality_values_() == other._value_equality_values_()
+            def __hash__(self):
+                return hash(self._value_equality_values_())
+            def _circuit_diagram_info_(self,args):
+                return f'{self.channel.__name__}({self.strength})'
+        _symbolic_channel_type.append(SymbolicChannel)
+    if isinstance(strength,str):
+        strength = sympy.Symbol(strength)
+    return _symbolic_channel_type[0](channel,strength,num_qubits)
+
+def parametric_noise(depol='p_depol',readout='p_readout'):
+    '''
+    Symbolic version of the notebook noise: depolarize(p_depol) on the qubits of every gate and bit_flip(p_readout)
+    before every measurement
+    Output:
+        noise_model,readout_noise: to pass to create_cirq, create_qsim_circuit or QND_fidelity_measures
+    '''
+    noise_model = cirq.ConstantQubitNoiseModel(symbolic_channel(cirq.depolarize,depol))
+    readout_noise = symbolic_channel(cirq.bit_flip,readout)
+    return noise_model,readout_noise
+
+# cirq.NoiseModel subclass of cirq_noise, defined on first use like SymbolicChannel
+_pauli_noise_type = []
+
+def _cirq_channel(channel):
+    errors,probs = channel
+    return cirq.asymmetric_depolarize(error_probabilities={error.replace('-','I'):p for error,p in zip(errors,probs)})
+
+def cirq_noise(noise_model,qubits):
+    '''
+    Gate and readout noise of a tool.noise_model.NoiseModel, the model sampled by the tool simulators, so that the
+    same heterogeneous noise (per gate and qubit, biased, correlated two-qubit channels) runs on qsim
+    Input:
+        noise_model: tool.noise_model.NoiseModel, gates named 'H', 'CX', 'CZ', 'S' (str(gate) otherwise)
+        qubits: cirq qubits of the circuit, qubit i of the model is qubits[i] (q of create_cirq)
+    Output:
+        noise_model,readout_noise: to pass to create_cirq, create_qsim_circuit or QND_fidelity_measures
+    '''
+    if not _pauli_noise_type:
+        class PauliNoiseModel(cirq.NoiseModel):
+            def __init__(self,noise_model,qubits):
+                self.model,self.index = noise_model,{q:i for i,q in enumerate(qubits)}
+                self.names = {cirq.H:'H',cirq.CX:'CX',cirq.CZ:'CZ',cirq.S:'S'}
+            def noisy_operation(self,operation):
+                if cirq.is_measurement(operation):
+                    return operation
+                channel = self.model.channel(self.names.get(operation.gate,str(operation.gate)),
+                                             tuple(self.index[q] for q in operation.qubits))
+                if channel is None:
+                    return operation
+                return [operation,_cirq_channel(channel).on(*operation.qubits)]
+            def on_each(self,*targets):
+                # readout noise of create_cirq
+                return [cirq.bit_flip(p).on(q) for q in targets
+                        for p in [self.model.measurement_probability(self.index[q])] if p > 0]
+        _pauli_noise_type.append(PauliNoiseModel)
+    noise = _pauli_noise_type[0](noise_model,qubits)
+    return noise,noise
+
+def noise_grid(ps_readout,ps_depol,readout='p_readout',depol='p_depol'):
+    '''
+    Resolvers of the (readout, depolarizing) grid, readout in the outer loop as in the notebook sweeps
+    '''
+    return list(cirq.to_resolvers(cirq.Product(cirq.Points(readout,list(ps_readout)),cirq.Points(depol,list(ps_depol)))))
+
+def run_sweep(circuit,params,repetitions,seed=None,simulator=None):
+    '''
+    Run a parametric circuit at every point of a sweep, without rebuilding it
+    One qsim simulator memoizes the translation of every resolved circuit, so repeated points
+    (e.g. the same grid for several initial states) are translated once
+    Input:
+        params: cirq sweep or list of resolvers (noise_grid)
+        simulator: qsimcirq.QSimSimulator to reuse, a new seeded one by default
+    Output:
+        measurements: list of dicts of measurement key -> array (repetitions x qubits), one per point
+    '''
+    resolvers = list(cirq.to_resolvers(params))
+    if simulator is None:
+        simulator = qsimcirq.QSimSimulator(seed=seed,circuit_memoization_size=max(len(resolvers),1))
+    return [simulator.run(circuit,param_resolver=resolver,repetitions=repetitions).measurements for resolver in resolvers]
+
 def signed_probs(mmts,num_qubit):
     '''
     For calculating expectation values of strings of the same pauli
@@ -125,4 +243,147 @@ def tab2circ(tab,qubits):
     circ += cirq.Z.on_each(qubits[(tabZ==1) & (tabX==0)])
     circ += cirq.X.on_each(qubits[(tabZ==0) & (tabX==1)])
     circ += cirq.Y.on_each(qubits[(tabZ==1) & (tabX==1)])
-    return circ
\ No newline at end of file
+    return circ
+
+# per-process context of the shot-parallel executor, set by _init_qsim_worker
+_qsim_worker = {}
+
+def _init_qsim_worker(circuit):
+    '''
+    Keep the circuit in the worker and warm up qsim on it once
+    '''
+    _qsim_worker['circuit'] = circuit
+    qsimcirq.QSimSimulator(seed=0).run(circuit, repetitions=1)
+
+def _run_qsim_chunk(args):
+    repetitions,seed = args
+    results = qsimcirq.QSimSimulator(seed=seed).run(_qsim_worker['circuit'], repetitions=repetitions)
+    return results.measurements
+
+def run_sharded(circuit,repetitions,seed=None,num_workers=None,chunk_size=1024,writer=None):
+    '''
+    Run a circuit with qsim, spreading the repetitions over a process pool
+    Repetitions are split into fixed-size chunks with seeds spawned from the master seed,
+    and merged in chunk order: results are bit-identical for any num_workers
+    Input:
+        num_workers: number of processes (default: number of CPUs), 1 runs in this process
+        writer: tool.shot_records.ShotRecordWriter, chunks are appended to it as they arrive
+                instead of being merged in memory
+    Output:
+        measurements: dict of measurement key -> array (repetitions x qubits), None with a writer
+    '''
+    if repetitions == 0:
+        return None if writer is not None else \
+            {key:np.zeros([0,width],dtype=int) for key,width in measurement_layout(circuit).items()}
+    sizes = [min(chunk_size,repetitions-start) for start in range(0,repetitions,chunk_size)]
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(len(sizes))]
+    if num_workers == 1:
+        _init_qsim_worker(circuit)
+        chunks = map(_run_qsim_chunk,zip(sizes,seeds))
+        return _collect_chunks(chunks,writer)
+    with ProcessPoolExecutor(num_workers,initializer=_init_qsim_worker,initargs=(circuit,)) as executor:
+        return _collect_chunks(executor.map(_run_qsim_chunk,zip(sizes,seeds)),writer)
+
+def _collect_chunks(chunks,writer=None):
+    if writer is not None:
+        for chunk in chunks:
+            writer.append(chunk)
+        return None
+    chunks = list(chunks)
+    return {key:np.concatenate([chunk[key] for chunk in chunks]) for key in chunks[0]}
+
+def measurement_layout(circuit):
+    '''
+    Measurement keys of a circuit with their number of qubits, in moment order (key_widths of a ShotRecordWriter)
+    '''
+    return {cirq.measurement_key_name(op):len(op.qubits) for op in circuit.all_operations() if cirq.is_measurement(op)}
+
+def signed_expectation(mmts_full,locs):
+    '''
+    For calculating expectation values of strings of the same pauli on the qubits `locs`
+    Eg: <ZZ> = P00 - P01 - P10 + P11
+    '''
+    outcomes = np.array(list(itertools.product([0,1],repeat=len(locs))))
+    mmts = mmts_full[:,locs]
+    signs = (-1)**(outcomes.sum(1)%2) #minus for odd number of 1s
+    probs = []
+    for outcome in outcomes:
+        probs.append((mmts==outcome).prod(1).sum()/mmts.shape[0])
+    return (signs*probs).sum()
+
+def QND_fidelity_measures(num_qubits,in_circuit,circuit,noise_model,readout_noise,num_rep=1024,seed=0,print_circ=False,
+                          num_workers=1,chunk_size=None,param_resolver=None,simulator=None):
+    '''
+    Flagged percentage and QSP fidelity of the X-stabilizer circuits `circuit` (moved from full_steane_flagged)
+    Input:
+        num_workers,chunk_size: shard the repetitions over processes (see run_sharded),
+                                chunk_size=None runs all repetitions with a single simulator
+        param_resolver: values of the noise symbols of parametric circuits and noise (parametric_noise)
+        simulator: qsimcirq.QSimSimulator reused across calls (its translations are memoized), chunk_size=None only
+    '''
+    # Direct measurement in X basis
+    hadamards = [[i] for i in range(num_qubits[0])]
+    mmts = ['m']+list(range(num_qubits[0]))
+    qubits = init_qubits(num_qubits)
+    in_circuit_measureX = create_cirq(qubits,[*hadamards,mmts],noise_model,readout_noise,['in_X_on_data'])
+    circuit_measureX = create_cirq(qubits,[*hadamards,mmts],noise_model,readout_noise,['X_on_data'])
+    full_circuit = in_circuit + in_circuit_measureX +\
+                    in_circuit + circuit + circuit_measureX
+    if print_circ: print(full_circuit)
+    if chunk_size is None:
+        simulator = qsimcirq.QSimSimulator(seed=seed) if simulator is None else simulator
+        measurements = simulator.run(full_circuit, param_resolver=param_resolver, repetitions=num_rep).measurements
+    else:
+        if param_resolver is not None:
+            full_circuit = cirq.resolve_parameters(full_circuit,param_resolver)
+        measurements = run_sharded(full_circuit,num_rep,seed,num_workers,chunk_size)
+
+    flags = np.hstack([measurements['flag_X1'],
+                       measurements['flag_X2'],
+                       measurements['flag_X3']])
+    if flags.shape[1] > 1:
+        flags = flags.sum(1).astype(bool).astype(int) # combine the triggered flags
+    unflagged_loc = (flags.flatten()==0)
+
+    synds = np.hstack([measurements['synd_X1'],
+                       measurements['synd_X2'],
+                       measurements['synd_X3']])
+    eigstate_locs = []
+    outcomes = np.array(list(itertools.product(range(2),repeat=3)))
+    for outcome in outcomes:
+        eigstate_locs.append((synds == np.array(outcome)).all(1))
+
+    measureX_out_eigstate = []
+    pancilla_unflagged = []
+    for loc in eigstate_locs:
+        measureX_out_eigstate.append(measurements['X_on_data'][unflagged_loc*loc])
+        pancilla_unflagged.append((unflagged_loc*loc).sum() / unflagged_loc.sum())
+    pancilla_unflagged = np.array(pancilla_unflagged)
+
+    flagged = (1-unflagged_loc.sum()/len(unflagged_loc))
+    print(f'\nFlagged percentage:\t {flagged*100:.2f} %')
+
+    # QSP fidelity
+    # Hard-coding signs and which qubits to evaluate ev
+    stab_signs = (-1)**outcomes
+    signs = np.zeros([8,7])
+    for i in range(8):
+        signs[i,:3] = stab_signs[i]
+        signs[i,3] = stab_signs[i,0]*stab_signs[i,1]
+        signs[i,4] = stab_signs[i,0]*stab_signs[i,2]
+        signs[i,5] = stab_signs[i,1]*stab_signs[i,2]
+        signs[i,6] = stab_signs[i,0]*stab_signs[i,1]*stab_signs[i,2]
+
+    locs = [[0,1,3,4],[0,2,3,6],[3,4,5,6],[1,2,4,6],[0,1,5,6],[0,2,4,5],[1,2,3,5]]
+    pouts = []
+    for i in range(8):
+        pout = 1
+        for j,loc in enumerate(locs):
+            pout += signs[i,j]*signed_expectation(measureX_out_eigstate[i],loc)
+        pouts.append(0.125*pout)
+    pouts = np.array(pouts)
+
+    f_qsp = (pancilla_unflagged*pouts).sum()
+    print(f'QSP fidelity:\t\t {f_qsp}')
+
+    return flagged,f_qsp
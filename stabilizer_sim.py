@@ -1,5 +1,7 @@
 import numpy as np
 import itertools
+from tool.fault_cache import cached_arrays
+from tool.testing import run_test
 
 def str2tab(pauli_str):
     if type(pauli_str) == list:
@@ -72,7 +74,22 @@ def get_faults(fault_types):
 def get_flag_error_set(num_qubits,stab_strings,fault_types,gate_seq,verbose=0):
     '''
     Get flag error set from a stabilizer measurement circuit caused by a single fault
+    The set is cached by content (tool.fault_cache), verbose=2 recomputes it to print every fault
     '''
+    compute = lambda: _flag_error_set(num_qubits,stab_strings,fault_types,gate_seq,verbose)
+    if verbose==2:
+        out = compute()
+    else:
+        out = cached_arrays('get_flag_error_set',[num_qubits,stab_strings,fault_types,gate_seq],compute)
+    flag_error_set = out['flag_error_set']
+    if verbose:
+        print('\n> Flag error set <')
+        for flag_error in tab2str(flag_error_set[:,0]):
+            print('      ',flag_error)
+    
+    return out['flags'],flag_error_set[:,0],flag_error_set #reduce the equivalent errors
+
+def _flag_error_set(num_qubits,stab_strings,fault_types,gate_seq,verbose=0):
     num_qubit = sum(num_qubits)
     num_data,num_synd,num_flag = num_qubits
     flag_error_set = None
@@ -119,13 +136,8 @@ def get_flag_error_set(num_qubits,stab_strings,fault_types,gate_seq,verbose=0):
                 # print(tab2str(stab_equiv(error,stabilizers)))
                 flag_error_set = np.stack([*flag_error_set,stab_equiv(error,stabilizers)])
                 out_flags.append(flag)
-                
-    if verbose:
-        print('\n> Flag error set <')
-        for flag_error in tab2str(flag_error_set[:,0]):
-            print('      ',flag_error)
     
-    return np.array(out_flags),flag_error_set[:,0],flag_error_set #reduce the equivalent errors
+    return {'flags':np.array(out_flags),'flag_error_set':flag_error_set}
 
 def check_FT(qec_code,flag_error_set,flags,stab_loc,verbose=0):
     '''
@@ -176,4 +188,262 @@ def lut_decoder(qec_code):
     
     syndromes = one_qubit_errors@all_stabilizers_twisted.T %2
     assert np.unique(syndromes@bin2dec).size == one_qubit_errors.shape[0] # unique syndrome for every erro
-    return dict(zip(syndromes@bin2dec,one_qubit_errors))
\ No newline at end of file
+    return dict(zip(syndromes@bin2dec,one_qubit_errors))
+
+def complete_lut(qec_code,lut=None):
+    '''
+    Extend a LUT decoder to every syndrome reachable by up to two of its corrections
+    Output: array (2**len(qec_code),2*num) of corrections indexed by the decimal syndrome (0 = no correction)
+    '''
+    num = len(qec_code[0])
+    lut = lut_decoder(qec_code) if lut is None else lut
+    table = np.zeros([2**len(qec_code),2*num]).astype(np.uint8)
+    known = np.zeros(2**len(qec_code)).astype(bool)
+    known[0] = True
+    for key,error in lut.items():
+        table[key],known[key] = error,True
+    for (k1,e1),(k2,e2) in itertools.combinations(lut.items(),2):
+        if not known[k1^k2]:
+            table[k1^k2],known[k1^k2] = (e1+e2)%2,True
+    return table
+
+def flag_lookup_table(qec_code,stabilizer_gateseqs,num_qubits,fault_types='XYZ'):
+    '''
+    Flag LUT of stabilizer circuits in the notebook format (measurements as ['m',synd],['m',flag,...])
+    For every single fault raising the flag of circuit i, the data error is keyed by (i, decimal syndrome),
+    keeping the lowest-weight error per key
+    '''
+    num_qubit = sum(num_qubits)
+    num_data = num_qubits[0]
+    bin2dec = 2**np.arange(len(qec_code))[::-1]
+    all_stabilizers = str2tab(qec_code)
+    all_stabilizers_twisted = np.hstack([all_stabilizers[:,num_data:],all_stabilizers[:,:num_data]])
+    faults = get_faults(fault_types)
+
+    flag_lut = {}
+    for i,gate_seq in enumerate(stabilizer_gateseqs):
+        gates = [loc for loc in gate_seq if 'm' not in loc]
+        flag_qubits = [q for loc in gate_seq if 'm' in loc for q in loc[1:]][1:]
+        for j in range(len(gates)):
+            Ops = np.array([fault_operators(num_qubit,gates[j],fault).sum(0) for fault in faults[len(gates[j])-1]])
+            for gate in gates[j+1:]:
+                update_gate(gate,Ops)
+            Ops = Ops % 2
+            flagged = Ops[:,[num_qubit+q for q in flag_qubits]].sum(1) > 0
+            errors = np.hstack([Ops[:,:num_data],Ops[:,num_qubit:num_qubit+num_data]])[flagged]
+            for error,synd in zip(errors,(errors@all_stabilizers_twisted.T%2)@bin2dec):
+                weight = (error[:num_data] | error[num_data:]).sum()
+                if (i,synd) not in flag_lut or weight < flag_lut[(i,synd)][1]:
+                    flag_lut[(i,synd)] = (error,weight)
+    return {key:error for key,(error,_) in flag_lut.items()}
+
+def depolarize_frames(frames,qubits,p,rng,active=None):
+    '''
+    Single-qubit depolarizing noise with probability p on each of `qubits` of the Pauli frames [Z|X]
+    '''
+    num_qubit = frames.shape[-1]//2
+    for q in qubits:
+        hit = rng.random(len(frames)) < p
+        if active is not None: hit &= active
+        pauli = rng.integers(1,4,size=len(frames))*hit # 1:X, 2:Y, 3:Z
+        frames[:,q] ^= (pauli>=2).astype(frames.dtype)
+        frames[:,q+num_qubit] ^= ((pauli==1)|(pauli==2)).astype(frames.dtype)
+    return frames
+
+def run_stabilizer_frames(frames,gate_seq,p_depol,p_readout,rng,active=None,noise_model=None):
+    '''
+    Propagate Pauli frames [Z|X] (num_shots,2*num_qubit) through one stabilizer circuit in the notebook format
+    (H: [q], CNOT: (c,t), measurement: ['m',q,...]) with depolarizing noise after each gate on its qubits
+    and bit-flip readout noise, as create_cirq does. Measured qubits are reset.
+    Noise only hits the `active` shots, the gates leave the data frames of the other shots unchanged.
+    A tool.noise_model.NoiseModel (gates named 'H' and 'CX') replaces p_depol and p_readout, see model_frames.
+    Output: list of outcome flips, one (num_shots,len(qubits)) array per measurement
+    '''
+    if noise_model is not None:
+        return model_frames(frames,gate_seq,noise_model,rng,active)
+    num_qubit = frames.shape[-1]//2
+    outcomes = []
+    for loc in gate_seq:
+        if 'm' in loc:
+            qubits = list(loc[1:])
+            out = frames[:,[q+num_qubit for q in qubits]].copy()
+            if p_readout:
+                out ^= (rng.random(out.shape) < p_readout).astype(out.dtype)
+            outcomes.append(out)
+            frames[:,qubits+[q+num_qubit for q in qubits]] = 0
+        else:
+            update_gate(loc,frames)
+            if p_depol:
+                depolarize_frames(frames,loc,p_depol,rng,active)
+    return outcomes
+
+def model_frames(frames,gate_seq,noise_model,rng,active=None):
+    '''
+    run_stabilizer_frames with the channels of a tool.noise_model.NoiseModel, sampled for all shots in one draw
+    from its compiled alias tables. Readout errors hit every shot, gate errors only the `active` ones.
+    '''
+    num_qubit = frames.shape[-1]//2
+    sequence,ends = [],[]
+    for loc in gate_seq:
+        if 'm' in loc:
+            sequence += [('Meas',(q,len(sequence))) for q in loc[1:]]
+        else:
+            sequence.append(('H' if len(loc) == 1 else 'CX',tuple(loc)))
+        ends.append(len(sequence))
+    noise = noise_model.compile(sequence)
+    events = noise.sample(len(frames),rng)
+    errors_at = {}
+    for j,(i,before,qubits,_,_) in enumerate(noise.locations):
+        if active is not None and not before:
+            events[~active,j] = 0
+        errors_at.setdefault((i,before),[]).append(j)
+    def add_errors(key):
+        for j in errors_at.get(key,[]):
+            x,z = noise.error_bits(j)
+            qubits = list(noise.locations[j][2])
+            frames[:,qubits] ^= z[events[:,j]]
+            frames[:,[q+num_qubit for q in qubits]] ^= x[events[:,j]]
+
+    outcomes,start = [],0
+    for loc,end in zip(gate_seq,ends):
+        for i in range(start,end):
+            add_errors((i,True))
+            if sequence[i][0] != 'Meas':
+                update_gate(sequence[i][1],frames)
+            add_errors((i,False))
+        if 'm' in loc:
+            qubits = list(loc[1:])
+            outcomes.append(frames[:,[q+num_qubit for q in qubits]].copy())
+            frames[:,qubits+[q+num_qubit for q in qubits]] = 0
+        start = end
+    return outcomes
+
+def qec_memory_rounds(stabilizer_gateseqs,qec_code,num_qubits,num_shots,num_rounds,p_depol,p_readout,
+                      seed=None,lut=None,logicals=('ZZZZZZZ','XXXXXXX'),noise_model=None,frames=None):
+    '''
+    Streaming memory experiment on Pauli frames, advanced one QEC cycle at a time (qec_cycle of full_steane_flagged)
+    Starting from a perfect code state, each cycle measures the stabilizers one by one and stops at the first
+    nontrivial syndrome or flag. If triggered, all stabilizers are measured again and the data is corrected with
+    the flag LUT (flag raised in the first pass) or the LUT on the second syndrome. Only the frames of the shots
+    are kept between cycles, so memory does not grow with the number of rounds.
+    Input:
+        stabilizer_gateseqs: stabilizer circuits in the order of qec_code, e.g. [Z1,Z2,Z3,X1,X2,X3]
+        num_qubits: [num_data,num_synd,num_flag]
+        noise_model: tool.noise_model.NoiseModel replacing p_depol and p_readout (qubits indexed data, syndrome, flag)
+        frames: initial Pauli frames [Z|X] (num_shots,2*num_qubit) uint8, advanced in place (perfect code state if None)
+    Output (generator), per round: dict with
+        'syndrome','flags': detection events of the first pass (num_shots,len(qec_code)), unmeasured checks are 0
+        'repeated': shots measuring the stabilizers a second time
+        'failed': shots whose data frame is a logical error after ideal decoding
+    '''
+    rng = np.random.default_rng(seed)
+    num_qubit = sum(num_qubits)
+    num_data = num_qubits[0]
+    num_checks = len(stabilizer_gateseqs)
+    bin2dec = 2**np.arange(num_checks)[::-1]
+    corrections = complete_lut(qec_code,lut)
+    flag_lut = flag_lookup_table(qec_code,stabilizer_gateseqs,num_qubits)
+    all_stabilizers = str2tab(qec_code)
+    all_stabilizers_twisted = np.hstack([all_stabilizers[:,num_data:],all_stabilizers[:,:num_data]])
+    logical_tab = str2tab(list(logicals))
+    logicals_twisted = np.hstack([logical_tab[:,num_data:],logical_tab[:,:num_data]])
+    data_cols = np.r_[0:num_data,num_qubit:num_qubit+num_data]
+
+    if frames is None:
+        frames = np.zeros([num_shots,2*num_qubit]).astype(np.uint8)
+    for _ in range(num_rounds):
+        syndrome = np.zeros([num_shots,num_checks]).astype(np.uint8)
+        flags = np.zeros([num_shots,num_checks]).astype(np.uint8)
+        active = np.ones(num_shots).astype(bool)
+        for i,gate_seq in enumerate(stabilizer_gateseqs):
+            outcomes = run_stabilizer_frames(frames,gate_seq,p_depol,p_readout,rng,active,noise_model)
+            syndrome[active,i] = outcomes[0][active,0]
+            flags[active,i] = np.hstack(outcomes)[active,1:].max(1) if len(outcomes) > 1 else 0
+            active &= (syndrome[:,i] == 0) & (flags[:,i] == 0)
+
+        repeated = ~active
+        if repeated.any():
+            sub = frames[repeated]
+            synd2 = np.hstack([run_stabilizer_frames(sub,gate_seq,p_depol,p_readout,rng,
+                                                     noise_model=noise_model)[0][:,:1]
+                               for gate_seq in stabilizer_gateseqs])@bin2dec
+            data = sub[:,data_cols]
+            data ^= corrections[synd2]
+            flagged = flags[repeated].argmax(1)
+            for j in np.flatnonzero(flags[repeated].any(1)):
+                key = (flagged[j],synd2[j])
+                if key in flag_lut:
+                    data[j] = sub[j,data_cols]^flag_lut[key]
+            sub[:,data_cols] = data
+            frames[repeated] = sub
+
+        # ideal decoding of the residual data error
+        data = frames[:,data_cols].astype(int)
+        data ^= corrections[(data@all_stabilizers_twisted.T%2)@bin2dec]
+        failed = ((data@logicals_twisted.T)%2).any(1)
+        yield {'syndrome':syndrome,'flags':flags,'repeated':repeated,'failed':failed}
+
+def run_memory_experiment(stabilizer_gateseqs,qec_code,num_qubits,num_shots,num_rounds,p_depol,p_readout,
+                          seed=None,**kwargs):
+    '''
+    Lifetimes of a memory experiment computed on the fly from qec_memory_rounds
+    Output:
+        lifetimes: number of rounds survived before the first logical failure (num_rounds if none)
+        stats: dict with 'failed' (shots that failed), 'repeat_rate' (fraction of cycles measuring twice),
+               'detection_rate' (fraction of cycles with a nontrivial first-pass syndrome or flag)
+    '''
+    lifetimes = np.full(num_shots,num_rounds)
+    repeats = detections = 0
+    for r,round_ in enumerate(qec_memory_rounds(stabilizer_gateseqs,qec_code,num_qubits,num_shots,num_rounds,
+                                                p_depol,p_readout,seed,**kwargs)):
+        lifetimes[round_['failed'] & (lifetimes == num_rounds)] = r
+        repeats += round_['repeated'].sum()
+        detections += (round_['syndrome'].any(1) | round_['flags'].any(1)).sum()
+    stats = {'failed':lifetimes < num_rounds,
+             'repeat_rate':repeats/(num_shots*num_rounds),
+             'detection_rate':detections/(num_shots*num_rounds)}
+    return lifetimes,stats
+
+############################## TESTING ##############################
+STEANE_CODE = ['ZZIZZII','ZIZZIIZ','IIIZZZZ','XXIXXII','XIXXIIX','IIIXXXX']
+# flag stabilizer circuits of full_steane_flagged, order Z1245,Z1347,Z4567 then X
+STEANE_GATESEQS = [[[10],(10,7),(0,7),(1,10),(3,7),(4,10),(10,7),[10],['m',7],['m',10]],
+                   [[11],(11,8),(2,11),(0,8),(3,8),(6,8),(11,8),[11],['m',8],['m',11]],
+                   [[12],(12,9),(3,9),(4,12),(6,9),(5,12),(12,9),[12],['m',9],['m',12]],
+                   [[7],(7,10),(7,0),(10,1),(7,3),(10,4),(7,10),[7],['m',7],['m',10]],
+                   [[8],(8,11),(11,2),(8,0),(8,3),(8,6),(8,11),[8],['m',8],['m',11]],
+                   [[9],(9,12),(9,3),(12,4),(9,6),(12,5),(9,12),[9],['m',9],['m',12]]]
+
+def test_memory_experiment():
+    '''
+    Noiseless memory: no detection, repeat or failure, and every weight-1 data error injected in the frames is
+    detected, measured again and removed exactly by the LUT correction, without any failure
+    '''
+    num_qubits = [7,3,3]
+    num_data,num_qubit = 7,13
+    lifetimes,stats = run_memory_experiment(STEANE_GATESEQS,STEANE_CODE,num_qubits,200,5,0,0,seed=0)
+    errors = ['I'*q+P+'I'*(num_data-q-1) for P in 'XYZ' for q in range(num_data)]
+    frames = np.zeros([len(errors),2*num_qubit]).astype(np.uint8)
+    tab = str2tab(errors)
+    frames[:,:num_data],frames[:,num_qubit:num_qubit+num_data] = tab[:,num_data:],tab[:,:num_data]
+    rounds = list(qec_memory_rounds(STEANE_GATESEQS,STEANE_CODE,num_qubits,len(errors),2,0,0,seed=0,frames=frames))
+    test_cases = {
+        'p=0': (0,0.,0.,5),
+        'weight-1 errors': (True,0,0,True,0),
+    }
+    outputs = {
+        'p=0': (stats['failed'].sum(),stats['repeat_rate'],stats['detection_rate'],lifetimes.min()),
+        'weight-1 errors': (rounds[0]['repeated'].all(),rounds[0]['failed'].sum(),int(frames.sum()),
+                            rounds[0]['syndrome'].any(1).all(),rounds[1]['repeated'].sum()),
+    }
+    run_test(test_cases,lambda name: outputs[name],'memory_experiment')
+
+def test_all():
+    print('\nTesting functions in stabilizer_sim.py ...\n')
+    test_memory_experiment()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
@@ -4,4 +4,5 @@ setup(
     name='tool',
     version='0.1',
     packages=['tool'],
+    package_data={'tool': ['data/*.npz']},
 )
\ No newline at end of file
@@ -0,0 +1,4 @@
+import sys
+from tool.cli import main
+
+sys.exit(main())
@@ -0,0 +1,270 @@
+import os
+import json
+import hashlib
+import numpy as np
+from typing import List, Tuple
+from tool import qec
+from tool.lazy import is_available
+from tool.testing import run_test
+
+"""
+Precomputed built-in data shipped with the package.
+
+The named gate sequences of qec.get_sequence, the stabilizer groups of the named codes, the look-up tables of tool.ft
+and the flag error sets of the named flag circuits of stabilizer_sim are stored in tool/data/builtins.npz, so that
+the command-line verifier (python -m tool) reads them instead of rebuilding them at every start. The file records a
+hash of the definitions it was built from (the named sequences, code generators, look-up tables and flag circuits)
+and of ASSET_VERSION, so edits elsewhere in the sources keep it valid. If they changed, it is ignored and the data
+is recomputed until the file is rebuilt with python -m tool build-assets. ASSET_VERSION is bumped when the way the
+data is computed from them changes (e.g. qec.compute_stabilizer_group or stabilizer_sim.get_flag_error_set).
+
+Methods:
+    build_assets(...): Precompute the built-in data into a .npz file.
+    load_assets(...): Arrays of the asset file, empty if it is missing or out of date.
+    get_sequence(...), get_stabilizer_group(...), get_look_up_table(...), get_flag_error_set(...): Built-in data.
+    encode_sequence(...), decode_sequence(...): Gate sequences as arrays.
+    test_all(): Runs all the test methods.
+"""
+
+ASSET_FILE = os.path.join(os.path.dirname(__file__), 'data', 'builtins.npz')
+ASSET_VERSION = 1
+
+# stabilizer generators of the named codes
+CODES = {
+    # layout of the flag bridge circuits, with the Steane_flag_bridge look-up tables
+    'steane': ('ZZZZ---', '-ZZ-ZZ-', '--ZZ-ZZ', 'XXXX---', '-XX-XX-', '--XX-XX'),
+    # layout of the full_steane_flagged notebook
+    'steane_flagged': ('ZZ-ZZ--', 'Z-ZZ--Z', '---ZZZZ', 'XX-XX--', 'X-XX--X', '---XXXX'),
+    'steane_code_Goto': qec.common_qecc('steane_code_Goto'),
+    'bitflip_code': qec.common_qecc('bitflip_code'),
+}
+
+# single-stabilizer flag circuits in the stabilizer_sim format: (num_qubits, stab_strings, gate_seq)
+FLAG_CIRCUITS = {
+    'ZZZZ_1c': ([4,1,1], ['ZZZZ'], [[5],(5,4),(2,5),(0,4),(3,5),(1,4),(5,4),[5]]),
+    'XXXX_1c': ([4,1,1], ['XXXX'], [[4],(4,5),(5,2),(4,0),(5,3),(4,1),(4,5),[4]]),
+    'ZZZZ_4a': ([4,1,1], ['ZZZZ'], [[5],(5,4),(3,5),(0,4),(1,4),(2,4),(5,4),[5]]),
+    'XXXX_4a': ([4,1,1], ['XXXX'], [[4],(4,5),(5,3),(4,0),(4,1),(4,2),(4,5),[4]]),
+}
+FLAG_FAULT_TYPES = 'XYZ'
+
+def _data_hash() -> str:
+    """Hash of ASSET_VERSION and of the definitions the built-in data is computed from."""
+    from tool import ft
+    definitions = [ASSET_VERSION, qec.get_sequence(), CODES, ft.look_up_table, FLAG_CIRCUITS, FLAG_FAULT_TYPES]
+    return hashlib.sha256(json.dumps(definitions, sort_keys=True).encode()).hexdigest()
+
+def encode_sequence(gate_sequence) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Gate sequence as arrays of gate names and qubits.
+
+    Args:
+        gate_sequence: Sequence of (gate, qubits) in the tool format, or of qubit lists/tuples in the
+            stabilizer_sim format (the gate names are then empty).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Gate names and qubits (padded with -1).
+    """
+    if len(gate_sequence) > 0 and isinstance(gate_sequence[0][0], str):
+        gates, positions = [gate for gate, _ in gate_sequence], [pos for _, pos in gate_sequence]
+    else:
+        gates, positions = [''] * len(gate_sequence), list(gate_sequence)
+    qubits = np.full((len(positions), 2), -1, dtype=np.int16)
+    for i, pos in enumerate(positions):
+        qubits[i, :len(pos)] = pos
+    return np.array(gates, dtype='U4'), qubits
+
+def decode_sequence(gates: np.ndarray, qubits: np.ndarray):
+    """
+    Inverse of encode_sequence.
+
+    Returns:
+        Tuple of (gate, qubits) in the tool format, or list of [q] and (c, t) in the stabilizer_sim format.
+    """
+    positions = [tuple(int(q) for q in row if q >= 0) for row in qubits]
+    if len(gates) > 0 and gates[0] == '':
+        return [list(pos) if len(pos) == 1 else pos for pos in positions]
+    return tuple((str(gate), pos) for gate, pos in zip(gates, positions))
+
+def build_assets(filename: str = ASSET_FILE) -> str:
+    """
+    Precompute the built-in data into a .npz file.
+    The flag error sets are only included if stabilizer_sim can be imported (run from the repository root).
+
+    Args:
+        filename (str): Output file.
+
+    Returns:
+        str: The output file.
+    """
+    from tool import ft
+    arrays = {'data_hash': np.array(_data_hash())}
+    for name, sequence in qec.get_sequence().items():
+        arrays[f'sequence/{name}/gates'], arrays[f'sequence/{name}/qubits'] = encode_sequence(sequence)
+    for name, generators in CODES.items():
+        group = qec.compute_stabilizer_group([list(stabilizer) for stabilizer in generators])
+        arrays[f'code/{name}/generators'] = np.array(generators)
+        arrays[f'code/{name}/group'] = np.array([''.join(element) for element in group])
+    for name, lut in ft.look_up_table.items():
+        arrays[f'lut/{name}/syndromes'] = np.array(list(lut.keys()))
+        arrays[f'lut/{name}/corrections'] = np.array(list(lut.values()))
+
+    if is_available('stabilizer_sim'):
+        for name in FLAG_CIRCUITS:
+            flags, _, flag_error_set = _compute_flag_error_set(name)
+            num_qubits, stab_strings, gate_seq = FLAG_CIRCUITS[name]
+            arrays[f'flag/{name}/gates'], arrays[f'flag/{name}/qubits'] = encode_sequence(gate_seq)
+            arrays[f'flag/{name}/num_qubits'] = np.array(num_qubits)
+            arrays[f'flag/{name}/stab_strings'] = np.array(stab_strings)
+            arrays[f'flag/{name}/flags'] = flags
+            arrays[f'flag/{name}/flag_error_set'] = flag_error_set
+
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    np.savez(filename, **arrays)
+    _close_assets()
+    return filename
+
+# open asset files by file name
+_assets = {}
+
+def load_assets(filename: str = ASSET_FILE):
+    """
+    Arrays of the asset file by key, e.g. 'code/steane/group'.
+    The file stays open and arrays are only read when accessed.
+    Empty if the file is missing or was built from other definitions or another ASSET_VERSION.
+
+    Args:
+        filename (str): Asset file.
+
+    Returns:
+        Mapping of key -> np.ndarray.
+    """
+    if filename not in _assets:
+        try:
+            data = np.load(filename, allow_pickle=False)
+        except OSError:
+            data = {}
+        if len(data) and ('data_hash' not in data or str(data['data_hash']) != _data_hash()):
+            data.close()
+            data = {}
+        _assets[filename] = data
+    return _assets[filename]
+
+def _close_assets() -> None:
+    for data in _assets.values():
+        if hasattr(data, 'close'):
+            data.close()
+    _assets.clear()
+
+def get_sequence(name: str) -> Tuple:
+    """
+    Named gate sequence of qec.get_sequence.
+    """
+    assets = load_assets()
+    if f'sequence/{name}/gates' in assets:
+        return decode_sequence(assets[f'sequence/{name}/gates'], assets[f'sequence/{name}/qubits'])
+    return qec.get_sequence(name)
+
+def code_names() -> List[str]:
+    """Names of the built-in codes."""
+    return list(CODES)
+
+def get_stabilizer_group(code: str) -> List[List[str]]:
+    """
+    Full stabilizer group of a named code, as returned by qec.compute_stabilizer_group.
+
+    Args:
+        code (str): Name of the code, see CODES.
+
+    Returns:
+        List[List[str]]: Stabilizer group elements.
+    """
+    assets = load_assets()
+    if f'code/{code}/group' in assets:
+        return [list(element) for element in assets[f'code/{code}/group']]
+    return qec.compute_stabilizer_group([list(stabilizer) for stabilizer in CODES[code]])
+
+def get_look_up_table(name: str) -> dict:
+    """
+    Named look-up table of tool.ft.
+    """
+    assets = load_assets()
+    if f'lut/{name}/syndromes' in assets:
+        return dict(zip(assets[f'lut/{name}/syndromes'].tolist(), assets[f'lut/{name}/corrections'].tolist()))
+    from tool import ft
+    return ft.look_up_table[name]
+
+def _compute_flag_error_set(name: str):
+    import stabilizer_sim
+    num_qubits, stab_strings, gate_seq = FLAG_CIRCUITS[name]
+    return stabilizer_sim.get_flag_error_set(num_qubits, stab_strings, FLAG_FAULT_TYPES, gate_seq)
+
+def get_flag_error_set(name: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Flag error set of a named flag circuit, as returned by stabilizer_sim.get_flag_error_set.
+    Read from the asset file, so stabilizer_sim is only needed if it is not there.
+
+    Args:
+        name (str): Name of the flag circuit, see FLAG_CIRCUITS.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: flags, flag_error_set, flag_error_set_full.
+    """
+    assets = load_assets()
+    if f'flag/{name}/flags' in assets:
+        flag_error_set = assets[f'flag/{name}/flag_error_set']
+        return assets[f'flag/{name}/flags'], flag_error_set[:,0], flag_error_set
+    return _compute_flag_error_set(name)
+
+
+############################## TESTING ##############################
+def test_encode_sequence():
+    """
+    Test that encode_sequence and decode_sequence are inverse of each other.
+    """
+    test_cases = [qec.get_sequence('flag_bridge_CX_SZ1'), qec.get_sequence('Goto_1c'),
+                  (('H', (0,)), ('Meas', (3, 1))), FLAG_CIRCUITS['ZZZZ_1c'][2]]
+    run_test([list(range(len(test_cases))), [True]*len(test_cases)],
+             lambda i: decode_sequence(*encode_sequence(test_cases[i])) == test_cases[i], 'encode_sequence')
+
+def test_assets():
+    """
+    Test that the built-in data read from an asset file matches the data it was computed from, and that the file
+    is ignored once ASSET_VERSION changes.
+    """
+    global ASSET_VERSION
+    import tempfile
+    from tool import ft
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = build_assets(os.path.join(tmp, 'builtins.npz'))
+        assets = load_assets(filename)
+        results = {
+            'sequences': all(decode_sequence(assets[f'sequence/{name}/gates'], assets[f'sequence/{name}/qubits'])
+                             == sequence for name, sequence in qec.get_sequence().items()),
+            'groups': all(sorted(''.join(e) for e in qec.compute_stabilizer_group([list(s) for s in CODES[name]]))
+                          == sorted(assets[f'code/{name}/group']) for name in CODES),
+            'luts': all(dict(zip(assets[f'lut/{name}/syndromes'], assets[f'lut/{name}/corrections'])) == lut
+                        for name, lut in ft.look_up_table.items()),
+            'missing file': load_assets(os.path.join(tmp, 'missing.npz')),
+        }
+        _close_assets()
+        ASSET_VERSION += 1
+        try:
+            results['other version'] = load_assets(filename)
+        finally:
+            ASSET_VERSION -= 1
+            _close_assets()
+    answers = {'sequences': True, 'groups': True, 'luts': True, 'missing file': {}, 'other version': {}}
+    run_test([list(answers), list(answers.values())], lambda x: results[x], 'build_assets/load_assets')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_encode_sequence()
+    test_assets()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
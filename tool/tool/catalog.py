@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import tempfile
+import numpy as np
+from typing import Callable, List
+from tool.testing import run_test
+
+"""
+Local catalog of simulation and verification results.
+
+Results are stored in a SQLite database, keyed by the content hash of the circuit and of the code together with
+the noise parameters, number of shots, seed and any other parameters. A matching entry is reused instead of being
+recomputed, and a changed circuit or stabilizer group gives a new key instead of stale data. Summary numbers
+(logical error rate, acceptance, FT verdict) are stored in columns for fast queries, the full result is pickled.
+
+The database is $PEAQUE_CATALOG, or ~/.cache/peaque_ftqec/catalog.sqlite by default, and is shared by all notebooks.
+
+Methods:
+    content_hash(...): Stable hash of circuits, codes, states and parameters.
+    ResultsCatalog: The catalog, with get, put, cached and query.
+    test_all(): Runs all the test methods.
+"""
+
+DEFAULT_CATALOG = os.environ.get('PEAQUE_CATALOG',
+                                 os.path.join(os.path.expanduser('~'), '.cache', 'peaque_ftqec', 'catalog.sqlite'))
+
+SUMMARY_COLUMNS = ('logical_error_rate', 'acceptance', 'ft')
+
+def _canonical(obj):
+    """JSON-compatible canonical form of obj, numpy arrays are replaced by their hash."""
+    if isinstance(obj, np.ndarray):
+        return {'__ndarray__': [str(obj.dtype), list(obj.shape),
+                                hashlib.sha256(np.ascontiguousarray(obj).tobytes()).hexdigest()]}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, dict):
+        return {str(key): _canonical(value) for key, value in sorted(obj.items(), key=lambda kv: str(kv[0]))}
+    if isinstance(obj, (list, tuple)):
+        return [_canonical(value) for value in obj]
+    if isinstance(obj, complex):
+        return [obj.real, obj.imag]
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if hasattr(obj, 'to_json'):
+        return obj.to_json()
+    return repr(obj)
+
+def content_hash(obj) -> str:
+    """
+    Stable hash of a circuit, gate sequence, stabilizer group, state vector or parameter dict.
+    Lists and tuples hash the same, dicts do not depend on their order.
+
+    Args:
+        obj: Object to hash.
+
+    Returns:
+        str: SHA-256 hex digest.
+    """
+    return hashlib.sha256(json.dumps(_canonical(obj), sort_keys=True).encode()).hexdigest()
+
+class ResultsCatalog:
+    """
+    SQLite catalog of results.
+
+    Example:
+        >>> catalog = ResultsCatalog()
+        >>> verdict = catalog.cached('check_ft', lambda: check_ft(sequences, used_anc_inds, lut_name, group, 0),
+        ...                          circuit=sequences, code=group, params={'lut': lut_name},
+        ...                          summarize=lambda ft: {'ft': ft})
+        >>> catalog.query(kind='check_ft', ft=False)
+    """
+    def __init__(self, path: str = None):
+        """
+        Args:
+            path (str): Database file, DEFAULT_CATALOG by default. ':memory:' keeps it in memory.
+        """
+        self.path = DEFAULT_CATALOG if path is None else path
+        if self.path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                circuit_hash TEXT NOT NULL,
+                code_hash TEXT NOT NULL,
+                noise TEXT NOT NULL,
+                shots INTEGER,
+                seed INTEGER,
+                params TEXT NOT NULL,
+                logical_error_rate REAL,
+                acceptance REAL,
+                ft INTEGER,
+                created REAL NOT NULL,
+                payload BLOB NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_circuit ON results (kind, circuit_hash, code_hash);
+        """)
+
+    @staticmethod
+    def make_key(kind: str, circuit, code, noise: dict = None, shots: int = None, seed: int = None,
+                 params: dict = None) -> dict:
+        """
+        Key fields of an entry.
+
+        Args:
+            kind (str): Kind of result, e.g. 'error_distribution' or 'check_ft'.
+            circuit: Circuit or gate sequence(s), hashed by content.
+            code: Stabilizer group or code description, hashed by content.
+            noise (dict): Noise parameters.
+            shots (int): Number of shots.
+            seed (int): Seed.
+            params (dict): Any other parameter the result depends on.
+
+        Returns:
+            dict: Columns identifying the entry, including its key.
+        """
+        fields = {
+            'kind': kind,
+            'circuit_hash': content_hash(circuit),
+            'code_hash': content_hash(code),
+            'noise': json.dumps(_canonical(noise or {}), sort_keys=True),
+            'shots': shots,
+            'seed': seed,
+            'params': json.dumps(_canonical(params or {}), sort_keys=True),
+        }
+        fields['key'] = content_hash(fields)
+        return fields
+
+    def get(self, kind: str, circuit, code, noise: dict = None, shots: int = None, seed: int = None,
+            params: dict = None):
+        """
+        Stored result of a computation, None if there is none. Arguments as in make_key.
+        """
+        key = self.make_key(kind, circuit, code, noise, shots, seed, params)['key']
+        row = self.connection.execute('SELECT payload FROM results WHERE key = ?', (key,)).fetchone()
+        return None if row is None else pickle.loads(row[0])
+
+    def put(self, kind: str, result, circuit, code, noise: dict = None, shots: int = None, seed: int = None,
+            params: dict = None, **summary) -> str:
+        """
+        Store (or replace) a result. Arguments as in make_key.
+
+        Args:
+            result: Picklable result.
+            summary: Values of SUMMARY_COLUMNS for queries.
+
+        Returns:
+            str: Key of the entry.
+        """
+        unknown = set(summary) - set(SUMMARY_COLUMNS)
+        if unknown:
+            raise ValueError(f'Unknown summary columns {unknown}, expected {SUMMARY_COLUMNS}')
+        fields = self.make_key(kind, circuit, code, noise, shots, seed, params)
+        fields.update({name: _canonical(summary.get(name)) for name in SUMMARY_COLUMNS})
+        fields.update({'created': time.time(), 'payload': pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)})
+        with self.connection:
+            self.connection.execute(f'INSERT OR REPLACE INTO results ({", ".join(fields)}) '
+                                    f'VALUES ({", ".join("?"*len(fields))})', tuple(fields.values()))
+        return fields['key']
+
+    def cached(self, kind: str, compute: Callable, circuit, code, noise: dict = None, shots: int = None,
+               seed: int = None, params: dict = None, summarize: Callable = None, recompute: bool = False):
+        """
+        Reuse the stored result of a computation, or compute and store it. Arguments as in make_key.
+
+        Args:
+            compute (Callable): Function without arguments computing the result.
+            summarize (Callable): Function from the result to a dict of SUMMARY_COLUMNS values.
+            recompute (bool): Whether to ignore a stored result.
+
+        Returns:
+            The result.
+        """
+        key_args = (kind, circuit, code, noise, shots, seed, params)
+        if not recompute:
+            result = self.get(*key_args)
+            if result is not None:
+                return result
+        result = compute()
+        self.put(kind, result, *key_args[1:], **(summarize(result) if summarize else {}))
+        return result
+
+    def query(self, **filters) -> List[dict]:
+        """
+        Entries matching the filters, without their results.
+
+        Args:
+            filters: Column values, e.g. kind='check_ft', ft=False, or circuit=... / code=... (hashed),
+                noise=... (dict) and params=... (dict).
+
+        Returns:
+            List[dict]: Matching entries, newest first.
+        """
+        conditions, values = [], []
+        for name, value in filters.items():
+            if name in ('circuit', 'code'):
+                name, value = f'{name}_hash', content_hash(value)
+            elif name in ('noise', 'params'):
+                value = json.dumps(_canonical(value), sort_keys=True)
+            conditions.append(f'{name} = ?')
+            values.append(value)
+        columns = ['key', 'kind', 'circuit_hash', 'code_hash', 'noise', 'shots', 'seed', 'params',
+                   *SUMMARY_COLUMNS, 'created']
+        where = f' WHERE {" AND ".join(conditions)}' if conditions else ''
+        rows = self.connection.execute(f'SELECT {", ".join(columns)} FROM results{where} ORDER BY created DESC',
+                                       values).fetchall()
+        entries = [dict(zip(columns, row)) for row in rows]
+        for entry in entries:
+            entry['noise'], entry['params'] = json.loads(entry['noise']), json.loads(entry['params'])
+        return entries
+
+    def delete(self, key: str) -> None:
+        """Remove an entry."""
+        with self.connection:
+            self.connection.execute('DELETE FROM results WHERE key = ?', (key,))
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __enter__(self) -> 'ResultsCatalog':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+############################## TESTING ##############################
+def test_content_hash():
+    """
+    Test the content_hash function.
+    """
+    test_cases = [
+        ((('H', (0,)), ('CX', (0, 1))), [['H', [0]], ['CX', [0, 1]]]),
+        ({'p': 1e-3, 'q': 2}, {'q': 2, 'p': 1e-3}),
+        (np.arange(4), np.arange(4)),
+    ]
+    different = [
+        ((('H', (0,)), ('CX', (0, 1))), (('H', (0,)), ('CX', (1, 0)))),
+        (np.arange(4), np.arange(4.)),
+        (np.zeros(70000), np.r_[np.zeros(69999), 1.]),
+    ]
+    run_test([test_cases + different, [True]*len(test_cases) + [False]*len(different)],
+             lambda x: content_hash(x[0]) == content_hash(x[1]), 'content_hash')
+
+def test_results_catalog():
+    """
+    Test storing, reusing and querying results.
+    """
+    calls = []
+    def compute():
+        calls.append(1)
+        return {'rate': np.array([0.1, 0.2])}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'catalog.sqlite')
+        circuit, code = [('H', (0,)), ('CX', (0, 1))], ['ZZ', 'XX']
+        with ResultsCatalog(path) as catalog:
+            first = catalog.cached('rates', compute, circuit, code, noise={'p': 1e-3}, shots=100, seed=1,
+                                   summarize=lambda r: {'logical_error_rate': r['rate'][0]})
+            catalog.cached('rates', compute, circuit, code, noise={'p': 1e-3}, shots=100, seed=1)
+            catalog.cached('rates', compute, circuit, code, noise={'p': 1e-3}, shots=100, seed=2)
+            catalog.cached('rates', compute, circuit, ['ZZ', 'YY'], noise={'p': 1e-3}, shots=100, seed=1)
+        # a new connection reuses the stored result
+        with ResultsCatalog(path) as catalog:
+            again = catalog.cached('rates', compute, circuit, code, noise={'p': 1e-3}, shots=100, seed=1)
+            matches = catalog.query(kind='rates', circuit=circuit, code=code)
+            low = catalog.query(logical_error_rate=0.1)
+
+    results = {
+        'computations': len(calls),
+        'reused': bool(np.array_equal(first['rate'], again['rate'])),
+        'query': sorted(m['seed'] for m in matches),
+        'summary': [(m['seed'], m['noise']) for m in low],
+    }
+    answers = {'computations': 3, 'reused': True, 'query': [1, 2], 'summary': [(1, {'p': 1e-3})]}
+    run_test([list(answers), list(answers.values())], lambda x: results[x], 'ResultsCatalog')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_content_hash()
+    test_results_catalog()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
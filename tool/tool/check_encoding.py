@@ -1,7 +1,14 @@
+from __future__ import annotations
 import itertools
-from qulacs import QuantumState, QuantumCircuit
-from qulacs.gate import Measurement, H, CNOT, CZ, X, Adaptive
+import numpy as np
+from typing import TYPE_CHECKING
+from tool.lazy import lazy_import
 from tool.testing import run_test
+if TYPE_CHECKING:
+    from qulacs import QuantumState, QuantumCircuit
+
+# qulacs is imported on first use
+qulacs = lazy_import('qulacs')
 import os
 
 def print_state(state: QuantumState, computational_states: list[str], num_data: int = 7) -> None:
@@ -16,16 +23,17 @@ def print_state(state: QuantumState, computational_states: list[str], num_data:
     Returns:
         None
     """
-    for i, s in enumerate(computational_states):
-        s = s[:num_data] + '|' + s[num_data:]
-        if abs(state[i]) > 1e-6:
-            print(f'{s}: {state[i].real:.3f}  +  {state[i].imag:.3f}i')
+    for i in np.flatnonzero(np.abs(state) > 1e-6):
+        s = computational_states[i][:num_data] + '|' + computational_states[i][num_data:]
+        print(f'{s}: {state[i].real:.3f}  +  {state[i].imag:.3f}i')
 
 gatedict = {
-    'H': H,
-    'CX': CNOT,
-    'CZ': CZ,
-    'Meas': Measurement,
+    'H': lambda *pos: qulacs.gate.H(*pos),
+    'CX': lambda *pos: qulacs.gate.CNOT(*pos),
+    'CZ': lambda *pos: qulacs.gate.CZ(*pos),
+    'S': lambda *pos: qulacs.gate.S(*pos),
+    'T': lambda *pos: qulacs.gate.T(*pos),
+    'Meas': lambda *pos: qulacs.gate.Measurement(*pos),
 }
 
 def run_stabilizer_circuit_old(gate_sequence: list[tuple[str, tuple[int]]], num_qubits: int, num_meas: int,
@@ -48,20 +56,20 @@ def run_stabilizer_circuit_old(gate_sequence: list[tuple[str, tuple[int]]], num_
 
     while anc_meas != target_outcomes:
 
-        state = QuantumState(num_qubits)
+        state = qulacs.QuantumState(num_qubits)
         state.set_zero_state()
 
-        circuit = QuantumCircuit(num_qubits)
+        circuit = qulacs.QuantumCircuit(num_qubits)
         for gate, pos in gate_sequence:
             circuit.add_gate(gatedict[gate](*pos))
             # reset qubit manually at each Measurement
             if gate == 'Meas':
                 circuit.update_quantum_state(state)
                 if state.get_classical_value(pos[1]) == 1:
-                    circuit = QuantumCircuit(num_qubits)
+                    circuit = qulacs.QuantumCircuit(num_qubits)
                     circuit.add_X_gate(pos[0])
                     circuit.update_quantum_state(state)
-                circuit = QuantumCircuit(num_qubits)
+                circuit = qulacs.QuantumCircuit(num_qubits)
         # run the remaining circuit after the last Measurement
         if gate != 'Meas':
             circuit.update_quantum_state(state)   
@@ -77,10 +85,71 @@ def run_stabilizer_circuit_old(gate_sequence: list[tuple[str, tuple[int]]], num_
 
     return state, anc_meas
 
+# compiled circuits keyed by (num_qubits, gate sequence) and idle state buffers keyed by num_qubits
+_compiled_circuits = {}
+_state_pool = {}
+
+def compile_stabilizer_circuit(gate_sequence: list[tuple[str, tuple[int]]], num_qubits: int) -> QuantumCircuit:
+    """
+    Build the qulacs circuit of a gate sequence, with a reset after each Measurement.
+    Circuits are cached, so repeated calls with the same sequence return the same object.
+
+    Args:
+        gate_sequence (list[tuple[str, tuple[int]]]): List of gates and their positions.
+        num_qubits (int): Number of qubits in the circuit.
+
+    Returns:
+        QuantumCircuit: The compiled circuit.
+    """
+    key = (num_qubits, tuple((gate, tuple(pos)) for gate, pos in gate_sequence))
+    if key not in _compiled_circuits:
+        circuit = qulacs.QuantumCircuit(num_qubits)
+        for gate, pos in gate_sequence:
+            circuit.add_gate(gatedict[gate](*pos))
+            # reset qubit manually at each Measurement
+            # (read the register of this measurement since reused states keep their classical registers)
+            if gate == 'Meas':
+                Reset = qulacs.gate.Adaptive(qulacs.gate.X(pos[0]), lambda register, i=pos[1]: register[i] == 1)
+                circuit.add_gate(Reset)
+        _compiled_circuits[key] = circuit
+    return _compiled_circuits[key]
+
+def acquire_state(num_qubits: int) -> QuantumState:
+    """
+    Get a state buffer in the zero state, reusing a released one if available.
+
+    Args:
+        num_qubits (int): Number of qubits.
+
+    Returns:
+        QuantumState: State in the zero state.
+    """
+    pool = _state_pool.get(num_qubits, [])
+    state = pool.pop() if len(pool) > 0 else qulacs.QuantumState(num_qubits)
+    state.set_zero_state()
+    return state
+
+def release_state(state: QuantumState) -> None:
+    """
+    Return a state buffer to the pool. The state must not be used afterwards.
+
+    Args:
+        state (QuantumState): State to release.
+    """
+    _state_pool.setdefault(state.get_qubit_count(), []).append(state)
+
+def clear_caches() -> None:
+    """
+    Clear the compiled circuits and the pool of state buffers.
+    """
+    _compiled_circuits.clear()
+    _state_pool.clear()
+
 def run_stabilizer_circuit(gate_sequence: list[tuple[str, tuple[int]]], num_qubits: int, num_meas: int,
                            target_outcomes: str = None, verbose: bool = False) -> tuple[QuantumState, str]:
     """
     Run a stabilizer circuit with the given gate sequence.
+    The returned state can be given back with release_state once it is no longer needed.
 
     Args:
         gate_sequence (list[tuple[str, tuple[int]]]): List of gates and their positions.
@@ -92,20 +161,12 @@ def run_stabilizer_circuit(gate_sequence: list[tuple[str, tuple[int]]], num_qubi
     Returns:
         tuple[QuantumState, str]: The final quantum state and the ancilla measurement outcomes.
     """
-    computational_states = [''.join(map(str,i))[::-1] for i in itertools.product([0, 1], repeat=num_qubits)]
     anc_meas = ''
-
-    circuit = QuantumCircuit(num_qubits)
-    for gate, pos in gate_sequence:
-        circuit.add_gate(gatedict[gate](*pos))
-        # reset qubit manually at each Measurement
-        if gate == 'Meas':
-            Reset = Adaptive(X(pos[0]), lambda register: register[-1] == 1)
-            circuit.add_gate(Reset)
+    circuit = compile_stabilizer_circuit(gate_sequence, num_qubits)
+    state = acquire_state(num_qubits)
 
     while anc_meas != target_outcomes:
 
-        state = QuantumState(num_qubits)
         state.set_zero_state()
         circuit.update_quantum_state(state)   
 
@@ -115,10 +176,41 @@ def run_stabilizer_circuit(gate_sequence: list[tuple[str, tuple[int]]], num_qubi
             break
 
     if verbose:
+        computational_states = [''.join(map(str,i))[::-1] for i in itertools.product([0, 1], repeat=num_qubits)]
         print(f'ancilla meas: {anc_meas}')
         print_state(state.get_vector(), computational_states)
 
     return state, anc_meas
+
+def run_stabilizer_circuit_batch(gate_sequence: list[tuple[str, tuple[int]]], num_qubits: int, num_meas: int,
+                                 num_shots: int, return_vectors: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Run a stabilizer circuit num_shots times with one compiled circuit and one state buffer.
+
+    Args:
+        gate_sequence (list[tuple[str, tuple[int]]]): List of gates and their positions.
+        num_qubits (int): Number of qubits in the circuit.
+        num_meas (int): Number of measurement qubits.
+        num_shots (int): Number of repetitions.
+        return_vectors (bool): Whether to also return the final state vectors.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: 
+            outcomes: uint8 array (num_shots x num_meas) of ancilla measurement outcomes.
+            vectors: complex array (num_shots x 2**num_qubits) of final state vectors, or None.
+    """
+    circuit = compile_stabilizer_circuit(gate_sequence, num_qubits)
+    state = acquire_state(num_qubits)
+    outcomes = np.zeros([num_shots, num_meas], dtype=np.uint8)
+    vectors = np.zeros([num_shots, 2**num_qubits], dtype=complex) if return_vectors else None
+    for shot in range(num_shots):
+        state.set_zero_state()
+        circuit.update_quantum_state(state)
+        outcomes[shot] = [state.get_classical_value(i) for i in range(num_meas)]
+        if return_vectors:
+            vectors[shot] = state.get_vector()
+    release_state(state)
+    return outcomes, vectors
     
 def get_state_dict(state: QuantumState, computational_states: list[str], num_data: int = 7) -> dict[str, complex]:
     """
@@ -133,16 +225,87 @@ def get_state_dict(state: QuantumState, computational_states: list[str], num_dat
         dict[str, complex]: Dictionary representation of the quantum state.
     """
     state_dict = {}
-    for i, s in enumerate(computational_states):
-        s = s[:num_data]
-        if abs(state[i]) > 1e-6:
-            state_dict[s] = state[i]
+    for i in np.flatnonzero(np.abs(state) > 1e-6):
+        state_dict[computational_states[i][:num_data]] = state[i]
     return state_dict
 
+def state_vectors(states) -> np.ndarray:
+    """
+    State vectors as a NumPy array.
+
+    Args:
+        states: A QuantumState, a list of QuantumState, or state vectors (2^n or (num_states x 2^n) array).
+
+    Returns:
+        np.ndarray: complex array, 2^n for a single state, (num_states x 2^n) otherwise.
+    """
+    if hasattr(states, 'get_vector'):
+        return states.get_vector()
+    if len(states) > 0 and hasattr(states[0], 'get_vector'):
+        return np.stack([state.get_vector() for state in states])
+    return np.asarray(states)
+
+def data_amplitudes(vectors: np.ndarray, num_data: int = 7) -> np.ndarray:
+    """
+    Reduce state vectors to the data qubits (0 to num_data-1, the low bits of the index in qulacs),
+    for states whose ancilla qubits are in a computational basis state (e.g. reset after measurement).
+    The ancilla basis state is the one carrying the largest weight.
+
+    Args:
+        vectors (np.ndarray): (..., 2^n) state vectors.
+        num_data (int): Number of data qubits.
+
+    Returns:
+        np.ndarray: (..., 2^num_data) amplitudes of the data qubits.
+    """
+    vectors = np.asarray(vectors)
+    blocks = vectors.reshape(vectors.shape[:-1] + (-1, 2**num_data))
+    ancilla = np.argmax((np.abs(blocks)**2).sum(-1), axis=-1)
+    return np.take_along_axis(blocks, ancilla[..., None, None], axis=-2)[..., 0, :]
+
+def state_fidelity(vectors: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """
+    Fidelity |<reference|vector>|^2 of normalized states, insensitive to the global phase.
+
+    Args:
+        vectors (np.ndarray): (..., 2^n) state vectors.
+        reference (np.ndarray): 2^n state vector, or vectors broadcasting against vectors.
+
+    Returns:
+        np.ndarray: Fidelities, with the leading shape of vectors.
+    """
+    vectors, reference = np.asarray(vectors), np.asarray(reference)
+    overlap = np.abs((reference.conj() * vectors).sum(-1))**2
+    return overlap / (np.abs(vectors)**2).sum(-1) / (np.abs(reference)**2).sum(-1)
+
+def compare_states(states, reference, num_data: int = None, tol: float = 1e-6):
+    """
+    Compare states to a reference state up to a global phase, optionally on the data qubits only.
+
+    Args:
+        states: States to compare, see state_vectors.
+        reference: Reference state, see state_vectors.
+        num_data (int): Number of data qubits to reduce to (data_amplitudes), None to compare the full states.
+        tol (float): Largest infidelity of equal states.
+
+    Returns:
+        bool or np.ndarray: Whether each state equals the reference.
+
+    Example:
+        >>> compare_states([codeword, -codeword, other], codeword)
+        array([ True,  True, False])
+    """
+    vectors, reference = state_vectors(states), state_vectors(reference)
+    if num_data is not None:
+        vectors, reference = data_amplitudes(vectors, num_data), data_amplitudes(reference, num_data)
+    same = state_fidelity(vectors, reference) > 1 - tol
+    return bool(same) if same.ndim == 0 else same
+
 def check_encoding(gate_sequence: list[tuple[str, tuple[int]]], num_qubits: int, num_meas: int, lut: dict[str, int],
                    correct: str, title: str = '') -> bool:
     """
     Check the encoding of a stabilizer circuit.
+    States are compared to the code word on the data qubits, up to a global phase (compare_states).
 
     Args:
         gate_sequence (list[tuple[str, tuple[int]]]): List of gates and their positions.
@@ -155,11 +318,10 @@ def check_encoding(gate_sequence: list[tuple[str, tuple[int]]], num_qubits: int,
     Returns:
         bool: True if the encoding is correct, False otherwise.
     """
-    computational_states = [''.join(map(str,i))[::-1] for i in itertools.product([0, 1], repeat=num_qubits)]
-
-    # get code word
+    # get code word, on the data qubits since the ancillas are reset
     state, anc_meas = run_stabilizer_circuit(gate_sequence, num_qubits, num_meas, target_outcomes='000')
-    codeword = get_state_dict(state.get_vector(),computational_states)
+    codeword = data_amplitudes(state.get_vector())
+    release_state(state)
 
     synd_list = list(lut.keys())
 
@@ -168,23 +330,25 @@ def check_encoding(gate_sequence: list[tuple[str, tuple[int]]], num_qubits: int,
     afters = []
     while len(synd_list) > 0:
         state, anc_meas = run_stabilizer_circuit(gate_sequence, num_qubits, num_meas)
-        before = get_state_dict(state.get_vector(),computational_states) == codeword
+        before = compare_states(data_amplitudes(state.get_vector()), codeword)
         # print(anc_meas,synd_list)
         if anc_meas in synd_list:
             synd_list.remove(anc_meas)
         else:
+            release_state(state)
             continue
 
         # correct single qubit
         if anc_meas != '000':
-            circuit = QuantumCircuit(num_qubits)
+            circuit = qulacs.QuantumCircuit(num_qubits)
             if correct == 'Z':
                 circuit.add_Z_gate(lut[anc_meas])
             elif correct == 'X':
                 circuit.add_X_gate(lut[anc_meas])
             circuit.update_quantum_state(state)
-        after = get_state_dict(state.get_vector(),computational_states) == codeword
+        after = compare_states(data_amplitudes(state.get_vector()), codeword)
         afters.append(after)
+        release_state(state)
 
         print(f'   synd = {anc_meas}:  {before}  ->  {after}')
     return all(afters)
@@ -266,8 +430,62 @@ def test_check_encoding():
 
     run_test([test_cases, [True]*len(test_cases)], lambda x: check_encoding(*x), 'check_encoding')
 
+def test_run_stabilizer_circuit_batch():
+    # standard Z-checks on |0000000>: all syndromes are trivial
+    gate_sequence = [
+        *[('CX', (control, target)) for control, target in zip([3,4,5,6],[7]*4)],
+        ('Meas', (7,0)),
+        *[('CX', (control, target)) for control, target in zip([1,2,5,6],[7]*4)],
+        ('Meas', (7,1)),
+        *[('CX', (control, target)) for control, target in zip([0,2,4,6],[7]*4)],
+        ('Meas', (7,2)),
+    ]
+    test_cases = {
+        5: (5, 3, 0, True),
+        20: (20, 3, 0, True),
+    }
+    def test_func(num_shots):
+        outcomes, vectors = run_stabilizer_circuit_batch(gate_sequence, 8, 3, num_shots, return_vectors=True)
+        return (*outcomes.shape, outcomes.sum(), bool(abs(abs(vectors[:,0]) - 1).max() < 1e-10))
+    run_test(test_cases, test_func, 'run_stabilizer_circuit_batch')
+
+def test_compare_states():
+    """
+    Tests the comparison up to global phase on the data qubits, for one state and a batch.
+    """
+    # standard X-checks on |0000000> give the logical 0 state, the ancilla is reset
+    gate_sequence = [
+        ('H', (7,)), *[('CX', (7, target)) for target in [3,4,5,6]], ('H', (7,)), ('Meas', (7,0)),
+        ('H', (7,)), *[('CX', (7, target)) for target in [1,2,5,6]], ('H', (7,)), ('Meas', (7,1)),
+        ('H', (7,)), *[('CX', (7, target)) for target in [0,2,4,6]], ('H', (7,)), ('Meas', (7,2)),
+    ]
+    state, _ = run_stabilizer_circuit(gate_sequence, 8, 3, target_outcomes='000')
+    codeword = state.get_vector()
+    flipped = codeword.reshape(2, 2**7)[:, ::-1].reshape(-1) # X on every data qubit: logical 1
+    on_ancilla = np.roll(codeword, 2**7) # same data state, ancilla in |1>
+    computational_states = [''.join(map(str,i))[::-1] for i in itertools.product([0, 1], repeat=8)]
+    test_cases = {
+        'global phase': True,
+        'logical 1': False,
+        'ancilla in |1>': (False, True),
+        'batch': [True, True, False, True],
+        'get_state_dict': True,
+    }
+    outputs = {
+        'global phase': compare_states(1j*codeword, state),
+        'logical 1': compare_states(flipped, codeword, num_data=7),
+        'ancilla in |1>': (compare_states(on_ancilla, codeword), compare_states(on_ancilla, codeword, num_data=7)),
+        'batch': compare_states([codeword, -codeword, flipped, on_ancilla], codeword, num_data=7).tolist(),
+        'get_state_dict': get_state_dict(codeword, computational_states) == {
+            s[:7]: codeword[i] for i, s in enumerate(computational_states) if abs(codeword[i]) > 1e-6},
+    }
+    release_state(state)
+    run_test(test_cases, lambda input: outputs[input], 'compare_states')
+
 def test_all():
     print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_run_stabilizer_circuit_batch()
+    test_compare_states()
     test_check_encoding()
     print()
     print()
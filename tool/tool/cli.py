@@ -0,0 +1,222 @@
+import os
+import argparse
+import numpy as np
+from typing import List
+from tool import assets
+from tool.lazy import is_available
+from tool.testing import run_test
+
+"""
+Command-line verifier, run as python -m tool.
+
+Only numpy and the combinatorial modules are imported, the built-in sequences, codes, look-up tables and flag error
+sets are read from the precomputed assets (tool.assets). The exit status is 0 if the circuits are fault-tolerant,
+1 if they are not, so that scripts can call the verifier in a loop.
+
+Examples:
+    python -m tool ft flag_bridge_CX_SZ1 flag_bridge_CX_SZ2 flag_bridge_CX_SZ3 \\
+        --ancillas 0,1,2 1,0,3 3,1,2 --lut Steane_flag_bridge_SZ --code steane
+    python -m tool flags ZZZZ_1c --code steane_flagged --stab-loc 0,3,1,4
+    python -m tool batch manifest.json --workers 4 --output verdicts.json
+    python -m tool search ZZZZ --flags 1 --code steane_flagged --stab-loc 0,3,1,4 --top 5
+    python -m tool optimize flag_bridge_CZ_SX1 --preserve-locations
+    python -m tool list
+    python -m tool build-assets
+
+Methods:
+    main(...): Run the command line, returns the exit status.
+    test_all(): Runs all the test methods.
+"""
+
+def _indices(text: str) -> List[int]:
+    return [int(i) for i in text.split(',')]
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m tool', description='Fault-tolerance verifier.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ft_parser = commands.add_parser('ft', help='tool.ft.check_ft on named stabilizer check sequences')
+    ft_parser.add_argument('sequences', nargs='+', help='sequence names, one per round (python -m tool list)')
+    ft_parser.add_argument('--ancillas', nargs='+', type=_indices, required=True,
+                           help='used ancilla indices of every round, e.g. 0,1,2 1,0,3 3,1,2')
+    ft_parser.add_argument('--lut', required=True, help='look-up table name')
+    ft_parser.add_argument('--code', default='steane', help='code name (default: steane)')
+    ft_parser.add_argument('-v', '--verbose', type=int, default=0, choices=[0, 1, 2], help='check_ft verbosity')
+
+    flags_parser = commands.add_parser('flags', help='stabilizer_sim.check_FT on a named flag circuit')
+    flags_parser.add_argument('circuit', help='flag circuit name (python -m tool list)')
+    flags_parser.add_argument('--code', default='steane_flagged', help='code name (default: steane_flagged)')
+    flags_parser.add_argument('--stab-loc', type=_indices, required=True,
+                              help='data qubits of the circuit in the code, e.g. 0,3,1,4')
+    flags_parser.add_argument('-v', '--verbose', type=int, default=0, choices=[0, 1, 2], help='check_FT verbosity')
+
+    batch_parser = commands.add_parser('batch', help='tool.ft_batch.check_ft_batch on a JSON manifest of jobs')
+    batch_parser.add_argument('manifest', nargs='?', help='manifest file, the flag bridge circuits by default')
+    batch_parser.add_argument('--workers', type=int, default=None, help='number of processes (default: all CPUs)')
+    batch_parser.add_argument('--output', help='write the verdicts as JSON')
+
+    search_parser = commands.add_parser('search', help='tool.flag_search.search_flag_circuits for a stabilizer')
+    search_parser.add_argument('stabilizer', help='stabilizer on the data qubits of the circuit, e.g. ZZZZ')
+    search_parser.add_argument('--flags', type=int, default=1, help='largest number of flag qubits (default: 1)')
+    search_parser.add_argument('--code', help='code name, to require distinguishable flagged errors')
+    search_parser.add_argument('--stab-loc', type=_indices, help='data qubits of the circuit in the code')
+    search_parser.add_argument('--top', type=int, default=10, help='number of circuits printed (default: 10)')
+    search_parser.add_argument('--workers', type=int, default=None, help='number of processes (default: all CPUs)')
+
+    optimize_parser = commands.add_parser('optimize', help='tool.peephole.optimization_report on named sequences')
+    optimize_parser.add_argument('sequences', nargs='*', help='sequence names, all Clifford sequences by default')
+    optimize_parser.add_argument('--preserve-locations', action='store_true',
+                                 help='keep the two-qubit gates (fault locations) in order')
+
+    for command in (ft_parser, flags_parser, batch_parser, search_parser, optimize_parser):
+        command.add_argument('-q', '--quiet', action='store_true', help='only set the exit status')
+
+    commands.add_parser('list', help='names of the built-in sequences, codes, look-up tables and flag circuits')
+    build_parser = commands.add_parser('build-assets', help='precompute the built-in data')
+    build_parser.add_argument('--output', default=assets.ASSET_FILE, help='asset file')
+    return parser
+
+def _check_ft(args) -> bool:
+    from tool import ft
+    if len(args.ancillas) != len(args.sequences):
+        raise SystemExit(f'error: {len(args.sequences)} sequences but {len(args.ancillas)} --ancillas')
+    for name in args.sequences:
+        # unknown names fail here rather than inside check_ft
+        assets.get_sequence(name)
+    stabilizer_group = assets.get_stabilizer_group(args.code)
+    if args.verbose == 0:
+        return ft.ft_verdict(args.sequences, args.ancillas, args.lut, stabilizer_group)['ft']
+    try:
+        return ft.check_ft(args.sequences, args.ancillas, args.lut, stabilizer_group, verbose=args.verbose)
+    except AssertionError:
+        # check_ft asserts that no unflagged fault leaves a weight > 1 error
+        return False
+
+def _check_flags(args) -> bool:
+    try:
+        import stabilizer_sim
+    except ImportError:
+        raise SystemExit('error: stabilizer_sim not found, run from the repository root')
+    flags, flag_error_set, _ = assets.get_flag_error_set(args.circuit)
+    qec_code = [stabilizer.replace('-', 'I') for stabilizer in assets.CODES[args.code]]
+    fault_tolerant, _ = stabilizer_sim.check_FT(qec_code, flag_error_set, flags, np.array(args.stab_loc),
+                                                verbose=args.verbose)
+    return fault_tolerant
+
+def _check_batch(args) -> bool:
+    from tool import ft_batch
+    jobs = ft_batch.load_manifest(args.manifest) if args.manifest else ft_batch.flag_bridge_manifest()
+    verdicts = ft_batch.check_ft_batch(jobs, num_workers=args.workers)
+    if args.output:
+        ft_batch.save_verdicts(verdicts, args.output)
+    for verdict in verdicts if not args.quiet else []:
+        name = verdict['name'] or verdict['index']
+        if verdict['error'] is not None:
+            print(f'{name}: error {verdict["error"]}')
+        elif verdict['ft']:
+            print(f'{name}: fault-tolerant')
+        else:
+            unflagged = sum(not location['flagged'] for location in verdict['harmful'])
+            print(f'{name}: NOT fault-tolerant ({unflagged} unflagged harmful locations)')
+    return all(verdict['ft'] for verdict in verdicts)
+
+def _search(args) -> bool:
+    from tool import flag_search
+    if (args.code is None) != (args.stab_loc is None):
+        raise SystemExit('error: --code and --stab-loc go together')
+    code = None if args.code is None else [stabilizer.replace('-', 'I') for stabilizer in assets.CODES[args.code]]
+    circuits = flag_search.search_flag_circuits(args.stabilizer, args.flags, code, args.stab_loc,
+                                                num_workers=args.workers)
+    for circuit in circuits[:args.top] if not args.quiet else []:
+        print(f'depth {circuit["depth"]}, {circuit["num_cnots"]} CNOTs, num_qubits {circuit["num_qubits"]}: '
+              f'{circuit["stabilizer_sim"]}')
+    if not args.quiet:
+        print(f'{args.stabilizer}: {len(circuits)} fault-tolerant circuits')
+    return len(circuits) > 0
+
+def _list() -> None:
+    from tool import qec, ft
+    print('sequences:    ', ' '.join(qec.get_sequence()))
+    print('codes:        ', ' '.join(assets.code_names()))
+    print('look-up tables:', ' '.join(ft.look_up_table))
+    print('flag circuits:', ' '.join(assets.FLAG_CIRCUITS))
+
+def main(argv: List[str] = None) -> int:
+    """
+    Run the command line.
+
+    Args:
+        argv (List[str]): Arguments, sys.argv[1:] by default.
+
+    Returns:
+        int: Exit status, 0 if fault-tolerant (all jobs of a batch, a circuit was found by search, the optimized
+            sequences are equivalent, or for list/build-assets), 1 otherwise.
+    """
+    args = _parser().parse_args(argv)
+    if args.command == 'list':
+        _list()
+        return 0
+    if args.command == 'build-assets':
+        print(assets.build_assets(args.output))
+        return 0
+
+    if args.command == 'batch':
+        return 0 if _check_batch(args) else 1
+    if args.command == 'search':
+        return 0 if _search(args) else 1
+    if args.command == 'optimize':
+        from tool import peephole
+        results = peephole.optimization_report(args.sequences or None, args.preserve_locations, not args.quiet)
+        return 0 if all(report['equivalent'] for _, report in results.values()) else 1
+
+    try:
+        fault_tolerant = _check_ft(args) if args.command == 'ft' else _check_flags(args)
+    except KeyError as error:
+        raise SystemExit(f'error: unknown name {error}, see python -m tool list')
+    if not args.quiet:
+        names = ' '.join(args.sequences) if args.command == 'ft' else args.circuit
+        print(f'{names}: {"fault-tolerant" if fault_tolerant else "NOT fault-tolerant"}')
+    return 0 if fault_tolerant else 1
+
+
+############################## TESTING ##############################
+def test_main():
+    """
+    Test the exit status of the ft, batch, search, optimize and flags commands.
+    """
+    ft_args = {
+        'flag bridge SZ': ['ft', 'flag_bridge_CX_SZ1', 'flag_bridge_CX_SZ2', 'flag_bridge_CX_SZ3',
+                           '--ancillas', '0,1,2', '1,0,3', '3,1,2', '--lut', 'Steane_flag_bridge_SZ', '-q'],
+        'flag bridge SX': ['ft', 'flag_bridge_CZ_SX2', 'flag_bridge_CZ_SX3',
+                           '--ancillas', '1,0,3', '3,1,2', '--lut', 'Steane_flag_bridge_SX', '-q'],
+        'non-FT': ['ft', 'ZZZZ_nonFT', '--ancillas', '0', '--lut', 'Steane_flag_bridge_SZ', '-q'],
+        'batch': ['batch', '--workers', '1', '-q'],
+        'search': ['search', 'ZZZZ', '--code', 'steane_flagged', '--stab-loc', '0,3,1,4', '--workers', '1', '-q'],
+        'search without flag': ['search', 'ZZZZ', '--flags', '0', '--workers', '1', '-q'],
+        'optimize': ['optimize', '--preserve-locations', '-q'],
+    }
+    answers = {'flag bridge SZ': 0, 'flag bridge SX': 0, 'non-FT': 1, 'batch': 0, 'search': 0,
+               'search without flag': 1, 'optimize': 0}
+    run_test([list(answers), list(answers.values())], lambda x: main(ft_args[x]), 'main (ft)')
+
+    if not is_available('stabilizer_sim'):
+        print('>> main (flags) - No Test (stabilizer_sim not found, run from the repository root) <<')
+        return
+    flags_args = {
+        'ZZZZ_1c': ['flags', 'ZZZZ_1c', '--stab-loc', '0,3,1,4', '-q'],
+        'ZZZZ_1c on steane': ['flags', 'ZZZZ_1c', '--code', 'steane', '--stab-loc', '0,1,2,3', '-q'],
+        'not a stabilizer': ['flags', 'ZZZZ_1c', '--code', 'steane', '--stab-loc', '0,1,2,6', '-q'],
+    }
+    answers = {'ZZZZ_1c': 0, 'ZZZZ_1c on steane': 0, 'not a stabilizer': 1}
+    run_test([list(answers), list(answers.values())], lambda x: main(flags_args[x]), 'main (flags)')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_main()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
@@ -0,0 +1,242 @@
+import os
+import json
+import itertools
+import numpy as np
+from typing import List
+from tool import qec
+from tool.fault_paths import CHANNELS, get_single_faults, decode_signatures
+from tool.testing import run_test
+
+"""
+Detector error models (DEM) of the stabilizer check circuits.
+
+A uniform Pauli channel with probability p over the k = 4^n-1 Paulis of a location is equivalent to applying
+each Pauli independently with probability q = (1 - (1 - (k+1)p/k)^(2/(k+1)))/2. Every such Pauli is an
+independent fault mechanism whose effect (ancilla outcomes, final data error and logical observables) comes
+from the single-fault propagation of tool.ft. Mechanisms with the same effect are merged, q = q1 + q2 - 2 q1 q2,
+and shots are sampled by XOR-ing the bit-packed effects of the mechanisms that fire.
+
+Methods:
+    extract_dem(...): Compile gate sequences and channel probabilities into a detector error model.
+    sample_dem(...): Sample shots from a detector error model.
+    save_dem(...), load_dem(...): Write and read a detector error model as a compressed .npz file.
+    test_all(): Runs all the test methods.
+"""
+
+MECHANISM_COLUMNS = ('outcomes', 'x', 'z', 'observables')
+
+def independent_probability(p: np.ndarray, num_faults: np.ndarray) -> np.ndarray:
+    """
+    Probability of each independent Pauli mechanism that reproduces a uniform Pauli channel.
+
+    Args:
+        p (np.ndarray): Total probability of the channel.
+        num_faults (np.ndarray): Number of Paulis of the channel (1, 3 or 15).
+
+    Returns:
+        np.ndarray: Probability of each mechanism.
+    """
+    num_faults = np.asarray(num_faults, dtype=float)
+    return (1 - (1 - (num_faults + 1)/num_faults*np.asarray(p))**(2/(num_faults + 1)))/2
+
+def extract_dem(
+    sequences: List,
+    noise: dict,
+    num_qubits: int = 11,
+    num_datas: int = 7,
+    logicals: List[str] = (),
+) -> dict:
+    """
+    Compile gate sequences with a noise specification into a detector error model.
+
+    Args:
+        sequences (List): List of gate sequences (names or gate tuples), one per round.
+        noise (dict): Probability of each noise channel of fault_paths.CHANNELS, missing channels are noiseless.
+        num_qubits (int): Number of qubits.
+        num_datas (int): Number of data qubits.
+        logicals (List[str]): Logical operators on the data qubits, observable i flips when the final data error
+            anticommutes with logicals[i].
+
+    Returns:
+        dict: Detector error model with
+            probability: probability of each mechanism,
+            outcomes, x, z, observables: bit-packed effect of each mechanism (uint64),
+            num_rounds, num_ancillas, num_datas, logicals, noise.
+
+    Example:
+        >>> dem = extract_dem(['flag_bridge_CX_SZ3'], {'idle': 1e-3, '1q': 1e-3, '2q': 1e-3, 'meas': 1e-3})
+        >>> shots = sample_dem(dem, 10**6, seed=0)
+    """
+    faults = get_single_faults(sequences, num_qubits, num_datas, meas_errors=noise.get('meas', 0) > 0,
+                               merge=False)
+    channel_probs = np.array([noise.get(channel, 0.) for channel in CHANNELS])
+    probs = independent_probability(channel_probs[faults['channel']], np.rint(1/faults['weight']))
+
+    logical_paulis = qec.pack_paulis(list(logicals))
+    observables = np.zeros(len(probs), dtype=np.uint64)
+    for i, logical in enumerate(logical_paulis):
+        anticommute = qec.popcount((faults['x'] & logical['z']) ^ (faults['z'] & logical['x'])) & 1
+        observables |= anticommute.astype(np.uint64) << np.uint64(i)
+
+    mechanisms = np.zeros(len(probs), dtype=[(name, np.uint64) for name in MECHANISM_COLUMNS])
+    mechanisms['outcomes'], mechanisms['x'], mechanisms['z'] = faults['outcomes'], faults['x'], faults['z']
+    mechanisms['observables'] = observables
+    keep = (probs > 0) & (np.bitwise_or.reduce([mechanisms[name] for name in MECHANISM_COLUMNS]) > 0)
+    mechanisms, probs = mechanisms[keep], probs[keep]
+
+    # merge identical mechanisms: an odd number of them must fire
+    unique, inverse = np.unique(mechanisms, return_inverse=True)
+    flip = np.ones(len(unique))
+    np.multiply.at(flip, inverse.ravel(), 1 - 2*probs)
+
+    dem = {name: unique[name] for name in MECHANISM_COLUMNS}
+    dem.update({
+        'probability': (1 - flip)/2,
+        'num_rounds': faults['num_rounds'],
+        'num_ancillas': faults['num_ancillas'],
+        'num_datas': num_datas,
+        'logicals': list(logicals),
+        'noise': {channel: float(noise.get(channel, 0.)) for channel in CHANNELS},
+    })
+    return dem
+
+def sample_dem(dem: dict, num_shots: int, seed: int = None) -> dict:
+    """
+    Sample shots from a detector error model.
+    Each mechanism fires in a binomial number of distinct shots, and its bit-packed effect is XOR-ed into them,
+    so the cost scales with the number of firings rather than shots x mechanisms.
+
+    Args:
+        dem (dict): Detector error model from extract_dem.
+        num_shots (int): Number of shots.
+        seed (int): Seed of the random number generator.
+
+    Returns:
+        dict: Bit-packed outcomes, x, z and observables of every shot (uint64 arrays of length num_shots).
+    """
+    rng = np.random.default_rng(seed)
+    shots = {name: np.zeros(num_shots, dtype=np.uint64) for name in MECHANISM_COLUMNS}
+    num_fired = rng.binomial(num_shots, dem['probability'])
+    for m in np.flatnonzero(num_fired):
+        fired = rng.choice(num_shots, num_fired[m], replace=False)
+        for name in MECHANISM_COLUMNS:
+            if dem[name][m]:
+                shots[name][fired] ^= dem[name][m]
+    return shots
+
+def save_dem(dem: dict, filename: str) -> None:
+    """
+    Write a detector error model as a compressed .npz file, the scalars are stored as a JSON header.
+
+    Args:
+        dem (dict): Detector error model from extract_dem.
+        filename (str): File name.
+    """
+    header = {key: value for key, value in dem.items() if not isinstance(value, np.ndarray)}
+    np.savez_compressed(filename, header=json.dumps(header), probability=dem['probability'],
+                        **{name: dem[name] for name in MECHANISM_COLUMNS})
+
+def load_dem(filename: str) -> dict:
+    """
+    Read a detector error model written by save_dem.
+
+    Args:
+        filename (str): File name.
+
+    Returns:
+        dict: Detector error model.
+    """
+    with np.load(filename) as data:
+        dem = json.loads(str(data['header']))
+        dem.update({name: data[name] for name in ('probability',) + MECHANISM_COLUMNS})
+    return dem
+
+
+############################## TESTING ##############################
+def test_independent_probability():
+    """
+    Test the independent_probability function.
+    Each Pauli of the channel must result with probability p/k.
+    """
+    def single_pauli_probability(x):
+        p, k = x
+        q = independent_probability(p, k)
+        # Pauli P results when the mechanisms that fire multiply to P, enumerate subsets of the group
+        num_qubits = {1: 0, 3: 1, 15: 2}[k]
+        if num_qubits == 0:
+            return round(float(q), 12)
+        paulis = qec.pack_paulis([''.join(s) for s in itertools.product('-XYZ', repeat=num_qubits)][1:])
+        total = 0.
+        for subset in range(1 << k):
+            chosen = [(subset >> i) & 1 for i in range(k)]
+            x = np.bitwise_xor.reduce(paulis['x'][np.array(chosen, bool)], initial=np.uint64(0))
+            z = np.bitwise_xor.reduce(paulis['z'][np.array(chosen, bool)], initial=np.uint64(0))
+            if x == paulis['x'][0] and z == paulis['z'][0]:
+                total += q**sum(chosen)*(1 - q)**(k - sum(chosen))
+        return round(total, 12)
+
+    test_cases = [(0.01, 1), (0.01, 3), (0.03, 3), (0.01, 15)]
+    answers = [round(p/k, 12) for p, k in test_cases]
+    run_test([test_cases, answers], single_pauli_probability, 'independent_probability')
+
+def test_extract_dem():
+    """
+    Test the extract_dem function.
+    """
+    noise = {'idle': 2e-3, '1q': 1e-3, '2q': 3e-3, 'meas': 1e-3}
+    dem = extract_dem(['flag_bridge_CX_SZ2', 'flag_bridge_CX_SZ3'], noise, logicals=['XXXXXXX', 'ZZZZZZZ'])
+    mechanisms = np.stack([dem[name] for name in MECHANISM_COLUMNS], axis=1)
+
+    test_cases = [
+        ('no duplicates', len(np.unique(mechanisms, axis=0)) == len(mechanisms)),
+        ('no trivial mechanisms', bool(mechanisms.any(axis=1).all())),
+        ('probabilities', bool(((dem['probability'] > 0) & (dem['probability'] < 0.5)).all())),
+        ('ancilla flips', bool(np.isin(np.uint64(1) << np.arange(8, dtype=np.uint64), dem['outcomes']).all())),
+        ('meas only', len(extract_dem(['flag_bridge_CX_SZ3'], {'meas': 1e-2})['probability'])),
+    ]
+    run_test([[t[0] for t in test_cases], [True]*4 + [4]], lambda x: dict(test_cases)[x], 'extract_dem')
+
+    # save and load
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'dem.npz')
+        save_dem(dem, filename)
+        loaded = load_dem(filename)
+    same = all(np.array_equal(loaded[name], dem[name]) for name in ('probability',) + MECHANISM_COLUMNS)
+    run_test([[0], [True]], lambda x: same and loaded['noise'] == dem['noise'], 'save_dem/load_dem')
+
+def test_sample_dem():
+    """
+    Test the sample_dem function against the exact fault-path polynomial.
+    The acceptance estimate must lie within 4 standard deviations.
+    """
+    from tool.fault_paths import enumerate_fault_paths, evaluate_fault_polynomial, _steane_stabilizer_group
+    sequences, used_anc_inds = ['flag_bridge_CX_SZ2', 'flag_bridge_CX_SZ3'], [[1,0,3],[3,1,2]]
+    lut_name, stabilizer_group = 'Steane_flag_bridge_SZ', _steane_stabilizer_group()
+    p, num_shots = 5e-3, 200000
+
+    dem = extract_dem(sequences, dict.fromkeys(CHANNELS, p))
+    shots = sample_dem(dem, num_shots, seed=1)
+    accepted, failed = decode_signatures(shots['x'], shots['z'], shots['outcomes'], dem['num_rounds'],
+                                         dem['num_ancillas'], used_anc_inds, lut_name, stabilizer_group)
+    poly = enumerate_fault_paths(sequences, used_anc_inds, lut_name, stabilizer_group, order=2)
+    acceptance = float(evaluate_fault_polynomial(poly, p)[1])
+    std = np.sqrt(acceptance*(1 - acceptance)/num_shots)
+    run_test([[p], [True]], lambda x: bool(abs(accepted.mean() - acceptance) < 4*std), 'sample_dem')
+
+    same_seed = all(np.array_equal(a, b) for a, b in zip(sample_dem(dem, 1000, seed=3).values(),
+                                                        sample_dem(dem, 1000, seed=3).values()))
+    run_test([[3], [True]], lambda x: same_seed, 'sample_dem (seeded)')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_independent_probability()
+    test_extract_dem()
+    test_sample_dem()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
@@ -0,0 +1,238 @@
+import os
+import numpy as np
+from tool import noisy_sim
+from tool.testing import run_test
+
+"""
+Automatic choice of the simulator of a noisy gate sequence, between the Pauli-frame engine and the qulacs state
+vector of tool.noisy_sim.
+
+A circuit is inspected for its gate set, number of qubits, noise and requested outputs:
+    - Clifford gates (FRAME_GATES) with Pauli noise, when only measurements and single-term Pauli observables are
+      requested, go to the frame engine (noisy_sim.run_noisy_frames): one stabilizer-tableau run for the reference,
+      then O(shots x gates) bit operations instead of a 2^n state vector per shot, up to MAX_FRAME_QUBITS qubits,
+    - non-Clifford gates, final states or multi-term observables go to the state vector
+      (noisy_sim.run_noisy_stabilizer_circuit, presampled noise), up to MAX_STATEVECTOR_QUBITS qubits.
+The decision and its reason are returned with the results, so that a notebook can record which engine ran.
+
+Methods:
+    inspect_circuit(...): Gate set, size, noise and output requirements of a circuit.
+    select_engine(...): Engine able to run a circuit fastest, with the reason.
+    simulate(...): Run a circuit on the selected (or a given) engine.
+    test_all(): Runs all the test methods.
+"""
+
+ENGINES = ('frames', 'statevector')
+FRAME_GATES = ('I', 'H', 'S', 'CX', 'CZ', 'Meas')
+# bit-packed frames hold at most 64 qubits
+MAX_FRAME_QUBITS = 64
+MAX_STATEVECTOR_QUBITS = 30
+OUTPUTS = ('measurements', 'observables', 'states')
+
+def _single_term(observable) -> bool:
+    return not hasattr(observable[0], 'get_term_count') or observable[0].get_term_count() == 1
+
+def inspect_circuit(
+        gate_sequence: list[tuple[str, tuple[int]]],
+        num_qubits: int,
+        observables: list = (),
+        outputs: tuple[str] = ('measurements', 'observables'),
+        noise_1q = None,
+        noise_2q = None,
+        ) -> dict:
+    """
+    Properties of a circuit that decide which engines can run it.
+
+    Args:
+        gate_sequence (list[tuple[str, tuple[int]]]): List of gates and their positions.
+        num_qubits (int): Number of qubits.
+        observables (list): [observable, label] pairs or specs, see noisy_sim.pack_observables.
+        outputs (tuple[str]): Requested outputs among OUTPUTS.
+        noise_1q, noise_2q: Pauli letters of the gate noise, see noisy_sim.run_noisy_stabilizer_circuit.
+
+    Returns:
+        dict: gates (sorted gate names), non_clifford (gates outside FRAME_GATES), num_qubits, pauli_noise,
+            multi_term (number of observables that are not a single Pauli), outputs.
+    """
+    unknown = set(outputs) - set(OUTPUTS)
+    if unknown:
+        raise ValueError(f'unknown outputs {sorted(unknown)}, expected some of {OUTPUTS}')
+    gates = sorted({gate for gate, _ in gate_sequence})
+    return {
+        'gates': gates,
+        'non_clifford': [gate for gate in gates if gate not in FRAME_GATES],
+        'num_qubits': num_qubits,
+        'pauli_noise': set((noise_1q or '') + (noise_2q or '')) <= set('XYZ'),
+        'multi_term': sum(not _single_term(observable) for observable in observables),
+        'outputs': tuple(outputs),
+    }
+
+def select_engine(properties: dict) -> tuple[str, str]:
+    """
+    Fastest engine able to run a circuit.
+
+    Args:
+        properties (dict): Output of inspect_circuit.
+
+    Returns:
+        tuple[str, str]: Engine name (ENGINES) and the reason of the choice.
+
+    Raises:
+        ValueError: If no engine can run the circuit.
+    """
+    n = properties['num_qubits']
+    needs_vector = []
+    if properties['non_clifford']:
+        needs_vector.append(f'non-Clifford gates {", ".join(properties["non_clifford"])}')
+    if not properties['pauli_noise']:
+        needs_vector.append('non-Pauli noise')
+    if 'states' in properties['outputs']:
+        needs_vector.append('final states requested')
+    if properties['multi_term'] and 'observables' in properties['outputs']:
+        needs_vector.append(f'{properties["multi_term"]} multi-term observables')
+    if n > MAX_FRAME_QUBITS and not needs_vector:
+        needs_vector.append(f'{n} qubits exceed the {MAX_FRAME_QUBITS}-qubit frames')
+
+    if not needs_vector:
+        return 'frames', (f'Clifford gates ({", ".join(properties["gates"])}) with Pauli noise and shot outputs: '
+                          f'Pauli frames instead of 2^{n} amplitudes per shot')
+    if n > MAX_STATEVECTOR_QUBITS:
+        raise ValueError(f'{"; ".join(needs_vector)} need a state vector, but {n} qubits exceed '
+                         f'{MAX_STATEVECTOR_QUBITS}')
+    return 'statevector', f'{"; ".join(needs_vector)}: state vector of 2^{n} amplitudes'
+
+def simulate(
+        gate_sequence: list[tuple[str, tuple[int]]],
+        num_qubits: int,
+        num_meas: int,
+        num_shots: int,
+        observables: list = (),
+        outputs: tuple[str] = ('measurements', 'observables'),
+        noise_1q = None,
+        noise_2q = None,
+        meas_noise = None,
+        noise_prob_1q = 0.,
+        noise_prob_2q = 0.,
+        seed: int = None,
+        engine: str = None,
+        noise_model = None,
+        ) -> dict:
+    """
+    Run a noisy gate sequence on the engine selected by select_engine, or on a given engine.
+
+    Args:
+        gate_sequence, num_qubits, num_meas, num_shots, noise_*: See noisy_sim.run_noisy_stabilizer_circuit.
+        observables (list): [observable, label] pairs or specs, see noisy_sim.pack_observables.
+        outputs (tuple[str]): Requested outputs among OUTPUTS.
+        seed (int): Seed of the noise.
+        engine (str): Engine to use (ENGINES), None to select it.
+        noise_model (tool.noise_model.NoiseModel): If given, replaces the noise_* arguments on either engine.
+
+    Returns:
+        dict: engine, reason, properties (inspect_circuit) and the requested outputs: measurements
+            (num_shots x num_meas), observables (num_shots x num_observables), states (list of QuantumState).
+
+    Raises:
+        ValueError: If the given engine cannot run the circuit.
+    """
+    properties = inspect_circuit(gate_sequence, num_qubits, observables, outputs, noise_1q, noise_2q)
+    selected, reason = select_engine(properties)
+    if engine is None:
+        engine = selected
+    elif engine == 'frames' and selected != 'frames':
+        raise ValueError(f'the frame engine cannot run this circuit: {reason.split(":")[0]}')
+    elif engine != selected:
+        reason = f'{engine} requested (would select {selected}: {reason})'
+    else:
+        reason = f'{engine} requested: {reason}'
+    if engine not in ENGINES:
+        raise ValueError(f'unknown engine {engine}, expected one of {ENGINES}')
+
+    noise = (noise_1q, noise_2q, meas_noise, noise_prob_1q, noise_prob_2q)
+    result = {'engine': engine, 'reason': reason, 'properties': properties}
+    if engine == 'frames':
+        obs_results, measurements = noisy_sim.run_noisy_frames(gate_sequence, num_qubits, num_meas, num_shots,
+                                                               list(observables), *noise, seed=seed,
+                                                               noise_model=noise_model)
+        states = None
+    else:
+        # (coefficient, Pauli string) specs are built into qulacs observables
+        specs = [observable for observable in observables if isinstance(observable[1], str)
+                 and not hasattr(observable[0], 'get_term_count')]
+        qulacs_observables = noisy_sim.build_observables(num_qubits, specs) if specs else list(observables)
+        states, obs_results, measurements = noisy_sim.run_noisy_stabilizer_circuit(
+            gate_sequence, num_qubits, num_meas, num_shots, qulacs_observables, *noise, presample=True, seed=seed,
+            noise_model=noise_model)
+    outputs_by_name = {'measurements': np.asarray(measurements, dtype=np.uint8).reshape(num_shots, num_meas),
+                       'observables': np.asarray(obs_results).reshape(num_shots, len(observables)),
+                       'states': states}
+    result.update({name: outputs_by_name[name] for name in outputs})
+    return result
+
+
+############################## TESTING ##############################
+def test_select_engine():
+    """
+    Test the engine chosen for Clifford and non-Clifford circuits, requested outputs and sizes.
+    """
+    clifford = [('H', (0,)), ('CX', (0, 1)), ('CX', (0, 2)), ('Meas', (2, 0))]
+    test_cases = {
+        'clifford shots': (clifford, 3, [(1, 'Z 0 Z 1')], ('measurements', 'observables'), 'frames'),
+        'states': (clifford, 3, [], ('measurements', 'states'), 'statevector'),
+        'T gate': (clifford + [('T', (0,))], 3, [], ('measurements',), 'statevector'),
+        'large clifford': ([('H', (0,)), ('CX', (0, 39))], 40, [], ('measurements',), 'frames'),
+        'large T': ([('H', (0,)), ('T', (39,))], 40, [], ('measurements',), ValueError),
+    }
+    def test_func(name):
+        sequence, num_qubits, observables, outputs, _ = test_cases[name]
+        try:
+            return select_engine(inspect_circuit(sequence, num_qubits, observables, outputs, 'XYZ', 'XYZ'))[0]
+        except ValueError:
+            return ValueError
+    run_test({name: case[-1] for name, case in test_cases.items()}, test_func, 'select_engine')
+
+def test_simulate():
+    """
+    Test that both engines agree on a deterministic Clifford circuit, that a T gate runs on the state vector,
+    that forcing the frame engine on it fails, and that a Clifford circuit beyond MAX_STATEVECTOR_QUBITS runs.
+    """
+    # ZZ parity of a Bell pair, then a T gate that commutes with the observables
+    sequence = [('H', (0,)), ('CX', (0, 1)), ('CX', (0, 2)), ('CX', (1, 2)), ('Meas', (2, 0))]
+    specs = [(1, 'Z 0 Z 1'), (1, 'X 0 X 1')]
+    frames = simulate(sequence, 3, 1, 300, specs, seed=2)
+    vector = simulate(sequence, 3, 1, 5, specs, ('measurements', 'observables', 'states'), seed=2)
+    with_t = simulate(sequence + [('T', (0,)), ('T', (1,))], 3, 1, 5, [(1, 'Z 0 Z 1')], seed=2)
+    # ZZ parity of a 39-qubit GHZ state measured on a 40th qubit
+    ghz = [('H', (0,))] + [('CX', (q, q + 1)) for q in range(38)] + [('CX', (37, 39)), ('CX', (38, 39)),
+                                                                      ('Meas', (39, 0))]
+    large = simulate(ghz, 40, 1, 100, [(1, 'Z 0 Z 38'), (1, ' '.join(f'X {q}' for q in range(39)))], seed=2)
+    test_cases = {
+        'frame engine': ('frames', 0, (1, 1)),
+        'statevector engine': ('statevector', 0, (1, 1)),
+        'T gate': ('statevector', 0, (1,)),
+        'forced frames': ValueError,
+        'large clifford': ('frames', 0, (1, 1)),
+    }
+    def test_func(name):
+        if name == 'forced frames':
+            try:
+                simulate(sequence + [('T', (0,))], 3, 1, 5, engine='frames')
+            except ValueError:
+                return ValueError
+        result = {'frame engine': frames, 'statevector engine': vector, 'T gate': with_t,
+                  'large clifford': large}[name]
+        return (result['engine'], int(result['measurements'].sum()),
+                tuple(np.round(result['observables'].real.mean(0), 6)))
+    run_test(test_cases, test_func, 'simulate')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_select_engine()
+    test_simulate()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
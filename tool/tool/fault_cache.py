@@ -0,0 +1,257 @@
+import os
+import time
+import hashlib
+import tempfile
+from collections import OrderedDict
+import numpy as np
+from typing import Callable, Dict
+from tool.catalog import content_hash
+from tool.testing import run_test
+
+"""
+Content-addressed cache of propagated fault tables.
+
+Tables (dicts of numpy arrays) are keyed by the hash of what they are computed from, e.g. the gate sequence, the
+qubit counts and the fault alphabet, and by the hash of the sources of the propagation code (ft, qec and
+stabilizer_sim), so editing them does not serve stale tables. Recently used tables are kept in memory. With a disk
+tier, all of them are also stored as .npz files, evicted least-recently-used first once the directory exceeds its
+size limit.
+
+The default cache is memory-only. Setting PEAQUE_FAULT_CACHE to a directory (e.g. ~/.cache/peaque_ftqec/faults)
+adds the disk tier, PEAQUE_FAULT_CACHE=off or set_cache(None) disables caching.
+
+Methods:
+    FaultTableCache: Two-tier (memory and disk) LRU cache.
+    cached_arrays(...): Look up a table in the default cache, computing and storing it on a miss.
+    get_cache(), set_cache(...): Default cache.
+    test_all(): Runs all the test methods.
+"""
+
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.environ.get('PEAQUE_FAULT_CACHE')
+
+class FaultTableCache:
+    """
+    Two-tier LRU cache of dicts of numpy arrays.
+    Lookups return copies, so callers may modify the tables in place.
+    """
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = 256 << 20, memory_items: int = 128):
+        """
+        Args:
+            directory (str): Directory of the disk tier, None for a memory-only cache.
+            max_bytes (int): Size limit of the disk tier.
+            memory_items (int): Number of tables kept in memory.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.memory = OrderedDict()
+        self.hits = {'memory': 0, 'disk': 0, 'miss': 0}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def _touch(self, key: str) -> None:
+        # file timestamps from the kernel are coarse, set the access time explicitly
+        now = time.time_ns()
+        try:
+            os.utime(self._path(key), ns=(now, now))
+        except FileNotFoundError:
+            # evicted by another process sharing the directory
+            pass
+
+    def _remember(self, key: str, arrays: Dict[str, np.ndarray]) -> None:
+        self.memory[key] = arrays
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str) -> Dict[str, np.ndarray]:
+        """
+        Table stored under key, None on a miss.
+        """
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            self.hits['memory'] += 1
+            return {name: values.copy() for name, values in self.memory[key].items()}
+        if self.directory is not None:
+            try:
+                with np.load(self._path(key), allow_pickle=False) as data:
+                    arrays = {name: data[name] for name in data.files}
+                self._touch(key)
+            except (OSError, ValueError):
+                arrays = None
+            if arrays is not None:
+                self.hits['disk'] += 1
+                self._remember(key, arrays)
+                return {name: values.copy() for name, values in arrays.items()}
+        self.hits['miss'] += 1
+        return None
+
+    def put(self, key: str, arrays: Dict[str, np.ndarray]) -> None:
+        """
+        Store a table under key, then evict the least recently used files beyond the size limit.
+        """
+        arrays = {name: np.array(values) for name, values in arrays.items()}
+        self._remember(key, arrays)
+        if self.directory is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, self._path(key))
+        self._touch(key)
+        self.evict()
+
+    def evict(self) -> None:
+        """Remove the least recently used files until the disk tier fits in max_bytes."""
+        stats = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.npz'):
+                # other processes sharing the directory may remove files at any time
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                stats.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        stats.sort()
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in stats:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self) -> None:
+        """Empty both tiers."""
+        self.memory.clear()
+        if self.directory is not None:
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith('.npz'):
+                    os.remove(entry.path)
+
+_cache = {}
+
+def _source_hash() -> str:
+    """Hash of ft, qec and stabilizer_sim (when it can be found), computed once."""
+    if 'source_hash' not in _cache:
+        import importlib.util
+        directory = os.path.dirname(__file__)
+        filenames = [os.path.join(directory, name) for name in ('ft.py', 'qec.py')]
+        spec = importlib.util.find_spec('stabilizer_sim')
+        if spec is not None and spec.origin is not None:
+            filenames.append(spec.origin)
+        digest = hashlib.sha256()
+        for filename in filenames:
+            with open(filename, 'rb') as f:
+                digest.update(f.read())
+        _cache['source_hash'] = digest.hexdigest()
+    return _cache['source_hash']
+
+def get_cache() -> FaultTableCache:
+    """
+    Default cache, created on first use: memory-only unless PEAQUE_FAULT_CACHE names a directory, None if caching
+    is disabled.
+    """
+    if 'default' not in _cache:
+        directory = DEFAULT_CACHE_DIR
+        if directory is not None and directory.lower() in ('', '0', 'off', 'none'):
+            _cache['default'] = None
+        else:
+            try:
+                _cache['default'] = FaultTableCache(directory)
+            except OSError:
+                # unwritable directory: keep the memory tier only
+                _cache['default'] = FaultTableCache(None)
+    return _cache['default']
+
+def set_cache(cache: FaultTableCache) -> None:
+    """
+    Replace the default cache, None disables caching.
+    """
+    _cache['default'] = cache
+
+def cached_arrays(kind: str, key_parts, compute: Callable[[], Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    """
+    Table computed by compute(), looked up in the default cache by the content hash of (kind, key_parts) and of the
+    propagation sources.
+
+    Args:
+        kind (str): Name of the computation.
+        key_parts: Everything the table depends on (gate sequences, qubit counts, fault alphabet, ...).
+        compute (Callable): Function without arguments returning the table as a dict of numpy arrays.
+
+    Returns:
+        Dict[str, np.ndarray]: The table.
+    """
+    cache = get_cache()
+    if cache is None:
+        return compute()
+    key = content_hash([CACHE_VERSION, _source_hash(), kind, key_parts])
+    arrays = cache.get(key)
+    if arrays is None:
+        arrays = compute()
+        cache.put(key, arrays)
+    return arrays
+
+
+############################## TESTING ##############################
+def test_fault_table_cache():
+    """
+    Test the memory and disk tiers, the eviction by size, files removed by another process and the recomputation
+    after a change of the propagation sources.
+    """
+    table = {'error': np.arange(1000, dtype=np.uint64), 'fault': np.array(['X', 'YZ'])}
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = FaultTableCache(tmp, max_bytes=20000, memory_items=1)
+        cache.put('a', table)
+        copy = cache.get('a')
+        copy['error'][:] = 0
+        memory_hit = cache.get('a')
+        # a fresh cache only has the disk tier
+        cache = FaultTableCache(tmp, max_bytes=20000, memory_items=1)
+        disk_hit = cache.get('a')
+        # reading 'a' makes 'b' the least recently used when 'c' does not fit
+        cache.put('b', table)
+        cache.get('a')
+        cache.put('c', table)
+        remaining = sorted(entry.name for entry in os.scandir(tmp))
+        # another process evicts 'c'
+        os.remove(os.path.join(tmp, 'c.npz'))
+        cache._touch('c')
+        cache.evict()
+
+        calls, saved = [], dict(_cache)
+        set_cache(FaultTableCache(tmp, memory_items=0))
+        compute = lambda: calls.append(1) or table
+        cached_arrays('test', [1], compute)
+        cached_arrays('test', [1], compute)
+        _cache['source_hash'] = 'edited'
+        cached_arrays('test', [1], compute)
+        _cache.clear()
+        _cache.update(saved)
+        results = {
+            'memory': np.array_equal(memory_hit['error'], table['error']),
+            'disk': np.array_equal(disk_hit['error'], table['error']) and list(disk_hit['fault']) == ['X', 'YZ'],
+            'miss': cache.get('missing'),
+            'evicted': remaining,
+            'recomputed after edit': len(calls),
+        }
+    answers = {'memory': True, 'disk': True, 'miss': None, 'evicted': ['a.npz', 'c.npz'], 'recomputed after edit': 2}
+    run_test([list(answers), list(answers.values())], lambda x: results[x], 'FaultTableCache')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_fault_table_cache()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
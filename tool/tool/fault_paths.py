@@ -0,0 +1,398 @@
+import os
+import math
+import numpy as np
+from typing import List, Tuple
+from tool import qec, ft
+from tool.testing import run_test
+
+"""
+Exact enumeration of fault paths up to a given order.
+
+Each location (idle, 1-qubit gate, 2-qubit gate, ancilla measurement) of the stabilizer check circuits fails
+with the probability of its noise channel, uniformly over its Pauli faults. Pauli propagation through Clifford
+circuits is linear, so the effect of several faults is the XOR of their single-fault signatures (final data error
+and ancilla outcomes). Failure and acceptance are then polynomials in the channel probabilities,
+    P(p) = sum_m A[m] prod_c p_c^m_c (1 - p_c)^(N_c - m_c),
+where m counts the faulty locations of each channel and N_c is the number of locations of channel c.
+Enumerating all fault combinations with sum(m) <= order gives P(p) exactly up to O(p^(order+1)).
+
+Combinations are streamed depth first in chunks of bounded size, and each distinct signature of a chunk is decoded
+once. No pruning by symmetry or by disjoint supports is done: the check circuits are not invariant under the code
+automorphisms (tool.symmetry), and the look-up-table decoding depends on the combined ancilla outcomes, so the
+contributions of faults with disjoint supports do not factorize. Merging equal signatures is the exact reduction.
+
+Methods:
+    get_single_faults(...): Propagate every single fault of every round into bit-packed signatures.
+    decode_signatures(...): Acceptance and failure of data errors with ancilla outcomes, as in ft.check_ft.
+    enumerate_fault_paths(...): Coefficients A[m] of the failure and acceptance polynomials.
+    evaluate_fault_polynomial(...): Failure and acceptance probabilities at given channel probabilities.
+    expand_fault_polynomial(...): Monomial coefficients of a polynomial, exact up to the enumerated order.
+    test_all(): Runs all the test methods.
+"""
+
+CHANNELS = ('idle', '1q', '2q', 'meas')
+
+def get_single_faults(
+    sequences: List,
+    num_qubits: int = 11,
+    num_datas: int = 7,
+    meas_errors: bool = True,
+    merge: bool = True,
+) -> dict:
+    """
+    Propagate every single fault of every round to the end of the sequences.
+    Faults in round s are inserted in sequences[s] and propagated through the later rounds.
+    Faults of one location with the same signature are merged, with their weights summed, unless merge is False.
+
+    Args:
+        sequences (List): List of gate sequences (names or gate tuples), one per round.
+        num_qubits (int): Number of qubits.
+        num_datas (int): Number of data qubits.
+        meas_errors (bool): Whether to include flips of the ancilla outcomes.
+        merge (bool): Whether to merge the faults of a location with the same signature.
+
+    Returns:
+        dict: Arrays over the (merged) faults, sorted by location,
+            x, z: final data error (packed bits),
+            outcomes: ancilla outcomes, bit r*num_ancillas+a for ancilla a in round r,
+            location: location index,
+            channel: index in CHANNELS,
+            weight: probability of the fault given that its location fails,
+        and num_locations (per channel), num_rounds, num_ancillas.
+    """
+    num_rounds, num_ancillas = len(sequences), num_qubits - num_datas
+    assert num_rounds*num_ancillas <= 64
+    x, z, outcomes, locations, channels, weights = [], [], [], [], [], []
+    num_locations = 0
+    for s in range(num_rounds):
+        table = ft.run_sequences(sequences[s:], num_qubits=num_qubits, num_datas=num_datas)
+        keys = [(idx, gate[0], tuple(gate[1])) for idx, gate in zip(table['idx'], table['gate'])]
+        ids = {}
+        local_ids = np.array([ids.setdefault(key, len(ids)) for key in keys])
+        counts = np.bincount(local_ids)
+
+        shifts = (s + np.arange(num_rounds - s, dtype=np.uint64)[:, None])*np.uint64(num_ancillas) \
+                 + np.arange(num_ancillas, dtype=np.uint64)
+        bits = table['ancilla_outcomes'].astype(np.uint64) << shifts
+        x.append(table['final']['x'])
+        z.append(table['final']['z'])
+        outcomes.append(np.bitwise_or.reduce(bits.reshape(len(table), -1), axis=1))
+        locations.append(num_locations + local_ids)
+        channels.append([0 if gate == 'I' else len(pos) for _, gate, pos in keys])
+        weights.append(1/counts[local_ids])
+        num_locations += len(ids)
+
+    if meas_errors:
+        num_meas = num_rounds*num_ancillas
+        x.append(np.zeros(num_meas, dtype=np.uint64))
+        z.append(np.zeros(num_meas, dtype=np.uint64))
+        outcomes.append(np.uint64(1) << np.arange(num_meas, dtype=np.uint64))
+        locations.append(num_locations + np.arange(num_meas))
+        channels.append([CHANNELS.index('meas')]*num_meas)
+        weights.append(np.ones(num_meas))
+
+    faults = np.zeros(sum(map(len, x)), dtype=[('location', np.int64), ('x', np.uint64),
+                                               ('z', np.uint64), ('outcomes', np.uint64)])
+    for name, values in zip(['location', 'x', 'z', 'outcomes'], [locations, x, z, outcomes]):
+        faults[name] = np.concatenate(values)
+    channels, weights = np.concatenate(channels), np.concatenate(weights)
+
+    channel_of_location = np.zeros(faults['location'].max() + 1, dtype=np.int64)
+    channel_of_location[faults['location']] = channels
+    if merge:
+        # merge faults with the same signature at the same location (sorted by location)
+        merged, first, inverse = np.unique(faults, return_index=True, return_inverse=True)
+        weights = np.bincount(inverse.ravel(), weights=weights, minlength=len(merged))
+    else:
+        merged, first = faults, np.arange(len(faults))
+    return {
+        'x': merged['x'],
+        'z': merged['z'],
+        'outcomes': merged['outcomes'],
+        'location': merged['location'],
+        'channel': channels[first],
+        'weight': weights,
+        'num_locations': np.bincount(channel_of_location, minlength=len(CHANNELS)),
+        'num_rounds': num_rounds,
+        'num_ancillas': num_ancillas,
+    }
+
+def decode_signatures(
+    x: np.ndarray,
+    z: np.ndarray,
+    outcomes: np.ndarray,
+    num_rounds: int,
+    num_ancillas: int,
+    used_anc_inds: List[List[int]],
+    lut_name: str,
+    stabilizer_group,
+    num_datas: int = 7,
+    max_weight: int = 1,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decode data errors with their ancilla outcomes through the stages of ft.check_ft.
+
+    Args:
+        x, z (np.ndarray): Final data errors (packed bits).
+        outcomes (np.ndarray): Packed ancilla outcomes, as in get_single_faults.
+        num_rounds (int): Number of rounds.
+        num_ancillas (int): Number of ancillas.
+        used_anc_inds (List[List[int]]): List of used ancilla indices.
+        lut_name (str): Look-up table name.
+        stabilizer_group: Stabilizer group.
+        num_datas (int): Number of data qubits.
+        max_weight (int): Largest correctable weight of the reduced error.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Tuple of
+            accepted: True when no flag is triggered,
+            failed: True when accepted and the reduced error has weight > max_weight.
+    """
+    shifts = np.arange(num_rounds*num_ancillas, dtype=np.uint64)
+    table = ft.LocationTable(len(x))
+    table.set_column('ancilla_outcomes', ((outcomes[:, None] >> shifts) & np.uint64(1)).astype(np.uint8)
+                     .reshape(len(x), num_rounds, num_ancillas))
+    errors = np.zeros(len(x), dtype=qec.PAULI_DTYPE)
+    errors['x'], errors['z'] = x, z
+    table.set_column('final', errors)
+
+    ft.read_ancillas(table, used_anc_inds)
+    ft.apply_look_up_table(table, ft.look_up_table[lut_name], num_datas)
+    ft.reduce_modulo_stabilizers(table, stabilizer_group)
+    weights = table['equiv_wt']
+    if lut_name[-1] in 'ZX':
+        ft.remove_error_type(table, 'X' if lut_name[-1] == 'Z' else 'Z', num_datas)
+        weights = table['reduced_wt']
+    accepted = ~table['flagged']
+    return accepted, accepted & (weights > max_weight)
+
+def enumerate_fault_paths(
+    sequences: List,
+    used_anc_inds: List[List[int]],
+    lut_name: str,
+    stabilizer_group,
+    order: int = 2,
+    num_qubits: int = 11,
+    num_datas: int = 7,
+    meas_errors: bool = True,
+    max_weight: int = 1,
+    chunk_size: int = 1 << 16,
+) -> dict:
+    """
+    Enumerate all combinations of at most `order` faulty locations and collect the failure and acceptance
+    polynomials. Combinations are built location by location, so a location fails at most once, and extended
+    depth first in chunks of about chunk_size, so memory does not grow with the number of combinations. Each distinct
+    combined signature of a chunk is decoded only once.
+
+    Args:
+        sequences (List): List of gate sequences (names or gate tuples), one per round.
+        used_anc_inds (List[List[int]]): List of used ancilla indices.
+        lut_name (str): Look-up table name.
+        stabilizer_group: Stabilizer group.
+        order (int): Largest number of faulty locations.
+        num_qubits (int): Number of qubits.
+        num_datas (int): Number of data qubits.
+        meas_errors (bool): Whether to include flips of the ancilla outcomes.
+        max_weight (int): Largest correctable weight of the reduced error.
+        chunk_size (int): Number of combinations extended at once.
+
+    Returns:
+        dict: Polynomial with
+            channels: names of the noise channels present in the circuit,
+            num_locations: number of locations of each channel,
+            order: enumerated order,
+            failure, acceptance: coefficients A[m], arrays of shape (order+1,)*len(channels).
+
+    Example:
+        >>> poly = enumerate_fault_paths(['flag_bridge_CX_SZ3'], [[3,1,2]], 'Steane_flag_bridge_SZ', stabilizer_group)
+        >>> expand_fault_polynomial(poly, uniform=True)[:2]
+        array([0., 0.])
+    """
+    faults = get_single_faults(sequences, num_qubits, num_datas, meas_errors)
+    present = np.flatnonzero(faults['num_locations'])
+    channel_inds = np.full(len(CHANNELS), -1)
+    channel_inds[present] = np.arange(len(present))
+    decode_args = (faults['num_rounds'], faults['num_ancillas'], used_anc_inds, lut_name,
+                   stabilizer_group, num_datas, max_weight)
+
+    shape = (order + 1,)*len(present)
+    failure, acceptance = np.zeros(shape), np.zeros(shape)
+    accepted, failed = decode_signatures(np.zeros(1, np.uint64), np.zeros(1, np.uint64),
+                                         np.zeros(1, np.uint64), *decode_args)
+    failure[(0,)*len(present)], acceptance[(0,)*len(present)] = failed[0], accepted[0]
+
+    signature_dtype = [('x', np.uint64), ('z', np.uint64), ('outcomes', np.uint64)]
+    next_item = np.searchsorted(faults['location'], faults['location'], side='right')
+    num_items = len(next_item)
+
+    def accumulate(signatures, weights, counts):
+        unique, inverse = np.unique(signatures, return_inverse=True)
+        accepted, failed = decode_signatures(unique['x'], unique['z'], unique['outcomes'], *decode_args)
+        inds = np.ravel_multi_index(tuple(counts.T), shape)
+        np.add.at(failure.reshape(-1), inds, weights*failed[inverse.ravel()])
+        np.add.at(acceptance.reshape(-1), inds, weights*accepted[inverse.ravel()])
+
+    def descend(last, signatures, weights, counts, num_faults):
+        accumulate(signatures, weights, counts)
+        if num_faults == order:
+            return
+        # extend every combination by a fault at a later location, chunk by chunk
+        num_ext = num_items - next_item[last]
+        cumulative = np.cumsum(num_ext)
+        edges = np.concatenate([[0], np.flatnonzero(np.diff(cumulative // chunk_size)) + 1, [len(last)]])
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            ext = num_ext[lo:hi]
+            prefix = lo + np.repeat(np.arange(hi - lo), ext)
+            if len(prefix) == 0:
+                continue
+            starts = np.repeat(np.cumsum(ext) - ext, ext)
+            new_last = next_item[last][prefix] + np.arange(len(prefix)) - starts
+            new_signatures = signatures[prefix]
+            for name in ['x', 'z', 'outcomes']:
+                new_signatures[name] ^= faults[name][new_last]
+            new_counts = counts[prefix]
+            new_counts[np.arange(len(new_last)), channel_inds[faults['channel'][new_last]]] += 1
+            descend(new_last, new_signatures, weights[prefix]*faults['weight'][new_last], new_counts,
+                    num_faults + 1)
+
+    if order >= 1:
+        signatures = np.zeros(num_items, dtype=signature_dtype)
+        for name in ['x', 'z', 'outcomes']:
+            signatures[name] = faults[name]
+        counts = np.zeros((num_items, len(present)), dtype=np.int64)
+        counts[np.arange(num_items), channel_inds[faults['channel']]] = 1
+        descend(np.arange(num_items), signatures, faults['weight'].copy(), counts, 1)
+
+    return {
+        'channels': tuple(CHANNELS[c] for c in present),
+        'num_locations': faults['num_locations'][present],
+        'order': order,
+        'failure': failure,
+        'acceptance': acceptance,
+    }
+
+def _channel_probs(poly: dict, p) -> List:
+    """Probabilities of each channel of the polynomial, from a common value or a dict by channel name."""
+    if isinstance(p, dict):
+        return [np.asarray(p.get(channel, 0.)) for channel in poly['channels']]
+    return [np.asarray(p)]*len(poly['channels'])
+
+def evaluate_fault_polynomial(poly: dict, p) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Evaluate the failure and acceptance polynomials.
+
+    Args:
+        poly (dict): Polynomial from enumerate_fault_paths.
+        p (float, np.ndarray or dict): Probability of every channel, or a dict from channel name to probability.
+            Arrays are broadcast, e.g. to evaluate a whole curve at once.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Tuple of
+            failure: probability of an accepted run with an uncorrectable error,
+            acceptance: probability of no flag.
+        The logical error rate after post-selection is failure/acceptance.
+    """
+    probs = _channel_probs(poly, p)
+    failure, acceptance = 0., 0.
+    for m in zip(*np.nonzero(poly['failure'] + poly['acceptance'])):
+        term = 1.
+        for prob, num, count in zip(probs, poly['num_locations'], m):
+            term = term * prob**count * (1 - prob)**(num - count)
+        failure = failure + poly['failure'][m]*term
+        acceptance = acceptance + poly['acceptance'][m]*term
+    return failure, acceptance
+
+def expand_fault_polynomial(poly: dict, name: str = 'failure', uniform: bool = False) -> np.ndarray:
+    """
+    Expand a polynomial into monomials of the channel probabilities.
+    Coefficients with total degree <= poly['order'] are exact, higher ones are dropped.
+
+    Args:
+        poly (dict): Polynomial from enumerate_fault_paths.
+        name (str): 'failure' or 'acceptance'.
+        uniform (bool): Whether all channels share the same probability p.
+
+    Returns:
+        np.ndarray: Coefficient of prod_c p_c^k_c at index k, or of p^k at index k if uniform.
+    """
+    coeffs = poly[name]
+    order = poly['order']
+    expanded = np.zeros_like(coeffs)
+    for m in zip(*np.nonzero(coeffs)):
+        # (1-p)^(N-m) = sum_j comb(N-m, j) (-p)^j
+        for extra in np.ndindex(*(order + 1 - np.array(m))):
+            if sum(m) + sum(extra) > order:
+                continue
+            factor = np.prod([math.comb(int(num - count), j)*(-1)**j
+                              for num, count, j in zip(poly['num_locations'], m, extra)])
+            expanded[tuple(np.add(m, extra))] += coeffs[m]*factor
+
+    if not uniform:
+        return expanded
+    total_degree = np.add.reduce(np.indices(expanded.shape), axis=0)
+    return np.bincount(total_degree.ravel(), weights=expanded.ravel())[:order + 1]
+
+
+############################## TESTING ##############################
+def _steane_stabilizer_group():
+    stabilizer_generators = ['ZZZZ---','-ZZ-ZZ-','--ZZ-ZZ',
+                             'XXXX---','-XX-XX-','--XX-XX']
+    return qec.compute_stabilizer_group([list(stab) for stab in stabilizer_generators])
+
+def test_enumerate_fault_paths():
+    """
+    Test the enumerate_fault_paths function.
+    The flag bridge circuits are fault-tolerant, so failure starts at order 2.
+    """
+    stabilizer_group = _steane_stabilizer_group()
+    test_cases = [
+        (['flag_bridge_CX_SZ3'], [[3,1,2]], 'Steane_flag_bridge_SZ', stabilizer_group),
+        (['flag_bridge_CZ_SX3'], [[3,1,2]], 'Steane_flag_bridge_SX', stabilizer_group),
+        (['flag_bridge_CX_SZ2','flag_bridge_CX_SZ3'], [[1,0,3],[3,1,2]], 'Steane_flag_bridge_SZ', stabilizer_group),
+    ]
+    run_test([test_cases, [[0, 0]]*len(test_cases)],
+             lambda x: list(expand_fault_polynomial(enumerate_fault_paths(*x, order=2), uniform=True)[:2]),
+             'enumerate_fault_paths')
+
+    # order-1 acceptance counts every unflagged single fault, as in check_ft
+    locations = ft.run_sequences(['flag_bridge_CX_SZ3'])
+    ft.read_ancillas(locations, [[3,1,2]])
+    keys = [str((idx, gate)) for idx, gate in zip(locations['idx'], locations['gate'])]
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    expected = np.sum(~locations['flagged']/counts[inverse.ravel()])
+    poly = enumerate_fault_paths(['flag_bridge_CX_SZ3'], [[3,1,2]], 'Steane_flag_bridge_SZ', stabilizer_group,
+                                 order=1, meas_errors=False)
+    first_order = sum(poly['acceptance'][tuple(np.eye(len(poly['channels']), dtype=int)[c])]
+                      for c in range(len(poly['channels'])))
+    run_test([[0], [round(expected, 9)]], lambda x: round(first_order, 9), 'enumerate_fault_paths (acceptance)')
+
+    # small chunks give the same polynomials
+    args = (['flag_bridge_CX_SZ2','flag_bridge_CX_SZ3'], [[1,0,3],[3,1,2]], 'Steane_flag_bridge_SZ', stabilizer_group)
+    whole = enumerate_fault_paths(*args, order=2)
+    chunked = enumerate_fault_paths(*args, order=2, chunk_size=500)
+    run_test([['failure', 'acceptance'], [True, True]], lambda name: np.allclose(whole[name], chunked[name]),
+             'enumerate_fault_paths (chunks)')
+
+def test_evaluate_fault_polynomial():
+    """
+    Test the evaluate_fault_polynomial function against the expanded polynomial at small p.
+    """
+    poly = enumerate_fault_paths(['flag_bridge_CX_SZ3'], [[3,1,2]], 'Steane_flag_bridge_SZ',
+                                 _steane_stabilizer_group(), order=2)
+    coeffs = expand_fault_polynomial(poly, 'acceptance', uniform=True)
+    test_cases = [1e-5, 1e-4]
+    answers = [round(float(np.polyval(coeffs[::-1], p)), 6) for p in test_cases]
+    run_test([test_cases, answers], lambda p: round(float(evaluate_fault_polynomial(poly, p)[1]), 6),
+             'evaluate_fault_polynomial')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_enumerate_fault_paths()
+    test_evaluate_fault_polynomial()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
@@ -0,0 +1,641 @@
+import os
+import math
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+from tool import gf2, symmetry
+from tool.testing import run_test
+
+"""
+Search for fault-tolerant flag circuits measuring a single stabilizer.
+
+The circuits follow the template of the circuits 1c and 4a of the full_steane_flagged notebook, with the data qubits
+0..w-1, the syndrome qubit w and the flag qubits w+1..w+f (num_qubits = [w, 1, f]). For a Z stabilizer,
+    - every flag is prepared in |+> (H), opened by CX(flag, syndrome) and closed by the same CNOT, then measured in the
+      X basis (H),
+    - every data qubit is coupled by CX(data, ancilla) to the syndrome, or to a flag whose window is open.
+X stabilizers use the same circuits with every CNOT reversed and H on the syndrome instead of the flags. A candidate
+is given by the order of the data qubits, the ancilla each of them is coupled to and the window of every flag.
+
+A candidate is fault-tolerant if
+    1. no unflagged single fault leaves a data error of weight > 1 modulo the measured stabilizer, and
+    2. (when the code and the location of the data qubits in it are given) flagged faults with the same flags and code
+       syndrome leave errors that are equivalent modulo the code, so that a flag look-up table can correct them.
+Faults are the 3 single-qubit Paulis after single-qubit gates and the 15 two-qubit Paulis after CNOTs, as in
+stabilizer_sim.get_faults('XYZ').
+
+Circuits are built from the last data coupling backwards while the Clifford of the suffix is kept as a tableau of
+the images of X and Z of every qubit, so the faults after a new gate are final as soon as it is prepended. A suffix
+with an unflagged weight > 1 fault is abandoned together with all the circuits that end with it. Subtrees are
+spread over a process pool, and larger stabilizers can be annealed instead.
+
+Relabelling the data qubits of a circuit by a symmetry of the check (any permutation without a code, a permutation
+induced by a code automorphism that maps stab_loc onto itself otherwise, see tool.symmetry) preserves both conditions.
+Only the subtrees of one last data qubit per orbit are searched, and their circuits are relabelled to the others.
+
+Methods:
+    build_flag_circuit(...): Gate sequence of a candidate.
+    to_stabilizer_sim(...): Gate sequence in the stabilizer_sim format ([q] for H, (c, t) for CX).
+    circuit_depth(...): Depth of a gate sequence.
+    evaluate_flag_circuit(...): Fault-tolerance of a gate sequence.
+    flag_circuit_placements(...): Fault-tolerance of a gate sequence at every placement on the code, once per orbit.
+    search_flag_circuits(...): Exhaustive search with pruning, ranked by depth and CNOT count.
+    anneal_flag_circuits(...): Simulated annealing over candidates for larger stabilizers.
+    test_all(): Runs all the test methods.
+"""
+
+def _windows(num_data: int, num_flags: int) -> List[Tuple[Tuple[int, int]]]:
+    """All flag windows (open, close) with 0 <= open < close <= num_data, flags ordered by window."""
+    spans = [(a, b) for a in range(num_data) for b in range(a + 1, num_data + 1)]
+    return list(itertools.combinations_with_replacement(spans, num_flags))
+
+def build_flag_circuit(
+    order: List[int],
+    targets: List[int],
+    windows: List[Tuple[int, int]],
+    stabilizer_type: str = 'Z',
+) -> Tuple[Tuple[str, Tuple[int]]]:
+    """
+    Gate sequence of a flag circuit.
+
+    Args:
+        order (List[int]): Data qubits in the order they are coupled.
+        targets (List[int]): Ancilla of every coupling, 0 for the syndrome and j for flag j (1-based).
+        windows (List[Tuple[int, int]]): (open, close) of every flag: the flag is opened before coupling `open` and
+            closed before coupling `close` (after the last coupling if close == len(order)).
+        stabilizer_type (str): 'Z' or 'X'.
+
+    Returns:
+        Tuple[Tuple[str, Tuple[int]]]: Gate sequence on num_qubits = [w, 1, len(windows)].
+
+    Example:
+        >>> build_flag_circuit([2, 0, 3, 1], [1, 0, 1, 0], [(0, 4)])  # circuit 1c
+        (('H', (5,)), ('CX', (5, 4)), ('CX', (2, 5)), ('CX', (0, 4)), ('CX', (3, 5)), ('CX', (1, 4)),
+         ('CX', (5, 4)), ('H', (5,)))
+    """
+    num_data = len(order)
+    synd = num_data
+    ancillas = [synd] + [num_data + 1 + j for j in range(len(windows))]
+    hadamards = ancillas[1:] if stabilizer_type == 'Z' else [synd]
+
+    def cx(a, b):
+        return ('CX', (a, b)) if stabilizer_type == 'Z' else ('CX', (b, a))
+
+    gates = [('H', (q,)) for q in hadamards]
+    for k in range(num_data + 1):
+        gates += [cx(ancillas[j + 1], synd) for j, (_, close) in enumerate(windows) if close == k]
+        gates += [cx(ancillas[j + 1], synd) for j, (start, _) in enumerate(windows) if start == k]
+        if k < num_data:
+            gates.append(cx(order[k], ancillas[targets[k]]))
+    gates += [('H', (q,)) for q in hadamards]
+    return tuple(gates)
+
+def to_stabilizer_sim(gates) -> List:
+    """
+    Gate sequence in the stabilizer_sim format: [q] for H and (c, t) for CX.
+    """
+    return [list(pos) if name == 'H' else tuple(pos) for name, pos in gates]
+
+def circuit_depth(gates) -> int:
+    """
+    Number of layers of a gate sequence when every gate is scheduled as early as possible.
+    """
+    levels = {}
+    for _, pos in gates:
+        level = 1 + max(levels.get(q, 0) for q in pos)
+        for q in pos:
+            levels[q] = level
+    return max(levels.values(), default=0)
+
+def _popcount(value: int) -> int:
+    return bin(value).count('1')
+
+def _code_tables(code: List[str], stab_loc: List[int]):
+    """
+    Packed generators of the code, row-reduced generators as integers z | x << n (tool.gf2.rref_ints) and the data
+    qubit -> code qubit map, and the number of code qubits n.
+    """
+    def pack(pauli):
+        x = sum(1 << i for i, p in enumerate(pauli) if p in 'XY')
+        z = sum(1 << i for i, p in enumerate(pauli) if p in 'ZY')
+        return x, z
+    generators = [pack(stabilizer) for stabilizer in code]
+    basis = gf2.rref_ints([z | x << len(code[0]) for x, z in generators])
+    return generators, basis, list(stab_loc), len(code[0])
+
+class _FaultChecker:
+    """
+    Tableau of the suffix Clifford and fault-tolerance checks of the faults after prepended gates.
+    """
+    def __init__(self, num_data: int, num_flags: int, stabilizer_type: str, code=None, stab_loc=None):
+        self.num_data = num_data
+        self.num_qubits = num_data + 1 + num_flags
+        self.data_mask = (1 << num_data) - 1
+        self.flag_shift = num_data + 1
+        stabilizer = self.data_mask
+        self.stabilizer = (0, stabilizer) if stabilizer_type == 'Z' else (stabilizer, 0)
+        self.code = None if code is None else _code_tables(code, stab_loc)
+
+    def identity(self):
+        """Tableau of the empty suffix: images of X_q and Z_q."""
+        return ([(1 << q, 0) for q in range(self.num_qubits)], [(0, 1 << q) for q in range(self.num_qubits)])
+
+    def prepend(self, tableau, gate):
+        """Tableau of gate followed by the suffix."""
+        images_x, images_z = list(tableau[0]), list(tableau[1])
+        name, pos = gate
+        if name == 'H':
+            q = pos[0]
+            images_x[q], images_z[q] = images_z[q], images_x[q]
+        elif name == 'CX':
+            c, t = pos
+            images_x[c] = (images_x[c][0] ^ images_x[t][0], images_x[c][1] ^ images_x[t][1])
+            images_z[t] = (images_z[c][0] ^ images_z[t][0], images_z[c][1] ^ images_z[t][1])
+        else:
+            raise ValueError(f'Unknown gate {name}')
+        return images_x, images_z
+
+    def faults(self, tableau, gate):
+        """Final Paulis (x, z) of the faults right after gate, for a suffix tableau that does not include it."""
+        basis = []
+        for q in gate[1]:
+            basis += [tableau[0][q], tableau[1][q]]
+        finals = []
+        for bits in range(1, 1 << len(basis)):
+            x = z = 0
+            for i, (bx, bz) in enumerate(basis):
+                if bits >> i & 1:
+                    x, z = x ^ bx, z ^ bz
+            finals.append((x, z))
+        return finals
+
+    def split(self, final):
+        """Data error (x, z), flags and syndrome bit of a final Pauli (measurements flip on X)."""
+        x, z = final
+        return (x & self.data_mask, z & self.data_mask), x >> self.flag_shift, x >> self.num_data & 1
+
+    def reduced_weight(self, error) -> int:
+        sx, sz = self.stabilizer
+        return min(_popcount(error[0] | error[1]), _popcount((error[0] ^ sx) | (error[1] ^ sz)))
+
+    def harmful(self, finals) -> bool:
+        """Whether one of the faults is unflagged and leaves an error of weight > 1."""
+        for final in finals:
+            error, flags, _ = self.split(final)
+            if flags == 0 and self.reduced_weight(error) > 1:
+                return True
+        return False
+
+    def distinguishable(self, finals) -> bool:
+        """Whether flagged faults with the same flags and code syndrome leave equivalent errors."""
+        if self.code is None:
+            return True
+        generators, basis, stab_loc, num_code_qubits = self.code
+        seen = {}
+        for final in finals:
+            (ex, ez), flags, _ = self.split(final)
+            if flags == 0:
+                continue
+            x = sum(1 << stab_loc[i] for i in range(self.num_data) if ex >> i & 1)
+            z = sum(1 << stab_loc[i] for i in range(self.num_data) if ez >> i & 1)
+            syndrome = tuple((_popcount(x & gz) + _popcount(z & gx)) & 1 for gx, gz in generators)
+            first = seen.setdefault((flags, syndrome), (x, z))
+            if gf2.reduce_int(first[1] ^ z | (first[0] ^ x) << num_code_qubits, basis):
+                return False
+        return True
+
+def evaluate_flag_circuit(
+    gates,
+    num_data: int,
+    num_flags: int,
+    stabilizer_type: str = 'Z',
+    code: List[str] = None,
+    stab_loc: List[int] = None,
+) -> dict:
+    """
+    Fault-tolerance of a flag circuit in the tool format (see to_stabilizer_sim for the notebook format).
+
+    Args:
+        gates: Gate sequence on num_qubits = [num_data, 1, num_flags].
+        num_data (int): Weight of the stabilizer.
+        num_flags (int): Number of flag qubits.
+        stabilizer_type (str): 'Z' or 'X'.
+        code (List[str]): Stabilizer generators of the code, e.g. ['ZZIZZII', ...], to check that flagged errors are
+            distinguishable.
+        stab_loc (List[int]): Code qubit of every data qubit of the circuit.
+
+    Returns:
+        dict: ft, num_harmful (unflagged faults with weight > 1 errors), distinguishable, depth and num_cnots.
+    """
+    checker = _FaultChecker(num_data, num_flags, stabilizer_type, code, stab_loc)
+    tableau, finals, num_harmful = checker.identity(), [], 0
+    for gate in reversed(tuple(gates)):
+        gate_finals = checker.faults(tableau, gate)
+        num_harmful += sum(checker.harmful([final]) for final in gate_finals)
+        finals += gate_finals
+        tableau = checker.prepend(tableau, gate)
+    distinguishable = checker.distinguishable(finals)
+    return {
+        'ft': num_harmful == 0 and distinguishable,
+        'num_harmful': num_harmful,
+        'distinguishable': distinguishable,
+        'depth': circuit_depth(gates),
+        'num_cnots': sum(name == 'CX' for name, _ in gates),
+    }
+
+def flag_circuit_placements(
+    gates,
+    num_data: int,
+    num_flags: int,
+    stabilizer_type: str,
+    code: List[str],
+    placements: List[List[int]] = None,
+) -> dict:
+    """
+    Fault-tolerance of a flag circuit at every placement of its data qubits on the code qubits (the itertools
+    permutations of the full_steane_flagged notebook), evaluated once per orbit of the code automorphisms.
+
+    Args:
+        gates, num_data, num_flags, stabilizer_type, code: See evaluate_flag_circuit.
+        placements (List[List[int]]): stab_loc of every placement, by default all the placements of the stabilizer on
+            the code (tool.symmetry.code_placements).
+
+    Returns:
+        dict: Output of evaluate_flag_circuit for every placement (tuple).
+
+    Example:
+        >>> verdicts = flag_circuit_placements(build_flag_circuit([2,0,3,1], [1,0,1,0], [(0,4)]), 4, 1, 'Z',
+        ...                                    ['ZZIZZII', 'ZIZZIIZ', 'IIIZZZZ', 'XXIXXII', 'XIXXIIX', 'IIIXXXX'])
+        >>> len(verdicts), all(verdict['ft'] for verdict in verdicts.values())
+        (168, True)
+    """
+    if placements is None:
+        placements = symmetry.code_placements(code, stabilizer_type*num_data)
+    evaluate = lambda stab_loc: evaluate_flag_circuit(gates, num_data, num_flags, stabilizer_type, code, list(stab_loc))
+    return symmetry.evaluate_placements(evaluate, placements, symmetry.code_automorphisms(code),
+                                        lambda result, _: dict(result))
+
+def _position_transversals(num_data: int, code: List[str] = None, stab_loc: List[int] = None) -> dict:
+    """
+    Orbits of the data positions under the relabellings that preserve the checks, with one relabelling per member:
+    {representative: {position: permutation sending the representative to it}}.
+    """
+    if code is None:
+        # the symmetric group, whose transpositions of 0 reach every position
+        symmetries = [tuple(range(num_data))]
+        for d in range(1, num_data):
+            swap = list(range(num_data))
+            swap[0], swap[d] = d, 0
+            symmetries.append(tuple(swap))
+    else:
+        symmetries = symmetry.placement_symmetries(symmetry.code_automorphisms(code), stab_loc)
+    transversals = {}
+    for d in range(num_data):
+        if not any(d in members for members in transversals.values()):
+            transversals[d] = {}
+            for s in symmetries:
+                transversals[d].setdefault(s[d], s)
+    return transversals
+
+def _candidate(order, targets, windows, stabilizer_type) -> dict:
+    gates = build_flag_circuit(order, targets, windows, stabilizer_type)
+    return {
+        'gates': gates,
+        'stabilizer_sim': to_stabilizer_sim(gates),
+        'num_qubits': [len(order), 1, len(windows)],
+        'order': list(order),
+        'targets': list(targets),
+        'windows': [tuple(window) for window in windows],
+        'depth': circuit_depth(gates),
+        'num_cnots': sum(name == 'CX' for name, _ in gates),
+    }
+
+def _rank(candidates: List[dict]) -> List[dict]:
+    return sorted(candidates, key=lambda c: (c['depth'], c['num_cnots'], c['gates']))
+
+def _search_subtree(task) -> Tuple[List[dict], int]:
+    """
+    Depth-first search over the couplings of a window configuration, from the last coupling backwards.
+    Returns the fault-tolerant candidates and the number of candidates built to the first gate.
+    """
+    num_data, windows, stabilizer_type, code, stab_loc, last = task
+    num_flags = len(windows)
+    checker = _FaultChecker(num_data, num_flags, stabilizer_type, code, stab_loc)
+    synd, flags = num_data, [num_data + 1 + j for j in range(num_flags)]
+    hadamards = flags if stabilizer_type == 'Z' else [synd]
+
+    def cx(a, b):
+        return ('CX', (a, b)) if stabilizer_type == 'Z' else ('CX', (b, a))
+
+    def prepend_all(tableau, finals, gates):
+        """Prepend gates (last one first), None if a fault is harmful."""
+        for gate in reversed(gates):
+            gate_finals = checker.faults(tableau, gate)
+            if checker.harmful(gate_finals):
+                return None
+            finals = finals + gate_finals
+            tableau = checker.prepend(tableau, gate)
+        return tableau, finals
+
+    def slot_gates(k):
+        """Window CNOTs before coupling k."""
+        return ([cx(flags[j], synd) for j, (_, close) in enumerate(windows) if close == k] +
+                [cx(flags[j], synd) for j, (start, _) in enumerate(windows) if start == k])
+
+    found, completed = [], [0]
+
+    def descend(k, tableau, finals, order, targets):
+        # couplings k..num_data-1 and the window CNOTs after coupling k-1 are in the suffix
+        if k == 0:
+            completed[0] += 1
+            state = prepend_all(tableau, finals, [('H', (q,)) for q in hadamards])
+            if state is not None and checker.distinguishable(state[1]):
+                found.append(_candidate(order, targets, windows, stabilizer_type))
+            return
+        choices = [last] if k == num_data and last is not None else [
+            (d, a) for d in range(num_data) if d not in order
+            for a in range(num_flags + 1) if a == 0 or windows[a - 1][0] <= k - 1 < windows[a - 1][1]]
+        for d, a in choices:
+            ancilla = synd if a == 0 else flags[a - 1]
+            state = prepend_all(tableau, finals, slot_gates(k - 1) + [cx(d, ancilla)])
+            if state is None:
+                continue
+            descend(k - 1, *state, [d] + order, [a] + targets)
+
+    state = prepend_all(checker.identity(), [], slot_gates(num_data) + [('H', (q,)) for q in hadamards])
+    if state is not None:
+        descend(num_data, *state, [], [])
+    return found, completed[0]
+
+def search_flag_circuits(
+    stabilizer: str,
+    num_flags: int = 1,
+    code: List[str] = None,
+    stab_loc: List[int] = None,
+    num_workers: int = None,
+    max_results: int = None,
+    return_stats: bool = False,
+    use_symmetry: bool = True,
+):
+    """
+    Exhaustive search for fault-tolerant flag circuits measuring a stabilizer, with pruning.
+
+    Args:
+        stabilizer (str): Stabilizer on the data qubits of the circuit, e.g. 'ZZZZ' or 'XXXXXX'.
+        num_flags (int): Largest number of flag qubits, circuits with 0..num_flags flags are searched.
+        code (List[str]): Stabilizer generators of the code, to also require distinguishable flagged errors.
+        stab_loc (List[int]): Code qubit of every data qubit of the circuit.
+        num_workers (int): Number of processes (default: number of CPUs), 1 runs in this process.
+        max_results (int): Number of circuits returned, all by default.
+        return_stats (bool): Whether to also return the number of candidates and of candidates that survived
+            the pruning up to their first gate.
+        use_symmetry (bool): Search one last data qubit per orbit of the symmetries of the check and relabel the
+            circuits found, instead of all of them (same circuits).
+
+    Returns:
+        List[dict]: Fault-tolerant circuits ranked by depth then CNOT count, each with gates (tool format),
+            stabilizer_sim (notebook format), num_qubits, order, targets, windows, depth and num_cnots.
+
+    Example:
+        >>> circuits = search_flag_circuits('ZZZZ', code=['ZZIZZII', 'ZIZZIIZ', 'IIIZZZZ', 'XXIXXII', 'XIXXIIX',
+        ...                                              'IIIXXXX'], stab_loc=[0, 3, 1, 4])
+        >>> circuits[0]['stabilizer_sim']
+    """
+    types = set(stabilizer)
+    if len(types) != 1 or types - set('XZ'):
+        raise ValueError(f'Only X-type or Z-type stabilizers are supported, got {stabilizer}')
+    stabilizer_type, num_data = stabilizer[0], len(stabilizer)
+
+    transversals = _position_transversals(num_data, code, stab_loc) if use_symmetry else \
+        {d: {d: tuple(range(num_data))} for d in range(num_data)}
+    tasks = []
+    for f in range(num_flags + 1):
+        for windows in _windows(num_data, f):
+            # split the search on the last coupling
+            lasts = [(d, a) for d in transversals for a in range(f + 1)
+                     if a == 0 or windows[a - 1][0] <= num_data - 1 < windows[a - 1][1]]
+            tasks += [(num_data, windows, stabilizer_type, code, stab_loc, last) for last in lasts]
+
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    if num_workers == 1:
+        results = list(map(_search_subtree, tasks))
+    else:
+        chunksize = max(1, len(tasks)//(4*num_workers))
+        with ProcessPoolExecutor(num_workers) as executor:
+            results = list(executor.map(_search_subtree, tasks, chunksize=chunksize))
+
+    # relabel the circuits of every searched subtree to the subtrees of its orbit
+    circuits = _rank([_candidate([s[d] for d in circuit['order']], circuit['targets'], circuit['windows'],
+                                 stabilizer_type)
+                      for found, _ in results for circuit in found
+                      for s in transversals[circuit['order'][-1]].values()])[:max_results]
+    if return_stats:
+        num_candidates = sum(math.factorial(num_data)*_num_targets(num_data, windows)
+                             for f in range(num_flags + 1) for windows in _windows(num_data, f))
+        return circuits, {'candidates': num_candidates, 'completed': sum(c for _, c in results)}
+    return circuits
+
+def _num_targets(num_data: int, windows) -> int:
+    """Number of target assignments of a window configuration."""
+    return math.prod(1 + sum(start <= k < close for start, close in windows) for k in range(num_data))
+
+def _anneal_chain(task) -> List[dict]:
+    num_data, num_flags, stabilizer_type, code, stab_loc, num_steps, temperature, seed = task
+    rng = np.random.default_rng(seed)
+
+    def random_windows():
+        return sorted(tuple(sorted(rng.choice(num_data + 1, 2, replace=False))) for _ in range(num_flags))
+
+    def valid_targets(windows, targets):
+        return [a if a == 0 or windows[a - 1][0] <= k < windows[a - 1][1] else 0 for k, a in enumerate(targets)]
+
+    def cost(state):
+        order, targets, windows = state
+        gates = build_flag_circuit(order, targets, windows, stabilizer_type)
+        result = evaluate_flag_circuit(gates, num_data, num_flags, stabilizer_type, code, stab_loc)
+        return result['num_harmful'] + (0 if result['distinguishable'] else 1), result
+
+    windows = random_windows()
+    state = (list(rng.permutation(num_data)), valid_targets(windows, list(rng.integers(0, num_flags + 1, num_data))),
+             windows)
+    current, _ = cost(state)
+    found = {}
+    for step in range(num_steps):
+        order, targets, windows = list(state[0]), list(state[1]), list(state[2])
+        move = rng.integers(3) if num_flags > 0 else 0
+        if move == 0:
+            i, j = rng.choice(num_data, 2, replace=False)
+            order[i], order[j] = order[j], order[i]
+        elif move == 1:
+            targets[rng.integers(num_data)] = int(rng.integers(num_flags + 1))
+        else:
+            windows[rng.integers(num_flags)] = tuple(sorted(rng.choice(num_data + 1, 2, replace=False)))
+            windows = sorted(windows)
+        proposal = ([int(d) for d in order], valid_targets(windows, targets), [tuple(map(int, w)) for w in windows])
+        proposed, result = cost(proposal)
+        temp = temperature*(1 - step/num_steps) + 1e-9
+        if proposed <= current or rng.random() < np.exp((current - proposed)/temp):
+            state, current = proposal, proposed
+            if current == 0:
+                circuit = _candidate(*state, stabilizer_type)
+                found[circuit['gates']] = circuit
+    return list(found.values())
+
+def anneal_flag_circuits(
+    stabilizer: str,
+    num_flags: int = 1,
+    code: List[str] = None,
+    stab_loc: List[int] = None,
+    num_chains: int = 4,
+    num_steps: int = 2000,
+    temperature: float = 2.,
+    seed: int = None,
+    num_workers: int = None,
+) -> List[dict]:
+    """
+    Simulated annealing over the candidates with exactly num_flags flags, for stabilizers too large to enumerate.
+    The cost is the number of unflagged weight > 1 faults (+1 if flagged errors are not distinguishable), moves swap
+    two data qubits, retarget a coupling or move a flag window. Independent chains run in parallel.
+
+    Args:
+        stabilizer, num_flags, code, stab_loc: As in search_flag_circuits.
+        num_chains (int): Number of independent chains.
+        num_steps (int): Number of moves per chain.
+        temperature (float): Initial temperature, decreased linearly to 0.
+        seed (int): Master seed, chains use seeds spawned from it.
+        num_workers (int): Number of processes (default: number of CPUs), 1 runs in this process.
+
+    Returns:
+        List[dict]: Distinct fault-tolerant circuits found, ranked as in search_flag_circuits.
+    """
+    stabilizer_type, num_data = stabilizer[0], len(stabilizer)
+    seeds = [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(num_chains)]
+    tasks = [(num_data, num_flags, stabilizer_type, code, stab_loc, num_steps, temperature, s) for s in seeds]
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    if num_workers == 1:
+        results = list(map(_anneal_chain, tasks))
+    else:
+        with ProcessPoolExecutor(num_workers) as executor:
+            results = list(executor.map(_anneal_chain, tasks))
+    unique = {circuit['gates']: circuit for found in results for circuit in found}
+    return _rank(list(unique.values()))
+
+
+############################## TESTING ##############################
+STEANE_FLAGGED = ['ZZIZZII', 'ZIZZIIZ', 'IIIZZZZ', 'XXIXXII', 'XIXXIIX', 'IIIXXXX']
+
+def test_build_flag_circuit():
+    """
+    Test build_flag_circuit on the circuits of the full_steane_flagged notebook.
+    """
+    test_cases = [
+        (([2,0,3,1], [1,0,1,0], [(0,4)], 'Z'), [[5],(5,4),(2,5),(0,4),(3,5),(1,4),(5,4),[5]]),
+        (([2,0,3,1], [1,0,1,0], [(0,4)], 'X'), [[4],(4,5),(5,2),(4,0),(5,3),(4,1),(4,5),[4]]),
+        (([3,0,1,2], [1,0,0,0], [(0,4)], 'Z'), [[5],(5,4),(3,5),(0,4),(1,4),(2,4),(5,4),[5]]),
+        (([3,0,1,2], [1,0,0,0], [(0,4)], 'X'), [[4],(4,5),(5,3),(4,0),(4,1),(4,2),(4,5),[4]]),
+    ]
+    run_test(list(zip(*test_cases)), lambda x: to_stabilizer_sim(build_flag_circuit(*x)), 'build_flag_circuit')
+
+def test_measured_observable():
+    """
+    Test that candidates measure the stabilizer: the syndrome measurement propagates back to the stabilizer on the
+    data qubits (times Z on ancillas prepared in |0>), and every flag measurement to ancillas only.
+    """
+    from tool import qec
+    def measured(args):
+        order, targets, windows, stabilizer_type = args
+        gates = build_flag_circuit(order, targets, windows, stabilizer_type)
+        num_data, num_qubits = len(order), len(order) + 1 + len(windows)
+        paulis = qec.pack_paulis(['-'*q + 'Z' + '-'*(num_qubits - q - 1) for q in range(num_data, num_qubits)])
+        for gate, pos in reversed(gates):
+            qec.clifford_transform_packed(paulis, gate, pos)
+        strings = qec.unpack_paulis(paulis, num_qubits)
+        ancillas_z = all(set(s[num_data:]) <= set('Z-') for s in strings)
+        return ancillas_z and strings[0][:num_data], [s[:num_data] for s in strings[1:]]
+    test_cases = [
+        (([2,0,3,1], [1,0,1,0], [(0,4)], 'Z'), ('ZZZZ', ['----'])),
+        (([2,0,3,1], [1,0,1,0], [(0,4)], 'X'), ('XXXX', ['----'])),
+        (([0,1,2,3,4,5], [0,1,2,2,1,0], [(1,5),(2,4)], 'Z'), ('ZZZZZZ', ['------']*2)),
+        (([0,1,2,3,4,5], [0,1,2,2,1,0], [(1,5),(2,4)], 'X'), ('XXXXXX', ['------']*2)),
+    ]
+    run_test(list(zip(*test_cases)), measured, 'measured observable')
+
+def test_evaluate_flag_circuit():
+    """
+    Test evaluate_flag_circuit: the notebook circuits are fault-tolerant, the circuit without flag is not.
+    """
+    test_cases = [
+        ((build_flag_circuit([2,0,3,1], [1,0,1,0], [(0,4)]), 4, 1, 'Z', STEANE_FLAGGED, [0,3,1,4]), True),
+        ((build_flag_circuit([3,0,1,2], [1,0,0,0], [(0,4)]), 4, 1, 'Z', STEANE_FLAGGED, [0,3,6,2]), True),
+        ((build_flag_circuit([2,0,3,1], [1,0,1,0], [(0,4)], 'X'), 4, 1, 'X', STEANE_FLAGGED, [3,6,4,5]), True),
+        ((build_flag_circuit([0,1,2,3], [0,0,0,0], []), 4, 0, 'Z'), False),
+    ]
+    run_test(list(zip(*test_cases)), lambda x: evaluate_flag_circuit(*x)['ft'], 'evaluate_flag_circuit')
+
+def test_search_flag_circuits():
+    """
+    Test that the search returns fault-tolerant circuits, ranked, with the pruning visiting fewer nodes than there
+    are candidates, and the same circuits serially and in parallel.
+    """
+    circuits, stats = search_flag_circuits('ZZZZ', 1, STEANE_FLAGGED, [0,3,1,4], num_workers=1, return_stats=True)
+    parallel = search_flag_circuits('ZZZZ', 1, STEANE_FLAGGED, [0,3,1,4], num_workers=2)
+    full, full_stats = search_flag_circuits('ZZZZ', 1, STEANE_FLAGGED, [0,3,1,4], num_workers=1, return_stats=True,
+                                            use_symmetry=False)
+    no_code = search_flag_circuits('ZZZZZ', 1, num_workers=1)
+    notebook_1c = to_stabilizer_sim(build_flag_circuit([2,0,3,1], [1,0,1,0], [(0,4)]))
+    keys = [(c['depth'], c['num_cnots']) for c in circuits]
+    results = {
+        'all FT': all(evaluate_flag_circuit(c['gates'], 4, len(c['windows']), 'Z', STEANE_FLAGGED,
+                                            [0,3,1,4])['ft'] for c in circuits),
+        'ranked': keys == sorted(keys),
+        'no unflagged circuit': all(len(c['windows']) > 0 for c in circuits),
+        'notebook 1c found': any(c['stabilizer_sim'] == notebook_1c for c in circuits),
+        'pruned': stats['completed'] < stats['candidates'],
+        'parallel': [c['gates'] for c in parallel] == [c['gates'] for c in circuits],
+        'symmetry': [c['gates'] for c in full] == [c['gates'] for c in circuits] and
+                    4*stats['completed'] == full_stats['completed'],
+        'symmetry without code': [c['gates'] for c in no_code] ==
+                                 [c['gates'] for c in search_flag_circuits('ZZZZZ', 1, num_workers=1,
+                                                                           use_symmetry=False)],
+    }
+    run_test([list(results), [True]*len(results)], lambda x: results[x], 'search_flag_circuits')
+
+    annealed = anneal_flag_circuits('ZZZZ', 1, STEANE_FLAGGED, [0,3,1,4], num_chains=2, num_steps=300, seed=0,
+                                    num_workers=1)
+    found = {c['gates'] for c in circuits}
+    run_test([[0], [True]], lambda x: len(annealed) > 0 and all(c['gates'] in found for c in annealed),
+             'anneal_flag_circuits')
+
+def test_flag_circuit_placements():
+    """
+    Test that the verdicts expanded from the orbit representatives are those of every placement, for the notebook
+    circuits 1c and 4a and a circuit without flag.
+    """
+    circuits = {
+        '1c': (build_flag_circuit([2,0,3,1], [1,0,1,0], [(0,4)]), 1),
+        '4a': (build_flag_circuit([3,0,1,2], [1,0,0,0], [(0,4)]), 1),
+        'no flag': (build_flag_circuit([0,1,2,3], [0,0,0,0], []), 0),
+    }
+    def test_func(name):
+        gates, num_flags = circuits[name]
+        verdicts = flag_circuit_placements(gates, 4, num_flags, 'Z', STEANE_FLAGGED)
+        direct = {loc: evaluate_flag_circuit(gates, 4, num_flags, 'Z', STEANE_FLAGGED, list(loc)) for loc in verdicts}
+        return len(verdicts), sum(v['ft'] for v in verdicts.values()), verdicts == direct
+    run_test({'1c': (168, 168, True), '4a': (168, 168, True), 'no flag': (168, 0, True)}, test_func,
+             'flag_circuit_placements')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_build_flag_circuit()
+    test_measured_observable()
+    test_evaluate_flag_circuit()
+    test_search_flag_circuits()
+    test_flag_circuit_placements()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
@@ -2,7 +2,7 @@ import os
 import numpy as np
 import itertools
 from typing import List, Tuple
-from tool import qec
+from tool import qec, fault_cache
 from tool.testing import run_test
 
 def get_faults(fault_types: str, weight1_only: bool = False) -> List[List[str]]:
@@ -48,6 +48,191 @@ def get_fault_string(num_qubits: int, locs: List, fault: str) -> List[str]:
         fault_string[locs[i]] = fault[i]
     return fault_string    
 
+class LocationTable:
+    """
+    Columnar table of fault locations.
+
+    Each column is a NumPy array with one entry per location. Stages of the FT pipeline
+    add or overwrite columns in place instead of appending to every row, and Pauli errors
+    are stored bit-packed (see qec.PAULI_DTYPE). Strings are only rendered on demand by
+    `to_rows`, e.g. for print_locations.
+    """
+    __slots__ = ('num_rows', 'columns', 'formatters')
+
+    def __init__(self, num_rows: int):
+        self.num_rows = num_rows
+        self.columns = {}
+        self.formatters = {}
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __setitem__(self, name: str, values) -> None:
+        self.set_column(name, values)
+
+    def set_column(self, name: str, values, formatter=str) -> None:
+        """
+        Add or overwrite a column.
+
+        Args:
+            name (str): Column name.
+            values (array-like): One value per location (first axis).
+            formatter (Callable, optional): Function rendering one entry for printing.
+                None keeps the raw entry. Defaults to str.
+        """
+        values = np.asarray(values)
+        assert len(values) == self.num_rows, f'column {name} has {len(values)} rows instead of {self.num_rows}'
+        self.columns[name] = values
+        self.formatters[name] = formatter
+
+    def take(self, inds) -> 'LocationTable':
+        """
+        Select a subset of locations.
+
+        Args:
+            inds (array-like): Boolean mask or integer indices.
+
+        Returns:
+            LocationTable: New table with the selected locations.
+        """
+        inds = np.arange(self.num_rows)[inds]
+        table = LocationTable(len(inds))
+        for name, values in self.columns.items():
+            table.set_column(name, values[inds], self.formatters[name])
+        return table
+
+    def to_rows(self, names: List[str]) -> List[List]:
+        """
+        Render the table as a list of rows, e.g. for print_locations.
+
+        Args:
+            names (List[str]): Column names to render, in order.
+
+        Returns:
+            List[List]: One list of rendered entries per location.
+        """
+        rows = [[] for _ in range(self.num_rows)]
+        for name in names:
+            formatter = self.formatters[name] or (lambda value: value)
+            for row, value in zip(rows, self.columns[name]):
+                row.append(formatter(value))
+        return rows
+
+def _object_column(values: List) -> np.ndarray:
+    """
+    Build a 1D object array without letting NumPy unpack tuples into extra dimensions.
+    """
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
+
+def error_formatter(num_datas: int, num_qubits: int = None):
+    """
+    Formatter rendering a packed error as 'data|ancillas', or only the data part if num_qubits is None.
+    """
+    if num_qubits is None:
+        return lambda p: qec.unpack_pauli(p['x'], p['z'], num_datas)
+    return lambda p: (qec.unpack_pauli(p['x'], p['z'], num_datas) + '|'
+                      + qec.unpack_pauli(p['x'], p['z'], num_qubits - num_datas, num_datas))
+
+def propagate_faults(
+    gate_seq: List,
+    fault_types: str,
+    num_qubits: int,
+    num_datas: int,
+    weight1_only: bool = False,
+) -> LocationTable:
+    """
+    Propagate every single fault to the end of the gate sequence.
+    Faults are inserted AFTER each gate in the gate sequence, preceded by idle faults on every qubit.
+    All faults are propagated together in one pass over the sequence using bit-packed Paulis.
+    Results are kept in the fault table cache (tool.fault_cache).
+
+    Args:
+        gate_seq (List): List of gate sequences.
+        fault_types (str): String containing the fault types.
+        num_qubits (int): Number of qubits.
+        num_datas (int): Number of data qubits.
+        weight1_only (bool): Whether to include only weight-1 faults.
+
+    Returns:
+        LocationTable: Table with columns
+            idx: index of the faulty gate (-1 for initial idle faults),
+            gate: faulty gate and its location,
+            fault: inserted fault,
+            error: propagated error (packed).
+    """
+    arrays = fault_cache.cached_arrays(
+        'propagate_faults', [gate_seq, fault_types, num_qubits, num_datas, bool(weight1_only)],
+        lambda: _propagate_faults(gate_seq, fault_types, num_qubits, num_datas, weight1_only))
+    return _location_table(arrays, num_qubits, num_datas)
+
+def _propagate_faults(gate_seq, fault_types, num_qubits, num_datas, weight1_only) -> dict:
+    """Arrays of propagate_faults, gates are split into names and positions (padded with -1)."""
+    gate_seq = [('I', (j,)) for j in range(num_qubits)] + list(gate_seq)
+    all_faults = get_faults(fault_types, weight1_only)
+
+    idxs, gates, faults, fault_strings, offsets = [], [], [], [], []
+    for i, (faulty_gate, faulty_locs) in enumerate(gate_seq):
+        for fault in all_faults[len(faulty_locs)-1]:
+            idxs.append(max(i-num_qubits,-1))
+            gates.append(gate_seq[i])
+            faults.append(fault)
+            fault_strings.append(get_fault_string(num_qubits, faulty_locs, fault))
+        offsets.append(len(faults))
+
+    inserted = qec.pack_paulis(fault_strings)
+    errors = np.zeros(len(faults), dtype=qec.PAULI_DTYPE)
+    # faults inserted after gate i only see gates i+1, i+2, ...
+    for i, (gate, position) in enumerate(gate_seq):
+        start = offsets[i-1] if i > 0 else 0
+        qec.clifford_transform_packed(errors[:start], gate, position)
+        errors[start:offsets[i]] = inserted[start:offsets[i]]
+
+    return {
+        'idx': np.array(idxs, dtype=np.int64),
+        **_split_gates(gates),
+        'fault': np.array(faults, dtype=str),
+        'error': errors,
+    }
+
+def _split_gates(gates: List) -> dict:
+    """Gate names and positions (padded with -1) of (gate, position) pairs, for the fault table cache."""
+    gate_pos = np.full((len(gates), 2), -1)
+    for i, (_, position) in enumerate(gates):
+        gate_pos[i, :len(position)] = position
+    return {'gate_name': np.array([gate for gate, _ in gates], dtype=str), 'gate_pos': gate_pos}
+
+def _location_table(arrays: dict, num_qubits: int, num_datas: int) -> LocationTable:
+    """LocationTable of the arrays from _propagate_faults and _run_sequences."""
+    gates = [(str(name), tuple(int(q) for q in position if q >= 0))
+             for name, position in zip(arrays['gate_name'], arrays['gate_pos'])]
+    table = LocationTable(len(arrays['idx']))
+    table.set_column('idx', arrays['idx'], formatter=int)
+    table.set_column('gate', _object_column(gates), formatter=None)
+    table.set_column('fault', arrays['fault'])
+    table.set_column('error', arrays['error'], formatter=error_formatter(num_datas, num_qubits))
+    return table
+
+def as_gate_sequence(sequence) -> Tuple:
+    """
+    Look up a sequence by name, or pass an explicit gate sequence through.
+
+    Args:
+        sequence (str or Tuple): Sequence name for qec.get_sequence, or a tuple of (gate, position).
+
+    Returns:
+        Tuple: Gate sequence.
+    """
+    return qec.get_sequence(sequence) if isinstance(sequence, str) else tuple(sequence)
+
 def get_bad_locations(
     gate_seq: List, 
     fault_types: str, 
@@ -55,6 +240,7 @@ def get_bad_locations(
     num_datas: int, 
     weight1_only: bool = 'False', 
     verbose: str = 'bad locations',
+    locations: LocationTable = None,
 ) -> List:
     """
     Get the bad locations based on the gate sequence, fault types, and other parameters.
@@ -67,29 +253,18 @@ def get_bad_locations(
         num_qubits (int): Number of qubits.
         num_datas (int): Number of data qubits.
         verbose (bool, optional): Whether to print verbose output. Defaults to False.
+        locations (LocationTable, optional): Table of propagate_faults for the same arguments, e.g. from
+            tool.incremental.IncrementalPropagator, instead of propagating the faults again.
 
     Returns:
         List: List of bad locations.
     """
-    all_locs = []
-    bad_locs = []
-    
-    gate_seq = [('I', (j,)) for j in range(num_qubits)] + list(gate_seq)
-    # loop through initial idle errors then the gate sequence
-    for i, (faulty_gate, faulty_locs) in enumerate(gate_seq):
-        num_locs = len(faulty_locs)
-        faults = get_faults(fault_types, weight1_only)[num_locs-1]
-        for fault in faults:
-            # get the starting fault string
-            fault_string = get_fault_string(num_qubits, faulty_locs, fault)
-            # update the fault string with the subsequent gates
-            for gate, position in gate_seq[i+1:]:
-                fault_string = qec.clifford_transform(list(fault_string), gate, position)
-
-            final_error = ''.join(fault_string[:num_datas]) + '|' + ''.join(fault_string[num_datas:])
-            all_locs.append([max(i-num_qubits,-1), gate_seq[i], fault, final_error])
-            if qec.pauli_weight(fault_string[:num_datas]) > 1:
-                bad_locs.append([max(i-num_qubits,-1), gate_seq[i], fault, final_error])
+    table = locations if locations is not None else propagate_faults(gate_seq, fault_types, num_qubits, num_datas,
+                                                                     weight1_only)
+    data_weights = qec.packed_weight(table['error'], qec.bit_mask(range(num_datas)))
+
+    all_locs = table.to_rows(['idx', 'gate', 'fault', 'error'])
+    bad_locs = [loc for loc, weight in zip(all_locs, data_weights) if weight > 1]
 
     if verbose == 'bad locations':
         print(' idx  gate  location  fault  final_error')
@@ -257,42 +432,72 @@ def print_locations(locations, extras=None):
 
         print(print_str)
 
-def run_sequences(sequences: List[str], bad_locations_only: bool = False) -> Tuple[List, List]:
+def run_sequences(
+    sequences: List[str], 
+    bad_locations_only: bool = False, 
+    num_qubits: int = 11, 
+    num_datas: int = 7,
+    locations: LocationTable = None,
+) -> LocationTable:
     """
     Run sequences of gates with a single fault in the first sequence.
+    The ancillas are measured and reset after each sequence.
     Return the propagated errors and ancilla outcomes from all faults.
+    Results are kept in the fault table cache (tool.fault_cache).
 
     Args:
-        sequences (List[str]): List of gate sequences.
+        sequences (List[str]): List of gate sequences, by name or as explicit gate tuples.
         bad_locations_only (bool): Indicator for returning only the bad locations.
+        num_qubits (int): Number of qubits.
+        num_datas (int): Number of data qubits.
+        locations (LocationTable, optional): Table of propagate_faults(sequences[0], 'XYZ', num_qubits, num_datas),
+            e.g. from tool.incremental.IncrementalPropagator. The result is then not cached.
 
     Returns:
-        Tuple[List, List]: Tuple of 
-            locations: List of locations.
-            ancilla_outcomes: List of ancilla outcomes.
+        LocationTable: Table from propagate_faults with the additional columns
+            ancilla_outcomes: uint8 array (locations x sequences x ancillas),
+            final: final data errors (same array as `error`).
     """
-    bad_locations, all_locations = get_bad_locations(
-        qec.get_sequence(sequences[0]), 'XYZ', 11, 7, 
-        weight1_only=False, verbose=''
-    )
-    
-    if bad_locations_only:
-        locations = bad_locations
+    gate_seqs = [as_gate_sequence(sequence) for sequence in sequences]
+    if locations is not None:
+        arrays = _run_sequences(gate_seqs, bad_locations_only, num_qubits, num_datas, locations)
     else:
-        locations = all_locations
+        arrays = fault_cache.cached_arrays(
+            'run_sequences', [gate_seqs, bool(bad_locations_only), num_qubits, num_datas],
+            lambda: _run_sequences(gate_seqs, bad_locations_only, num_qubits, num_datas))
+
+    locations = _location_table(arrays, num_qubits, num_datas)
+    locations.set_column('ancilla_outcomes', arrays['ancilla_outcomes'],
+                         formatter=lambda out: '|'.join(''.join(map(str, o)) for o in out))
+    locations.set_column('final', locations['error'], formatter=error_formatter(num_datas))
+    return locations
+
+def _run_sequences(gate_seqs, bad_locations_only, num_qubits, num_datas, locations=None) -> dict:
+    """Arrays of run_sequences."""
+    if locations is None:
+        locations = propagate_faults(gate_seqs[0], 'XYZ', num_qubits, num_datas)
+    data_mask = qec.bit_mask(range(num_datas))
+    if bad_locations_only:
+        locations = locations.take(qec.packed_weight(locations['error'], data_mask) > 1)
 
+    errors = locations['error'].copy()
     ancilla_outcomes = []
-    locations, outcomes = reset_ancillas(locations)
-    ancilla_outcomes.append([''.join(map(str,out)) for out in outcomes])
-
-    for sequence in sequences[1:]:
-        locations = update_locations(locations, qec.get_sequence(sequence), 7)
-        locations, outcomes = reset_ancillas(locations)
-        ancilla_outcomes.append([''.join(map(str,out)) for out in outcomes])
-
-    ancilla_outcomes = ['|'.join(out) for out in np.array(ancilla_outcomes).T]
-
-    return locations, ancilla_outcomes
+    for i, gate_seq in enumerate(gate_seqs):
+        if i > 0:
+            for gate, position in gate_seq:
+                qec.clifford_transform_packed(errors, gate, position)
+        # X or Y on an ancilla triggers it, then reset
+        ancilla_outcomes.append(qec.get_bits(errors['x'], range(num_datas, num_qubits)))
+        errors['x'] &= data_mask
+        errors['z'] &= data_mask
+
+    return {
+        'idx': locations['idx'],
+        **_split_gates(locations['gate']),
+        'fault': locations['fault'],
+        'error': errors,
+        'ancilla_outcomes': np.stack(ancilla_outcomes, axis=1),
+    }
 
 look_up_table = {
     'Steane_flag_bridge_SZ': {
@@ -398,9 +603,208 @@ def correct_errors(locations: List, syndromes: List, lut: dict) -> List:
         updated_locations.append(locations[i] + [''.join(corrected_error)])
     return updated_locations
 
+def read_ancillas(locations: LocationTable, used_anc_inds: List[List[int]]) -> LocationTable:
+    """
+    Split the ancilla outcomes into syndromes and flags, in place.
+    Columnar version of process_ancillas.
+
+    Args:
+        locations (LocationTable): Table from run_sequences.
+        used_anc_inds (List[List[int]]): List of used ancilla indices, syndrome first then flags.
+
+    Returns:
+        LocationTable: Same table with the additional columns syndrome, flags and flagged.
+    """
+    outcomes = locations['ancilla_outcomes']
+    assert outcomes.shape[1] == len(used_anc_inds)
+    syndromes = np.stack([outcomes[:, i, inds[0]] for i, inds in enumerate(used_anc_inds)], axis=1)
+    flags = np.concatenate([outcomes[:, i, inds[1:]] for i, inds in enumerate(used_anc_inds)], axis=1)
+    splits = np.cumsum([len(inds) - 1 for inds in used_anc_inds])[:-1]
+
+    locations.set_column('syndrome', syndromes, formatter=lambda synd: ''.join(map(str, synd)))
+    locations.set_column('flags', flags, 
+                         formatter=lambda flag: '|'.join(''.join(map(str, f)) for f in np.split(flag, splits)))
+    locations.set_column('flagged', flags.any(axis=1))
+    return locations
+
+def apply_look_up_table(locations: LocationTable, lut: dict, num_datas: int = 7) -> LocationTable:
+    """
+    Correct the final data errors based on the syndromes and look-up table, in place.
+    Columnar version of correct_errors.
+
+    Args:
+        locations (LocationTable): Table from read_ancillas.
+        lut (dict): Look-up table.
+        num_datas (int): Number of data qubits.
+
+    Returns:
+        LocationTable: Same table with the additional column corrected.
+    """
+    syndromes = locations['syndrome']
+    codes = syndromes.astype(np.int64) @ (1 << np.arange(syndromes.shape[1])[::-1])
+    unique_codes, inverse = np.unique(codes, return_inverse=True)
+    corrections = qec.pack_paulis([lut[format(code, f'0{syndromes.shape[1]}b')] for code in unique_codes])[inverse]
+
+    corrected = locations['final'].copy()
+    corrected['x'] ^= corrections['x']
+    corrected['z'] ^= corrections['z']
+    locations.set_column('corrected', corrected, formatter=error_formatter(num_datas))
+    return locations
+
+def reduce_modulo_stabilizers(locations: LocationTable, stabilizer_group, column: str = 'corrected',
+                              num_datas: int = None, max_group_size: int = 1 << 10) -> LocationTable:
+    """
+    Find the smallest-weight equivalent errors under the stabilizer group, in place.
+    Columnar version of modulo_stabilizers, ties are broken as in qec.lowest_weight_equivalent.
+
+    Every error is compared with the whole group at once, unless the group has more than max_group_size elements:
+    each distinct error is then reduced with gf2.min_weight_equivalent on independent generators, first capped at
+    weight 1 (the fault-tolerance threshold, decided from canonical coset representatives), and only searched in
+    full if it is heavier.
+
+    Args:
+        locations (LocationTable): Table of locations.
+        stabilizer_group: Stabilizer group, as Pauli strings or already packed (qec.PAULI_DTYPE).
+        column (str): Column of (data) errors to reduce.
+        num_datas (int): Number of data qubits, required for a packed group.
+        max_group_size (int): Largest group compared with all errors at once.
+
+    Returns:
+        LocationTable: Same table with the additional columns equiv and equiv_wt.
+    """
+    errors = locations[column]
+    if isinstance(stabilizer_group, np.ndarray) and stabilizer_group.dtype == qec.PAULI_DTYPE:
+        group = stabilizer_group
+    else:
+        num_datas = len(stabilizer_group[0])
+        group = qec.pack_paulis(stabilizer_group)
+
+    if len(group) > max_group_size:
+        from tool import gf2
+        generators = gf2.independent_paulis(qec.unpack_paulis(group, num_datas))
+        distinct, inverse = np.unique(errors, return_inverse=True)
+        equivalents, weights = [], []
+        for error in qec.unpack_paulis(distinct, num_datas):
+            equivalent, weight = gf2.min_weight_equivalent(error, generators, max_weight=1)
+            if equivalent is None:
+                equivalent, weight = gf2.min_weight_equivalent(error, generators)
+            equivalents.append(equivalent)
+            weights.append(weight)
+        inverse = inverse.reshape(-1)
+        locations.set_column('equiv', qec.pack_paulis(equivalents)[inverse], formatter=error_formatter(num_datas))
+        locations.set_column('equiv_wt', np.array(weights, dtype=int)[inverse], formatter=int)
+        return locations
+
+    candidates = np.empty((len(errors), len(group) + 1), dtype=qec.PAULI_DTYPE)
+    candidates[:, 0] = errors
+    candidates['x'][:, 1:] = errors['x'][:, None] ^ group['x']
+    candidates['z'][:, 1:] = errors['z'][:, None] ^ group['z']
+
+    weights = qec.packed_weight(candidates)
+    keys = qec.pauli_sort_key(candidates, num_datas)
+    keys[weights > weights.min(axis=1, keepdims=True)] = np.iinfo(np.uint64).max
+    rows, best = np.arange(len(errors)), keys.argmin(axis=1)
+
+    locations.set_column('equiv', candidates[rows, best], formatter=error_formatter(num_datas))
+    locations.set_column('equiv_wt', weights[rows, best], formatter=int)
+    return locations
+
+def remove_error_type(locations: LocationTable, pauli: str, num_datas: int = 7) -> LocationTable:
+    """
+    Remove X or Z errors from the equivalent errors, in place.
+    Columnar version of remove_x_errors and remove_z_errors.
+
+    Args:
+        locations (LocationTable): Table from reduce_modulo_stabilizers.
+        pauli (str): 'X' to remove X errors (Y -> Z), 'Z' to remove Z errors (Y -> X).
+        num_datas (int): Number of data qubits.
+
+    Returns:
+        LocationTable: Same table with the additional columns reduced and reduced_wt.
+    """
+    reduced = locations['equiv'].copy()
+    reduced[pauli.lower()] = 0
+    locations.set_column('reduced', reduced, formatter=error_formatter(num_datas))
+    locations.set_column('reduced_wt', qec.packed_weight(reduced), formatter=int)
+    return locations
+
+FT_COLUMNS = ['idx', 'gate', 'fault', 'error', 'ancilla_outcomes', 'syndrome', 'flags', 'final',
+              'corrected', 'equiv', 'equiv_wt', 'reduced', 'reduced_wt']
+
+def run_ft_pipeline(
+    sequences: List[str],
+    used_anc_inds: List[List[int]],
+    lut_name: str,
+    stabilizer_group,
+    num_datas: int = None,
+    locations: LocationTable = None,
+) -> LocationTable:
+    """
+    Run the stages of check_ft on all single-fault locations, without printing.
+
+    Args:
+        sequences (List[str]): List of gate sequences, each is a stabilizer check circuit.
+        used_anc_inds (List[List[int]]): List of used ancilla indices.
+        lut_name (str): Look-up table name, ending in Z (X corrections) or X (Z corrections).
+        stabilizer_group: Stabilizer group, as Pauli strings or already packed (qec.PAULI_DTYPE).
+        num_datas (int): Number of data qubits, required for a packed group.
+        locations (LocationTable): Propagated faults of the first sequence, see run_sequences.
+
+    Returns:
+        LocationTable: Table with the columns of FT_COLUMNS, flagged and reduced_wt.
+    """
+    locations = run_sequences(sequences, bad_locations_only=False, locations=locations)
+    # process ancilla outcomes
+    read_ancillas(locations, used_anc_inds)
+    # correct errors
+    apply_look_up_table(locations, look_up_table[lut_name])
+    # update bad locations when modulo the stabilizer group
+    reduce_modulo_stabilizers(locations, stabilizer_group, num_datas=num_datas)
+    # remove the error type that the look-up table does not correct
+    if lut_name[-1] == 'Z':
+        remove_error_type(locations, 'X')
+    elif lut_name[-1] == 'X':
+        remove_error_type(locations, 'Z')
+    return locations
+
+def ft_verdict(
+    sequences: List[str],
+    used_anc_inds: List[List[int]],
+    lut_name: str,
+    stabilizer_group,
+    num_datas: int = None,
+    locations: LocationTable = None,
+) -> dict:
+    """
+    Structured result of check_ft, without printing or asserting.
+
+    Args:
+        Same as run_ft_pipeline.
+
+    Returns:
+        dict: Verdict with
+            ft: True if no unflagged fault leaves an error of (reduced) weight > 1,
+            num_locations, num_flagged, num_harmful: number of fault locations, flagged ones and ones with
+                (reduced) weight > 1,
+            harmful: one dict per harmful location with its columns of FT_COLUMNS rendered as in check_ft
+                and whether it is flagged; unflagged ones make the circuits non fault-tolerant.
+    """
+    locations = run_ft_pipeline(sequences, used_anc_inds, lut_name, stabilizer_group, num_datas, locations)
+    flagged = locations['flagged']
+    harmful = locations['reduced_wt'] > 1
+    rows = locations.take(harmful).to_rows(FT_COLUMNS)
+    return {
+        'ft': not bool((harmful & ~flagged).any()),
+        'num_locations': len(locations),
+        'num_flagged': int(flagged.sum()),
+        'num_harmful': int(harmful.sum()),
+        'harmful': [dict(zip(FT_COLUMNS, row), flagged=bool(flag)) for row, flag in zip(rows, flagged[harmful])],
+    }
+
 def check_ft(sequences: List[str], used_anc_inds: List[List[int]], lut_name: str, stabilizer_group, verbose: int = 2) -> bool:
     """
     Check the fault tolerance of gate sequences.
+    See ft_verdict for a version that neither prints nor asserts.
 
     Args:
         sequences (List[str]): List of gate sequences, each is a stabilizer check circuit.
@@ -415,63 +819,39 @@ def check_ft(sequences: List[str], used_anc_inds: List[List[int]], lut_name: str
     Returns:
         bool: True if the fault tolerance is satisfied, False otherwise.
     """
-    locations, ancilla_outcomes =  run_sequences(sequences, bad_locations_only=False)
-    print_extras = []
-    # process ancilla outcomes
-    locations, syndromes = process_ancillas(locations, ancilla_outcomes, used_anc_inds)
-    print_extras += [('  ancilla_outcomes', max(len(ancilla_outcomes[0]),14) + 4)]
+    locations = run_ft_pipeline(sequences, used_anc_inds, lut_name, stabilizer_group)
+    num_rounds, num_ancillas = locations['ancilla_outcomes'].shape[1:]
+    print_extras = [('  ancilla_outcomes', max(num_rounds*(num_ancillas+1)-1,14) + 4)]
     print_extras += [(' synds',5), ('   flags  ',10),  ('  final ',9)]
-
-    # correct errors
-    locations = correct_errors(locations, syndromes, look_up_table[lut_name])
     print_extras += [('  corrected', 12)]
-
-    # update bad locations when modulo the stabilizer group
-    locations, _, _ = modulo_stabilizers(locations, stabilizer_group, True)
     print_extras += [('   equiv',8), ('  wt',4)]
-
     if lut_name[-1] == 'Z':
-        # remove X errors
-        locations, remaining_locations = remove_x_errors(locations)
         print_extras += [('  remove_X',8), ('  wt',8)]
     elif lut_name[-1] == 'X':
-        # remove Z errors
-        locations, remaining_locations = remove_z_errors(locations)
         print_extras += [('  remove_Z',8), (' wt',6)]
+    columns = FT_COLUMNS
 
     if verbose > 0:
         ent_gate, stab = sequences[0].split('_')[-2:]
         print(f'\n------All harmful errors from {stab} circuit with {ent_gate}------')
-        print_locations(remaining_locations, print_extras)
+        print_locations(locations.take(locations['reduced_wt'] > 1).to_rows(columns), print_extras)
 
     ################ check flags and syndromes ################
-    unflagged_locations = []
-    flagged_synd0_locations = []
-    flagged_synd1_locations = []
-
-    unflagged_weight2 = False
-    for loc in locations:
-        if '1' in loc[6]:
-            if '1' in loc[5]:
-                flagged_synd1_locations.append(loc)
-            else:
-                flagged_synd0_locations.append(loc)
-        else:
-            unflagged_locations.append(loc)
-            if loc[-1] > 1:
-                unflagged_weight2 = True
+    flagged = locations['flagged']
+    nonzero_synd = locations['syndrome'].any(axis=1)
+    unflagged_weight2 = bool((locations['reduced_wt'][~flagged] > 1).any())
     assert unflagged_weight2 == False
 
     if verbose > 1:
         print('\n------Unflagged locations (accepted)------')
-        print_locations(unflagged_locations, print_extras)
+        print_locations(locations.take(~flagged).to_rows(columns), print_extras)
         print('-----Unflagged weight > 1:',unflagged_weight2)
 
         print('\n------Flagged locations with synd=0 (rejected)------')
-        print_locations(flagged_synd0_locations, print_extras)
+        print_locations(locations.take(flagged & ~nonzero_synd).to_rows(columns), print_extras)
 
         print('\n------Flagged locations with synd=1 (rejected)------')
-        print_locations(flagged_synd1_locations, print_extras)
+        print_locations(locations.take(flagged & nonzero_synd).to_rows(columns), print_extras)
 
     return not unflagged_weight2
 
@@ -528,6 +908,27 @@ def test_modulo_stabilizers():
     print('>> modulo_stabilizers - No Test <<')
     pass
 
+def test_reduce_modulo_stabilizers():
+    """
+    Test the reduce_modulo_stabilizers function against modulo_stabilizers.
+    """
+    stabilizer_generators = list(qec.common_qecc('steane_code_Goto')) + ['Z'*7]
+    stabilizer_group = qec.compute_stabilizer_group([list(stab) for stab in stabilizer_generators])
+    locations = propagate_faults(qec.get_sequence('Goto_1c'), 'XYZ', 7, 7)
+    locations.set_column('data', locations['error'], formatter=error_formatter(7))
+    reduce_modulo_stabilizers(locations, stabilizer_group, column='data')
+
+    updated_locations, _ = modulo_stabilizers(locations.to_rows(['idx', 'gate', 'fault', 'error']), stabilizer_group)
+    test_cases = [[tuple(loc[-2:]) for loc in updated_locations], 
+                  [tuple(loc[-2:]) for loc in locations.to_rows(['equiv', 'equiv_wt'])]]
+    run_test(test_cases, lambda x: x, 'reduce_modulo_stabilizers')
+
+    # the same group treated as large goes through gf2.min_weight_equivalent
+    expected = locations.to_rows(['equiv', 'equiv_wt'])
+    reduce_modulo_stabilizers(locations, stabilizer_group, column='data', max_group_size=0)
+    run_test([[tuple(row) for row in locations.to_rows(['equiv', 'equiv_wt'])], [tuple(row) for row in expected]],
+             lambda x: x, 'reduce_modulo_stabilizers (large group)')
+
 def test_remove_z_errors():
     """
     Test the remove_z_errors function.
@@ -589,6 +990,7 @@ def test_all():
     test_update_locations()
     test_reset_ancillas()
     test_modulo_stabilizers()
+    test_reduce_modulo_stabilizers()
     test_remove_z_errors()
     test_check_ft()
     print()
@@ -0,0 +1,174 @@
+import os
+import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+from tool import qec, ft
+from tool.catalog import content_hash
+from tool.testing import run_test
+
+"""
+Batch verification of fault tolerance over a manifest of candidate circuits.
+
+A manifest is a list of jobs, each a dict with the arguments of ft.check_ft:
+    sequences:        list of sequence names (or explicit gate tuples), one per round,
+    used_anc_inds:    used ancilla indices of every round,
+    lut_name:         look-up table name,
+    stabilizer_group: stabilizer group, or the name of a built-in code (tool.assets.CODES),
+    name:             optional label of the job.
+Jobs are distributed over a process pool and return the structured verdicts of ft.ft_verdict: nothing is printed,
+and a failing job gives a verdict with an error instead of stopping the batch. Each distinct stabilizer group is
+packed once and sent to every worker when it starts, jobs only carry its key.
+
+Methods:
+    flag_bridge_manifest(...): Manifest of the flag bridge circuits of qec.get_sequence.
+    load_manifest(...), save_verdicts(...): Read a JSON manifest and write the verdicts as JSON.
+    check_ft_batch(...): Verify the jobs of a manifest in parallel.
+    test_all(): Runs all the test methods.
+"""
+
+FLAG_BRIDGE_ANCILLAS = [[0,1,2], [1,0,3], [3,1,2]]
+
+def flag_bridge_manifest(rounds: int = 3) -> List[dict]:
+    """
+    Manifest of the flag bridge circuits: every entangling gate (CX, CZ) and stabilizer type (SZ, SX), with the
+    last 1 to rounds rounds.
+
+    Args:
+        rounds (int): Largest number of rounds.
+
+    Returns:
+        List[dict]: Jobs.
+    """
+    jobs = []
+    for ent in ['CX', 'CZ']:
+        for stab in ['SZ', 'SX']:
+            for start in range(3 - rounds, 3):
+                jobs.append({
+                    'name': f'flag_bridge_{ent}_{stab}{start + 1}-3',
+                    'sequences': [f'flag_bridge_{ent}_{stab}{i + 1}' for i in range(start, 3)],
+                    'used_anc_inds': FLAG_BRIDGE_ANCILLAS[start:],
+                    'lut_name': f'Steane_flag_bridge_{stab}',
+                    'stabilizer_group': 'steane',
+                })
+    return jobs
+
+def load_manifest(filename: str) -> List[dict]:
+    """
+    Read a manifest from a JSON file (a list of jobs).
+    """
+    with open(filename) as f:
+        return json.load(f)
+
+def save_verdicts(verdicts: List[dict], filename: str) -> None:
+    """
+    Write verdicts as a JSON file.
+    """
+    with open(filename, 'w') as f:
+        json.dump(verdicts, f, indent=1, default=str)
+
+def _stabilizer_group(group) -> List[List[str]]:
+    if isinstance(group, str):
+        from tool import assets
+        return assets.get_stabilizer_group(group)
+    return group
+
+# per-process packed stabilizer groups of the batch executor, set by _init_ft_worker
+_ft_worker = {}
+
+def _init_ft_worker(groups: dict) -> None:
+    """
+    Prepare a worker with the packed stabilizer groups (key -> (packed group, number of data qubits)).
+    """
+    _ft_worker.clear()
+    _ft_worker.update(groups)
+
+def _run_ft_job(job: tuple) -> dict:
+    index, name, sequences, used_anc_inds, lut_name, group_key = job
+    verdict = {'index': index, 'name': name, 'sequences': [str(seq) for seq in sequences], 'lut_name': lut_name}
+    try:
+        group, num_datas = _ft_worker[group_key]
+        verdict.update(ft.ft_verdict(sequences, used_anc_inds, lut_name, group, num_datas))
+        verdict['error'] = None
+    except Exception as error:
+        verdict.update({'ft': None, 'error': f'{type(error).__name__}: {error}'})
+    return verdict
+
+def check_ft_batch(jobs: List[dict], num_workers: int = None, chunksize: int = None) -> List[dict]:
+    """
+    Verify the jobs of a manifest in parallel.
+
+    Args:
+        jobs (List[dict]): Manifest, see the module docstring.
+        num_workers (int): Number of processes (default: number of CPUs), 1 runs in this process.
+        chunksize (int): Number of jobs sent to a worker at a time, by default a quarter of the jobs per worker.
+
+    Returns:
+        List[dict]: Verdict of every job, in order, with the keys of ft.ft_verdict and
+            index, name, sequences, lut_name: the job,
+            error: None, or the exception raised by the job (ft is then None).
+
+    Example:
+        >>> verdicts = check_ft_batch(flag_bridge_manifest())
+        >>> [v['name'] for v in verdicts if not v['ft']]
+    """
+    groups, tasks = {}, []
+    for index, job in enumerate(jobs):
+        group = _stabilizer_group(job['stabilizer_group'])
+        key = content_hash(group)
+        if key not in groups:
+            groups[key] = (qec.pack_paulis(group), len(group[0]))
+        tasks.append((index, job.get('name'), list(job['sequences']), job['used_anc_inds'], job['lut_name'], key))
+
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    if num_workers == 1 or len(tasks) <= 1:
+        _init_ft_worker(groups)
+        return [_run_ft_job(task) for task in tasks]
+    chunksize = chunksize or max(1, len(tasks)//(4*num_workers))
+    with ProcessPoolExecutor(num_workers, initializer=_init_ft_worker, initargs=(groups,)) as executor:
+        return list(executor.map(_run_ft_job, tasks, chunksize=chunksize))
+
+
+############################## TESTING ##############################
+def test_check_ft_batch():
+    """
+    Test the check_ft_batch function against check_ft, in this process and over a pool.
+    """
+    stabilizer_group = qec.compute_stabilizer_group([list(s) for s in ['ZZZZ---','-ZZ-ZZ-','--ZZ-ZZ',
+                                                                        'XXXX---','-XX-XX-','--XX-XX']])
+    jobs = flag_bridge_manifest()
+    jobs += [
+        {'name': 'non-FT', 'sequences': ['ZZZZ_nonFT'], 'used_anc_inds': [[0]],
+         'lut_name': 'Steane_flag_bridge_SZ', 'stabilizer_group': stabilizer_group},
+        {'name': 'unknown LUT', 'sequences': ['flag_bridge_CX_SZ3'], 'used_anc_inds': [[3,1,2]],
+         'lut_name': 'missing', 'stabilizer_group': stabilizer_group},
+    ]
+    expected = []
+    for job in jobs[:-1]:
+        try:
+            expected.append(ft.check_ft(job['sequences'], job['used_anc_inds'], job['lut_name'],
+                                        stabilizer_group, verbose=0))
+        except AssertionError:
+            expected.append(False)
+    expected.append(None)
+
+    serial = check_ft_batch(jobs, num_workers=1)
+    parallel = check_ft_batch(jobs, num_workers=2)
+    results = {
+        'serial': [verdict['ft'] for verdict in serial],
+        'parallel': [verdict['ft'] for verdict in parallel],
+        'harmful': [len(verdict['harmful']) > 0 for verdict in serial[-2:-1]],
+        'error': serial[-1]['error'].split(':')[0],
+    }
+    answers = {'serial': expected, 'parallel': expected, 'harmful': [True], 'error': 'KeyError'}
+    run_test([list(answers), list(answers.values())], lambda x: results[x], 'check_ft_batch')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_check_ft_batch()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
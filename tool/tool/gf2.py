@@ -0,0 +1,532 @@
+import os
+import math
+import itertools
+import numpy as np
+from typing import List, Tuple
+from tool import qec
+from tool.testing import run_test
+
+"""
+Bit-packed GF(2) linear algebra for stabilizer groups, without listing their elements.
+
+Binary matrices are stored row by row as uint64 words (column j is bit j % 64 of word j // 64), so that a row
+operation is a XOR of a few words. Pauli strings use the symplectic layout of stabilizer_sim.str2tab: a row of 2n
+columns with the Z part first, then the X part. A stabilizer group is represented by the row-reduced echelon form of
+its generators, which gives in polynomial time:
+    - the number of independent generators (rank),
+    - whether an error is a stabilizer (membership in the row space),
+    - a canonical representative of the coset error * group, equal for two errors iff they are stabilizer
+      equivalent (the error with the bits of the pivot columns cleared),
+    - the normalizer (nullspace of the twisted generators) and logical operators in symplectic pairs,
+    - the minimum-weight element of a coset, by branch and bound over the reduced generators (exponential only in the
+      worst case), or by matching the canonical representatives of all low-weight Paulis when the weight is capped.
+The same reduction is available on single Python integers (rref_ints, reduce_int) for small scalar checks.
+
+Methods:
+    pack_rows(...), unpack_rows(...), pack_ints(...): Binary matrices as uint64 words.
+    tab_from_paulis(...), paulis_from_tab(...): Pauli strings to and from the str2tab layout.
+    rref(...), rank(...), nullspace(...): Row reduction.
+    reduce_rows(...), in_rowspace(...): Coset canonicalization and membership.
+    rref_ints(...), reduce_int(...): Same on Python integers.
+    symplectic_twist(...), commutation_matrix(...), logical_operators(...): Symplectic routines.
+    independent_paulis(...): Independent subset of Pauli strings, generating the same group.
+    min_weight_equivalent(...): Minimum-weight stabilizer equivalent of an error.
+    test_all(): Runs all the test methods.
+"""
+
+WORD = 64
+
+def _num_words(num_cols: int) -> int:
+    return max(1, (num_cols + WORD - 1)//WORD)
+
+def pack_rows(matrix: np.ndarray) -> np.ndarray:
+    """
+    Pack a binary matrix into uint64 words.
+
+    Args:
+        matrix (np.ndarray): (rows, columns) array of 0/1.
+
+    Returns:
+        np.ndarray: (rows, words) uint64 array.
+    """
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.uint8))
+    num_words = _num_words(matrix.shape[1])
+    padded = np.zeros((matrix.shape[0], num_words*WORD), dtype=np.uint8)
+    padded[:, :matrix.shape[1]] = matrix
+    return np.packbits(padded, axis=1, bitorder='little').view('<u8').astype(np.uint64)
+
+def unpack_rows(packed: np.ndarray, num_cols: int) -> np.ndarray:
+    """
+    Inverse of pack_rows.
+
+    Returns:
+        np.ndarray: (rows, num_cols) uint8 array of 0/1.
+    """
+    packed = np.ascontiguousarray(packed, dtype='<u8')
+    bits = np.unpackbits(packed.view(np.uint8).reshape(len(packed), -1), axis=1, bitorder='little')
+    return bits[:, :num_cols]
+
+def pack_ints(values: List[int], num_cols: int) -> np.ndarray:
+    """
+    Pack Python integers (bit j is column j) into uint64 words.
+    """
+    num_words, mask = _num_words(num_cols), (1 << WORD) - 1
+    return np.array([[(value >> (WORD*k)) & mask for k in range(num_words)] for value in values],
+                    dtype=np.uint64).reshape(len(values), num_words)
+
+def tab_from_paulis(pauli_strings: List[str]) -> np.ndarray:
+    """
+    Symplectic matrix of Pauli strings, same as stabilizer_sim.str2tab ('-' is also accepted for the identity).
+
+    Args:
+        pauli_strings (List[str]): Pauli strings on n qubits.
+
+    Returns:
+        np.ndarray: (len(pauli_strings), 2n) array, Z part then X part.
+    """
+    paulis = np.array([list(p) for p in pauli_strings])
+    return np.hstack([np.isin(paulis, ['Z', 'Y']), np.isin(paulis, ['X', 'Y'])]).astype(int)
+
+def paulis_from_tab(tab: np.ndarray) -> List[str]:
+    """
+    Pauli strings of a symplectic matrix in the str2tab layout (as stabilizer_sim.tab2str, always a list).
+    """
+    tab = np.atleast_2d(tab)
+    num_qubits = tab.shape[1]//2
+    z, x = tab[:, :num_qubits], tab[:, num_qubits:]
+    return [''.join('IXZY'[int(i)] for i in row) for row in x + 2*z]
+
+def rref(packed: np.ndarray, num_cols: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Reduced row echelon form of a packed binary matrix.
+
+    Args:
+        packed (np.ndarray): (rows, words) uint64 array.
+        num_cols (int): Number of columns.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Independent reduced rows, and the pivot column of each of them.
+    """
+    rows = np.array(packed, dtype=np.uint64, copy=True).reshape(len(packed), -1)
+    pivots, r = [], 0
+    for col in range(num_cols):
+        if r == len(rows):
+            break
+        word, bit = col//WORD, np.uint64(1) << np.uint64(col % WORD)
+        candidates = np.flatnonzero(rows[r:, word] & bit)
+        if len(candidates) == 0:
+            continue
+        p = r + candidates[0]
+        if p != r:
+            rows[[r, p]] = rows[[p, r]]
+        others = (rows[:, word] & bit) != 0
+        others[r] = False
+        rows[others] ^= rows[r]
+        pivots.append(col)
+        r += 1
+    return rows[:r], np.array(pivots, dtype=np.int64)
+
+def rank(packed: np.ndarray, num_cols: int) -> int:
+    """
+    Rank of a packed binary matrix, e.g. the number of independent stabilizer generators.
+    """
+    return len(rref(packed, num_cols)[1])
+
+def nullspace(packed: np.ndarray, num_cols: int) -> np.ndarray:
+    """
+    Basis of the vectors v with M v = 0.
+
+    Returns:
+        np.ndarray: (num_cols - rank, words) packed basis.
+    """
+    reduced, pivots = rref(packed, num_cols)
+    free = np.setdiff1d(np.arange(num_cols), pivots)
+    basis = np.zeros((len(free), num_cols), dtype=np.uint8)
+    basis[np.arange(len(free)), free] = 1
+    basis[:, pivots] = unpack_rows(reduced, num_cols)[:, free].T
+    return pack_rows(basis) if len(free) else np.zeros((0, _num_words(num_cols)), dtype=np.uint64)
+
+def reduce_rows(vectors: np.ndarray, reduced: np.ndarray, pivots: np.ndarray) -> np.ndarray:
+    """
+    Canonical representatives of the cosets vector + row space: the vectors with the pivot bits cleared by adding
+    reduced rows. Two vectors are in the same coset (stabilizer equivalent) iff their representatives are equal.
+
+    Args:
+        vectors (np.ndarray): (n, words) packed vectors.
+        reduced, pivots: Output of rref.
+
+    Returns:
+        np.ndarray: (n, words) packed representatives.
+    """
+    vectors = np.array(vectors, dtype=np.uint64, copy=True).reshape(len(vectors), reduced.shape[1])
+    for row, col in zip(reduced, pivots):
+        has = (vectors[:, col//WORD] >> np.uint64(col % WORD)) & np.uint64(1) != 0
+        vectors[has] ^= row
+    return vectors
+
+def in_rowspace(vectors: np.ndarray, reduced: np.ndarray, pivots: np.ndarray) -> np.ndarray:
+    """
+    Whether each vector is in the row space (e.g. an error is a stabilizer).
+
+    Returns:
+        np.ndarray: Boolean array.
+    """
+    return ~reduce_rows(vectors, reduced, pivots).any(axis=1)
+
+def rref_ints(values: List[int]) -> List[Tuple[int, int]]:
+    """
+    Row reduction of Python integers (bit j is column j).
+
+    Returns:
+        List[Tuple[int, int]]: (pivot bit, row) of the independent rows, every pivot bit is cleared in the other rows.
+    """
+    basis = []
+    for value in values:
+        value = reduce_int(value, basis)
+        if value:
+            pivot = value.bit_length() - 1
+            basis = [(p, row ^ value if row >> pivot & 1 else row) for p, row in basis]
+            basis.append((pivot, value))
+    return basis
+
+def reduce_int(value: int, basis: List[Tuple[int, int]]) -> int:
+    """
+    Canonical representative of the coset value + span(basis), for a basis from rref_ints.
+    """
+    for pivot, row in basis:
+        if value >> pivot & 1:
+            value ^= row
+    return value
+
+def symplectic_twist(packed: np.ndarray, num_qubits: int) -> np.ndarray:
+    """
+    Swap the Z and X parts of packed symplectic rows, so that the symplectic product of a and b is the parity of
+    a & twist(b).
+    """
+    tab = unpack_rows(packed, 2*num_qubits)
+    return pack_rows(np.hstack([tab[:, num_qubits:], tab[:, :num_qubits]]))
+
+def commutation_matrix(a: np.ndarray, b: np.ndarray, num_qubits: int) -> np.ndarray:
+    """
+    Symplectic products of packed Paulis: entry (i, j) is 1 if a[i] and b[j] anticommute.
+
+    Returns:
+        np.ndarray: (len(a), len(b)) uint8 array.
+    """
+    overlaps = a[:, None, :] & symplectic_twist(b, num_qubits)[None, :, :]
+    return (qec.popcount(overlaps).sum(-1) & 1).astype(np.uint8)
+
+def logical_operators(stabilizers: np.ndarray, num_qubits: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Logical operators of a stabilizer code in symplectic pairs.
+
+    Args:
+        stabilizers (np.ndarray): Packed generators in the str2tab layout (dependent generators are allowed).
+        num_qubits (int): Number of qubits n.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Packed logical_x and logical_z, k = n - rank rows each, reduced modulo the
+            stabilizers, with logical_x[i] anticommuting with logical_z[j] iff i == j.
+
+    Example:
+        >>> tab = pack_rows(tab_from_paulis(['ZZZZIII', 'IZZIZZI', 'IIZZIZZ', 'XXXXIII', 'IXXIXXI', 'IIXXIXX']))
+        >>> paulis_from_tab(unpack_rows(logical_operators(tab, 7)[0], 14))
+    """
+    reduced, pivots = rref(stabilizers, 2*num_qubits)
+    normalizer = list(reduce_rows(nullspace(symplectic_twist(reduced, num_qubits), 2*num_qubits), reduced, pivots))
+    logical_x, logical_z = [], []
+    while normalizer:
+        v = normalizer.pop(0)
+        if not normalizer:
+            break
+        rest = np.array(normalizer)
+        products = commutation_matrix(v[None], rest, num_qubits)[0]
+        if not products.any():
+            # commutes with the whole normalizer: a stabilizer
+            continue
+        w = rest[np.argmax(products)]
+        del normalizer[int(np.argmax(products))]
+        rest = np.array(normalizer) if normalizer else np.zeros((0, len(v)), dtype=np.uint64)
+        with_v = commutation_matrix(rest, v[None], num_qubits)[:, 0].astype(bool)
+        with_w = commutation_matrix(rest, w[None], num_qubits)[:, 0].astype(bool)
+        rest[with_w] ^= v
+        rest[with_v] ^= w
+        normalizer = list(rest)
+        logical_x.append(v)
+        logical_z.append(w)
+    shape = (0, _num_words(2*num_qubits))
+    logical_x = reduce_rows(np.array(logical_x).reshape(-1, shape[1]), reduced, pivots)
+    logical_z = reduce_rows(np.array(logical_z).reshape(-1, shape[1]), reduced, pivots)
+    return logical_x, logical_z
+
+
+def _pauli_int(pauli) -> int:
+    """Pauli string as the integer z | x << n of its str2tab row."""
+    n = len(pauli)
+    return sum((p in 'ZY') << i | (p in 'XY') << (n + i) for i, p in enumerate(pauli))
+
+def _pauli_string(value: int, num_qubits: int) -> str:
+    return ''.join('-XZY'[(value >> (num_qubits + i) & 1) + 2*(value >> i & 1)] for i in range(num_qubits))
+
+def _low_weight_paulis(num_qubits: int, max_weight: int):
+    """Integers of the Paulis of weight <= max_weight, by increasing weight."""
+    for weight in range(max_weight + 1):
+        for qubits in itertools.combinations(range(num_qubits), weight):
+            for paulis in itertools.product((1 << num_qubits, 1, 1 | 1 << num_qubits), repeat=weight):
+                yield sum(p << q for p, q in zip(paulis, qubits))
+
+def _num_low_weight_paulis(num_qubits: int, max_weight: int) -> int:
+    return sum(math.comb(num_qubits, w)*3**w for w in range(max_weight + 1))
+
+def independent_paulis(paulis: List[str]) -> List[str]:
+    """
+    Independent subset of Pauli strings generating the same group, in their order, e.g. generators of an enumerated
+    stabilizer group.
+
+    Args:
+        paulis (List[str]): Pauli strings, '-' or 'I' for the identity.
+
+    Returns:
+        List[str]: The Pauli strings that are not products of the previous ones.
+
+    Example:
+        >>> independent_paulis(['ZZ-', '-ZZ', 'Z-Z', 'XXX'])
+        ['ZZ-', '-ZZ', 'XXX']
+    """
+    independent, basis = [], []
+    for pauli in paulis:
+        value = _pauli_int(pauli)
+        if reduce_int(value, basis):
+            independent.append(pauli)
+            basis = rref_ints([_pauli_int(p) for p in independent])
+    return independent
+
+def min_weight_equivalent(error, generators: List[str], max_weight: int = None) -> Tuple[str, int]:
+    """
+    Lowest-weight error equivalent to an error under the stabilizer group of generators, without listing the group.
+    Ties are broken as in qec.lowest_weight_equivalent (smallest string, '-' < 'X' < 'Y' < 'Z').
+
+    The search decides the reduced generators one by one (branch and bound): qubits on which no undecided generator
+    acts are final, so their weight is a lower bound for the whole subtree, which is abandoned if it exceeds the best
+    weight found (or max_weight). With a small max_weight, the canonical coset representatives of all Paulis of
+    weight <= max_weight are compared with the one of the error instead.
+
+    Args:
+        error (str or List[str]): Pauli error, '-' or 'I' for the identity.
+        generators (List[str]): Stabilizer generators (dependent generators are allowed).
+        max_weight (int): Only look for equivalent errors of weight <= max_weight, e.g. 1 for fault tolerance.
+
+    Returns:
+        Tuple[str, int]: Lowest-weight equivalent error ('-' for the identity) and its weight, (None, None) if every
+            equivalent error is heavier than max_weight.
+
+    Example:
+        >>> min_weight_equivalent('ZZZ----', ['ZZZZ---', '-ZZ-ZZ-', '--ZZ-ZZ', 'XXXX---', '-XX-XX-', '--XX-XX'])
+        ('---Z---', 1)
+    """
+    num_qubits = len(error)
+    z_mask = (1 << num_qubits) - 1
+    def weight(value):
+        return bin((value | value >> num_qubits) & z_mask).count('1')
+
+    basis = rref_ints([_pauli_int(g) for g in generators])
+    value = _pauli_int(error)
+    if max_weight is not None and _num_low_weight_paulis(num_qubits, max_weight) <= 1 << len(basis):
+        target = reduce_int(value, basis)
+        for candidate in _low_weight_paulis(num_qubits, max_weight):
+            if reduce_int(candidate, basis) == target:
+                ties = [c for c in _low_weight_paulis(num_qubits, weight(candidate))
+                        if weight(c) == weight(candidate) and reduce_int(c, basis) == target]
+                best = min(_pauli_string(c, num_qubits) for c in ties)
+                return best, weight(candidate)
+        return None, None
+
+    # independent generators as given (usually sparse), ordered by their last qubit so that qubits become final early
+    rows = [_pauli_int(g) for g in independent_paulis(generators)]
+    rows.sort(key=lambda row: ((row | row >> num_qubits) & z_mask).bit_length())
+    # columns on which the undecided generators rows[d:] act
+    free = [0]*(len(rows) + 1)
+    for d in range(len(rows) - 1, -1, -1):
+        free[d] = free[d + 1] | rows[d]
+    # qubits before the first qubit with a free column are final
+    prefix = [(((f | f >> num_qubits) & z_mask) & -((f | f >> num_qubits) & z_mask)).bit_length() - 1
+              if f else num_qubits for f in free]
+    # first upper bound by greedy descent
+    descent, improved = value, True
+    while improved:
+        improved = False
+        for row in rows:
+            if weight(descent ^ row) < weight(descent):
+                descent, improved = descent ^ row, True
+    cap = num_qubits if max_weight is None else max_weight
+    start = min((value, descent), key=lambda v: (weight(v), _pauli_string(v, num_qubits)))
+    best = [weight(start), _pauli_string(start, num_qubits)] if weight(start) <= cap else [cap + 1, None]
+
+    def search(d, current):
+        bound = weight(current & ~free[d])
+        if bound > best[0]:
+            return
+        if bound == best[0] and best[1] is not None and prefix[d] > 0:
+            # ties can only win on a smaller string, whose final qubits are already known
+            if _pauli_string(current, num_qubits)[:prefix[d]] > best[1][:prefix[d]]:
+                return
+        if d == len(rows):
+            w = weight(current)
+            if w > cap:
+                return
+            if w < best[0] or (w == best[0] and (best[1] is None or _pauli_string(current, num_qubits) < best[1])):
+                best[:] = w, _pauli_string(current, num_qubits)
+            return
+        children = [current, current ^ rows[d]]
+        children.sort(key=lambda child: weight(child & ~free[d + 1]))
+        for child in children:
+            search(d + 1, child)
+
+    search(0, value)
+    return (best[1], best[0]) if best[1] is not None else (None, None)
+
+
+############################## TESTING ##############################
+STEANE = ['ZZZZIII', 'IZZIZZI', 'IIZZIZZ', 'XXXXIII', 'IXXIXXI', 'IIXXIXX']
+
+def toric_code(size: int) -> List[str]:
+    """Plaquette and vertex stabilizers of the toric code on a size x size torus (2 size^2 qubits)."""
+    def edge(i, j, d):
+        return 2*((i % size)*size + j % size) + d
+    stabilizers = []
+    for i in range(size):
+        for j in range(size):
+            for pauli, edges in (('Z', [edge(i, j, 0), edge(i, j, 1), edge(i + 1, j, 1), edge(i, j + 1, 0)]),
+                                 ('X', [edge(i, j, 0), edge(i, j, 1), edge(i - 1, j, 0), edge(i, j - 1, 1)])):
+                stabilizer = ['I']*(2*size*size)
+                for e in edges:
+                    stabilizer[e] = pauli
+                stabilizers.append(''.join(stabilizer))
+    return stabilizers
+
+def test_packing():
+    """
+    Test pack_rows/unpack_rows, pack_ints and tab_from_paulis/paulis_from_tab round trips.
+    """
+    rng = np.random.default_rng(0)
+    matrix = rng.integers(0, 2, (5, 130))
+    ints = [int(''.join(map(str, row[::-1])), 2) for row in matrix]
+    test_cases = {
+        'rows': np.array_equal(unpack_rows(pack_rows(matrix), 130), matrix),
+        'ints': np.array_equal(pack_ints(ints, 130), pack_rows(matrix)),
+        'paulis': paulis_from_tab(tab_from_paulis(STEANE + ['XYZ-III'])) == STEANE + ['XYZIIII'],
+    }
+    run_test([list(test_cases), [True]*len(test_cases)], lambda x: test_cases[x], 'pack_rows')
+
+def test_row_reduction():
+    """
+    Test rank, nullspace, membership and coset canonicalization against the enumerated Steane stabilizer group.
+    """
+    n = 7
+    stabilizers = pack_rows(tab_from_paulis(STEANE))
+    reduced, pivots = rref(stabilizers, 2*n)
+    group = qec.compute_stabilizer_group([list(s.replace('I', '-')) for s in STEANE])
+    group_tab = pack_rows(tab_from_paulis([''.join(g) for g in group]))
+    errors = pack_rows(np.random.default_rng(1).integers(0, 2, (20, 2*n)))
+    canonical = reduce_rows(errors, reduced, pivots)
+    # every element of the coset of an error has the same representative
+    coset = reduce_rows((errors[:, None, :] ^ group_tab[None]).reshape(-1, errors.shape[1]), reduced, pivots)
+    kernel = nullspace(stabilizers, 2*n)
+    to_int = lambda row: int(''.join(map(str, row[::-1])), 2)
+    basis = rref_ints([to_int(row) for row in tab_from_paulis(STEANE)])
+    int_coset = [[reduce_int(to_int(e) ^ to_int(g), basis) for g in unpack_rows(group_tab, 2*n)]
+                 for e in unpack_rows(errors, 2*n)]
+    test_cases = {
+        'rank': rank(np.vstack([stabilizers, stabilizers[:2] ^ stabilizers[2:4]]), 2*n) == 6,
+        'group members': bool(in_rowspace(group_tab, reduced, pivots).all()),
+        'non-members': not in_rowspace(pack_rows(tab_from_paulis(['ZIIIIII', 'XXIIIII'])), reduced, pivots).any(),
+        'cosets': bool((coset.reshape(len(errors), len(group_tab), -1) == canonical[:, None, :]).all()),
+        'nullspace': len(kernel) == 8 and not (qec.popcount(
+            stabilizers[:, None, :] & kernel[None]).sum(-1) & 1).any(),
+        'ints': all(len(set(reps)) == 1 for reps in int_coset) and
+            len({reps[0] for reps in int_coset}) == len({row.tobytes() for row in canonical}),
+    }
+    run_test([list(test_cases), [True]*len(test_cases)], lambda x: test_cases[x], 'rref/reduce_rows')
+
+def test_logical_operators():
+    """
+    Test the logical operators of the Steane code and of a 200-qubit toric code: they commute with the stabilizers,
+    are not stabilizers and come in anticommuting pairs.
+    """
+    def check(stabilizer_strings):
+        n = len(stabilizer_strings[0])
+        stabilizers = pack_rows(tab_from_paulis(stabilizer_strings))
+        reduced, pivots = rref(stabilizers, 2*n)
+        logical_x, logical_z = logical_operators(stabilizers, n)
+        logicals = np.vstack([logical_x, logical_z])
+        k = len(logical_x)
+        return (k,
+                not commutation_matrix(logicals, stabilizers, n).any(),
+                not in_rowspace(logicals, reduced, pivots).any(),
+                np.array_equal(commutation_matrix(logical_x, logical_z, n), np.eye(k, dtype=np.uint8)),
+                not commutation_matrix(logical_x, logical_x, n).any())
+    test_cases = {'steane': (STEANE, (1, True, True, True, True)),
+                  'toric 10x10': (toric_code(10), (2, True, True, True, True))}
+    run_test({name: answer for name, (_, answer) in test_cases.items()}, lambda x: check(test_cases[x][0]),
+             'logical_operators')
+
+def test_min_weight_equivalent():
+    """
+    Test min_weight_equivalent against the exhaustive search over the stabilizer group (qec.lowest_weight_equivalent)
+    for all Steane errors of weight <= 2, and recover weight-2 errors of a 5x5 toric code hidden by stabilizers.
+    """
+    steane = [stabilizer.replace('I', '-') for stabilizer in STEANE]
+    group = qec.compute_stabilizer_group([list(stabilizer) for stabilizer in steane])
+    errors = []
+    for weight in range(3):
+        for qubits in itertools.combinations(range(7), weight):
+            for paulis in itertools.product('XYZ', repeat=weight):
+                error = ['-']*7
+                for qubit, pauli in zip(qubits, paulis):
+                    error[qubit] = pauli
+                errors.append(''.join(error))
+    def exhaustive(error):
+        equivalent, weight = qec.lowest_weight_equivalent(list(error), group)
+        return ''.join(equivalent), weight
+    run_test([[len(group)], [steane]], lambda _: independent_paulis([''.join(element) for element in group]),
+             'independent_paulis')
+    run_test([errors, [exhaustive(error) for error in errors]], lambda x: min_weight_equivalent(x, steane),
+             'min_weight_equivalent (steane)')
+    run_test([errors, [exhaustive(error) if exhaustive(error)[1] <= 1 else (None, None) for error in errors]],
+             lambda x: min_weight_equivalent(x, steane, max_weight=1), 'min_weight_equivalent (max_weight)')
+    # max_weight = 2 goes through the branch and bound, errors of weight 3 such as XYZ---- have no equivalent
+    weight_three = ['XYZ----', 'Y-Z-X--', 'Y--Y--X', '-YX---X', '-Y--ZX-', '--X-Y-Z']
+    run_test([errors + weight_three, [exhaustive(error) if exhaustive(error)[1] <= 2 else (None, None)
+                                      for error in errors + weight_three]],
+             lambda x: min_weight_equivalent(x, steane, max_weight=2), 'min_weight_equivalent (max_weight 2)')
+
+    toric = toric_code(5)
+    n = len(toric[0])
+    rng = np.random.default_rng(0)
+    test_cases = {}
+    for _ in range(5):
+        error = np.zeros(2*n, dtype=int)
+        error[rng.choice(2*n, 2, replace=False)] = 1
+        for row in tab_from_paulis(toric)[rng.random(len(toric)) < 0.5]:
+            error ^= row
+        test_cases[paulis_from_tab(error[None])[0]] = True
+    def check(error):
+        equivalent, weight = min_weight_equivalent(error, toric)
+        tab = pack_rows(tab_from_paulis([error.replace('-', 'I'), equivalent.replace('-', 'I')]))
+        reduced, pivots = rref(pack_rows(tab_from_paulis(toric)), 2*n)
+        return weight <= 2 and bool(in_rowspace(tab[:1] ^ tab[1:], reduced, pivots)[0])
+    run_test(test_cases, check, 'min_weight_equivalent (toric 5x5)')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_packing()
+    test_row_reduction()
+    test_logical_operators()
+    test_min_weight_equivalent()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
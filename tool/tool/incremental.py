@@ -0,0 +1,347 @@
+import os
+import numpy as np
+from typing import List
+from tool import qec, ft
+from tool.testing import run_test
+
+"""
+Incremental fault propagation for gate sequences that are edited a few gates at a time.
+
+The final error of a fault inserted after gate i is the image of the fault under the Clifford of the gates i+1, ...
+When a sequence is edited, faults inserted after the last edited gate keep their errors, and faults inserted before
+the first edited gate share their propagation up to it with the unedited sequence. IncrementalPropagator keeps
+    - a trie of sequence prefixes, each node holding the errors of the faults inserted in the prefix propagated to
+      its end,
+    - a trie of reversed sequence suffixes, each node holding the Clifford of the suffix (as byte look-up tables of
+      the images of X and Z on every qubit) and the final errors of the faults of its first gate.
+A sequence is propagated from its longest known prefix through the gates up to its longest known suffix, whose
+Clifford maps the errors to the end in a few table look-ups. Only the edited gates are propagated gate by gate, and
+the new prefixes and suffixes are added to the tries for the next edit. Once the tries hold more than max_nodes
+nodes, the least recently used ones are pruned, so long searches keep a bounded memory. The tables are the ones of
+ft.propagate_faults and are passed to ft.get_bad_locations and ft.ft_verdict with their locations argument.
+
+Methods:
+    IncrementalPropagator: Incremental ft.propagate_faults, get_bad_locations and ft_verdict.
+    test_all(): Runs all the test methods.
+"""
+
+def _images_tables(images: np.ndarray, num_qubits: int) -> List:
+    """
+    Byte look-up tables of a Clifford given by the images of X_0..X_{n-1}, Z_0..Z_{n-1}: for each component (x, z)
+    and byte of the input, the XOR of the images of the bits set in the byte.
+    """
+    tables = []
+    for component, offset in (('x', 0), ('z', num_qubits)):
+        for start in range(0, num_qubits, 8):
+            table = np.zeros(256, dtype=qec.PAULI_DTYPE)
+            for k in range(min(8, num_qubits - start)):
+                image = images[offset + start + k]
+                table[1 << k: 2 << k]['x'] = table[:1 << k]['x'] ^ image['x']
+                table[1 << k: 2 << k]['z'] = table[:1 << k]['z'] ^ image['z']
+            tables.append((component, np.uint64(start), table))
+    return tables
+
+# bits of the byte values: _BYTE_BITS[k][b] is True if bit k of b is set
+_BYTE_BITS = [(np.arange(256) >> k) & 1 == 1 for k in range(8)]
+
+def _prepend_gate(images: np.ndarray, tables: List, gate, num_qubits: int, identity: np.ndarray):
+    """
+    Images and byte look-up tables of a gate followed by the Clifford given by images and tables. Only the images of
+    the generators on the qubits of the gate change, and only their tables are copied and updated.
+    """
+    name, position = gate
+    qubits = sorted(set(position))
+    generators = qubits + [num_qubits + q for q in qubits]
+    moved = identity[generators]
+    qec.clifford_transform_packed(moved, name, position)
+    moved = _apply_tables(tables, moved)
+
+    images, tables, copied = images.copy(), list(tables), set()
+    num_chunks = (num_qubits + 7)//8
+    for j, image in zip(generators, moved):
+        delta_x, delta_z = image['x'] ^ images[j]['x'], image['z'] ^ images[j]['z']
+        if not delta_x and not delta_z:
+            continue
+        images[j] = image
+        component, qubit = divmod(j, num_qubits)
+        t = component*num_chunks + qubit//8
+        if t not in copied:
+            tables[t] = tables[t][:2] + (tables[t][2].copy(),)
+            copied.add(t)
+        table, bits = tables[t][2], _BYTE_BITS[qubit % 8]
+        table['x'][bits] ^= delta_x
+        table['z'][bits] ^= delta_z
+    return images, tables
+
+def _apply_tables(tables: List, paulis: np.ndarray) -> np.ndarray:
+    """Images of packed Paulis under a Clifford given by _images_tables (phases are ignored)."""
+    images = np.zeros(len(paulis), dtype=qec.PAULI_DTYPE)
+    for component, start, table in tables:
+        entries = table[(paulis[component] >> start) & np.uint64(255)]
+        images['x'] ^= entries['x']
+        images['z'] ^= entries['z']
+    return images
+
+class _PrefixNode:
+    __slots__ = ('children', 'errors', 'used')
+
+    def __init__(self, errors: np.ndarray, used: int = 0):
+        self.children = {}
+        self.errors = errors
+        self.used = used
+
+class _SuffixNode:
+    __slots__ = ('children', 'images', 'tables', 'errors', 'used')
+
+    def __init__(self, images: np.ndarray, tables: List, errors: np.ndarray, used: int = 0):
+        self.children = {}
+        self.images = images
+        self.tables = tables
+        self.errors = errors
+        self.used = used
+
+def _descendants(root) -> List:
+    """Nodes of a trie, without its root."""
+    nodes, stack = [], list(root.children.values())
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(node.children.values())
+    return nodes
+
+def _prune(root, threshold: int) -> None:
+    """Remove the nodes last used before threshold (with their descendants, which were not used later)."""
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        node.children = {gate: child for gate, child in node.children.items() if child.used >= threshold}
+        stack.extend(node.children.values())
+
+class IncrementalPropagator:
+    """
+    ft.propagate_faults that reuses the propagation of the sequences it has already seen.
+
+    Args:
+        fault_types (str): String containing the fault types.
+        num_qubits (int): Number of qubits.
+        num_datas (int): Number of data qubits.
+        weight1_only (bool): Whether to include only weight-1 faults.
+        max_nodes (int): Number of trie nodes above which the least recently used half is pruned.
+
+    Attributes:
+        stats (dict): Number of calls, of gates propagated gate by gate, of fault locations whose errors were
+            taken from the suffix trie and of pruned nodes.
+
+    Example:
+        >>> propagator = IncrementalPropagator('XYZ', 11, 7)
+        >>> table = propagator.propagate_faults(sequence)
+        >>> table = propagator.propagate_faults(sequence[:5] + (('CX', (0, 9)),) + sequence[6:])  # 1 gate propagated
+    """
+    def __init__(self, fault_types: str = 'XYZ', num_qubits: int = 11, num_datas: int = 7, weight1_only: bool = False,
+                 max_nodes: int = 20000):
+        self.fault_types = fault_types
+        self.num_qubits = num_qubits
+        self.num_datas = num_datas
+        self.weight1_only = weight1_only
+        self.max_nodes = max_nodes
+        self._faults = ft.get_faults(fault_types, weight1_only)
+        self._inserted = {}
+        self._fault_names = [np.array(faults, dtype=str) for faults in self._faults]
+        self.clear()
+
+    def clear(self) -> None:
+        """Forget all the sequences seen so far."""
+        identity = qec.pack_paulis(['-'*q + p + '-'*(self.num_qubits - q - 1)
+                                    for p in 'XZ' for q in range(self.num_qubits)])
+        empty = np.zeros(0, dtype=qec.PAULI_DTYPE)
+        self._prefix_root = _PrefixNode(empty)
+        self._suffix_root = _SuffixNode(identity, _images_tables(identity, self.num_qubits), empty)
+        self._identity = identity
+        self._num_nodes = 0
+        self.stats = {'calls': 0, 'propagated_gates': 0, 'reused_locations': 0, 'pruned_nodes': 0}
+
+    def _prune(self) -> None:
+        """Keep the max_nodes/2 most recently used nodes (and the ones used as recently as the last of them)."""
+        nodes = _descendants(self._prefix_root) + _descendants(self._suffix_root)
+        threshold = sorted(node.used for node in nodes)[-(self.max_nodes//2) - 1]
+        _prune(self._prefix_root, threshold)
+        _prune(self._suffix_root, threshold)
+        num_nodes = len(_descendants(self._prefix_root)) + len(_descendants(self._suffix_root))
+        self.stats['pruned_nodes'] += len(nodes) - num_nodes
+        self._num_nodes = num_nodes
+
+    def _gate_faults(self, gate) -> np.ndarray:
+        """Packed faults inserted after a gate."""
+        if gate not in self._inserted:
+            _, position = gate
+            self._inserted[gate] = qec.pack_paulis([ft.get_fault_string(self.num_qubits, position, fault)
+                                                    for fault in self._faults[len(position) - 1]])
+        return self._inserted[gate]
+
+    def propagate_faults(self, gate_seq) -> ft.LocationTable:
+        """
+        Same table as ft.propagate_faults(gate_seq, fault_types, num_qubits, num_datas, weight1_only).
+
+        Args:
+            gate_seq: Gate sequence, or its name for qec.get_sequence.
+
+        Returns:
+            LocationTable: Table with the columns idx, gate, fault and error.
+        """
+        gates = [('I', (j,)) for j in range(self.num_qubits)]
+        gates += [(gate, tuple(int(q) for q in position)) for gate, position in ft.as_gate_sequence(gate_seq)]
+        num_gates = len(gates)
+        self.stats['calls'] += 1
+        call = self.stats['calls']
+
+        # longest known prefix
+        prefix, start = self._prefix_root, 0
+        while start < num_gates and gates[start] in prefix.children:
+            prefix = prefix.children[gates[start]]
+            prefix.used = call
+            start += 1
+        # longest known suffix after it
+        suffixes, end = [self._suffix_root], num_gates
+        while end > start and gates[end - 1] in suffixes[-1].children:
+            suffixes.append(suffixes[-1].children[gates[end - 1]])
+            suffixes[-1].used = call
+            end -= 1
+
+        # propagate the edited gates, adding their prefixes
+        errors = prefix.errors
+        for i in range(start, end):
+            propagated = len(errors)
+            errors = np.concatenate([errors, self._gate_faults(gates[i])])
+            qec.clifford_transform_packed(errors[:propagated], *gates[i])
+            node = _PrefixNode(errors, call)
+            prefix.children[gates[i]] = node
+            prefix = node
+        self.stats['propagated_gates'] += end - start
+
+        # add the suffixes of the edited gates: Clifford of gate i then the suffix, final errors of the faults of gate i
+        suffix = suffixes[-1]
+        for i in range(end - 1, start - 1, -1):
+            images, tables = _prepend_gate(suffix.images, suffix.tables, gates[i], self.num_qubits, self._identity)
+            node = _SuffixNode(images, tables, _apply_tables(suffix.tables, self._gate_faults(gates[i])), call)
+            suffix.children[gates[i]] = node
+            suffix = node
+        self._num_nodes += 2*(end - start)
+
+        # faults before the known suffix are mapped to the end by its Clifford, the others are already final
+        final = [_apply_tables(suffixes[-1].tables, errors)] + [node.errors for node in reversed(suffixes[1:])]
+        self.stats['reused_locations'] += sum(len(node.errors) for node in suffixes[1:])
+        if self._num_nodes > self.max_nodes:
+            self._prune()
+        return self._location_table(gates, np.concatenate(final))
+
+    def _location_table(self, gates, errors: np.ndarray) -> ft.LocationTable:
+        """Table with the columns of ft.propagate_faults."""
+        faults = [self._fault_names[len(position) - 1] for _, position in gates]
+        counts = [len(gate_faults) for gate_faults in faults]
+        faulty_gates = np.empty(len(gates), dtype=object)
+        for i, gate in enumerate(gates):
+            faulty_gates[i] = gate
+        idxs = np.maximum(np.arange(len(gates)) - self.num_qubits, -1)
+        table = ft.LocationTable(len(errors))
+        table.set_column('idx', np.repeat(idxs, counts), formatter=int)
+        table.set_column('gate', np.repeat(faulty_gates, counts), formatter=None)
+        table.set_column('fault', np.concatenate(faults))
+        table.set_column('error', errors, formatter=ft.error_formatter(self.num_datas, self.num_qubits))
+        return table
+
+    def get_bad_locations(self, gate_seq, verbose: str = None) -> List:
+        """
+        ft.get_bad_locations on the incrementally propagated faults.
+        """
+        return ft.get_bad_locations(gate_seq, self.fault_types, self.num_qubits, self.num_datas, self.weight1_only,
+                                    verbose=verbose, locations=self.propagate_faults(gate_seq))
+
+    def ft_verdict(self, sequences: List, used_anc_inds: List[List[int]], lut_name: str, stabilizer_group,
+                   num_datas: int = None) -> dict:
+        """
+        ft.ft_verdict with the faults of the first sequence propagated incrementally, the propagator must use the
+        fault types 'XYZ' of check_ft.
+        """
+        assert self.fault_types == 'XYZ' and not self.weight1_only, 'check_ft propagates all XYZ faults'
+        return ft.ft_verdict(sequences, used_anc_inds, lut_name, stabilizer_group, num_datas,
+                             locations=self.propagate_faults(sequences[0]))
+
+
+############################## TESTING ##############################
+def _edits(sequence, num_qubits: int, num_edits: int, seed: int = 0) -> List:
+    """Sequences obtained by successive random edits (replace, insert or delete one gate) of a sequence."""
+    rng = np.random.default_rng(seed)
+    sequences, sequence = [tuple(sequence)], list(sequence)
+    for _ in range(num_edits):
+        i = int(rng.integers(len(sequence)))
+        a, b = (int(q) for q in rng.choice(num_qubits, 2, replace=False))
+        gate = [('H', (a,)), ('S', (a,)), ('CX', (a, b)), ('CZ', (a, b))][rng.integers(4)]
+        edit = rng.integers(3)
+        if edit == 0:
+            sequence[i] = gate
+        elif edit == 1:
+            sequence.insert(i, gate)
+        elif len(sequence) > 1:
+            del sequence[i]
+        sequences.append(tuple(sequence))
+    return sequences
+
+def test_propagate_faults():
+    """
+    Test that the incremental tables match ft.propagate_faults over successive edits, including back and forth
+    edits that are fully cached, that fewer gates are propagated than a full propagation of every sequence, and that
+    a small node budget prunes the tries without changing the tables.
+    """
+    sequence = sum((qec.get_sequence(f'flag_bridge_CX_SZ{i}') for i in (1, 2, 3)), ())
+    sequences = _edits(sequence, 11, 20)
+    sequences += sequences[::-1]
+    propagator = IncrementalPropagator('XYZ', 11, 7)
+    budgeted = IncrementalPropagator('XYZ', 11, 7, max_nodes=100)
+    columns = ['idx', 'gate', 'fault', 'error']
+    def same_table(seq):
+        expected = ft.propagate_faults(seq, 'XYZ', 11, 7).to_rows(columns)
+        return propagator.propagate_faults(seq).to_rows(columns) == expected and \
+            budgeted.propagate_faults(seq).to_rows(columns) == expected
+    run_test([list(range(len(sequences))), [True]*len(sequences)], lambda i: same_table(sequences[i]),
+             'IncrementalPropagator.propagate_faults')
+    total = sum(len(seq) + 11 for seq in sequences)
+    num_nodes = len(_descendants(budgeted._prefix_root)) + len(_descendants(budgeted._suffix_root))
+    run_test([['propagated', 'budget'], [True, True]],
+             lambda x: propagator.stats['propagated_gates'] < total/5 if x == 'propagated' else
+             budgeted.stats['pruned_nodes'] > 0 and num_nodes <= budgeted.max_nodes,
+             'IncrementalPropagator.stats')
+
+    weight1 = IncrementalPropagator('XZ', 11, 7, weight1_only=True)
+    expected = [ft.get_bad_locations(seq, 'XZ', 11, 7, True, verbose=None)[0] for seq in sequences[:5]]
+    run_test([list(range(5)), expected], lambda i: weight1.get_bad_locations(sequences[i])[0],
+             'IncrementalPropagator.get_bad_locations')
+
+def test_ft_verdict():
+    """
+    Test the incremental ft_verdict against ft.ft_verdict on the flag bridge circuits and edits of them.
+    """
+    from tool.ft_batch import flag_bridge_manifest
+    from tool import assets
+    group = assets.get_stabilizer_group('steane')
+    propagator = IncrementalPropagator()
+    jobs = flag_bridge_manifest()
+    for job in jobs[:3]:
+        first = qec.get_sequence(job['sequences'][0])
+        for edited in _edits(first, 11, 3, seed=len(jobs))[1:]:
+            jobs.append(dict(job, sequences=[edited] + job['sequences'][1:]))
+    expected = [ft.ft_verdict(job['sequences'], job['used_anc_inds'], job['lut_name'], group) for job in jobs]
+    run_test([list(range(len(jobs))), expected],
+             lambda i: propagator.ft_verdict(jobs[i]['sequences'], jobs[i]['used_anc_inds'], jobs[i]['lut_name'],
+                                             group), 'IncrementalPropagator.ft_verdict')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_propagate_faults()
+    test_ft_verdict()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
@@ -0,0 +1,116 @@
+import os
+import sys
+import importlib
+import importlib.util
+from tool.testing import run_test
+
+"""
+Lazy imports of the simulator backends.
+
+qulacs, cirq and qsimcirq take from a fraction of a second to seconds to import, which dominates the run time of
+short scripts that never simulate anything (e.g. the combinatorial FT checks of python -m tool). Modules using them
+bind a LazyModule at import time, the backend is only imported on the first attribute access.
+
+Methods:
+    LazyModule: Module placeholder importing the module on first attribute access.
+    lazy_import(...): LazyModule of a module, or the module itself if it is already imported.
+    is_available(...): Whether a module can be imported, without importing it.
+    test_all(): Runs all the test methods.
+"""
+
+class LazyModule:
+    """
+    Placeholder of a module, imported on the first attribute access.
+
+    Example:
+        >>> qulacs = lazy_import('qulacs')
+        >>> state = qulacs.QuantumState(3)  # qulacs is imported here
+    """
+    def __init__(self, name: str):
+        """
+        Args:
+            name (str): Module name.
+        """
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        if self._module is None:
+            try:
+                self.__dict__['_module'] = importlib.import_module(self._name)
+            except ImportError as error:
+                raise ImportError(f'{self._name} is required for this function: {error}') from error
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr: str, value) -> None:
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        state = 'imported' if self._module is not None else 'not imported'
+        return f'<lazy module {self._name!r} ({state})>'
+
+def lazy_import(name: str):
+    """
+    Module placeholder importing the module on first use.
+
+    Args:
+        name (str): Module name, e.g. 'qulacs' or 'cirq'.
+
+    Returns:
+        LazyModule, or the module if it is already imported.
+    """
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
+
+def is_available(name: str) -> bool:
+    """
+    Whether a top-level module can be imported, without importing it.
+
+    Args:
+        name (str): Module name.
+
+    Returns:
+        bool: True if the module is installed.
+    """
+    return name in sys.modules or importlib.util.find_spec(name) is not None
+
+
+############################## TESTING ##############################
+def test_lazy_import():
+    """
+    Test the lazy_import function.
+    """
+    sys.modules.pop('colorsys', None)
+    colorsys = lazy_import('colorsys')
+    results = {
+        'deferred': 'colorsys' not in sys.modules,
+        'attribute': colorsys.rgb_to_hsv(1., 0., 0.),
+        'imported': 'colorsys' in sys.modules,
+        'already imported': lazy_import('os') is os,
+        'missing': is_available('_no_such_module_'),
+    }
+    try:
+        lazy_import('_no_such_module_').anything
+        results['error'] = None
+    except ImportError as error:
+        results['error'] = str(error).split(':')[0]
+    answers = {'deferred': True, 'attribute': (0., 1., 1.), 'imported': True, 'already imported': True,
+               'missing': False, 'error': '_no_such_module_ is required for this function'}
+    run_test([list(answers), list(answers.values())], lambda x: results[x], 'lazy_import')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_lazy_import()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
@@ -0,0 +1,416 @@
+import os
+import itertools
+import numpy as np
+from tool.testing import run_test
+
+"""
+Heterogeneous Pauli noise models, compiled once per gate sequence into sampling tables.
+
+A channel is a pair (errors, probabilities) where errors[k] is a Pauli string on the qubits of a gate ('-' for
+identity) and errors[0] is the identity, the format of the noise locations of tool.noisy_sim. A NoiseModel assigns
+channels by gate name and qubits, the most specific rule winning:
+    (gate, qubits) > (gate, any qubits) > (any gate, qubits) > (any gate, any qubits),
+so that biased single-qubit channels, correlated two-qubit channels (e.g. pauli_channel({'ZZ': p})) and bad qubits
+or couplers can be mixed, plus a readout flip probability per qubit.
+
+NoiseModel.compile lists the noise locations of a gate sequence and builds one alias table per distinct channel,
+so that the errors of a whole batch of shots are sampled in one vectorized draw, in O(1) per location instead of
+O(number of errors) for cumulative thresholds. The compiled model is consumed by the state-vector, parallel and
+Pauli-frame runners of tool.noisy_sim (noise_model argument), tool.dispatch, tool.sampling, and the memory
+experiment frames of stabilizer_sim.
+
+Methods:
+    pauli_channel(...): Channel from the probabilities of its Pauli errors.
+    depolarizing(...): Depolarizing channel on one or more qubits.
+    biased(...): Z-biased Pauli channel on one or more qubits.
+    NoiseModel: Channels by gate and qubit, and readout errors by qubit.
+    CompiledNoise: Noise locations of a gate sequence with their sampling tables.
+    test_all(): Runs all the test methods.
+"""
+
+PAULIS = '-XYZ'
+
+def pauli_channel(probabilities: dict) -> tuple[list[str], list[float]]:
+    """
+    Pauli channel from the probabilities of its non-identity errors.
+
+    Args:
+        probabilities (dict): Probability of every error, e.g. {'X': 1e-3, 'Z': 1e-2} or {'ZZ': 1e-3, 'XI': 1e-4}.
+            The letters act on the qubits of the gate in order, 'I' or '-' for identity.
+
+    Returns:
+        tuple[list[str], list[float]]: Errors with the identity first, and their probabilities.
+
+    Example:
+        >>> pauli_channel({'ZZ': 0.01, 'ZI': 0.002})
+        (['--', 'ZZ', 'Z-'], [0.988, 0.01, 0.002])
+    """
+    errors = [error.replace('I', '-') for error in probabilities]
+    num_qubits = len(errors[0]) if errors else 1
+    if any(len(error) != num_qubits or set(error) - set(PAULIS) or set(error) == {'-'} for error in errors):
+        raise ValueError(f'errors should be non-identity Pauli strings on {num_qubits} qubits, got {errors}')
+    probs = [float(p) for p in probabilities.values()]
+    if min(probs, default=0.) < 0 or sum(probs) > 1 + 1e-12:
+        raise ValueError(f'probabilities should be non-negative and sum to at most 1, got {probs}')
+    return ['-'*num_qubits] + errors, [1 - sum(probs)] + probs
+
+def _non_identity(num_qubits: int) -> list[str]:
+    return [''.join(error) for error in itertools.product(PAULIS, repeat=num_qubits)][1:]
+
+def depolarizing(p: float, num_qubits: int = 1) -> tuple[list[str], list[float]]:
+    """
+    Depolarizing channel, each of the 4^n - 1 non-identity Paulis with probability p / (4^n - 1).
+
+    Args:
+        p (float): Total error probability.
+        num_qubits (int): Number of qubits.
+
+    Returns:
+        tuple[list[str], list[float]]: Channel, see pauli_channel.
+    """
+    errors = _non_identity(num_qubits)
+    return pauli_channel({error: p/len(errors) for error in errors})
+
+def biased(p: float, bias: float, num_qubits: int = 1) -> tuple[list[str], list[float]]:
+    """
+    Z-biased Pauli channel: the errors made of Z and identities share p bias / (bias + 1), the others share the rest
+    evenly. On one qubit, p_Z / (p_X + p_Y) = bias, and bias = 1/2 is depolarizing.
+
+    Args:
+        p (float): Total error probability.
+        bias (float): Bias towards Z errors, inf for pure dephasing.
+        num_qubits (int): Number of qubits.
+
+    Returns:
+        tuple[list[str], list[float]]: Channel, see pauli_channel.
+
+    Example:
+        >>> biased(0.012, 5)
+        (['-', 'X', 'Y', 'Z'], [0.988, 0.001, 0.001, 0.01])
+    """
+    errors = _non_identity(num_qubits)
+    dephasing = [error for error in errors if set(error) <= set('-Z')]
+    p_z = p if np.isinf(bias) else p * bias / (bias + 1)
+    return pauli_channel({error: p_z/len(dephasing) if error in dephasing else (p - p_z)/(len(errors) - len(dephasing))
+                          for error in errors})
+
+def _alias_table(probabilities: list[float]) -> tuple[np.ndarray, np.ndarray]:
+    # Vose's alias method: column k keeps k with probability prob[k], otherwise gives alias[k]
+    k = len(probabilities)
+    scaled = np.array(probabilities, dtype=float) * k / sum(probabilities)
+    prob, alias = np.ones(k), np.arange(k)
+    small = [i for i in range(k) if scaled[i] < 1]
+    large = [i for i in range(k) if scaled[i] >= 1]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s], alias[s] = scaled[s], l
+        scaled[l] -= 1 - scaled[s]
+        (small if scaled[l] < 1 else large).append(l)
+    return prob, alias
+
+class CompiledNoise:
+    """
+    Noise locations of a gate sequence with the sampling tables of their channels.
+
+    Attributes:
+        locations (list[tuple]): One (gate index, before gate, qubits, errors, probabilities) per location, in
+            circuit order, the format of tool.noisy_sim.get_noise_locations. Measurement noise is applied before the
+            Meas gate (before gate True).
+        method (str): 'alias' (one uniform draw and two lookups per location) or 'cumulative' (thresholds on the
+            cumulative probabilities, the draws of tool.noisy_sim.sample_noise_events).
+    """
+
+    def __init__(self, locations: list[tuple], method: str = 'alias'):
+        if method not in ('alias', 'cumulative'):
+            raise ValueError(f"method should be 'alias' or 'cumulative', got {method}")
+        self.locations = locations
+        self.method = method
+        # one table per distinct channel
+        channels, self._channel_index = {}, np.zeros(len(locations), dtype=np.intp)
+        for j, (_, _, _, errors, probs) in enumerate(locations):
+            self._channel_index[j] = channels.setdefault((tuple(errors), tuple(probs)), len(channels))
+        max_errors = max((len(probs) for _, probs in channels), default=1)
+        self._sizes = np.array([len(probs) for _, probs in channels], dtype=np.intp)
+        if method == 'cumulative':
+            self._thresholds = np.ones([len(channels), max_errors])
+            for c, (_, probs) in enumerate(channels):
+                self._thresholds[c, :len(probs)] = np.cumsum(probs)
+                # a cumulative sum slightly below 1 must not select an error past the channel's last one
+                self._thresholds[c, len(probs) - 1:] = np.inf
+        else:
+            self._prob = np.ones([len(channels), max_errors])
+            self._alias = np.zeros([len(channels), max_errors], dtype=np.uint8)
+            for c, (_, probs) in enumerate(channels):
+                self._prob[c, :len(probs)], self._alias[c, :len(probs)] = _alias_table(probs)
+        self._error_bits = {}
+
+    def sample(self, num_shots: int, rng: np.random.Generator) -> np.ndarray:
+        """
+        Sample which error happens at every location for every shot, in one draw.
+
+        Args:
+            num_shots (int): Number of shots.
+            rng (numpy.random.Generator): Random number generator.
+
+        Returns:
+            numpy.ndarray: uint8 array (num_shots x num_locations) of error indices, 0 meaning no error.
+        """
+        if len(self.locations) == 0:
+            return np.zeros([num_shots, 0], dtype=np.uint8)
+        draws = rng.random([num_shots, len(self.locations)])
+        if self.method == 'cumulative':
+            return (draws[..., None] >= self._thresholds[self._channel_index]).sum(-1).astype(np.uint8)
+        sizes = self._sizes[self._channel_index]
+        draws *= sizes
+        columns = np.minimum(draws.astype(np.intp), sizes - 1)
+        draws -= columns
+        keep = draws < self._prob[self._channel_index, columns]
+        return np.where(keep, columns, self._alias[self._channel_index, columns]).astype(np.uint8)
+
+    def error_bits(self, j: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        X and Z bits of the errors of location j.
+
+        Args:
+            j (int): Location index.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: uint8 arrays (num_errors x num_qubits of the location), indexed by the
+                error indices of sample.
+        """
+        if j not in self._error_bits:
+            codes = np.array([[PAULIS.index(p) for p in error] for error in self.locations[j][3]])
+            self._error_bits[j] = ((codes == 1) | (codes == 2)).astype(np.uint8), (codes >= 2).astype(np.uint8)
+        return self._error_bits[j]
+
+class NoiseModel:
+    """
+    Pauli channels by gate and qubits, and readout flip probabilities by qubit.
+
+    Example:
+        >>> model = NoiseModel()
+        >>> model.add_gate_noise(biased(1e-3, 10))                   # every single-qubit gate
+        >>> model.add_gate_noise(pauli_channel({'ZZ': 5e-3, 'XX': 1e-3}), 'CX')
+        >>> model.add_gate_noise(depolarizing(2e-2, 2), 'CX', (3, 4))  # a bad coupler
+        >>> model.add_measurement_noise(1e-2)
+        >>> compiled = model.compile(gate_sequence)
+        >>> events = compiled.sample(10000, np.random.default_rng(0))
+    """
+
+    def __init__(self):
+        self._gate_noise = {}
+        self._meas_noise = {}
+        self._compiled = {}
+
+    def add_gate_noise(self, channel: tuple[list[str], list[float]], gates=None, qubits=None) -> None:
+        """
+        Apply a channel after gates, replacing a less specific rule.
+
+        Args:
+            channel (tuple[list[str], list[float]]): Channel (pauli_channel, depolarizing, biased).
+            gates (str or list[str]): Gate names, None for every gate on as many qubits as the channel (not Meas).
+            qubits (tuple[int] or list[tuple[int]]): Qubits of the gate in order, or a list of them, None for any.
+        """
+        num_qubits = len(channel[0][0])
+        gates = [gates] if gates is None or isinstance(gates, str) else list(gates)
+        qubits = [qubits] if qubits is None or np.ndim(qubits[0]) == 0 else list(qubits)
+        for pos in qubits:
+            if pos is not None and len(pos) != num_qubits:
+                raise ValueError(f'channel on {num_qubits} qubits applied to qubits {pos}')
+            for gate in gates:
+                self._gate_noise[gate, None if pos is None else tuple(pos), num_qubits] = channel
+        self._compiled.clear()
+
+    def add_measurement_noise(self, p: float, qubits=None) -> None:
+        """
+        Flip the outcome of measurements with probability p (an X error before the Meas gate).
+
+        Args:
+            p (float): Flip probability.
+            qubits (int or list[int]): Measured qubits, None for all.
+        """
+        for qubit in [qubits] if qubits is None or np.ndim(qubits) == 0 else qubits:
+            self._meas_noise[qubit] = float(p)
+        self._compiled.clear()
+
+    def channel(self, gate: str, qubits: tuple[int]):
+        """
+        Channel after a gate, None if noiseless.
+
+        Args:
+            gate (str): Gate name.
+            qubits (tuple[int]): Qubits of the gate.
+
+        Returns:
+            tuple[list[str], list[float]]: Channel of the most specific rule, or None.
+        """
+        if gate == 'Meas':
+            return None
+        qubits = tuple(qubits)
+        for key in [(gate, qubits), (gate, None), (None, qubits), (None, None)]:
+            channel = self._gate_noise.get(key + (len(qubits),))
+            if channel is not None:
+                return channel
+        return None
+
+    def measurement_probability(self, qubit: int) -> float:
+        """
+        Readout flip probability of a qubit.
+        """
+        return self._meas_noise.get(qubit, self._meas_noise.get(None, 0.))
+
+    def locations(self, gate_sequence: list[tuple[str, tuple[int]]]) -> list[tuple]:
+        """
+        Noise locations of a gate sequence, in circuit order, skipping noiseless gates.
+
+        Args:
+            gate_sequence (list[tuple[str, tuple[int]]]): List of gates and their positions.
+
+        Returns:
+            list[tuple]: (gate index, before gate, qubits, errors, probabilities) per location, see CompiledNoise.
+        """
+        locations = []
+        for i, (gate, pos) in enumerate(gate_sequence):
+            if gate == 'Meas':
+                p = self.measurement_probability(pos[0])
+                if p > 0:
+                    locations.append((i, True, (pos[0],), ['-', 'X'], [1 - p, p]))
+                continue
+            channel = self.channel(gate, pos)
+            if channel is not None and channel[1][0] < 1:
+                locations.append((i, False, tuple(pos), channel[0], channel[1]))
+        return locations
+
+    def compile(self, gate_sequence: list[tuple[str, tuple[int]]], method: str = 'alias') -> CompiledNoise:
+        """
+        Noise locations and sampling tables of a gate sequence, cached until the model changes.
+
+        Args:
+            gate_sequence (list[tuple[str, tuple[int]]]): List of gates and their positions.
+            method (str): Sampling method, see CompiledNoise.
+
+        Returns:
+            CompiledNoise: Compiled noise.
+        """
+        key = (tuple((gate, tuple(pos)) for gate, pos in gate_sequence), method)
+        if key not in self._compiled:
+            self._compiled[key] = CompiledNoise(self.locations(gate_sequence), method)
+        return self._compiled[key]
+
+    @classmethod
+    def from_legacy(cls, num_qubits: int, noise_1q=None, noise_2q=None, meas_noise=None,
+                    noise_prob_1q=0., noise_prob_2q=0.) -> 'NoiseModel':
+        """
+        Model of the noise arguments of tool.noisy_sim.run_noisy_stabilizer_circuit, with the same locations
+        (apart from zero-probability ones) and errors in the same order.
+
+        Args:
+            num_qubits (int): Number of qubits.
+            noise_1q, noise_2q, meas_noise, noise_prob_1q, noise_prob_2q: See run_noisy_stabilizer_circuit.
+
+        Returns:
+            NoiseModel: The model.
+        """
+        def channel(errors, noise_prob, name):
+            if np.ndim(noise_prob) == 0:
+                return pauli_channel({error: noise_prob/len(errors) for error in errors})
+            if len(noise_prob) != len(errors):
+                raise ValueError(f'{name} should be a float or a list of appropriate length')
+            return pauli_channel(dict(zip(errors, noise_prob)))
+
+        model = cls()
+        if noise_1q:
+            model.add_gate_noise(channel(list(noise_1q), noise_prob_1q, 'noise_prob_1q'))
+        if noise_2q:
+            # same order as get_noise_locations
+            errors = [''.join(err)[::-1] for err in itertools.product('-'+noise_2q, repeat=2)][1:]
+            model.add_gate_noise(channel(errors, noise_prob_2q, 'noise_prob_2q'))
+        if meas_noise:
+            if np.ndim(meas_noise) == 0:
+                model.add_measurement_noise(meas_noise)
+            elif len(meas_noise) == num_qubits:
+                for qubit, p in enumerate(meas_noise):
+                    model.add_measurement_noise(p, qubit)
+            else:
+                raise ValueError('meas_noise should be a float or a list of appropriate length')
+        return model
+
+
+############################## TESTING ##############################
+def test_noise_model():
+    """
+    Test the rule precedence of a heterogeneous model and that the legacy arguments give the locations of
+    tool.noisy_sim.get_noise_locations.
+    """
+    from tool.noisy_sim import get_noise_locations
+    gate_sequence = [('H', (0,)), ('CX', (0, 1)), ('CX', (3, 4)), ('CZ', (1, 2)), ('S', (2,)), ('Meas', (1, 0)),
+                     ('Meas', (4, 1))]
+    model = NoiseModel()
+    model.add_gate_noise(biased(1e-3, 10))
+    model.add_gate_noise(pauli_channel({'ZZ': 5e-3}), 'CX')
+    model.add_gate_noise(depolarizing(2e-2, 2), 'CX', (3, 4))
+    model.add_gate_noise(pauli_channel({'X': 1e-2}), qubits=(2,))
+    model.add_measurement_noise(1e-2)
+    model.add_measurement_noise(0., 4)
+    legacy = ('XYZ', 'XZ', [0.01, 0, 0, 0, 0.02], [0.001, 0.002, 0.003], 0.01)
+    expected = get_noise_locations(gate_sequence, 5, *legacy)
+    test_cases = {
+        'precedence': [(0, '-,X,Y,Z'), (1, '--,ZZ'), (2, 16), (4, '-,X'), (5, 0.01)],
+        'legacy': True,
+    }
+    def test_func(name):
+        if name == 'precedence':
+            return [(i, probs[1]) if before else (i, ','.join(errors) if len(errors) <= 4 else len(errors))
+                    for i, before, _, errors, probs in model.locations(gate_sequence)]
+        return [(i, b, q, list(e), list(np.round(p, 12))) for i, b, q, e, p in
+                NoiseModel.from_legacy(5, *legacy).locations(gate_sequence)] == \
+               [(i, b, q, list(e), list(np.round(p, 12))) for i, b, q, e, p in expected if p[0] < 1]
+    run_test(test_cases, test_func, 'noise_model')
+
+def test_compiled_noise():
+    """
+    Test the empirical frequencies of the alias tables, that the cumulative tables reproduce the draws of
+    tool.noisy_sim.sample_noise_events before it used them (frozen below), so that existing seeds are unchanged, and
+    that their largest draw stays within a channel narrower than the widest one.
+    """
+    class LargestDraw:
+        def random(self, shape):
+            return np.full(shape, np.nextafter(1., 0.))
+    from tool.noisy_sim import get_noise_locations
+    locations = NoiseModel.from_legacy(2, 'XYZ', 'XYZ', 0.3, [0.1, 0.2, 0.3], 0.3).locations(
+        [('H', (0,)), ('CX', (0, 1)), ('Meas', (1, 0))])
+    num_shots = 200000
+    events = CompiledNoise(locations).sample(num_shots, np.random.default_rng(0))
+    legacy = get_noise_locations([('H', (0,)), ('CX', (0, 1)), ('Meas', (1, 0))], 2, 'XYZ', 'XYZ', 0.3,
+                                 [0.1, 0.2, 0.3], 0.3)
+    test_cases = {
+        'freq_1q': (0.4, 0.1, 0.2, 0.3),
+        'freq_2q': tuple([0.7] + [0.02]*15),
+        'freq_meas': (0.7, 0.3),
+        'cumulative': True,
+        'largest draw': (9, 15),
+    }
+    # cumsum([0.1]*10)[-1] < 1, next to a two-qubit channel with 16 errors
+    short = (0, False, (0,), ['-'] + list('XYZ')*3, [0.1]*10)
+    outputs = {
+        'freq_1q': tuple(np.round(np.bincount(events[:, 0], minlength=4) / num_shots, 2)),
+        'freq_2q': tuple(np.round(np.bincount(events[:, 1], minlength=16) / num_shots, 2)),
+        'freq_meas': tuple(np.round(np.bincount(events[:, 2], minlength=2) / num_shots, 2)),
+        'cumulative': CompiledNoise(legacy, 'cumulative').sample(12, np.random.default_rng(4)).T.tolist() ==
+                      [[3, 0, 3, 2, 1, 0, 0, 3, 1, 3, 2, 2], [0, 0, 0, 11, 5, 14, 0, 0, 0, 0, 0, 0],
+                       [1, 0, 1, 0, 1, 1, 1, 0, 0, 0, 1, 1]],
+        'largest draw': tuple(CompiledNoise([short, legacy[1]], 'cumulative').sample(1, LargestDraw())[0]),
+    }
+    run_test(test_cases, lambda name: outputs[name], 'compiled_noise')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_noise_model()
+    test_compiled_noise()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
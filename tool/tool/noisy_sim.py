@@ -0,0 +1,1201 @@
+from __future__ import annotations
+import itertools
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from typing import TYPE_CHECKING
+from tool import qec
+from tool.check_encoding import qulacs, gatedict, compile_stabilizer_circuit
+from tool.catalog import ResultsCatalog
+from tool.noise_model import NoiseModel, CompiledNoise
+from tool.testing import run_test
+if TYPE_CHECKING:
+    from qulacs import QuantumState, QuantumCircuit
+    from qulacs.gate import DenseMatrix
+
+"""
+Noisy simulation of stabilizer circuits with qulacs (moved from the figures_of_merit notebook).
+
+Methods:
+    run_noisy_stabilizer_circuit(...): Run a gate sequence with Pauli noise after gates and before measurements.
+    get_noise_locations(...): List the noise locations of a gate sequence with their Pauli channels.
+    sample_noise_events(...): Pre-sample the Pauli errors of every shot at every noise location.
+    compile_noise(...): Noise locations and sampling tables from the noise arguments or a NoiseModel.
+    run_noisy_stabilizer_circuit_parallel(...): Seeded shot-parallel version over a process pool.
+    run_noisy_frames(...): Vectorized Pauli-frame version, without state vectors per shot.
+    tableau_reference(...): Measurements and Pauli observables of the noiseless run of a Clifford gate sequence.
+    pack_observables(...): Bit-packed Paulis and coefficients of single-term observables.
+    frame_observables(...): Observable values of all shots from their Pauli frames, in one operation.
+    vector_observables(...), state_observables(...): Observable values of state vectors, batched over observables.
+    error_distribution(...): Observables and lowest-weight equivalents of every data error, kept in the results catalog.
+    test_all(): Runs all the test methods.
+"""
+
+gate_dict = {
+    '-': lambda q: qulacs.gate.Identity(q),
+    'X': lambda q: qulacs.gate.X(q),
+    'Y': lambda q: qulacs.gate.Y(q),
+    'Z': lambda q: qulacs.gate.Z(q),
+}
+
+def common_gate(gatename: str) -> np.ndarray:
+    """
+    Get the single-qubit Pauli matrix based on the gate name.
+
+    Args:
+        gatename (str): '-', 'X', 'Y' or 'Z'.
+
+    Returns:
+        numpy.ndarray: Gate matrix.
+    """
+    gate_dict = {
+        '-': np.eye(2),
+        'X': np.array([[0,1],[1,0]]),
+        'Y': np.array([[0,-1j],[1j,0]]),
+        'Z': np.array([[1,0],[0,-1]]),
+    }
+    return gate_dict[gatename]
+
+def weight2_Pauli(pstr: str, qubits: tuple[int]) -> DenseMatrix:
+    """
+    Two-qubit Pauli as a dense matrix gate.
+    Note that qulacs takes the first target as the least significant qubit,
+    so pstr[0] acts on qubits[1] and pstr[1] on qubits[0].
+
+    Args:
+        pstr (str): Two-qubit Pauli string.
+        qubits (tuple[int]): Target qubits.
+
+    Returns:
+        DenseMatrix: The gate.
+    """
+    mat_gate = qulacs.gate.DenseMatrix(qubits,np.kron(common_gate(pstr[0]),common_gate(pstr[1])))
+    return mat_gate
+
+def get_prob_list(noise_prob, num_errors: int, name: str) -> list[float]:
+    """
+    Probabilities of [no error, error 1, ..., error num_errors].
+
+    Args:
+        noise_prob (float or list[float]): Total error probability (split evenly) or one probability per error.
+        num_errors (int): Number of non-trivial errors.
+        name (str): Name of the argument for the error message.
+
+    Returns:
+        list[float]: Probabilities.
+    """
+    if type(noise_prob) == float:
+        return [1-noise_prob] + [noise_prob/num_errors]*num_errors
+    elif len(noise_prob) == num_errors:
+        return [1-sum(noise_prob)] + list(noise_prob)
+    else:
+        raise ValueError(f'{name} should be a float or a list of appropriate length')
+
+def get_noise_locations(
+        gate_sequence: list[tuple[str, tuple[int]]],
+        num_qubits: int,
+        noise_1q = None,
+        noise_2q = None,
+        meas_noise = None,
+        noise_prob_1q = 0.,
+        noise_prob_2q = 0.,
+        ) -> list[tuple]:
+    """
+    List the noise locations of a gate sequence, in circuit order.
+
+    Args:
+        gate_sequence (list[tuple[str, tuple[int]]]): List of gates and their positions.
+        num_qubits (int): Number of qubits in the circuit.
+        noise_1q, noise_2q, meas_noise, noise_prob_1q, noise_prob_2q: See run_noisy_stabilizer_circuit.
+
+    Returns:
+        list[tuple]: One (gate index, before gate, qubits, errors, probabilities) per location, where
+            errors[k] is a Pauli string on `qubits` with errors[0] the identity,
+            before gate is True for measurement noise (applied before the Meas gate).
+    """
+    if noise_1q:
+        errors_1q = list('-'+noise_1q)
+        prob_list_1q = get_prob_list(noise_prob_1q, len(errors_1q)-1, 'noise_prob_1q')
+    if noise_2q:
+        # match weight2_Pauli: the first letter acts on the second qubit
+        errors_2q = [''.join(err)[::-1] for err in itertools.product('-'+noise_2q,repeat=2)]
+        prob_list_2q = get_prob_list(noise_prob_2q, len(errors_2q)-1, 'noise_prob_2q')
+    if meas_noise:
+        if type(meas_noise) == float:
+            prob_list_meas = [[1-meas_noise, meas_noise]]*num_qubits
+        elif len(meas_noise) == num_qubits:
+            prob_list_meas = [[1-p,p] for p in meas_noise]
+        else:
+            raise ValueError('meas_noise should be a float or a list of appropriate length')
+
+    locations = []
+    for i, (gate, pos) in enumerate(gate_sequence):
+        if meas_noise and gate == 'Meas':
+            locations.append((i, True, (pos[0],), ['-', 'X'], prob_list_meas[pos[0]]))
+        if noise_1q and len(pos) == 1:
+            locations.append((i, False, tuple(pos), errors_1q, prob_list_1q))
+        if noise_2q and len(pos) == 2 and gate != 'Meas':
+            locations.append((i, False, tuple(pos), errors_2q, prob_list_2q))
+    return locations
+
+def sample_noise_events(locations: list[tuple], num_shots: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Pre-sample which error happens at every noise location for every shot, in one draw.
+
+    Args:
+        locations (list[tuple]): Noise locations from get_noise_locations.
+        num_shots (int): Number of shots.
+        rng (numpy.random.Generator): Random number generator.
+
+    Returns:
+        numpy.ndarray: uint8 array (num_shots x num_locations) of error indices, 0 meaning no error.
+    """
+    return CompiledNoise(locations, 'cumulative').sample(num_shots, rng)
+
+def compile_noise(
+        gate_sequence: list[tuple[str, tuple[int]]],
+        num_qubits: int,
+        noise_args: tuple = (),
+        noise_model: NoiseModel = None,
+        ) -> CompiledNoise:
+    """
+    Noise locations of a gate sequence with their sampling tables.
+
+    Args:
+        gate_sequence (list[tuple[str, tuple[int]]]): List of gates and their positions.
+        num_qubits (int): Number of qubits in the circuit.
+        noise_args (tuple): (noise_1q, noise_2q, meas_noise, noise_prob_1q, noise_prob_2q), see
+            run_noisy_stabilizer_circuit.
+        noise_model (tool.noise_model.NoiseModel): If given, replaces noise_args and samples with alias tables.
+
+    Returns:
+        CompiledNoise: The locations of get_noise_locations sampled as sample_noise_events, or those of the model.
+    """
+    if noise_model is not None:
+        return noise_model.compile(gate_sequence)
+    return CompiledNoise(get_noise_locations(gate_sequence, num_qubits, *noise_args), 'cumulative')
+
+def _noiseless_is_deterministic(gate_sequence: list[tuple[str, tuple[int]]], num_qubits: int) -> bool:
+    """
+    Whether every measurement of the noiseless circuit has a deterministic outcome.
+    The noiseless circuit is then deterministic, so a single run represents every error-free shot.
+    """
+    state = qulacs.QuantumState(num_qubits)
+    state.set_zero_state()
+    circuit = qulacs.QuantumCircuit(num_qubits)
+    for gate, pos in gate_sequence:
+        if gate == 'Meas':
+            circuit.update_quantum_state(state)
+            circuit = qulacs.QuantumCircuit(num_qubits)
+            p0 = state.get_zero_probability(pos[0])
+            if min(p0, 1-p0) > 1e-10:
+                return False
+        circuit.add_gate(gatedict[gate](*pos))
+        if gate == 'Meas':
+            Reset = qulacs.gate.Adaptive(qulacs.gate.X(pos[0]), lambda register, i=pos[1]: register[i] == 1)
+            circuit.add_gate(Reset)
+    return True
+
+def _error_map(locations: list[tuple], events: np.ndarray) -> dict:
+    """
+    Group the non-identity errors of one error pattern by (gate index, before gate).
+    """
+    errors_at = {}
+    for j in np.flatnonzero(events):
+        gate_ind, before, qubits, errors, _ = locations[j]
+        errors_at.setdefault((gate_ind, before), []).append((qubits, errors[events[j]]))
+    return errors_at
+
+def _build_circuit(gate_sequence: list[tuple[str, tuple[int]]], num_qubits: int, errors_at: dict,
+                   split_measurements: bool = False):
+    """
+    Build the circuit of a gate sequence with the given errors inserted as single-qubit Paulis.
+    With split_measurements, return the list of (circuit segment, Meas position or None) instead, 
+    leaving the measurements (and resets) to the caller.
+    """
+    def add_errors(circuit, key):
+        for qubits, error in errors_at.get(key, []):
+            for q, p in zip(qubits, error):
+                if p != '-':
+                    circuit.add_gate(gate_dict[p](q))
+
+    segments = []
+    circuit = qulacs.QuantumCircuit(num_qubits)
+    for i, (gate, pos) in enumerate(gate_sequence):
+        add_errors(circuit, (i, True))
+        if split_measurements and gate == 'Meas':
+            segments.append((circuit, tuple(pos)))
+            circuit = qulacs.QuantumCircuit(num_qubits)
+        else:
+            circuit.add_gate(gatedict[gate](*pos))
+        add_errors(circuit, (i, False))
+        if gate == 'Meas' and not split_measurements:
+            Reset = qulacs.gate.Adaptive(qulacs.gate.X(pos[0]), lambda register, i=pos[1]: register[i] == 1)
+            circuit.add_gate(Reset) # assume perfect reset
+    if split_measurements:
+        segments.append((circuit, None))
+        return segments
+    return circuit
+
+def _sparse_noisy_circuit(gate_sequence: list[tuple[str, tuple[int]]], num_qubits: int,
+                          locations: list[tuple], events: np.ndarray) -> QuantumCircuit:
+    """
+    Build the circuit of one error pattern, inserting only its non-identity Paulis.
+    """
+    return _build_circuit(gate_sequence, num_qubits, _error_map(locations, events))
+
+def _run_segments(segments: list[tuple], state: QuantumState, rng: np.random.Generator) -> None:
+    """
+    Run circuit segments from the zero state, drawing the measurement outcomes from rng
+    (qulacs' own measurement randomness cannot be seeded). Measured qubits are reset.
+    """
+    state.set_zero_state()
+    for circuit, meas in segments:
+        circuit.update_quantum_state(state)
+        if meas is None:
+            continue
+        qubit, register = meas
+        outcome = int(rng.random() >= state.get_zero_probability(qubit))
+        (qulacs.gate.P1 if outcome else qulacs.gate.P0)(qubit).update_quantum_state(state)
+        state.normalize(state.get_squared_norm())
+        state.set_classical_value(register, outcome)
+        if outcome:
+            qulacs.gate.X(qubit).update_quantum_state(state)
+
+def run_noisy_stabilizer_circuit(
+        gate_sequence: list[tuple[str, tuple[int]]],
+        num_qubits: int,
+        num_meas: int,
+        num_shots: int,
+        observables: list,
+        noise_1q = None, # eg: 'X' is bit-flip noise, 'Z' is phase-flip noise
+        noise_2q = None,
+        meas_noise = None,
+        noise_prob_1q = 0.,
+        noise_prob_2q = 0.,
+        verbose: bool = False,
+        presample: bool = False,
+        seed: int = None,
+        noise_model: NoiseModel = None,
+        ):
+    '''
+    Currently assuming perfect reset
+
+    With presample=True, the errors of all shots are sampled up front (sample_noise_events).
+    Error-free shots run the bare circuit, and share a single result (same state object)
+    when the noiseless circuit is deterministic. The other shots only get their non-identity
+    Paulis inserted, with one circuit per distinct error pattern.
+
+    The observables are evaluated in one batch per run (state_observables). Circuits whose noiseless
+    measurements are deterministic can skip the state vectors altogether with run_noisy_frames.
+
+    A tool.noise_model.NoiseModel (per-gate and per-qubit channels) replaces the noise_* arguments, and implies
+    presample. So does a seed, since the noise and measurements of qulacs' Probabilistic gates cannot be seeded:
+    the errors and the measurement outcomes (_run_segments) are then both drawn from the seeded generator.
+    '''
+    if presample or noise_model is not None or seed is not None:
+        return _run_presampled(gate_sequence, num_qubits, num_meas, num_shots, observables,
+                               noise_1q, noise_2q, meas_noise, noise_prob_1q, noise_prob_2q, seed, verbose,
+                               noise_model)
+
+    if noise_1q:
+        op_func_1q = lambda q: [gate_dict[op](q) for op in '-'+noise_1q]
+        prob_list_1q = get_prob_list(noise_prob_1q, len(noise_1q), 'noise_prob_1q')
+
+    if noise_2q:
+        op_func_2q = lambda qs: [weight2_Pauli(''.join(err),qs) for err in itertools.product('-'+noise_2q,repeat=2)]
+        prob_list_2q = get_prob_list(noise_prob_2q, (len(noise_2q)+1)**2-1, 'noise_prob_2q')
+
+    if meas_noise:
+        op_func_meas = lambda q: [gate_dict[op](q) for op in '-X']
+        if type(meas_noise) == float:
+            prob_list_meas = [[1-meas_noise, meas_noise]]*num_qubits
+        elif len(meas_noise) == num_qubits:
+            prob_list_meas = [[1-p,p] for p in meas_noise]
+        else:
+            raise ValueError('meas_noise should be a float or a list of appropriate length')
+
+    # Construct circuit
+    circuit = qulacs.QuantumCircuit(num_qubits)
+    for gate, pos in gate_sequence:
+        # Add measurement noise
+        if meas_noise and gate == 'Meas':
+            circuit.add_gate(qulacs.gate.Probabilistic(prob_list_meas[pos[0]], op_func_meas(pos[0])))
+        # Add gate or measurement
+        circuit.add_gate(gatedict[gate](*pos))
+        # Add gate noise
+        if noise_1q and len(pos) == 1:
+            circuit.add_gate(qulacs.gate.Probabilistic(prob_list_1q, op_func_1q(pos[0])))
+        if noise_2q and len(pos) == 2 and gate != 'Meas':
+            circuit.add_gate(qulacs.gate.Probabilistic(prob_list_2q, op_func_2q(pos)))
+        # reset qubit manually at each Measurement
+        if gate == 'Meas':
+            Reset = qulacs.gate.Adaptive(qulacs.gate.X(pos[0]), lambda register, i=pos[1]: register[i] == 1)
+            circuit.add_gate(Reset) # assume perfect reset
+
+    # Run circuit
+    measurements = []
+    states = []
+    for _ in range(num_shots):
+        state = qulacs.QuantumState(num_qubits)
+        state.set_zero_state()
+        circuit.update_quantum_state(state)
+        measurements.append([state.get_classical_value(i) for i in range(num_meas)])
+        states.append(state)
+    obs_results = state_observables(states, observables)
+
+    return states, obs_results, np.array(measurements)
+
+def _run_presampled(gate_sequence, num_qubits, num_meas, num_shots, observables,
+                    noise_1q, noise_2q, meas_noise, noise_prob_1q, noise_prob_2q, seed, verbose, noise_model=None):
+    """
+    Presampled sparse-noise version of run_noisy_stabilizer_circuit. With a seed, the measurement outcomes are drawn
+    from the same generator as the errors, instead of qulacs' unseeded Measurement gates.
+    """
+    noise = compile_noise(gate_sequence, num_qubits, (noise_1q, noise_2q, meas_noise, noise_prob_1q, noise_prob_2q),
+                          noise_model)
+    locations = noise.locations
+    rng = np.random.default_rng(seed)
+    events = noise.sample(num_shots, rng)
+    patterns, pattern_inds = np.unique(events, axis=0, return_inverse=True)
+    pattern_inds = pattern_inds.reshape(-1)
+    error_free = np.flatnonzero(~patterns.any(axis=1))
+    deterministic = len(error_free) > 0 and _noiseless_is_deterministic(gate_sequence, num_qubits)
+    if verbose:
+        print(f'{len(locations)} noise locations, {(pattern_inds == error_free[0]).sum() if len(error_free) else 0}'
+              f'/{num_shots} error-free shots, {len(patterns)} distinct error patterns')
+
+    def run(circuit):
+        state = qulacs.QuantumState(num_qubits)
+        if seed is None:
+            state.set_zero_state()
+            circuit.update_quantum_state(state)
+        else:
+            _run_segments(circuit, state, rng)
+        return state, [state.get_classical_value(i) for i in range(num_meas)]
+
+    states = [None] * num_shots
+    measurements = [None] * num_shots
+    for k, pattern in enumerate(patterns):
+        shots = np.flatnonzero(pattern_inds == k)
+        if seed is not None:
+            circuit = _build_circuit(gate_sequence, num_qubits, _error_map(locations, pattern), split_measurements=True)
+        elif not pattern.any():
+            circuit = compile_stabilizer_circuit(gate_sequence, num_qubits)
+        else:
+            circuit = _sparse_noisy_circuit(gate_sequence, num_qubits, locations, pattern)
+        result = run(circuit) if deterministic and not pattern.any() else None
+        for shot in shots:
+            states[shot], measurements[shot] = result or run(circuit)
+
+    # error-free shots of a deterministic circuit share their state, which is evaluated once
+    return states, state_observables(states, observables), np.array(measurements)
+
+def build_observables(num_qubits: int, observable_specs: list[tuple[complex, str]]) -> list:
+    """
+    Build qulacs observables from (coefficient, Pauli string) specs, e.g. (1, 'Z 0 Z 1').
+    Specs are picklable, unlike qulacs observables, so they can be sent to worker processes.
+
+    Args:
+        num_qubits (int): Number of qubits.
+        observable_specs (list[tuple[complex, str]]): Coefficients and qulacs Pauli strings.
+
+    Returns:
+        list: [observable, label] pairs, as expected by run_noisy_stabilizer_circuit.
+    """
+    observables = []
+    for coef, obs_string in observable_specs:
+        obs = qulacs.Observable(num_qubits)
+        obs.add_operator(coef, obs_string)
+        observables.append([obs, obs_string.replace(' ', '')])
+    return observables
+
+def get_observable_specs(stabilizer_group: list[list[str]], num_data: int) -> list[tuple[complex, str]]:
+    """
+    Observable specs of the identity followed by every stabilizer group element on the data qubits.
+
+    Args:
+        stabilizer_group (list[list[str]]): Stabilizer group.
+        num_data (int): Number of data qubits.
+
+    Returns:
+        list[tuple[complex, str]]: Specs for build_observables.
+    """
+    specs = [(1, '')]
+    for elem in stabilizer_group:
+        obs_string = ''
+        Y_count = 0
+        for i in range(num_data):
+            if elem[i] != '-':
+                obs_string += f' {elem[i]} {i}'
+                if elem[i] == 'Y':
+                    Y_count += 1
+        # note that XZ = -iY
+        specs.append(((-1j)**Y_count, obs_string))
+    return specs
+
+_PAULI_IDS = {1: 'X', 2: 'Y', 3: 'Z'}
+
+def pack_observables(observables: list) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Bit-packed Pauli strings and coefficients of single-term observables.
+
+    Args:
+        observables (list): [observable, label] pairs (build_observables) or (coefficient, Pauli string) specs
+            (get_observable_specs), e.g. (1, 'Z 0 Z 1').
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Paulis of dtype qec.PAULI_DTYPE (bit q is qubit q) and complex coefficients.
+    """
+    paulis = np.zeros(len(observables), dtype=qec.PAULI_DTYPE)
+    coefs = np.zeros(len(observables), dtype=complex)
+    for k, observable in enumerate(observables):
+        if not hasattr(observable[0], 'get_term'):
+            coefs[k], tokens = observable[0], observable[1].split()
+            terms = zip(tokens[::2], map(int, tokens[1::2]))
+        else:
+            if observable[0].get_term_count() != 1:
+                raise ValueError('only single-term observables can be packed')
+            term = observable[0].get_term(0)
+            coefs[k] = term.get_coef()
+            terms = zip([_PAULI_IDS[i] for i in term.get_pauli_id_list()], term.get_index_list())
+        x, z = 0, 0
+        for pauli, qubit in terms:
+            x |= (pauli in 'XY') << qubit
+            z |= (pauli in 'YZ') << qubit
+        paulis[k] = (x, z)
+    return paulis, coefs
+
+def frame_observables(frames: np.ndarray, paulis: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """
+    Observable values of states that differ from a reference state by a Pauli frame: each value is the reference
+    value, negated when the frame anticommutes with the observable.
+
+    Args:
+        frames (np.ndarray): Pauli frames of the shots, dtype qec.PAULI_DTYPE.
+        paulis (np.ndarray): Observables, dtype qec.PAULI_DTYPE.
+        reference (np.ndarray): Observable values of the reference state.
+
+    Returns:
+        np.ndarray: (num_shots x num_observables) values, +-1 for the stabilizers of the reference state.
+    """
+    anticommute = (frames['x'][:, None] & paulis['z']) ^ (frames['z'][:, None] & paulis['x'])
+    return np.asarray(reference) * (1 - 2*(qec.popcount(anticommute) % 2))
+
+def vector_observables(vectors: np.ndarray, paulis: np.ndarray, coefs: np.ndarray) -> np.ndarray:
+    """
+    Expectation values <v|P|v> of Pauli observables on state vectors (qulacs ordering, bit q of the index is qubit q),
+    with one gather per distinct X part and a matrix product for all the Z parts sharing it.
+
+    Args:
+        vectors (np.ndarray): (num_states x 2^num_qubits) state vectors.
+        paulis (np.ndarray), coefs (np.ndarray): Observables from pack_observables.
+
+    Returns:
+        np.ndarray: (num_states x num_observables) complex expectation values.
+    """
+    vectors = np.asarray(vectors)
+    index = np.arange(vectors.shape[1], dtype=np.uint64)
+    values = np.zeros([len(vectors), len(paulis)], dtype=complex)
+    for x in np.unique(paulis['x']):
+        cols = np.flatnonzero(paulis['x'] == x)
+        # P|i> = i^(#Y) (-1)^|i & z| |i ^ x>
+        overlap = vectors[:, (index ^ x).astype(np.intp)].conj() * vectors
+        signs = 1 - 2*(qec.popcount(index[:, None] & paulis['z'][cols]) % 2)
+        values[:, cols] = overlap @ signs
+    return values * coefs * 1j**(qec.popcount(paulis['x'] & paulis['z']) % 4)
+
+def _real_if_hermitian(values: np.ndarray, observables: list) -> np.ndarray:
+    """Real part of observable values when every observable is Hermitian, as qulacs.Observable returns them."""
+    hermitian = all(obs.is_hermitian() if hasattr(obs, 'is_hermitian') else np.imag(obs) == 0
+                    for obs, _ in observables)
+    return values.real if hermitian else values
+
+def state_observables(states: list, observables: list) -> np.ndarray:
+    """
+    Observable values of qulacs states, as [[obs.get_expectation_value(state) for obs, _ in observables] for state
+    in states] but batched. States appearing several times (shared error-free results) are read once.
+
+    Args:
+        states (list[QuantumState]): States.
+        observables (list): [observable, label] pairs or specs, see pack_observables.
+
+    Returns:
+        np.ndarray: (num_states x num_observables) values, real when every observable is Hermitian.
+    """
+    if any(hasattr(obs, 'get_term_count') and obs.get_term_count() != 1 for obs, _ in observables):
+        values = np.array([[obs.get_expectation_value(state) for obs, _ in observables] for state in states])
+        return _real_if_hermitian(values.reshape(len(states), len(observables)), observables)
+    distinct = {}
+    rows = [distinct.setdefault(id(state), len(distinct)) for state in states]
+    unique_states = {id(state): state for state in states}
+    if not distinct:
+        return _real_if_hermitian(np.zeros([0, len(observables)], dtype=complex), observables)
+    vectors = np.stack([unique_states[key].get_vector() for key in distinct])
+    return _real_if_hermitian(vector_observables(vectors, *pack_observables(observables))[rows], observables)
+
+def _random_bits(rng: np.random.Generator, size: int, mask: int) -> np.ndarray:
+    """Uniformly random uint64 values restricted to the bits of mask."""
+    return rng.integers(0, 2**64 - 1, size, dtype=np.uint64, endpoint=True) & np.uint64(mask)
+
+def propagate_frames(
+        gate_sequence: list[tuple[str, tuple[int]]],
+        num_meas: int,
+        locations: list[tuple],
+        events: np.ndarray,
+        rng: np.random.Generator = None,
+        num_qubits: int = None,
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Propagate the sampled errors of all shots through a Clifford gate sequence at once, as Pauli frames.
+    A measurement is flipped by the X part of the frame on its qubit, and the perfect reset clears the qubit.
+    With rng, the Z part of the frame is randomized wherever a qubit is prepared in |0> (at the start and after every
+    reset), which leaves the state unchanged but makes the measurements that are random in the noiseless circuit
+    random, with the right correlations, relative to one reference run.
+
+    Args:
+        gate_sequence (list[tuple[str, tuple[int]]]): List of gates ('H', 'S', 'CX', 'CZ', 'Meas') and positions.
+        num_meas (int): Number of measurement registers.
+        locations (list[tuple]): Noise locations from get_noise_locations.
+        events (np.ndarray): Error indices from sample_noise_events.
+        rng (numpy.random.Generator): Random number generator of the Z randomization, None for none.
+        num_qubits (int): Number of qubits, required with rng.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Final frames (dtype qec.PAULI_DTYPE) and uint8 measurement flips
+            (num_shots x num_meas).
+    """
+    frames = np.zeros(len(events), dtype=qec.PAULI_DTYPE)
+    flips = np.zeros([len(events), num_meas], dtype=np.uint8)
+    at = {}
+    for j, (gate_ind, before, qubits, errors, _) in enumerate(locations):
+        packed = qec.pack_paulis([''.join(error[qubits.index(q)] if q in qubits else '-'
+                                          for q in range(max(qubits) + 1)) for error in errors])
+        at.setdefault((gate_ind, before), []).append((j, packed))
+    def add_errors(key):
+        for j, packed in at.get(key, []):
+            frames['x'] ^= packed['x'][events[:, j]]
+            frames['z'] ^= packed['z'][events[:, j]]
+
+    one = np.uint64(1)
+    if rng is not None:
+        frames['z'] = _random_bits(rng, len(events), (1 << num_qubits) - 1)
+    for i, (gate, pos) in enumerate(gate_sequence):
+        add_errors((i, True))
+        if gate == 'Meas':
+            qubit, register = np.uint64(pos[0]), pos[1]
+            flips[:, register] ^= ((frames['x'] >> qubit) & one).astype(np.uint8)
+            frames['x'] &= ~(one << qubit)
+            frames['z'] &= ~(one << qubit)
+            if rng is not None:
+                frames['z'] |= _random_bits(rng, len(events), 1 << int(qubit))
+        else:
+            qec.clifford_transform_packed(frames, gate, pos)
+        add_errors((i, False))
+    return frames, flips
+
+def _rowsum(tableau: np.ndarray, rows: np.ndarray, source: int) -> None:
+    """
+    Multiply the tableau rows by the source row IN PLACE, with the phase rule of Aaronson and Gottesman
+    (columns: x bits, z bits, sign bit).
+    """
+    n = (tableau.shape[1] - 1) // 2
+    x1, z1 = tableau[source, :n].astype(int), tableau[source, n:2*n].astype(int)
+    x2, z2 = tableau[rows, :n].astype(int), tableau[rows, n:2*n].astype(int)
+    g = x1*z1*(z2 - x2) + x1*(1 - z1)*z2*(2*x2 - 1) + (1 - x1)*z1*x2*(1 - 2*z2)
+    phase = 2*tableau[rows, 2*n].astype(int) + 2*int(tableau[source, 2*n]) + g.sum(axis=1)
+    tableau[rows, 2*n] = (phase % 4) // 2
+    tableau[rows, :2*n] ^= tableau[source, :2*n]
+
+def tableau_reference(
+        gate_sequence: list[tuple[str, tuple[int]]],
+        num_qubits: int,
+        num_meas: int,
+        paulis: np.ndarray,
+        coefs: np.ndarray,
+        rng: np.random.Generator,
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Noiseless run of a Clifford gate sequence on a stabilizer tableau with destabilizers (Aaronson and Gottesman),
+    in O(n^2) per measurement instead of a 2^n state vector. Outcomes are drawn from rng exactly as in _run_segments,
+    so the same generator gives the outcomes of the noiseless state-vector run, and measured qubits are reset.
+
+    Args:
+        gate_sequence (list[tuple[str, tuple[int]]]): List of gates ('I', 'H', 'S', 'CX', 'CZ', 'Meas') and positions.
+        num_qubits (int): Number of qubits.
+        num_meas (int): Number of measurement registers.
+        paulis (np.ndarray), coefs (np.ndarray): Observables from pack_observables.
+        rng (numpy.random.Generator): Random number generator of the measurement outcomes.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: uint8 measurement outcomes and observable values of the final state
+            (coefficient times +-1 for the stabilizers, 0 otherwise), as vector_observables.
+    """
+    n = num_qubits
+    # rows: destabilizers X_q, stabilizers Z_q, scratch row
+    tableau = np.zeros([2*n + 1, 2*n + 1], dtype=np.uint8)
+    tableau[np.arange(n), np.arange(n)] = 1
+    tableau[n + np.arange(n), n + np.arange(n)] = 1
+    x, z, r = tableau[:, :n], tableau[:, n:2*n], tableau[:, 2*n]
+    def hadamard(q):
+        r[:] ^= x[:, q] & z[:, q]
+        x[:, q], z[:, q] = z[:, q].copy(), x[:, q].copy()
+    def cnot(c, t):
+        r[:] ^= x[:, c] & z[:, t] & (x[:, t] ^ z[:, c] ^ 1)
+        x[:, t] ^= x[:, c]
+        z[:, c] ^= z[:, t]
+
+    outcomes = np.zeros(num_meas, dtype=np.uint8)
+    for gate, pos in gate_sequence:
+        if gate == 'I':
+            pass
+        elif gate == 'H':
+            hadamard(pos[0])
+        elif gate == 'S':
+            r[:] ^= x[:, pos[0]] & z[:, pos[0]]
+            z[:, pos[0]] ^= x[:, pos[0]]
+        elif gate == 'CX':
+            cnot(*pos)
+        elif gate == 'CZ':
+            hadamard(pos[1])
+            cnot(*pos)
+            hadamard(pos[1])
+        elif gate == 'Meas':
+            qubit, register = pos
+            anticommuting = n + np.flatnonzero(x[n:2*n, qubit])
+            if len(anticommuting):
+                p = anticommuting[0]
+                outcome = int(rng.random() >= 0.5)
+                others = np.flatnonzero(x[:2*n, qubit])
+                _rowsum(tableau, others[others != p], p)
+                tableau[p - n] = tableau[p]
+                tableau[p] = 0
+                z[p, qubit], r[p] = 1, outcome
+            else:
+                tableau[2*n] = 0
+                for i in np.flatnonzero(x[:n, qubit]):
+                    _rowsum(tableau, np.array([2*n]), i + n)
+                # deterministic outcome, the draw keeps the random stream of _run_segments
+                outcome = int(rng.random() >= 1 - r[2*n])
+            outcomes[register] = outcome
+            if outcome:
+                r[:] ^= z[:, qubit]
+        else:
+            raise ValueError(f'Unknown Clifford gate {gate}')
+
+    values = np.zeros(len(paulis), dtype=complex)
+    bits = np.arange(n, dtype=np.uint64)
+    one = np.uint64(1)
+    for k, pauli in enumerate(paulis):
+        px = ((pauli['x'] >> bits) & one).astype(np.uint8)
+        pz = ((pauli['z'] >> bits) & one).astype(np.uint8)
+        if ((x[n:2*n] @ pz + z[n:2*n] @ px) % 2).any():
+            continue
+        tableau[2*n] = 0
+        for i in np.flatnonzero((x[:n] @ pz + z[:n] @ px) % 2):
+            _rowsum(tableau, np.array([2*n]), i + n)
+        values[k] = coefs[k] * (1 - 2*int(r[2*n]))
+    return outcomes, values
+
+def run_noisy_frames(
+        gate_sequence: list[tuple[str, tuple[int]]],
+        num_qubits: int,
+        num_meas: int,
+        num_shots: int,
+        observables: list,
+        noise_1q = None,
+        noise_2q = None,
+        meas_noise = None,
+        noise_prob_1q = 0.,
+        noise_prob_2q = 0.,
+        seed: int = None,
+        noise_model: NoiseModel = None,
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Pauli-frame version of run_noisy_stabilizer_circuit. The noiseless circuit is simulated once on a stabilizer
+    tableau (tableau_reference), then the errors of all shots are propagated as frames (propagate_frames, with
+    randomized preparations for the random measurements) and the observables follow from the frames
+    (frame_observables), without a state vector per shot.
+
+    Args:
+        gate_sequence, num_qubits, num_meas, num_shots, noise_*: See run_noisy_stabilizer_circuit.
+        observables (list): [observable, label] pairs or specs, see pack_observables.
+        seed (int): Seed of the noise and of the measurement outcomes.
+        noise_model (tool.noise_model.NoiseModel): If given, replaces the noise_* arguments.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Observable values (num_shots x num_observables) and 
+            measurements (num_shots x num_meas).
+    """
+    rng = np.random.default_rng(seed)
+    noise = compile_noise(gate_sequence, num_qubits, (noise_1q, noise_2q, meas_noise, noise_prob_1q, noise_prob_2q),
+                          noise_model)
+    locations = noise.locations
+    events = noise.sample(num_shots, rng)
+    paulis, coefs = pack_observables(observables)
+    reference_meas, reference = tableau_reference(gate_sequence, num_qubits, num_meas, paulis, coefs, rng)
+
+    frames, flips = propagate_frames(gate_sequence, num_meas, locations, events, rng, num_qubits)
+    return _real_if_hermitian(frame_observables(frames, paulis, reference), observables), flips ^ reference_meas
+
+def error_distribution(
+        num_data: int,
+        stabilizer_group: list[list[str]],
+        init_state: QuantumState,
+        observables: list,
+        catalog: ResultsCatalog = None,
+        recompute: bool = False,
+        ) -> tuple[dict, dict, np.ndarray]:
+    """
+    Apply every Pauli error on the data qubits of a state and record the values of the observables,
+    grouped by the weight of the lowest-weight equivalent error (moved from the figures_of_merit notebook).
+    Nothing is stored by default. With a catalog (e.g. ResultsCatalog() for the shared default one), results are
+    kept in it, keyed by the state vector, the stabilizer group and the observables, so a changed circuit or code is
+    recomputed instead of loading a stale file.
+
+    Args:
+        num_data (int): Number of data qubits.
+        stabilizer_group (list[list[str]]): Stabilizer group.
+        init_state (QuantumState): Error-free state.
+        observables (list): [observable, label] pairs, e.g. from build_observables.
+        catalog (ResultsCatalog): Catalog keeping the results, None (or False) to only compute them.
+        recompute (bool): Whether to ignore a stored result.
+
+    Returns:
+        tuple[dict, dict, np.ndarray]: Tuple of
+            err_dist: weight -> {equivalent error: observable values (+-1)},
+            err_map: error -> equivalent error, for errors that are not their own equivalent,
+            err_counts: number of errors by (apparent weight, equivalent weight).
+    """
+    def compute():
+        err_dist = {i: {} for i in range(num_data+1)}
+        err_map = {}
+        err_counts = np.zeros([num_data+1,num_data+1], dtype=int)
+        state = init_state.copy()
+        for error in itertools.product(['X','Y','Z','-'],repeat=num_data):
+            error = ''.join(error)
+            init_weight = qec.pauli_weight(error)
+            # apply error to state
+            state.load(init_state)
+            for i, gate in enumerate(error):
+                gate_dict[gate](i).update_quantum_state(state)
+
+            # compute the observables
+            obs_values = state_observables([state], observables)[0]
+            assert abs(obs_values**2 - 1).max() < 1e-10 # should be all 1 or -1
+            obs_values = obs_values.real.round(10).astype(int)
+
+            # compute the equivalent error
+            equiv_error, weight = qec.lowest_weight_equivalent(error, stabilizer_group)
+            equiv_error = ''.join(equiv_error)
+            # check if equivalent error is already recorded
+            if equiv_error in err_dist[weight]:
+                assert (obs_values == err_dist[weight][equiv_error]).all() # observables should be the same
+            else:
+                err_dist[weight][equiv_error] = obs_values
+            if error != equiv_error:
+                err_map[error] = equiv_error
+            err_counts[init_weight][weight] += 1
+        return err_dist, err_map, err_counts
+
+    if catalog is None or catalog is False:
+        return compute()
+    # + 0.0 turns the -0.0 amplitudes left by rounding into 0.0, which hash the same
+    return catalog.cached('error_distribution', compute, circuit=init_state.get_vector().round(10) + 0.0,
+                          code=stabilizer_group, params={'num_data': num_data,
+                                                         'observables': [obs[0].to_json() for obs in observables]},
+                          recompute=recompute)
+
+# per-process context of the shot-parallel executor, set by _init_noisy_worker
+_worker = {}
+
+def _init_noisy_worker(gate_sequence, num_qubits, num_meas, observable_specs, noise_args, noise_model=None) -> None:
+    """
+    Prepare a worker: noise locations, observables and the warmed-up noiseless circuit segments.
+    """
+    _worker.clear()
+    _worker['num_qubits'] = num_qubits
+    _worker['num_meas'] = num_meas
+    _worker['gate_sequence'] = gate_sequence
+    _worker['observables'] = build_observables(num_qubits, observable_specs)
+    _worker['packed_observables'] = pack_observables(observable_specs)
+    _worker['noise'] = compile_noise(gate_sequence, num_qubits, noise_args, noise_model)
+    _worker['noiseless'] = _build_circuit(gate_sequence, num_qubits, {}, split_measurements=True)
+
+def _run_noisy_chunk(args: tuple[int, np.random.SeedSequence]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Run one chunk of shots in the current worker. The result only depends on the chunk's seed.
+    """
+    num_shots, seed_seq = args
+    rng = np.random.default_rng(seed_seq)
+    num_qubits, locations = _worker['num_qubits'], _worker['noise'].locations
+    events = _worker['noise'].sample(num_shots, rng)
+
+    state = qulacs.QuantumState(num_qubits)
+    circuits = {}
+    measurements = np.zeros([num_shots, _worker['num_meas']], dtype=np.uint8)
+    obs_results = np.zeros([num_shots, len(_worker['observables'])])
+    for shot in range(num_shots):
+        if events[shot].any():
+            key = events[shot].tobytes()
+            if key not in circuits:
+                circuits[key] = _build_circuit(_worker['gate_sequence'], num_qubits, 
+                                               _error_map(locations, events[shot]), split_measurements=True)
+            segments = circuits[key]
+        else:
+            segments = _worker['noiseless']
+        _run_segments(segments, state, rng)
+        measurements[shot] = [state.get_classical_value(i) for i in range(_worker['num_meas'])]
+        obs_results[shot] = vector_observables(state.get_vector()[None], *_worker['packed_observables'])[0].real
+    return obs_results, measurements
+
+def shard_shots(num_shots: int, chunk_size: int, seed: int = None) -> list[tuple[int, np.random.SeedSequence]]:
+    """
+    Split shots into fixed-size chunks, each with its own seed spawned from the master seed.
+    Chunks do not depend on the number of workers, so merged results do not either.
+
+    Args:
+        num_shots (int): Total number of shots.
+        chunk_size (int): Number of shots per chunk.
+        seed (int): Master seed.
+
+    Returns:
+        list[tuple[int, numpy.random.SeedSequence]]: (number of shots, seed) of each chunk.
+    """
+    sizes = [min(chunk_size, num_shots - start) for start in range(0, num_shots, chunk_size)]
+    return list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+
+def run_noisy_stabilizer_circuit_parallel(
+        gate_sequence: list[tuple[str, tuple[int]]],
+        num_qubits: int,
+        num_meas: int,
+        num_shots: int,
+        observable_specs: list[tuple[complex, str]],
+        noise_1q = None,
+        noise_2q = None,
+        meas_noise = None,
+        noise_prob_1q = 0.,
+        noise_prob_2q = 0.,
+        seed: int = None,
+        num_workers: int = None,
+        chunk_size: int = 1000,
+        writer = None,
+        noise_model: NoiseModel = None,
+        ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Shot-parallel run_noisy_stabilizer_circuit over a process pool.
+    Noise is presampled and measurement outcomes are drawn with NumPy, so for a given seed
+    the results are bit-identical for any number of workers.
+
+    Args:
+        gate_sequence, num_qubits, num_meas, num_shots, noise_*: See run_noisy_stabilizer_circuit.
+        observable_specs (list[tuple[complex, str]]): Observables, see build_observables.
+        seed (int): Master seed.
+        num_workers (int): Number of processes, defaults to the number of CPUs. 1 runs in this process.
+        chunk_size (int): Number of shots per chunk.
+        writer (tool.shot_records.ShotRecordWriter): If given, the measurements of every chunk are appended
+            to it under the key 'meas' as they arrive, and not returned.
+        noise_model (tool.noise_model.NoiseModel): If given, replaces the noise_* arguments.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Observable values (num_shots x num_observables) and 
+            measurements (num_shots x num_meas, None with a writer). States are not returned across processes.
+    """
+    chunks = shard_shots(num_shots, chunk_size, seed)
+    noise_args = (noise_1q, noise_2q, meas_noise, noise_prob_1q, noise_prob_2q)
+    initargs = (list(gate_sequence), num_qubits, num_meas, observable_specs, noise_args, noise_model)
+    if num_workers == 1:
+        _init_noisy_worker(*initargs)
+        results = _collect_noisy_chunks(map(_run_noisy_chunk, chunks), writer)
+    else:
+        with ProcessPoolExecutor(num_workers, initializer=_init_noisy_worker, initargs=initargs) as executor:
+            results = _collect_noisy_chunks(executor.map(_run_noisy_chunk, chunks), writer)
+    obs_results = np.concatenate([r[0] for r in results]) if results else np.zeros([0, len(observable_specs)])
+    if writer is not None:
+        return obs_results, None
+    measurements = np.concatenate([r[1] for r in results]) if results else np.zeros([0, num_meas], dtype=np.uint8)
+    return obs_results, measurements
+
+def _collect_noisy_chunks(results, writer=None) -> list:
+    """Gather the chunk results in order, streaming the measurements to the writer if given."""
+    collected = []
+    for obs_results, measurements in results:
+        if writer is not None:
+            writer.append({'meas': measurements})
+            measurements = None
+        collected.append((obs_results, measurements))
+    return collected
+
+############################## TESTING ##############################
+
+def test_sample_noise_events():
+    """
+    Tests the sample_noise_events method on the empirical error frequencies, and that the largest draw stays within
+    the errors of a channel whose probabilities sum to slightly less than 1.
+    """
+    gate_sequence = [('H', (0,)), ('CX', (0, 1)), ('Meas', (1, 0))]
+    locations = get_noise_locations(gate_sequence, 2, 'XYZ', 'XYZ', 0.2, [0.1, 0.2, 0.3], 0.3)
+    events = sample_noise_events(locations, 200000, np.random.default_rng(0))
+    test_cases = {
+        'num_locations': 3,
+        'freq_1q': (0.4, 0.1, 0.2, 0.3),
+        'freq_2q_no_error': 0.7,
+        'freq_meas': (0.8, 0.2),
+        'largest draw': (9, 15),
+    }
+    class LargestDraw:
+        def random(self, shape):
+            return np.full(shape, np.nextafter(1., 0.))
+    # cumsum([0.1]*10)[-1] < 1, next to a channel with more errors
+    short = (0, False, (0,), ['-'] + list('XYZ')*3, [0.1]*10)
+    outputs = {
+        'num_locations': len(locations),
+        'freq_1q': tuple(np.round(np.bincount(events[:, 0], minlength=4) / len(events), 2)),
+        'freq_2q_no_error': np.round((events[:, 1] == 0).mean(), 2),
+        'freq_meas': tuple(np.round(np.bincount(events[:, 2], minlength=2) / len(events), 2)),
+        'largest draw': tuple(sample_noise_events([short, locations[1]], 1, LargestDraw())[0]),
+    }
+    run_test(test_cases, lambda input: outputs[input], 'sample_noise_events')
+
+def test_run_noisy_stabilizer_circuit():
+    """
+    Tests that the presampled mode matches the Probabilistic-gate mode on a deterministic circuit, and that a seed
+    gives the same shots, with and without presample, also when the measurement outcomes are random.
+    """
+    bell = [('H', (0,)), ('CX', (0, 1)), ('Meas', (1, 0))]
+    # X errors after two H on each data qubit, then measure ZZ with an ancilla
+    gate_sequence = [('H', (0,)), ('H', (0,)), ('H', (1,)), ('H', (1,)),
+                     ('CX', (0, 2)), ('CX', (1, 2)), ('Meas', (2, 0))]
+    p, num_shots = 0.1, 20000
+    flip = p # an X error after the first H becomes a Z error
+    expected = 2*flip*(1-flip)
+    test_cases = {
+        False: True,
+        True: True,
+        'seed': True,
+        'seed, random outcomes': (True, True, True),
+    }
+    def test_func(presample):
+        if presample == 'seed':
+            runs = [run_noisy_stabilizer_circuit(gate_sequence, 3, 1, 100, [], noise_1q='X', noise_prob_1q=p,
+                                                 seed=3)[2] for _ in range(2)]
+            return np.array_equal(*runs)
+        if presample == 'seed, random outcomes':
+            runs = [run_noisy_stabilizer_circuit(bell, 2, 1, 200, [], noise_1q='X', noise_prob_1q=0.05,
+                                                 presample=presample, seed=3)[2] for presample in (False, True, True)]
+            return (np.array_equal(runs[0], runs[1]), np.array_equal(runs[1], runs[2]),
+                    bool(abs(runs[0].mean() - 0.5) < 0.15))
+        _, _, measurements = run_noisy_stabilizer_circuit(gate_sequence, 3, 1, num_shots, [],
+                                                          noise_1q='X', noise_prob_1q=p,
+                                                          presample=presample, seed=1 if presample else None)
+        return bool(abs(measurements.mean() - expected) < 5*np.sqrt(expected/num_shots))
+    run_test(test_cases, test_func, 'run_noisy_stabilizer_circuit')
+
+def test_run_noisy_stabilizer_circuit_parallel():
+    """
+    Tests that the results do not depend on the number of workers.
+    """
+    gate_sequence = [('H', (0,)), ('CX', (0, 2)), ('CX', (1, 2)), ('Meas', (2, 0)), ('H', (0,))]
+    specs = [(1, ''), (1, 'Z 0 Z 1'), (1, 'X 0')]
+    outputs = []
+    for num_workers in [1, 2, 3]:
+        outputs.append(run_noisy_stabilizer_circuit_parallel(gate_sequence, 3, 1, 250, specs, 'XYZ', 'XYZ', 0.05, 0.05, 0.05,
+                                                             seed=7, num_workers=num_workers, chunk_size=40))
+    test_cases = {
+        2: True,
+        3: True,
+    }
+    test_func = lambda i: all((a == b).all() for a, b in zip(outputs[0], outputs[i-1]))
+    run_test(test_cases, test_func, 'run_noisy_stabilizer_circuit_parallel')
+
+def test_vector_observables():
+    """
+    Tests the batched expectation values against qulacs on random states, for the Steane stabilizer group, and that
+    they are real for Hermitian observables, as from qulacs.Observable, in every runner.
+    """
+    stabilizer_group = qec.compute_stabilizer_group([list(g) for g in qec.common_qecc('steane_code_Goto')])
+    observables = build_observables(8, get_observable_specs(stabilizer_group, 7) + [(1, 'Y 0 X 7'), (-1, 'Y 3 Y 5')])
+    states = []
+    for seed in range(3):
+        states.append(qulacs.QuantumState(8))
+        states[-1].set_Haar_random_state(seed)
+    expected = np.array([[obs.get_expectation_value(state) for obs, _ in observables] for state in states])
+    operator = qulacs.GeneralQuantumOperator(8)
+    operator.add_operator(1j, 'Z 0 X 1')
+    sequence = [('H', (0,)), ('CX', (0, 2)), ('CX', (1, 2)), ('Meas', (2, 0))]
+    bell = build_observables(3, [(1, 'Z 0 Z 1'), (1, 'X 0 X 1')])
+    test_cases = {
+        'pairs': True,
+        'shared states': True,
+        'real values': (np.float64, np.float64, np.float64, np.float64),
+        'non-Hermitian': (np.complex128, True),
+    }
+    outputs = {
+        'pairs': np.allclose(state_observables(states, observables), expected),
+        'shared states': np.allclose(state_observables([states[1], states[0], states[1]], observables),
+                                     expected[[1, 0, 1]]),
+        'real values': (state_observables(states, observables).dtype.type,
+                        run_noisy_stabilizer_circuit(sequence, 3, 1, 3, bell, 'X', 'X', None, 0.1, 0.1)[1].dtype.type,
+                        run_noisy_stabilizer_circuit(sequence, 3, 1, 3, bell, 'X', 'X', None, 0.1, 0.1,
+                                                     presample=True, seed=1)[1].dtype.type,
+                        run_noisy_frames(sequence, 3, 1, 3, [(1, 'Z 0 Z 1')], seed=1)[0].dtype.type),
+        'non-Hermitian': (state_observables(states, [[operator, 'ZX']]).dtype.type,
+                          np.allclose(state_observables(states, [[operator, 'ZX']])[:, 0],
+                                      [operator.get_expectation_value(state) for state in states])),
+    }
+    run_test(test_cases, lambda input: outputs[input], 'vector_observables')
+
+def test_run_noisy_frames():
+    """
+    Tests that the Pauli-frame run matches the state-vector run of the same sampled errors, shot by shot.
+    """
+    # Bell pair with ZZ and XX checks, then a CZ
+    gate_sequence = [('H', (0,)), ('CX', (0, 1)), ('CX', (0, 2)), ('CX', (1, 2)), ('Meas', (2, 0)),
+                     ('H', (3,)), ('CX', (3, 0)), ('CX', (3, 1)), ('H', (3,)), ('Meas', (3, 1)), ('CZ', (0, 1))]
+    specs = [(1, ''), (1, 'Z 0 Z 1'), (1, 'X 0 X 1'), (1, 'Y 0 Y 1'), (1, 'X 0'), (-1, 'Y 0 X 1')]
+    noise = ('XYZ', 'XYZ', 0.05, 0.05, 0.05)
+    num_shots, seed = 200, 3
+    obs_results, measurements = run_noisy_frames(gate_sequence, 4, 2, num_shots, specs, *noise, seed=seed)
+
+    locations = get_noise_locations(gate_sequence, 4, *noise)
+    events = sample_noise_events(locations, num_shots, np.random.default_rng(seed))
+    observables = build_observables(4, specs)
+    expected_obs, expected_meas = [], []
+    for shot in range(num_shots):
+        state = qulacs.QuantumState(4)
+        state.set_zero_state()
+        _sparse_noisy_circuit(gate_sequence, 4, locations, events[shot]).update_quantum_state(state)
+        expected_meas.append([state.get_classical_value(i) for i in range(2)])
+        expected_obs.append([obs.get_expectation_value(state) for obs, _ in observables])
+    test_cases = {
+        'measurements': True,
+        'observables': True,
+        'random measurements': True,
+    }
+    def test_func(input):
+        if input == 'measurements':
+            return np.array_equal(measurements, expected_meas)
+        if input == 'observables':
+            return np.allclose(obs_results, expected_obs)
+        # Z 0 then Z 1 of a Bell pair, measured by the same ancilla with readout errors: random first outcome,
+        # the second one and the final Z 0 correlated with it
+        random_sequence = [('H', (0,)), ('CX', (0, 1)), ('CX', (0, 2)), ('Meas', (2, 0)), ('CX', (1, 2)),
+                           ('Meas', (2, 1))]
+        values, meas = run_noisy_frames(random_sequence, 3, 2, 4000, [(1, 'Z 0'), (1, 'X 0 X 1')],
+                                        meas_noise=[0., 0., 0.1], seed=5)
+        flipped = (1 - values[:, 0].real)/2 != meas[:, 1]
+        return bool(abs(meas[:, 0].mean() - 0.5) < 0.05 and abs(flipped.mean() - 0.1) < 0.03
+                    and abs((meas[:, 0] ^ meas[:, 1]).mean() - 0.18) < 0.03 and np.allclose(values[:, 1], 0))
+    run_test(test_cases, test_func, 'run_noisy_frames')
+
+def test_tableau_reference():
+    """
+    Tests the tableau run against the qulacs reference run of the same seed on random Clifford circuits with
+    mid-circuit measurements, for random Pauli observables and the Z_q of the final state.
+    """
+    def random_circuit(seed, n=5, length=40):
+        rng = np.random.default_rng(seed)
+        gate_sequence, num_meas = [], 0
+        for _ in range(length):
+            gate = rng.choice(['H', 'S', 'CX', 'CZ', 'Meas'])
+            if gate in ('CX', 'CZ'):
+                gate_sequence.append((gate, tuple(int(q) for q in rng.choice(n, 2, replace=False))))
+            elif gate == 'Meas':
+                gate_sequence.append((gate, (int(rng.integers(n)), num_meas)))
+                num_meas += 1
+            else:
+                gate_sequence.append((gate, (int(rng.integers(n)),)))
+        specs = [(1, ' '.join(f'{p} {q}' for q, p in enumerate(paulis) if p != 'I'))
+                 for paulis in rng.choice(list('IXYZ'), [8, n])] + [(-1, f'Z {q}') for q in range(n)]
+        return gate_sequence, num_meas, specs
+    def test_func(seed):
+        gate_sequence, num_meas, specs = random_circuit(seed)
+        paulis, coefs = pack_observables(specs)
+        state = qulacs.QuantumState(5)
+        _run_segments(_build_circuit(gate_sequence, 5, {}, split_measurements=True), state,
+                      np.random.default_rng(seed))
+        expected_meas = [state.get_classical_value(i) for i in range(num_meas)]
+        expected = vector_observables(state.get_vector()[None], paulis, coefs)[0]
+        meas, values = tableau_reference(gate_sequence, 5, num_meas, paulis, coefs, np.random.default_rng(seed))
+        return bool(np.array_equal(meas, expected_meas) and np.allclose(values, expected))
+    run_test({seed: True for seed in range(6)}, test_func, 'tableau_reference')
+
+def test_noise_model_runners():
+    """
+    Tests that the runners sample the same errors from a NoiseModel: the state-vector and frame runs of a deterministic
+    circuit with biased and correlated noise agree shot by shot, and the parallel run does not depend on the workers.
+    """
+    from tool.noise_model import biased, pauli_channel
+    gate_sequence = [('H', (0,)), ('H', (0,)), ('CX', (0, 2)), ('CX', (1, 2)), ('Meas', (2, 0)), ('S', (1,))]
+    model = NoiseModel()
+    model.add_gate_noise(biased(0.05, 10))
+    model.add_gate_noise(pauli_channel({'XX': 0.05, 'ZZ': 0.02}), 'CX')
+    model.add_gate_noise(pauli_channel({'ZX': 0.1}), 'CX', (1, 2))
+    model.add_measurement_noise(0.03, 2)
+    specs = [(1, 'Z 0 Z 1'), (1, 'Z 1')]
+    num_shots = 300
+    _, vector_obs, vector_meas = run_noisy_stabilizer_circuit(gate_sequence, 3, 1, num_shots,
+                                                              build_observables(3, specs), seed=4, noise_model=model)
+    frame_obs, frame_meas = run_noisy_frames(gate_sequence, 3, 1, num_shots, specs, seed=4, noise_model=model)
+    parallel = [run_noisy_stabilizer_circuit_parallel(gate_sequence, 3, 1, 120, specs, seed=2, num_workers=workers,
+                                                      chunk_size=50, noise_model=model) for workers in (1, 2)]
+    test_cases = {
+        'measurements': True,
+        'observables': True,
+        'parallel': True,
+    }
+    outputs = {
+        'measurements': np.array_equal(vector_meas, frame_meas) and 0 < frame_meas.sum() < num_shots,
+        'observables': np.allclose(vector_obs, frame_obs),
+        'parallel': all(np.array_equal(a, b) for a, b in zip(*parallel)),
+    }
+    run_test(test_cases, lambda input: outputs[input], 'noise_model runners')
+
+def test_error_distribution():
+    """
+    Tests error_distribution on the 3-qubit bit-flip code, and that states differing by the sign of a zero amplitude
+    share their catalog entry.
+    """
+    stabilizer_group = qec.compute_stabilizer_group([list('ZZ-'), list('-ZZ')])
+    observables = build_observables(3, [(1, 'Z 0 Z 1'), (1, 'Z 1 Z 2')])
+    state = qulacs.QuantumState(3)
+    state.set_zero_state()
+    err_dist, err_map, err_counts = error_distribution(3, stabilizer_group, state, observables)
+    negative_zero = qulacs.QuantumState(3)
+    negative_zero.load(np.where(np.arange(8) == 0, 1., -0.).astype(complex))
+    with tempfile.TemporaryDirectory() as tmp:
+        with ResultsCatalog(os.path.join(tmp, 'catalog.sqlite')) as catalog:
+            stored = error_distribution(3, stabilizer_group, negative_zero, observables, catalog)
+            error_distribution(3, stabilizer_group, state, observables, catalog)
+            num_entries = len(catalog.query(kind='error_distribution'))
+    test_cases = {
+        'counts': (64, 4),
+        'X on qubit 0': (1, (-1, 1)),
+        'equivalent': '--Z',
+        'catalog entries': (1, True),
+    }
+    outputs = {
+        'counts': (int(err_counts.sum()), int(err_counts[:, 0].sum())),
+        'X on qubit 0': (qec.pauli_weight('X--'), tuple(err_dist[1]['X--'])),
+        'equivalent': err_map['ZZZ'],
+        'catalog entries': (num_entries, np.array_equal(stored[2], err_counts)),
+    }
+    run_test(test_cases, lambda input: outputs[input], 'error_distribution')
+
+def test_all():
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_sample_noise_events()
+    test_run_noisy_stabilizer_circuit()
+    test_run_noisy_stabilizer_circuit_parallel()
+    test_vector_observables()
+    test_tableau_reference()
+    test_run_noisy_frames()
+    test_noise_model_runners()
+    test_error_distribution()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
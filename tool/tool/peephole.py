@@ -0,0 +1,279 @@
+import os
+import numpy as np
+from typing import List, Tuple
+from tool import qec
+from tool.testing import run_test
+
+"""
+Peephole optimization of Clifford gate sequences (H, S, CX, CZ) in the tool format.
+
+Two rules are applied until nothing changes:
+    - cancellation: H H, CX CX and CZ CZ on the same qubits cancel, also when the gates in between commute with them,
+    - conjugation: H(t) CZ(c, t) H(t) = CX(c, t), H(t) CX(c, t) H(t) = CZ(c, t) and H(c) H(t) CX(c, t) H(c) H(t) =
+      CX(t, c), when the H gates are the previous and next gates on their qubits.
+Two gates commute if, on each qubit they share, both act diagonally in the Z basis (CZ, S, CX control) or both in the
+X basis (CX target). With preserve_locations, two-qubit gates are kept in order and on the same qubits, only
+single-qubit gates are removed (by cancellation or absorbed by conjugation). The two-qubit fault locations are then
+kept one to one: the set of two-qubit faults is invariant under conjugation by H, and the faults of the removed
+single-qubit locations propagate to faults of the neighbouring two-qubit gates.
+
+Equivalence is proved by comparing the binary symplectic matrices of the sequences, i.e. the images of every X and
+Z up to phases. All the rules are exact identities, so the sequences are also equal as unitaries.
+
+Methods:
+    optimize_sequence(...): Optimized sequence and report.
+    symplectic_matrix(...), is_equivalent(...): Binary symplectic matrix of a sequence and equivalence of sequences.
+    optimization_report(...): Gates saved on the named sequences of qec.get_sequence.
+    test_all(): Runs all the test methods.
+"""
+
+OPTIMIZED_GATES = ('H', 'S', 'CX', 'CZ')
+
+def _num_qubits(*gate_seqs) -> int:
+    return 1 + max((q for gate_seq in gate_seqs for _, position in gate_seq for q in position), default=-1)
+
+def symplectic_matrix(gate_seq, num_qubits: int = None) -> np.ndarray:
+    """
+    Binary symplectic matrix of a Clifford gate sequence.
+
+    Args:
+        gate_seq: Gate sequence in the tool format.
+        num_qubits (int): Number of qubits, by default 1 + the largest qubit of the sequence.
+
+    Returns:
+        np.ndarray: (2n, 2n) uint8 matrix, row j < n (j >= n) is the image of X_j (Z_{j-n}) as [x bits | z bits].
+    """
+    num_qubits = _num_qubits(gate_seq) if num_qubits is None else num_qubits
+    images = qec.pack_paulis(['-'*q + p + '-'*(num_qubits - q - 1) for p in 'XZ' for q in range(num_qubits)])
+    for gate, position in gate_seq:
+        qec.clifford_transform_packed(images, gate, position)
+    return np.concatenate([qec.get_bits(images['x'], range(num_qubits)),
+                           qec.get_bits(images['z'], range(num_qubits))], axis=1).astype(np.uint8)
+
+def is_equivalent(gate_seq1, gate_seq2, num_qubits: int = None) -> bool:
+    """
+    Whether two Clifford gate sequences have the same symplectic matrix (are equal up to Pauli gates).
+    """
+    num_qubits = _num_qubits(gate_seq1, gate_seq2) if num_qubits is None else num_qubits
+    return bool(np.array_equal(symplectic_matrix(gate_seq1, num_qubits), symplectic_matrix(gate_seq2, num_qubits)))
+
+def _qubit_actions(gate) -> dict:
+    """Basis the gate acts diagonally in on each of its qubits: 'Z', 'X', or None."""
+    name, position = gate
+    if name == 'CZ':
+        return {position[0]: 'Z', position[1]: 'Z'}
+    if name == 'CX':
+        return {position[0]: 'Z', position[1]: 'X'}
+    if name == 'S':
+        return {position[0]: 'Z'}
+    return {q: None for q in position}
+
+def _commute(gate1, gate2) -> bool:
+    actions1, actions2 = _qubit_actions(gate1), _qubit_actions(gate2)
+    return all(actions1[q] is not None and actions1[q] == actions2[q] for q in actions1 if q in actions2)
+
+def _same_gate(gate1, gate2) -> bool:
+    if gate1[0] != gate2[0]:
+        return False
+    if gate1[0] == 'CZ':
+        return set(gate1[1]) == set(gate2[1])
+    return tuple(gate1[1]) == tuple(gate2[1])
+
+def _cancel(gates: List, preserve_locations: bool, counts: dict) -> bool:
+    """Remove pairs of self-inverse gates that meet by commuting, in place. Returns whether a pair was removed."""
+    changed = False
+    self_inverse = ('H',) if preserve_locations else ('H', 'CX', 'CZ')
+    i = 0
+    while i < len(gates):
+        if gates[i][0] in self_inverse:
+            for j in range(i + 1, len(gates)):
+                if _same_gate(gates[i], gates[j]):
+                    counts['cancellation'] += 2
+                    del gates[j], gates[i]
+                    changed = True
+                    i -= 1
+                    break
+                if not _commute(gates[i], gates[j]):
+                    break
+        i += 1
+    return changed
+
+def _neighbour(gates: List, index: int, qubit: int, step: int):
+    """Index of the previous (step -1) or next (step 1) gate on a qubit, None if there is none."""
+    j = index + step
+    while 0 <= j < len(gates):
+        if qubit in gates[j][1]:
+            return j
+        j += step
+    return None
+
+def _conjugate(gates: List, counts: dict) -> bool:
+    """Absorb H gates around CX and CZ gates, in place. Returns whether a gate was rewritten."""
+    changed = False
+    i = 0
+    while i < len(gates):
+        name, position = gates[i]
+        if name in ('CX', 'CZ'):
+            hadamards = {}
+            for q in position:
+                before, after = _neighbour(gates, i, q, -1), _neighbour(gates, i, q, 1)
+                if before is not None and after is not None and gates[before] == ('H', (q,)) == gates[after]:
+                    hadamards[q] = (before, after)
+            c, t = position
+            rewrite = None
+            if name == 'CX' and len(hadamards) == 2:
+                rewrite, removed = ('CX', (t, c)), hadamards[c] + hadamards[t]
+            elif name == 'CX' and t in hadamards:
+                rewrite, removed = ('CZ', (c, t)), hadamards[t]
+            elif name == 'CZ' and hadamards:
+                target = t if t in hadamards else c
+                rewrite, removed = ('CX', (c + t - target, target)), hadamards[target]
+            if rewrite is not None:
+                gates[i] = rewrite
+                for j in sorted(removed, reverse=True):
+                    del gates[j]
+                counts['conjugation'] += len(removed)
+                changed = True
+                i -= sum(j < i for j in removed)
+        i += 1
+    return changed
+
+def optimize_sequence(gate_seq, preserve_locations: bool = False, num_qubits: int = None) -> Tuple[Tuple, dict]:
+    """
+    Peephole optimization of a Clifford gate sequence.
+
+    Args:
+        gate_seq: Gate sequence in the tool format (H, S, CX, CZ), or its name for qec.get_sequence.
+        preserve_locations (bool): Keep the two-qubit gates in order and on the same qubits, see the module docstring.
+        num_qubits (int): Number of qubits of the equivalence check, by default 1 + the largest qubit.
+
+    Returns:
+        Tuple[Tuple, dict]: Optimized sequence and report with
+            gates_before, gates_after, saved: number of gates,
+            saved_by_gate: number of gates saved by gate name,
+            by_rule: gates removed by cancellation and by conjugation,
+            fault_locations_before, fault_locations_after: number of single faults of ft.get_faults('XYZ'),
+            equivalent: whether the symplectic matrices are equal.
+
+    Example:
+        >>> optimized, report = optimize_sequence('flag_bridge_CZ_SX1')
+        >>> report['saved']
+    """
+    original = qec.get_sequence(gate_seq) if isinstance(gate_seq, str) else tuple(gate_seq)
+    for gate, _ in original:
+        if gate not in OPTIMIZED_GATES:
+            raise ValueError(f'Only the gates {OPTIMIZED_GATES} can be optimized, got {gate}')
+    gates = [(gate, tuple(position)) for gate, position in original]
+    counts = {'cancellation': 0, 'conjugation': 0}
+    while _cancel(gates, preserve_locations, counts) | _conjugate(gates, counts):
+        pass
+
+    optimized = tuple(gates)
+    def by_gate(seq):
+        return {name: sum(gate == name for gate, _ in seq) for name in OPTIMIZED_GATES}
+    def fault_locations(seq):
+        return sum(3 if len(position) == 1 else 15 for _, position in seq)
+    before, after = by_gate(original), by_gate(optimized)
+    report = {
+        'gates_before': len(original),
+        'gates_after': len(optimized),
+        'saved': len(original) - len(optimized),
+        'saved_by_gate': {name: before[name] - after[name] for name in OPTIMIZED_GATES},
+        'by_rule': counts,
+        'fault_locations_before': fault_locations(original),
+        'fault_locations_after': fault_locations(optimized),
+        'equivalent': is_equivalent(original, optimized, num_qubits),
+    }
+    return optimized, report
+
+def optimization_report(names: List[str] = None, preserve_locations: bool = False, verbose: bool = True) -> dict:
+    """
+    Optimize named sequences of qec.get_sequence and report the gates saved.
+
+    Args:
+        names (List[str]): Sequence names, all the Clifford sequences by default.
+        preserve_locations (bool): See optimize_sequence.
+        verbose (bool): Print one line per sequence.
+
+    Returns:
+        dict: Name -> (optimized sequence, report of optimize_sequence).
+    """
+    sequences = qec.get_sequence()
+    if names is None:
+        names = [name for name, seq in sequences.items() if all(gate in OPTIMIZED_GATES for gate, _ in seq)]
+    results = {name: optimize_sequence(sequences[name], preserve_locations) for name in names}
+    if verbose:
+        print(' sequence                     gates  saved   H  CX  CZ   fault locations  equivalent')
+        for name, (_, report) in results.items():
+            saved = report['saved_by_gate']
+            print(f' {name:<28} {report["gates_before"]:>3}->{report["gates_after"]:<3} {report["saved"]:>3} '
+                  f'{saved["H"]:>3} {saved["CX"]:>3} {saved["CZ"]:>3}   {report["fault_locations_before"]:>5} -> '
+                  f'{report["fault_locations_after"]:<5}  {report["equivalent"]}')
+        print(f' total saved: {sum(report["saved"] for _, report in results.values())} gates')
+    return results
+
+
+############################## TESTING ##############################
+def test_rules():
+    """
+    Test the cancellation and conjugation rules on small sequences.
+    """
+    test_cases = [
+        ((('H', (0,)), ('H', (0,))), ()),
+        ((('CX', (0, 1)), ('CX', (2, 1)), ('CX', (0, 1))), (('CX', (2, 1)),)),
+        ((('CZ', (0, 1)), ('S', (0,)), ('CZ', (1, 0))), (('S', (0,)),)),
+        ((('CX', (0, 1)), ('CX', (1, 2)), ('CX', (0, 1))), (('CX', (0, 1)), ('CX', (1, 2)), ('CX', (0, 1)))),
+        ((('H', (1,)), ('CZ', (0, 1)), ('H', (1,))), (('CX', (0, 1)),)),
+        ((('H', (0,)), ('H', (1,)), ('CX', (0, 1)), ('H', (1,)), ('H', (0,))), (('CX', (1, 0)),)),
+        ((('H', (1,)), ('CX', (0, 1)), ('H', (1,)), ('CZ', (0, 1))), ()),
+        ((('H', (1,)), ('S', (1,)), ('H', (1,))), (('H', (1,)), ('S', (1,)), ('H', (1,)))),
+    ]
+    run_test(list(zip(*test_cases)), lambda x: optimize_sequence(x)[0], 'optimize_sequence')
+
+def test_equivalence():
+    """
+    Test that the optimized built-in sequences are equivalent, that is_equivalent detects a changed sequence, and that
+    preserve_locations keeps the two-qubit gates.
+    """
+    results = optimization_report(verbose=False)
+    preserved = optimization_report(preserve_locations=True, verbose=False)
+    two_qubit = lambda seq: [set(position) for _, position in seq if len(position) == 2]
+    cases = {
+        'all equivalent': all(report['equivalent'] for _, report in results.values()),
+        'all preserved equivalent': all(report['equivalent'] for _, report in preserved.values()),
+        'two-qubit gates kept': all(two_qubit(seq) == two_qubit(qec.get_sequence(name))
+                                    for name, (seq, _) in preserved.items()),
+        'gates saved': sum(report['saved'] for _, report in results.values()) > 0,
+        'not equivalent': is_equivalent((('CX', (0, 1)),), (('CX', (1, 0)),)),
+    }
+    answers = {'all equivalent': True, 'all preserved equivalent': True, 'two-qubit gates kept': True,
+               'gates saved': True, 'not equivalent': False}
+    run_test([list(answers), list(answers.values())], lambda x: cases[x], 'is_equivalent')
+
+def test_fault_tolerance():
+    """
+    Test that the flag bridge circuits optimized with preserve_locations have the same fault tolerance verdicts.
+    """
+    from tool import ft, assets
+    from tool.ft_batch import flag_bridge_manifest
+    group = assets.get_stabilizer_group('steane')
+    jobs = flag_bridge_manifest()
+    def verdict(job, optimize):
+        sequences = [optimize_sequence(seq, preserve_locations=True)[0] if optimize else seq
+                     for seq in job['sequences']]
+        return ft.ft_verdict(sequences, job['used_anc_inds'], job['lut_name'], group)['ft']
+    run_test([list(range(len(jobs))), [verdict(job, False) for job in jobs]], lambda i: verdict(jobs[i], True),
+             'optimize_sequence (fault tolerance)')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_rules()
+    test_equivalence()
+    test_fault_tolerance()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
@@ -162,6 +162,194 @@ clifford_transform_dict = {
         'ZZ': 'ZZ',
     }
 }
+
+############################## PACKED PAULIS ##############################
+# A Pauli string on n <= 64 qubits is stored as two unsigned integers (x, z),
+# where bit i of x (z) is set if qubit i carries an X (Z) component.
+
+PAULI_DTYPE = np.dtype([('x', np.uint64), ('z', np.uint64)])
+
+def pack_paulis(pauli_strings: List) -> np.ndarray:
+    """
+    Pack Pauli strings into a structured array with bit-packed x and z columns.
+
+    Args:
+        pauli_strings (List): List of Pauli strings (str or list of characters, '-' or 'I' for identity).
+
+    Returns:
+        numpy.ndarray: Structured array of dtype PAULI_DTYPE.
+
+    Example:
+        >>> p = pack_paulis(['XZ-', '--Y'])
+        >>> p['x'], p['z']
+        (array([1, 4], dtype=uint64), array([2, 4], dtype=uint64))
+    """
+    packed = np.zeros(len(pauli_strings), dtype=PAULI_DTYPE)
+    for i, p_str in enumerate(pauli_strings):
+        assert len(p_str) <= 64, 'packed Pauli strings support at most 64 qubits'
+        x, z = 0, 0
+        for j, p in enumerate(p_str):
+            if p in 'XY':
+                x |= 1 << j
+            if p in 'YZ':
+                z |= 1 << j
+        packed[i] = (x, z)
+    return packed
+
+def unpack_pauli(x: int, z: int, num_qubits: int, start: int = 0) -> str:
+    """
+    Convert one packed Pauli back to its string representation.
+
+    Args:
+        x (int): X bits.
+        z (int): Z bits.
+        num_qubits (int): Number of qubits to render.
+        start (int): First qubit to render.
+
+    Returns:
+        str: Pauli string.
+
+    Example:
+        >>> unpack_pauli(1, 6, 3)
+        'XZZ'
+    """
+    x, z = int(x), int(z)
+    return ''.join('-XZY'[((x >> j) & 1) + 2 * ((z >> j) & 1)] for j in range(start, start + num_qubits))
+
+def unpack_paulis(paulis: np.ndarray, num_qubits: int, start: int = 0) -> List[str]:
+    """
+    Convert a packed Pauli array back to a list of Pauli strings.
+
+    Args:
+        paulis (numpy.ndarray): Structured array of dtype PAULI_DTYPE.
+        num_qubits (int): Number of qubits to render.
+        start (int): First qubit to render.
+
+    Returns:
+        List[str]: List of Pauli strings.
+    """
+    return [unpack_pauli(x, z, num_qubits, start) for x, z in zip(paulis['x'], paulis['z'])]
+
+def bit_mask(qubits) -> np.uint64:
+    """
+    Bit mask with the bits of the given qubits set.
+
+    Args:
+        qubits (Iterable[int]): Qubit indices.
+
+    Returns:
+        numpy.uint64: Bit mask.
+    """
+    mask = 0
+    for q in qubits:
+        mask |= 1 << int(q)
+    return np.uint64(mask)
+
+def get_bits(values: np.ndarray, qubits) -> np.ndarray:
+    """
+    Extract the bits at the given qubit positions.
+
+    Args:
+        values (numpy.ndarray): Array of packed bits (uint64).
+        qubits (Iterable[int]): Qubit indices.
+
+    Returns:
+        numpy.ndarray: uint8 array of shape values.shape + (len(qubits),).
+    """
+    qubits = np.asarray(list(qubits), dtype=np.uint64)
+    return ((values[..., None] >> qubits) & np.uint64(1)).astype(np.uint8)
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """
+    Number of set bits of each element of a uint64 array.
+
+    Args:
+        values (numpy.ndarray): Array of uint64.
+
+    Returns:
+        numpy.ndarray: Array of int with the same shape.
+    """
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    as_bytes = values.view(np.uint8).reshape(values.shape + (8,))
+    return _POPCOUNT_TABLE[as_bytes].sum(-1, dtype=np.int64)
+
+def packed_weight(paulis: np.ndarray, mask: np.uint64 = None) -> np.ndarray:
+    """
+    Compute the weights of packed Pauli strings.
+
+    Args:
+        paulis (numpy.ndarray): Structured array of dtype PAULI_DTYPE.
+        mask (numpy.uint64, optional): Only count the qubits in this bit mask.
+
+    Returns:
+        numpy.ndarray: Weights.
+    """
+    support = paulis['x'] | paulis['z']
+    if mask is not None:
+        support = support & mask
+    return popcount(support)
+
+def pauli_sort_key(paulis: np.ndarray, num_qubits: int) -> np.ndarray:
+    """
+    Integer keys ordering packed Pauli strings like their strings, i.e. '-' < 'X' < 'Y' < 'Z'
+    with qubit 0 the most significant.
+
+    Args:
+        paulis (numpy.ndarray): Structured array of dtype PAULI_DTYPE.
+        num_qubits (int): Number of qubits (at most 32).
+
+    Returns:
+        numpy.ndarray: uint64 keys with the same shape as paulis.
+    """
+    assert num_qubits <= 32, 'sort keys support at most 32 qubits'
+    keys = np.zeros(paulis.shape, dtype=np.uint64)
+    one = np.uint64(1)
+    for j in range(num_qubits):
+        x = (paulis['x'] >> np.uint64(j)) & one
+        z = (paulis['z'] >> np.uint64(j)) & one
+        # '-': 0, 'X': 1, 'Y': 2, 'Z': 3
+        keys = (keys << np.uint64(2)) | (x + np.uint64(3) * z - np.uint64(2) * x * z)
+    return keys
+
+def clifford_transform_packed(paulis: np.ndarray, gate: str, position: Tuple[int]) -> np.ndarray:
+    """
+    Applies a Clifford gate IN PLACE to every packed Pauli string of an array.
+    Same convention as clifford_transform_dict.
+
+    Args:
+        paulis (numpy.ndarray): Structured array of dtype PAULI_DTYPE.
+        gate (str): Clifford gate ('I', 'H', 'S', 'CX' or 'CZ').
+        position (Tuple[int]): Positions to apply the gate.
+
+    Returns:
+        numpy.ndarray: The same (transformed) array.
+    """
+    x, z = paulis['x'], paulis['z']
+    one = np.uint64(1)
+    if gate == 'I':
+        pass
+    elif gate == 'H':
+        q = np.uint64(position[0])
+        flip = ((x >> q) ^ (z >> q)) & one
+        x ^= flip << q
+        z ^= flip << q
+    elif gate == 'S':
+        q = np.uint64(position[0])
+        z ^= x & (one << q)
+    elif gate == 'CX':
+        c, t = np.uint64(position[0]), np.uint64(position[1])
+        x ^= ((x >> c) & one) << t
+        z ^= ((z >> t) & one) << c
+    elif gate == 'CZ':
+        a, b = np.uint64(position[0]), np.uint64(position[1])
+        xa, xb = (x >> a) & one, (x >> b) & one
+        z ^= (xa << b) | (xb << a)
+    else:
+        raise ValueError(f'Unknown Clifford gate {gate}')
+    return paulis
+
 def pauli_weight(p_str):
     """
     Compute the weight of a Pauli string.
@@ -235,12 +423,12 @@ def common_qecc(name) -> Tuple[str]:
     # return [list(stabilizer) for stabilizer in qecc_dict[name]]
     return qecc_dict[name]
 
-def get_sequence(name: str) -> Tuple[Tuple[str, Tuple[int]]]:
+def get_sequence(name: str = None) -> Tuple[Tuple[str, Tuple[int]]]:
     """
     Returns a sequence of Clifford gates based on the specified name.
 
     Args:
-        name (str): Name of the sequence.
+        name (str): Name of the sequence, None for the dict of all sequences by name.
 
     Returns:
         Tuple[Tuple[str, Tuple[int]]]: Sequence of Clifford gates.
@@ -471,6 +659,8 @@ def get_sequence(name: str) -> Tuple[Tuple[str, Tuple[int]]]:
             *[('H', (i,)) for i in [2,3,5,6]],
         ),
     }
+    if name is None:
+        return sequence_dict
     return sequence_dict[name]
 
 def compute_stabilizer_group(stabilizer_generators: List[List[str]]) -> List[List[str]]:
@@ -607,6 +797,30 @@ def test_compute_stabilizer_group():
     test_func = lambda input: tuple([''.join(elem) for elem in compute_stabilizer_group([list(stab) for stab in input])])
     run_test(test_cases, test_func, 'compute_stabilizer_group', outfunc=set)
 
+def test_pack_paulis():
+    """
+    Tests the pack_paulis and unpack_paulis methods.
+    """
+    test_cases = {
+        ('XZ-', '--Y'): ('XZ-', '--Y'),
+        ('ZZZZ---', '-XX-YY-', '-------'): ('ZZZZ---', '-XX-YY-', '-------'),
+    }
+    run_test(test_cases, lambda input: tuple(unpack_paulis(pack_paulis(input), len(input[0]))), 'pack_paulis')
+
+def test_clifford_transform_packed():
+    """
+    Tests the clifford_transform_packed method against clifford_transform_dict.
+    """
+    test_cases = {}
+    for gate in ['I', 'H', 'S', 'CX', 'CZ']:
+        num_locs = 2 if gate in ['CX', 'CZ'] else 1
+        for p in itertools.product(['-','X','Y','Z'], repeat=num_locs):
+            test_cases[(gate, ''.join(p))] = clifford_transform_dict[gate][''.join(p)]
+    test_func = lambda input: unpack_paulis(
+        clifford_transform_packed(pack_paulis([input[1]]), input[0], tuple(range(len(input[1])))),
+        len(input[1]))[0]
+    run_test(test_cases, test_func, 'clifford_transform_packed')
+
 def test_lowest_weight_equivalent():
     print('>> lowest_weight_equivalent - No Test <<')
     pass
@@ -618,6 +832,8 @@ def test_all():
     test_clifford_transform_dict()
     test_clifford_transform_sequence()
     test_compute_stabilizer_group()
+    test_pack_paulis()
+    test_clifford_transform_packed()
     test_lowest_weight_equivalent()
     print()
     print()
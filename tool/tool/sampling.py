@@ -0,0 +1,374 @@
+import os
+import math
+import time
+from statistics import NormalDist
+import numpy as np
+from tool import dispatch
+from tool.testing import run_test
+
+"""
+Adaptive number of shots: a configuration is sampled in batches until the confidence intervals of its rates
+(logical failure, acceptance, ...) reach a target relative precision, or the budget is spent.
+
+A batch is a function run_batch(num_shots, seed) returning, for every tracked rate, the number of events and of
+trials, e.g. {'acceptance': (accepted, shots), 'failure': (failed, accepted)}; noisy_batch builds it for a noisy gate
+sequence (tool.dispatch.simulate). The batches grow at most geometrically towards the number of shots the current
+estimates need, so a point is not over-sampled, and low-rate points get the shots they need instead of a fixed count.
+A rate with no event yet has no relative precision: it runs to the budget, unless its upper bound falls below
+min_rate.
+
+Methods:
+    wilson_interval(...): Wilson score interval of a binomial rate.
+    clopper_pearson_interval(...): Exact (Clopper-Pearson) interval of a binomial rate.
+    relative_precision(...): Half-width of the interval over the estimate.
+    shots_needed(...): Trials needed for a relative precision at the current estimate.
+    sample_until_precise(...): Sample one configuration in batches until its rates are precise.
+    noisy_batch(...): Batch function of a noisy gate sequence.
+    adaptive_sweep(...): sample_until_precise over several configurations, with the time left of the sweep.
+    test_all(): Runs all the test methods.
+"""
+
+def _z(confidence: float) -> float:
+    return NormalDist().inv_cdf(0.5 + confidence/2)
+
+def wilson_interval(successes: int, trials: int, confidence: float = 0.95) -> tuple[float, float]:
+    """
+    Wilson score interval of a binomial rate.
+
+    Args:
+        successes (int): Number of events.
+        trials (int): Number of trials.
+        confidence (float): Confidence level.
+
+    Returns:
+        tuple[float, float]: Lower and upper bounds, (0, 1) without trials.
+
+    Example:
+        >>> np.round(wilson_interval(5, 100), 4)
+        array([0.0215, 0.1118])
+    """
+    if trials == 0:
+        return 0., 1.
+    z = _z(confidence)
+    p = successes / trials
+    center = (p + z**2/(2*trials)) / (1 + z**2/trials)
+    half_width = z * math.sqrt(p*(1 - p)/trials + z**2/(4*trials**2)) / (1 + z**2/trials)
+    return max(0., center - half_width), min(1., center + half_width)
+
+def _betainc(a: float, b: float, x: float) -> float:
+    # regularized incomplete beta function, continued fraction (modified Lentz)
+    if x <= 0. or x >= 1.:
+        return float(x >= 1.)
+    if x > (a + 1) / (a + b + 2):
+        return 1. - _betainc(b, a, 1. - x)
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a*math.log(x) + b*math.log1p(-x)) / a
+    tiny = 1e-300
+    c, d = 1., 1. - (a + b)*x/(a + 1)
+    d = 1. / (d if abs(d) > tiny else tiny)
+    f = d
+    for m in range(1, 10000):
+        for numerator in (m*(b - m)*x / ((a + 2*m - 1)*(a + 2*m)),
+                          -(a + m)*(a + b + m)*x / ((a + 2*m)*(a + 2*m + 1))):
+            d = 1. + numerator*d
+            d = 1. / (d if abs(d) > tiny else tiny)
+            c = 1. + numerator/c
+            c = c if abs(c) > tiny else tiny
+            f *= c*d
+        if abs(c*d - 1.) < 1e-15:
+            break
+    return front * f
+
+def _beta_quantile(q: float, a: float, b: float) -> float:
+    low, high = 0., 1.
+    for _ in range(100):
+        middle = (low + high) / 2
+        if _betainc(a, b, middle) < q:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+def clopper_pearson_interval(successes: int, trials: int, confidence: float = 0.95) -> tuple[float, float]:
+    """
+    Exact (Clopper-Pearson) interval of a binomial rate, from the quantiles of the beta distribution.
+
+    Args:
+        successes (int): Number of events.
+        trials (int): Number of trials.
+        confidence (float): Confidence level.
+
+    Returns:
+        tuple[float, float]: Lower and upper bounds, (0, 1) without trials.
+
+    Example:
+        >>> np.round(clopper_pearson_interval(0, 10), 4)
+        array([0.    , 0.3085])
+    """
+    alpha = 1 - confidence
+    low = 0. if successes == 0 else _beta_quantile(alpha/2, successes, trials - successes + 1)
+    high = 1. if successes == trials else _beta_quantile(1 - alpha/2, successes + 1, trials - successes)
+    return low, high
+
+INTERVALS = {'wilson': wilson_interval, 'clopper-pearson': clopper_pearson_interval}
+
+def relative_precision(successes: int, trials: int, interval: str = 'wilson', confidence: float = 0.95) -> float:
+    """
+    Half-width of the confidence interval over the estimated rate.
+
+    Args:
+        successes (int): Number of events.
+        trials (int): Number of trials.
+        interval (str): Interval in INTERVALS.
+        confidence (float): Confidence level.
+
+    Returns:
+        float: Relative precision, inf without events.
+    """
+    if successes == 0:
+        return math.inf
+    low, high = INTERVALS[interval](successes, trials, confidence)
+    return (high - low) / 2 / (successes / trials)
+
+def shots_needed(successes: int, trials: int, precision: float, confidence: float = 0.95) -> float:
+    """
+    Number of trials for a relative precision at the current estimate, z^2 (1 - p) / (p precision^2) from the normal
+    approximation.
+
+    Args:
+        successes (int): Number of events.
+        trials (int): Number of trials.
+        precision (float): Target relative precision.
+        confidence (float): Confidence level.
+
+    Returns:
+        float: Number of trials, inf without events.
+    """
+    if successes == 0:
+        return math.inf
+    p = successes / trials
+    return _z(confidence)**2 * (1 - p) / (p * precision**2)
+
+def _format_time(seconds: float) -> str:
+    if not math.isfinite(seconds):
+        return '?'
+    return time.strftime('%H:%M:%S', time.gmtime(seconds))
+
+def sample_until_precise(
+        run_batch,
+        precision: float = 0.1,
+        max_shots: int = 10**6,
+        min_shots: int = 100,
+        interval: str = 'wilson',
+        confidence: float = 0.95,
+        min_rate: float = 0.,
+        seed: int = None,
+        verbose: bool = False,
+        name: str = '',
+        ) -> dict:
+    """
+    Sample a configuration in batches until the relative precision of all its rates reaches the target, or the
+    budget is spent.
+
+    Args:
+        run_batch (callable): run_batch(num_shots, seed) returning {rate name: (events, trials)}, see noisy_batch.
+        precision (float): Target relative precision (half-width of the interval over the estimate) of every rate.
+        max_shots (int): Budget of shots.
+        min_shots (int): Size of the first batch, and smallest number of shots.
+        interval (str): Interval in INTERVALS.
+        confidence (float): Confidence level of the intervals.
+        min_rate (float): Rates whose upper bound falls below it are precise enough (e.g. no logical failure seen).
+        seed (int): Master seed, every batch gets its own spawned seed.
+        verbose (bool): Print the estimates, the throughput (shots/s) and the time left after every batch.
+        name (str): Name printed with the progress.
+
+    Returns:
+        dict: shots, counts ({rate: (events, trials)}), estimates ({rate: (rate, lower, upper)}), converged (bool),
+            reason, elapsed (s) and throughput (shots/s).
+
+    Raises:
+        ValueError: If the interval is unknown or max_shots or min_shots is not positive.
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f'unknown interval {interval}, expected one of {list(INTERVALS)}')
+    if max_shots < 1 or min_shots < 1:
+        raise ValueError(f'max_shots and min_shots should be at least 1, got {max_shots} and {min_shots}')
+    seeds = np.random.SeedSequence(seed)
+    counts, shots, batch, start = {}, 0, min(min_shots, max_shots), time.perf_counter()
+    while batch > 0:
+        for rate, (events, trials) in run_batch(batch, seeds.spawn(1)[0]).items():
+            previous = counts.get(rate, (0, 0))
+            counts[rate] = (previous[0] + int(events), previous[1] + int(trials))
+        shots += batch
+        elapsed = time.perf_counter() - start
+
+        estimates, needed = {}, 0
+        for rate, (events, trials) in counts.items():
+            low, high = INTERVALS[interval](events, trials, confidence)
+            estimates[rate] = (events / trials if trials else math.nan, low, high)
+            if relative_precision(events, trials, interval, confidence) > precision and high >= min_rate:
+                # trials of a rate can be a fraction of the shots (e.g. failures among accepted shots)
+                needed = max(needed, shots_needed(events, trials, precision, confidence) * shots / max(trials, 1))
+        converged = needed == 0 and shots >= min_shots
+        throughput = shots / elapsed if elapsed > 0 else math.inf
+        remaining = 0 if converged else min(needed, max_shots) - shots
+        if verbose:
+            rates = ', '.join(f'{rate} {p:.3g} [{low:.3g}, {high:.3g}]' for rate, (p, low, high) in estimates.items())
+            print(f'{name + ": " if name else ""}{shots} shots, {rates}, {throughput:.0f} shots/s, '
+                  f'{_format_time(max(remaining, 0) / throughput)} left')
+        if converged:
+            reason = f'relative precision {precision} reached'
+            break
+        if shots >= max_shots:
+            reason = f'budget of {max_shots} shots spent'
+            break
+        # at most double, so that a poor early estimate does not overshoot, and at least a tenth more, since the
+        # normal approximation of shots_needed can fall just short of the interval
+        batch = int(min(max(needed - shots, min_shots - shots, shots // 10, 1), shots, max_shots - shots))
+    return {'shots': shots, 'counts': counts, 'estimates': estimates, 'converged': converged, 'reason': reason,
+            'elapsed': elapsed, 'throughput': throughput}
+
+def noisy_batch(
+        gate_sequence: list[tuple[str, tuple[int]]],
+        num_qubits: int,
+        num_meas: int,
+        failure,
+        observables: list = (),
+        accept = None,
+        noise_1q = None,
+        noise_2q = None,
+        meas_noise = None,
+        noise_prob_1q = 0.,
+        noise_prob_2q = 0.,
+        engine: str = None,
+        noise_model = None,
+        ):
+    """
+    Batch function of a noisy gate sequence for sample_until_precise, on the engine of tool.dispatch.simulate.
+
+    Args:
+        gate_sequence, num_qubits, num_meas, noise_*: See noisy_sim.run_noisy_stabilizer_circuit.
+        failure (callable): failure(obs_results, measurements) returning a bool array, True for the logical failures.
+        observables (list): (coefficient, Pauli string) specs or [observable, label] pairs passed to failure.
+        accept (callable): accept(measurements) returning a bool array, True for the accepted shots (e.g. no flag
+            raised), all shots if None.
+        engine (str): Engine of tool.dispatch.simulate, None to select it.
+        noise_model (tool.noise_model.NoiseModel): If given, replaces the noise_* arguments.
+
+    Returns:
+        callable: run_batch(num_shots, seed) returning {'acceptance': (accepted, shots), 'failure': (failures among
+            the accepted shots, accepted)}, without acceptance if accept is None.
+
+    Example:
+        >>> flags = [1, 2, 4, 5, 7, 8]
+        >>> run_batch = noisy_batch(gate_sequence, num_qubits, num_meas, lambda obs, meas: obs[:, 0].real < 0,
+        ...                         [(1, 'Z 0 Z 1 Z 2 Z 3 Z 4 Z 5 Z 6')], lambda meas: meas[:, flags].sum(1) == 0,
+        ...                         'XYZ', 'XYZ', 1e-2, 1e-2, 1e-2)
+        >>> sample_until_precise(run_batch, precision=0.1)['estimates']['failure']
+    """
+    def run_batch(num_shots, seed):
+        result = dispatch.simulate(gate_sequence, num_qubits, num_meas, num_shots, observables,
+                                   ('measurements', 'observables'), noise_1q, noise_2q, meas_noise, noise_prob_1q,
+                                   noise_prob_2q, seed=seed, engine=engine, noise_model=noise_model)
+        accepted = np.ones(num_shots, dtype=bool) if accept is None else np.asarray(accept(result['measurements']))
+        failed = np.asarray(failure(result['observables'], result['measurements'])) & accepted
+        counts = {'failure': (failed.sum(), accepted.sum())}
+        if accept is not None:
+            counts['acceptance'] = (accepted.sum(), num_shots)
+        return counts
+    return run_batch
+
+def adaptive_sweep(configurations: dict, verbose: bool = False, **kwargs) -> dict:
+    """
+    sample_until_precise over several configurations, e.g. the noise strengths of a threshold plot.
+
+    Args:
+        configurations (dict): Batch functions (noisy_batch) by configuration name.
+        verbose (bool): Print the progress of every configuration and the time left of the sweep, estimated from the
+            time of the configurations done.
+        **kwargs: Arguments of sample_until_precise (precision, max_shots, ...).
+
+    Returns:
+        dict: Results of sample_until_precise by configuration name.
+    """
+    results, start = {}, time.perf_counter()
+    for i, (name, run_batch) in enumerate(configurations.items()):
+        results[name] = sample_until_precise(run_batch, verbose=verbose, name=str(name), **kwargs)
+        if verbose:
+            elapsed = time.perf_counter() - start
+            shots = sum(result['shots'] for result in results.values())
+            print(f'{i + 1}/{len(configurations)} configurations, {shots} shots, {shots / elapsed:.0f} shots/s, '
+                  f'sweep {_format_time((len(configurations) - i - 1) * elapsed / (i + 1))} left')
+    return results
+
+
+############################## TESTING ##############################
+def _bernoulli_batch(rates: dict):
+    # batch of independent events with the given rates
+    def run_batch(num_shots, seed):
+        rng = np.random.default_rng(seed)
+        return {rate: (rng.binomial(num_shots, p), num_shots) for rate, p in rates.items()}
+    return run_batch
+
+def test_intervals():
+    """
+    Test the Wilson and Clopper-Pearson intervals against reference values (scipy.stats.beta quantiles).
+    """
+    test_cases = {
+        'wilson 5/100': (wilson_interval, 5, 100, (0.021544, 0.111752)),
+        'wilson 0/50': (wilson_interval, 0, 50, (0., 0.071348)),
+        'clopper-pearson 5/100': (clopper_pearson_interval, 5, 100, (0.016432, 0.112835)),
+        'clopper-pearson 0/10': (clopper_pearson_interval, 0, 10, (0., 0.308497)),
+        'clopper-pearson 10/10': (clopper_pearson_interval, 10, 10, (0.691503, 1.)),
+        'clopper-pearson 3/100000': (clopper_pearson_interval, 3, 100000, (6.1868e-06, 8.7670e-05)),
+    }
+    def test_func(name):
+        func, successes, trials, expected = test_cases[name]
+        bounds = func(successes, trials)
+        return bool(np.allclose(bounds, expected, rtol=1e-4, atol=1e-6))
+    run_test([list(test_cases), [True]*len(test_cases)], test_func, 'intervals')
+
+def _raises(func):
+    try:
+        func()
+    except Exception as error:
+        return type(error)
+
+def test_sample_until_precise():
+    """
+    Test the stopping rules on Bernoulli batches and on a noisy measurement: the precision is reached with fewer
+    shots than the budget, rates without events run to the budget unless min_rate stops them, and the estimate of
+    a measurement error rate covers its true value.
+    """
+    high_rate = sample_until_precise(_bernoulli_batch({'failure': 0.05}), 0.2, 10**6, seed=1)
+    low_rate = sample_until_precise(_bernoulli_batch({'failure': 0.005, 'acceptance': 0.9}), 0.2, 10**6, seed=1)
+    never = sample_until_precise(_bernoulli_batch({'failure': 0.}), 0.2, 10**4, seed=1)
+    below = sample_until_precise(_bernoulli_batch({'failure': 0.}), 0.2, 10**6, min_rate=1e-3,
+                                 interval='clopper-pearson', seed=1)
+    measurement = sample_until_precise(noisy_batch([('Meas', (0, 0))], 1, 1, lambda obs, meas: meas[:, 0] == 1,
+                                                   meas_noise=0.1), 0.1, 10**5, seed=2)
+    test_cases = {
+        'high rate': lambda: (high_rate['converged'], 1000 < high_rate['shots'] < 3000,
+                              relative_precision(*high_rate['counts']['failure']) <= 0.2),
+        'low rate': lambda: (low_rate['converged'], 10000 < low_rate['shots'] < 30000,
+                             relative_precision(*low_rate['counts']['failure']) <= 0.2),
+        'no event': lambda: (never['converged'], never['shots'] == 10**4, never['reason'].startswith('budget')),
+        'below min_rate': lambda: (below['converged'], below['shots'] < 10**4, below['estimates']['failure'][2] < 1e-3),
+        'measurement error': lambda: (measurement['converged'], measurement['estimates']['failure'][1] < 0.1 <
+                                      measurement['estimates']['failure'][2]),
+        'no budget': lambda: _raises(lambda: sample_until_precise(_bernoulli_batch({'failure': 0.1}), 0.2, 0)),
+    }
+    answers = {'high rate': (True, True, True), 'low rate': (True, True, True), 'no event': (False, True, True),
+               'below min_rate': (True, True, True), 'measurement error': (True, True), 'no budget': ValueError}
+    run_test(answers, lambda x: test_cases[x](), 'sample_until_precise')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_intervals()
+    test_sample_until_precise()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
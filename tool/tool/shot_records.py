@@ -0,0 +1,362 @@
+import os
+import json
+import tempfile
+import numpy as np
+from typing import Dict, List, Iterator, Tuple
+from tool.catalog import content_hash
+from tool.testing import run_test
+
+"""
+Bit-packed shot records on disk.
+
+A record file holds the measurement outcomes of every shot as one bit-packed row (little bit order), after a
+fixed-size JSON header describing the circuit hash, noise parameters, seed and the layout of the measurement keys.
+Rows are appended chunk by chunk while a simulation runs, and read back through np.memmap without copying, so
+post-selection and decoding can stream over more shots than fit in memory. A provisional header is written as soon
+as the layout is known, so the rows of a run that did not close its record are recovered from the file size.
+
+File layout:
+    8 bytes     magic b'PQSHOTS1'
+    8 bytes     header size H (little-endian uint64)
+    H bytes     JSON header, padded with spaces
+    rest        num_shots x row_bytes uint8 rows, starting at a 64-byte aligned offset
+
+Methods:
+    circuit_hash(...): Stable hash of a circuit or gate sequence for the header.
+    ShotRecordWriter: Append measurement chunks to a record file.
+    read_shot_record(...): Header and memory-mapped rows of a record file.
+    unpack_measurements(...): Unpack rows into a dict of measurement key -> bits.
+    iter_shot_chunks(...): Stream a record file chunk by chunk.
+    any_bits(...): Post-select on packed rows without unpacking them.
+    test_all(): Runs all the test methods.
+"""
+
+MAGIC = b'PQSHOTS1'
+FORMAT_VERSION = 1
+
+def circuit_hash(circuit) -> str:
+    """
+    Stable hash of a circuit (cirq circuit, gate sequence, ...), as used by the results catalog.
+
+    Args:
+        circuit: Circuit or gate sequence.
+
+    Returns:
+        str: SHA-256 hex digest.
+    """
+    return content_hash(circuit)
+
+def _key_layout(key_widths: Dict[str, int]) -> List[List]:
+    """(key, bit offset, width) of every measurement key, in order."""
+    offsets = np.cumsum([0] + list(key_widths.values()))
+    return [[key, int(offset), int(width)] for key, offset, width in zip(key_widths, offsets, key_widths.values())]
+
+def pack_measurements(measurements: Dict[str, np.ndarray], layout: List[List]) -> np.ndarray:
+    """
+    Pack the measurements of a chunk of shots into rows.
+
+    Args:
+        measurements (Dict[str, np.ndarray]): Measurement key -> array (shots x width) of 0/1.
+        layout (List[List]): (key, bit offset, width) of every key, as in the header.
+
+    Returns:
+        np.ndarray: uint8 rows (shots x row_bytes).
+    """
+    bits = np.concatenate([np.asarray(measurements[key], dtype=np.uint8).reshape(-1, width)
+                           for key, _, width in layout], axis=1)
+    return np.packbits(bits, axis=1, bitorder='little')
+
+class ShotRecordWriter:
+    """
+    Append measurement chunks to a shot record file.
+    A provisional header (complete False) is written once the layout is known, and rewritten with the number of
+    shots on close.
+
+    Example:
+        >>> with ShotRecordWriter('shots.bin', seed=0, noise={'p_depol': 1e-3}) as writer:
+        ...     writer.append({'synd_X1': synd, 'flag_X1': flag})
+        >>> header, rows = read_shot_record('shots.bin')
+    """
+    def __init__(
+        self,
+        filename: str,
+        key_widths: Dict[str, int] = None,
+        circuit_hash: str = None,
+        noise: dict = None,
+        seed: int = None,
+        metadata: dict = None,
+        header_size: int = 4096,
+    ):
+        """
+        Args:
+            filename (str): Record file, overwritten.
+            key_widths (Dict[str, int]): Measurement key -> number of bits, in row order.
+                Inferred from the first chunk when None.
+            circuit_hash (str): Hash of the simulated circuit, see circuit_hash.
+            noise (dict): Noise parameters.
+            seed (int): Master seed of the simulation.
+            metadata (dict): Any other JSON-serializable information.
+            header_size (int): Bytes reserved for the JSON header, rounded so that rows are 64-byte aligned.
+        """
+        self.filename = filename
+        self.header = {
+            'version': FORMAT_VERSION,
+            'circuit_hash': circuit_hash,
+            'noise': noise,
+            'seed': seed,
+            'metadata': metadata or {},
+            'keys': None,
+            'num_bits': None,
+            'row_bytes': None,
+            'num_shots': 0,
+            'complete': False,
+        }
+        self.header_size = -(-(len(MAGIC) + 8 + header_size)//64)*64 - len(MAGIC) - 8
+        self.file = open(filename, 'wb')
+        if key_widths is not None:
+            self._set_layout(key_widths)
+        else:
+            self._write_header()
+
+    def _set_layout(self, key_widths: Dict[str, int]) -> None:
+        layout = _key_layout(key_widths)
+        num_bits = sum(width for _, _, width in layout)
+        self.header.update({'keys': layout, 'num_bits': num_bits, 'row_bytes': -(-num_bits//8)})
+        self._write_header()
+
+    def _write_header(self) -> None:
+        header = json.dumps(self.header).encode()
+        if len(header) > self.header_size:
+            self.file.close()
+            raise ValueError(f'Header of {len(header)} bytes does not fit in {self.header_size} bytes')
+        self.file.seek(0)
+        self.file.write(MAGIC + np.uint64(self.header_size).tobytes() + header.ljust(self.header_size))
+        self.file.seek(0, os.SEEK_END)
+        self.file.flush()
+
+    def append(self, measurements: Dict[str, np.ndarray]) -> None:
+        """
+        Append a chunk of shots.
+
+        Args:
+            measurements (Dict[str, np.ndarray]): Measurement key -> array (shots x width) of 0/1.
+        """
+        if self.header['keys'] is None:
+            # one bit per entry of a shot, also for an empty first chunk
+            self._set_layout({key: int(np.prod(np.shape(value)[1:])) for key, value in measurements.items()})
+        rows = pack_measurements(measurements, self.header['keys'])
+        self.file.write(rows.tobytes())
+        self.header['num_shots'] += len(rows)
+
+    def close(self) -> None:
+        """Write the header and close the file."""
+        if self.file.closed:
+            return
+        self.header['complete'] = True
+        self._write_header()
+        self.file.close()
+
+    def __enter__(self) -> 'ShotRecordWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def read_shot_record(filename: str) -> Tuple[dict, np.ndarray]:
+    """
+    Read the header and memory-map the rows of a shot record file (read-only, no copy).
+    For a record that was not closed (complete False), the number of shots is that of the complete rows in the file.
+
+    Args:
+        filename (str): Record file.
+
+    Returns:
+        Tuple[dict, np.ndarray]: Header and np.memmap of uint8 rows (num_shots x row_bytes).
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{filename} is not a shot record')
+        header_size = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(header_size))
+    offset = len(MAGIC) + 8 + header_size
+    if not header.get('complete', True) and header['row_bytes']:
+        header['num_shots'] = (os.path.getsize(filename) - offset)//header['row_bytes']
+    if header['num_shots'] == 0:
+        return header, np.zeros((0, header['row_bytes'] or 0), dtype=np.uint8)
+    rows = np.memmap(filename, dtype=np.uint8, mode='r', offset=offset,
+                     shape=(header['num_shots'], header['row_bytes']))
+    return header, rows
+
+def unpack_measurements(rows: np.ndarray, header: dict, keys: List[str] = None) -> Dict[str, np.ndarray]:
+    """
+    Unpack rows into measurement arrays.
+
+    Args:
+        rows (np.ndarray): uint8 rows, e.g. a slice of the memmap from read_shot_record.
+        header (dict): Header of the record.
+        keys (List[str]): Keys to unpack, all by default.
+
+    Returns:
+        Dict[str, np.ndarray]: Measurement key -> uint8 array (shots x width).
+    """
+    bits = np.unpackbits(rows, axis=1, count=header['num_bits'], bitorder='little')
+    return {key: bits[:, offset:offset + width] for key, offset, width in header['keys']
+            if keys is None or key in keys}
+
+def iter_shot_chunks(filename: str, chunk_size: int = 1 << 20, keys: List[str] = None) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Stream a shot record chunk by chunk, only one unpacked chunk is in memory at a time.
+
+    Args:
+        filename (str): Record file.
+        chunk_size (int): Number of shots per chunk.
+        keys (List[str]): Keys to unpack, all by default.
+
+    Yields:
+        Dict[str, np.ndarray]: Measurement key -> uint8 array (chunk shots x width).
+    """
+    header, rows = read_shot_record(filename)
+    for start in range(0, len(rows), chunk_size):
+        yield unpack_measurements(np.asarray(rows[start:start + chunk_size]), header, keys)
+
+def any_bits(rows: np.ndarray, header: dict, keys: List[str]) -> np.ndarray:
+    """
+    Whether any bit of the given measurement keys is set, computed on the packed rows.
+    E.g. any_bits(rows, header, ['flag_X1', 'flag_X2', 'flag_X3']) is the flagged mask for post-selection.
+
+    Args:
+        rows (np.ndarray): uint8 rows.
+        header (dict): Header of the record.
+        keys (List[str]): Measurement keys.
+
+    Returns:
+        np.ndarray: Boolean mask over the rows.
+    """
+    mask = np.zeros(header['num_bits'], dtype=np.uint8)
+    for key, offset, width in header['keys']:
+        if key in keys:
+            mask[offset:offset + width] = 1
+    byte_mask = np.packbits(mask, bitorder='little')
+    columns = np.flatnonzero(byte_mask)
+    return (rows[:, columns] & byte_mask[columns]).any(axis=1)
+
+
+############################## TESTING ##############################
+def test_shot_records():
+    """
+    Test writing a record in chunks and reading it back.
+    """
+    rng = np.random.default_rng(0)
+    widths = {'synd_X1': 1, 'flag_X1': 1, 'X_on_data': 7, 'extra': 13}
+    chunks = [{key: rng.integers(0, 2, size=(n, w)).astype(np.uint8) for key, w in widths.items()}
+              for n in [100, 37, 0, 250]]
+    expected = {key: np.concatenate([chunk[key] for chunk in chunks]) for key in widths}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'shots.bin')
+        with ShotRecordWriter(filename, circuit_hash=circuit_hash((('H', (0,)),)), noise={'p': 1e-3}, seed=7) as writer:
+            for chunk in chunks:
+                writer.append(chunk)
+        header, rows = read_shot_record(filename)
+        unpacked = unpack_measurements(rows, header)
+        streamed = list(iter_shot_chunks(filename, chunk_size=64, keys=['X_on_data']))
+        flagged = any_bits(rows, header, ['flag_X1', 'extra'])
+        results = {
+            'header': (header['num_shots'], header['row_bytes'], header['seed'], header['noise']),
+            'roundtrip': all(np.array_equal(unpacked[key], expected[key]) for key in widths),
+            'stream': np.array_equal(np.concatenate([c['X_on_data'] for c in streamed]), expected['X_on_data']),
+            'any_bits': np.array_equal(flagged, (expected['flag_X1'].any(1) | expected['extra'].any(1))),
+            'memmap': isinstance(rows, np.memmap),
+        }
+        del rows
+    answers = {'header': (387, 3, 7, {'p': 1e-3}), 'roundtrip': True, 'stream': True, 'any_bits': True, 'memmap': True}
+    run_test([list(answers), list(answers.values())], lambda x: results[x], 'shot_records')
+
+def test_partial_records():
+    """
+    Test an empty first chunk without key widths, and reading a record whose writer was not closed.
+    """
+    rng = np.random.default_rng(1)
+    chunk = {'synd': rng.integers(0, 2, size=(10, 12)), 'flag': rng.integers(0, 2, size=10)}
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'shots.bin')
+        with ShotRecordWriter(filename) as writer:
+            writer.append({'synd': np.zeros((0, 12)), 'flag': np.zeros(0)})
+            writer.append(chunk)
+        header, rows = read_shot_record(filename)
+        empty_first = (header['num_shots'], [width for _, _, width in header['keys']],
+                       np.array_equal(unpack_measurements(rows, header)['synd'], chunk['synd']))
+        del rows
+
+        # a crashed run: rows flushed without the final header, and half a row
+        crashed = os.path.join(tmp, 'crashed.bin')
+        writer = ShotRecordWriter(crashed, key_widths={'synd': 12, 'flag': 1})
+        writer.append(chunk)
+        writer.file.write(b'\0')
+        writer.file.flush()
+        header, rows = read_shot_record(crashed)
+        recovered = (header['complete'], header['num_shots'],
+                     np.array_equal(unpack_measurements(rows, header)['flag'][:, 0], chunk['flag']))
+        del rows
+        writer.file.close()
+        unused = os.path.join(tmp, 'unused.bin')
+        ShotRecordWriter(unused).file.close()
+        results = {'empty first chunk': empty_first, 'unclosed': recovered,
+                   'no chunk': read_shot_record(unused)[1].shape}
+    answers = {'empty first chunk': (10, [12, 1], True), 'unclosed': (False, 10, True), 'no chunk': (0, 0)}
+    run_test([list(answers), list(answers.values())], lambda x: results[x], 'shot_records (partial)')
+
+def test_runner_writers():
+    """
+    Test that the writer paths of the parallel runners store the measurements they would return.
+    """
+    from tool import noisy_sim
+    sequence = [('H', (0,)), ('CX', (0, 2)), ('CX', (1, 2)), ('Meas', (2, 0)), ('H', (1,)), ('Meas', (1, 1))]
+    args = (sequence, 3, 2, 250, [(1, 'Z 0')], 'XYZ', 'XYZ', 0.05, 0.01, 0.01)
+    _, expected = noisy_sim.run_noisy_stabilizer_circuit_parallel(*args, seed=3, num_workers=1, chunk_size=100)
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'noisy.bin')
+        with ShotRecordWriter(filename, seed=3) as writer:
+            _, returned = noisy_sim.run_noisy_stabilizer_circuit_parallel(*args, seed=3, num_workers=1,
+                                                                          chunk_size=100, writer=writer)
+        header, rows = read_shot_record(filename)
+        results = {'run_noisy_stabilizer_circuit_parallel': (returned, header['num_shots'],
+                                                             np.array_equal(unpack_measurements(rows, header)['meas'],
+                                                                            expected))}
+        del rows
+    answers = {'run_noisy_stabilizer_circuit_parallel': (None, 250, True)}
+
+    try:
+        import cirq
+        import qsim_utils
+    except ImportError:
+        print('>> run_sharded writer - No Test (qsim_utils not found, run from the repository root) <<')
+    else:
+        qubits = cirq.LineQubit.range(3)
+        circuit = cirq.Circuit(cirq.H(qubits[0]), cirq.CX(qubits[0], qubits[1]), cirq.measure(*qubits[:2], key='a'),
+                               cirq.H(qubits[2]), cirq.measure(qubits[2], key='b'))
+        expected = qsim_utils.run_sharded(circuit, 300, seed=5, num_workers=1, chunk_size=128)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'qsim.bin')
+            with ShotRecordWriter(filename, qsim_utils.measurement_layout(circuit)) as writer:
+                returned = qsim_utils.run_sharded(circuit, 300, seed=5, num_workers=1, chunk_size=128, writer=writer)
+            header, rows = read_shot_record(filename)
+            unpacked = unpack_measurements(rows, header)
+            results['run_sharded'] = (returned, header['num_shots'],
+                                      all(np.array_equal(unpacked[key], expected[key]) for key in expected))
+            del rows, unpacked
+        answers['run_sharded'] = (None, 300, True)
+    run_test([list(answers), list(answers.values())], lambda x: results[x], 'shot_records (runner writers)')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_shot_records()
+    test_partial_records()
+    test_runner_writers()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
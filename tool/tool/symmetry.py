@@ -0,0 +1,297 @@
+import os
+import itertools
+import numpy as np
+from typing import Callable, Dict, List, Tuple
+from tool import gf2, qec
+from tool.testing import run_test
+
+"""
+Qubit-permutation automorphisms of stabilizer codes, to evaluate one representative per orbit of equivalent
+placements or errors.
+
+A permutation p of the qubits (qubit q goes to p[q]) is an automorphism if it maps the stabilizer group onto itself
+(signs are ignored, which is exact for CSS codes with positive generators). The Steane code has 168 of them. Checks
+that only depend on the code up to relabelling, like the fault-tolerance of a flag circuit placed on the code qubits
+stab_loc (stabilizer_sim.check_FT, tool.flag_search.evaluate_flag_circuit) or the lowest-weight equivalent of an error,
+give the same result on a whole orbit, so they are evaluated once per orbit and expanded back.
+
+Automorphisms are found by backtracking over the images of qubits 0, 1, ... The generators are row-reduced with the
+bits of qubit q in positions 2q and 2q+1 and pivots on the highest bit, so the rows whose highest bit belongs to qubit
+k span the elements supported on qubits 0..k: as soon as qubit k has an image, these rows must map into the group.
+
+Methods:
+    code_automorphisms(...): Qubit permutations preserving the stabilizer group of a code.
+    permute_pauli(...): Image of a Pauli string under a qubit permutation.
+    code_placements(...): Placements of a stabilizer on the qubits of a code.
+    placement_symmetries(...): Permutations of the positions of a placement induced by the automorphisms.
+    canonical_placement(...): Representative of the orbit of a placement.
+    placement_orbits(...): Placements grouped by orbit.
+    evaluate_placements(...): Evaluate a function once per orbit of placements and expand the results.
+    error_orbits(...): Representatives of the orbits of a list of Pauli errors.
+    test_all(): Runs all the test methods.
+"""
+
+def _interleaved(pauli) -> int:
+    # bit 2q: Z part of qubit q, bit 2q+1: X part
+    return sum((p in 'ZY') << 2*q | (p in 'XY') << 2*q + 1 for q, p in enumerate(pauli))
+
+def _permute_int(value: int, permutation) -> int:
+    image = 0
+    for q, p in enumerate(permutation):
+        image |= (value >> 2*q & 3) << 2*p
+    return image
+
+def code_automorphisms(generators: List[str]) -> List[Tuple[int]]:
+    """
+    Qubit permutations mapping the stabilizer group of a code onto itself.
+
+    Args:
+        generators (List[str]): Stabilizer generators (str or list of characters, '-' or 'I' for identity).
+
+    Returns:
+        List[Tuple[int]]: Permutations p (qubit q goes to p[q]) in lexicographic order, the identity first.
+
+    Example:
+        >>> len(code_automorphisms(['ZZIZZII', 'ZIZZIIZ', 'IIIZZZZ', 'XXIXXII', 'XIXXIIX', 'IIIXXXX']))
+        168
+    """
+    num_qubits = len(generators[0])
+    basis = gf2.rref_ints([_interleaved(g) for g in generators])
+    # rows to check once qubit k has an image
+    completed = [[row for pivot, row in basis if pivot // 2 == k] for k in range(num_qubits)]
+    automorphisms, permutation, used = [], [None]*num_qubits, [False]*num_qubits
+
+    def in_group(row, k):
+        image = 0
+        for q in range(k + 1):
+            image |= (row >> 2*q & 3) << 2*permutation[q]
+        return gf2.reduce_int(image, basis) == 0
+
+    def descend(k):
+        if k == num_qubits:
+            automorphisms.append(tuple(permutation))
+            return
+        for image in range(num_qubits):
+            if used[image]:
+                continue
+            permutation[k], used[image] = image, True
+            if all(in_group(row, k) for row in completed[k]):
+                descend(k + 1)
+            used[image] = False
+        permutation[k] = None
+
+    descend(0)
+    return automorphisms
+
+def permute_pauli(pauli, permutation) -> str:
+    """
+    Image of a Pauli string under a qubit permutation.
+
+    Args:
+        pauli (str): Pauli string.
+        permutation (Tuple[int]): Qubit q goes to permutation[q].
+
+    Returns:
+        str: The permuted string.
+    """
+    image = [None]*len(pauli)
+    for q, p in enumerate(permutation):
+        image[p] = pauli[q]
+    return ''.join(image)
+
+def code_placements(generators: List[str], stabilizer: str) -> List[Tuple[int]]:
+    """
+    Ordered placements of a stabilizer on the qubits of a code: the code qubit of every letter, such that the placed
+    Pauli is in the stabilizer group.
+
+    Args:
+        generators (List[str]): Stabilizer generators (str or list of characters, '-' or 'I' for identity).
+        stabilizer (str): Pauli on the positions, e.g. 'ZZZZ'.
+
+    Returns:
+        List[Tuple[int]]: Placements in lexicographic order.
+
+    Example:
+        >>> len(code_placements(['ZZIZZII', 'ZIZZIIZ', 'IIIZZZZ', 'XXIXXII', 'XIXXIIX', 'IIIXXXX'], 'ZZZZ'))
+        168
+    """
+    num_qubits = len(generators[0])
+    basis = gf2.rref_ints([_interleaved(g) for g in generators])
+    placements = []
+    for support in itertools.combinations(range(num_qubits), len(stabilizer)):
+        for letters in sorted(set(itertools.permutations(stabilizer))):
+            pauli = ['-']*num_qubits
+            for q, p in zip(support, letters):
+                pauli[q] = p
+            if gf2.reduce_int(_interleaved(pauli), basis) == 0:
+                placements += [placement for placement in itertools.permutations(support)
+                               if all(pauli[q] == p for q, p in zip(placement, stabilizer))]
+    return sorted(placements)
+
+def placement_symmetries(automorphisms: List[Tuple[int]], placement: List[int]) -> List[Tuple[int]]:
+    """
+    Permutations s of the positions of a placement (position i goes to s[i]) induced by the automorphisms that map
+    the set of its qubits onto itself: p(placement[i]) = placement[s[i]].
+
+    Args:
+        automorphisms (List[Tuple[int]]): Output of code_automorphisms.
+        placement (List[int]): Code qubit of every position, e.g. the stab_loc of a flag circuit.
+
+    Returns:
+        List[Tuple[int]]: The distinct permutations, the identity first.
+    """
+    position = {q: i for i, q in enumerate(placement)}
+    symmetries = {}
+    for p in automorphisms:
+        if all(p[q] in position for q in placement):
+            symmetries.setdefault(tuple(position[p[q]] for q in placement))
+    return sorted(symmetries)
+
+def canonical_placement(placement: List[int], automorphisms: List[Tuple[int]]) -> Tuple[Tuple[int], Tuple[int]]:
+    """
+    Representative of the orbit of a placement, the smallest of its images.
+
+    Args:
+        placement (List[int]): Code qubit of every position.
+        automorphisms (List[Tuple[int]]): Output of code_automorphisms.
+
+    Returns:
+        Tuple[Tuple[int], Tuple[int]]: The representative and an automorphism mapping the placement onto it.
+    """
+    return min((tuple(p[q] for q in placement), p) for p in automorphisms)
+
+def placement_orbits(placements: List[List[int]], automorphisms: List[Tuple[int]]) -> Dict[Tuple[int], List]:
+    """
+    Group placements by orbit.
+
+    Args:
+        placements (List[List[int]]): Placements.
+        automorphisms (List[Tuple[int]]): Output of code_automorphisms.
+
+    Returns:
+        Dict[Tuple[int], List]: For every representative, the (placement, automorphism mapping it onto the
+            representative) of the placements in its orbit, in the order of placements.
+    """
+    orbits = {}
+    for placement in placements:
+        representative, p = canonical_placement(placement, automorphisms)
+        orbits.setdefault(representative, []).append((tuple(placement), p))
+    return orbits
+
+def evaluate_placements(
+        evaluate: Callable,
+        placements: List[List[int]],
+        automorphisms: List[Tuple[int]],
+        expand: Callable = None,
+        ) -> Dict[Tuple[int], object]:
+    """
+    Evaluate a relabelling-invariant function on one placement per orbit, and expand the results to all placements.
+
+    Args:
+        evaluate (Callable): evaluate(placement) for a placement (tuple of code qubits).
+        placements (List[List[int]]): Placements.
+        automorphisms (List[Tuple[int]]): Output of code_automorphisms.
+        expand (Callable): expand(result, p) mapping the result of the representative to the placement sent onto it
+            by the automorphism p (e.g. to permute the errors of a look-up table), the same result by default.
+
+    Returns:
+        Dict[Tuple[int], object]: Result of every placement.
+
+    Example:
+        >>> steane = ['ZZIZZII', 'ZIZZIIZ', 'IIIZZZZ', 'XXIXXII', 'XIXXIIX', 'IIIXXXX']
+        >>> placements = [p for comb in [[0,1,3,4],[0,2,3,6],[3,4,5,6]] for p in itertools.permutations(comb)]
+        >>> verdicts = evaluate_placements(lambda loc: check_FT(steane, flag_error_set, flags, np.array(loc))[0],
+        ...                                placements, code_automorphisms(steane))
+    """
+    results = {}
+    for representative, members in placement_orbits(placements, automorphisms).items():
+        result = evaluate(representative)
+        for placement, p in members:
+            results[placement] = result if expand is None else expand(result, p)
+    return results
+
+def error_orbits(errors: List[str], automorphisms: List[Tuple[int]]) -> Tuple[List[str], np.ndarray]:
+    """
+    Representatives of the orbits of Pauli errors under the automorphisms, the smallest image of each error.
+
+    Args:
+        errors (List[str]): Pauli strings (str or list of characters).
+        automorphisms (List[Tuple[int]]): Output of code_automorphisms.
+
+    Returns:
+        Tuple[List[str], np.ndarray]: The distinct representatives, and the index of the representative of every
+            error, as np.unique(..., return_inverse=True).
+    """
+    representatives, inverse = {}, np.zeros(len(errors), dtype=np.intp)
+    for i, error in enumerate(errors):
+        value = _interleaved(error)
+        canonical = min(_permute_int(value, p) for p in automorphisms)
+        inverse[i] = representatives.setdefault(canonical, (len(representatives), i))[0]
+    return [''.join(errors[i]) for _, i in representatives.values()], inverse
+
+
+############################## TESTING ##############################
+STEANE = ['ZZIZZII', 'ZIZZIIZ', 'IIIZZZZ', 'XXIXXII', 'XIXXIIX', 'IIIXXXX']
+
+def _brute_force_automorphisms(generators: List[str]) -> List[Tuple[int]]:
+    basis = gf2.rref_ints([_interleaved(g) for g in generators])
+    return [p for p in itertools.permutations(range(len(generators[0])))
+            if all(gf2.reduce_int(_permute_int(_interleaved(g), p), basis) == 0 for g in generators)]
+
+def test_code_automorphisms():
+    """
+    Test the automorphisms against all permutations for the Steane and 5-qubit codes, and their orders.
+    """
+    five_qubit = ['XZZX-', '-XZZX', 'X-XZZ', 'ZX-XZ']
+    test_cases = {
+        'steane': (168, True),
+        '5-qubit code': (10, True),
+        'toric 2x2': (32, True),
+    }
+    def test_func(name):
+        generators = {'steane': STEANE, '5-qubit code': five_qubit, 'toric 2x2': gf2.toric_code(2)}[name]
+        automorphisms = code_automorphisms(generators)
+        return len(automorphisms), automorphisms == _brute_force_automorphisms(generators)
+    run_test(test_cases, test_func, 'code_automorphisms')
+
+def test_orbits():
+    """
+    Test that the orbit representatives give the same lowest-weight equivalents as all errors of weight <= 2 of the
+    Steane code, and the placements of the full_steane_flagged notebook their number of orbits.
+    """
+    automorphisms = code_automorphisms(STEANE)
+    group = qec.compute_stabilizer_group([list(g) for g in STEANE])
+    errors = [gf2._pauli_string(value, 7) for value in gf2._low_weight_paulis(7, 2)]
+    representatives, inverse = error_orbits(errors, automorphisms)
+    weights = np.array([qec.lowest_weight_equivalent(list(e), group)[1] for e in representatives])
+    placements = [p for comb in [[0, 1, 3, 4], [0, 2, 3, 6], [3, 4, 5, 6]] for p in itertools.permutations(comb)]
+    orbits = placement_orbits(placements, automorphisms)
+    test_cases = {
+        'error orbits': (211, True),
+        'placement orbits': (1, 72),
+        'symmetries of a placement': 24,
+        'code placements': (168, 1, True),
+    }
+    outputs = {
+        'error orbits': (len(errors), np.array_equal(weights[inverse],
+                                                     [qec.lowest_weight_equivalent(list(e), group)[1]
+                                                      for e in errors])),
+        'placement orbits': (len(orbits), len(next(iter(orbits.values())))),
+        'symmetries of a placement': len(placement_symmetries(automorphisms, [0, 3, 1, 4])),
+        'code placements': (len(code_placements(STEANE, 'ZZZZ')),
+                            len(placement_orbits(code_placements(STEANE, 'ZZZZ'), automorphisms)),
+                            set(placements) <= set(code_placements(STEANE, 'ZZZZ'))),
+    }
+    run_test(test_cases, lambda name: outputs[name], 'orbits')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_code_automorphisms()
+    test_orbits()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()
@@ -0,0 +1,230 @@
+import os
+import math
+import itertools
+import numpy as np
+from typing import List, Tuple
+from tool import qec, gf2
+from tool.testing import run_test
+
+"""
+Exact error-weight tables from coset weight enumerators, without listing the 4^n Pauli errors.
+
+An error E is identified by its signature, the bits (-1)^s_i of the observables g_i it anticommutes with. With the
+stabilizers completed by one X and one Z logical operator per logical qubit, the signature is the pair (syndrome,
+logical class) and the errors sharing it form one coset E * S of the stabilizer group, so the minimum-weight
+equivalent of E is the lowest weight present in its coset. The weight enumerators of all 2^m cosets follow from the
+MacWilliams identity: the Fourier transform of the enumerator table at a subset u of the observables only depends on
+the weight j of their product,
+    sum_E (-1)^(u.s(E)) z^wt(E) = (1 + 3z)^(n - j) (1 - z)^j,
+so the table is the fast Walsh-Hadamard transform of these Krawtchouk polynomials over the group generated by the
+observables. The cost is O(m 2^m n) integer operations, exact for any code whose 2^m cosets fit in memory.
+
+This replaces the tables of the figures_of_merit notebook: err_counts (error_weight_counts), all_probs
+(error_weight_probabilities) and, grouped by coset, obs_dist (the observables of a coset are (-1)^(u.s)).
+
+Methods:
+    coset_observables(...): Stabilizers completed with logical operators.
+    group_weights(...): Weights of all the products of a list of Paulis.
+    coset_weight_enumerators(...): Weight enumerator of every (syndrome, logical class) coset.
+    min_weights(...): Minimum weight of every coset.
+    error_weight_counts(...): Number of errors of each apparent weight by equivalent weight.
+    error_weight_probabilities(...): Same, normalized by apparent weight.
+    test_all(): Runs all the test methods.
+"""
+
+def coset_observables(generators: List[str]) -> List[str]:
+    """
+    Complete stabilizer generators with logical operators, so that the signature of an error determines its coset.
+
+    Args:
+        generators (List[str]): Stabilizer generators (str or list of characters, '-' or 'I' for identity).
+
+    Returns:
+        List[str]: The generators followed by the k logical X then the k logical Z operators ('-' for identity),
+            unchanged if the generators already have rank n (a stabilizer state).
+
+    Example:
+        >>> coset_observables(['XZZX-', '-XZZX', 'X-XZZ', 'ZX-XZ'])
+        ['XZZX-', '-XZZX', 'X-XZZ', 'ZX-XZ', '-XX-Z', 'X--XY']
+    """
+    generators = [''.join(g).replace('I', '-') for g in generators]
+    num_qubits = len(generators[0])
+    logical_x, logical_z = gf2.logical_operators(gf2.pack_rows(gf2.tab_from_paulis(generators)), num_qubits)
+    logicals = np.vstack([logical_x, logical_z])
+    if not len(logicals):
+        return generators
+    return generators + [p.replace('I', '-') for p in gf2.paulis_from_tab(gf2.unpack_rows(logicals, 2*num_qubits))]
+
+def group_weights(paulis: List[str]) -> np.ndarray:
+    """
+    Weights of the 2^m products of subsets of m Pauli operators.
+
+    Args:
+        paulis (List[str]): Pauli strings, at most 64 qubits.
+
+    Returns:
+        np.ndarray: Array of 2^m int, entry u is the weight of the product of the paulis[i] with bit i of u set.
+    """
+    packed = qec.pack_paulis(paulis)
+    x, z = np.zeros(1, dtype=np.uint64), np.zeros(1, dtype=np.uint64)
+    for p in packed:
+        x = np.concatenate([x, x ^ p['x']])
+        z = np.concatenate([z, z ^ p['z']])
+    return qec.popcount(x | z)
+
+def _krawtchouk(num_qubits: int, dtype) -> np.ndarray:
+    # row j: coefficients of (1 + 3z)^(n - j) (1 - z)^j
+    table = np.zeros((num_qubits + 1, num_qubits + 1), dtype=dtype)
+    for j in range(num_qubits + 1):
+        for w in range(num_qubits + 1):
+            table[j, w] = sum(math.comb(num_qubits - j, a) * 3**a * math.comb(j, w - a) * (-1)**(w - a)
+                              for a in range(max(0, w - j), min(w, num_qubits - j) + 1))
+    return table
+
+def coset_weight_enumerators(generators: List[str], complete: bool = True) -> Tuple[np.ndarray, List[str]]:
+    """
+    Weight enumerators of the errors sharing each signature.
+
+    Args:
+        generators (List[str]): Stabilizer generators (str or list of characters, '-' or 'I' for identity).
+        complete (bool): Add the logical operators (coset_observables), otherwise the signature is the syndrome only.
+
+    Returns:
+        Tuple[np.ndarray, List[str]]: The (2^m, n+1) table whose entry [s, w] is the number of weight-w errors
+            anticommuting with the observables i for which bit i of s is set, and the m observables. The entries are
+            int64, or Python int when 4^n 2^m does not fit.
+
+    Example:
+        >>> enumerators, observables = coset_weight_enumerators(['ZZZZ---', '-ZZ-ZZ-', '--ZZ-ZZ',
+        ...                                                      'XXXX---', '-XX-XX-', '--XX-XX'])
+        >>> enumerators.shape, enumerators[0]
+        ((256, 8), array([ 1,  0,  0,  0, 21,  0, 42,  0]))
+    """
+    observables = coset_observables(generators) if complete else [''.join(g) for g in generators]
+    num_qubits, m = len(observables[0]), len(observables)
+    dtype = np.int64 if 2*num_qubits + m < 62 else object
+    # Fourier transform of the table, then the (self-inverse up to 2^m) Walsh-Hadamard transform
+    table = _krawtchouk(num_qubits, dtype)[group_weights(observables)]
+    for bit in range(m):
+        view = table.reshape(-1, 2, 2**bit, num_qubits + 1)
+        even, odd = view[:, 0], view[:, 1]
+        even += odd
+        odd *= -2
+        odd += even
+    return table // 2**m, observables
+
+def min_weights(enumerators: np.ndarray) -> np.ndarray:
+    """
+    Minimum weight of every coset.
+
+    Args:
+        enumerators (np.ndarray): Table of coset_weight_enumerators.
+
+    Returns:
+        np.ndarray: Array of 2^m int, -1 for the signatures no error has (dependent observables).
+    """
+    present = enumerators > 0
+    return np.where(present.any(1), present.argmax(1), -1)
+
+def error_weight_counts(generators: List[str]) -> np.ndarray:
+    """
+    Number of errors of each weight by the weight of their minimum-weight equivalent.
+
+    Args:
+        generators (List[str]): Stabilizer generators (str or list of characters, '-' or 'I' for identity).
+
+    Returns:
+        np.ndarray: Array (n+1, d+1) whose entry [i, j] is the number of weight-i errors (apparent weight) whose
+            lowest-weight stabilizer equivalent has weight j, d being the largest such weight.
+
+    Example:
+        >>> error_weight_counts(['ZZZZ---', '-ZZ-ZZ-', '--ZZ-ZZ', 'XXXX---', '-XX-XX-', '--XX-XX', 'ZZZZZZZ'])[2]
+        array([  0,  21, 168,   0])
+    """
+    enumerators, _ = coset_weight_enumerators(generators)
+    weights = min_weights(enumerators)
+    counts = np.zeros((enumerators.shape[1], weights.max() + 1), dtype=enumerators.dtype)
+    for j in range(weights.max() + 1):
+        counts[:, j] = enumerators[weights == j].sum(0)
+    return counts
+
+def error_weight_probabilities(generators: List[str]) -> np.ndarray:
+    """
+    Probability that a uniformly random error of a given weight has a minimum-weight equivalent of each weight,
+    the all_probs table of the figures_of_merit notebook.
+
+    Args:
+        generators (List[str]): Stabilizer generators (str or list of characters, '-' or 'I' for identity).
+
+    Returns:
+        np.ndarray: Array (n+1, d+1) of float, rows summing to 1.
+    """
+    counts = error_weight_counts(generators)
+    return (counts / counts.sum(1, keepdims=True)).astype(float)
+
+
+############################## TESTING ##############################
+STEANE_LOGICAL0 = ['ZZZZ---', '-ZZ-ZZ-', '--ZZ-ZZ', 'XXXX---', '-XX-XX-', '--XX-XX', 'ZZZZZZZ']
+
+def _brute_force_enumerators(observables: List[str]) -> np.ndarray:
+    # signature and weight of each of the 4^n errors
+    num_qubits = len(observables[0])
+    errors = qec.pack_paulis(list(itertools.product('-XYZ', repeat=num_qubits)))
+    packed = qec.pack_paulis(observables)
+    signatures = np.zeros(len(errors), dtype=np.int64)
+    for i, g in enumerate(packed):
+        anticommute = qec.popcount((errors['x'] & g['z']) ^ (errors['z'] & g['x'])) % 2
+        signatures |= anticommute << i
+    table = np.zeros((2**len(observables), num_qubits + 1), dtype=np.int64)
+    np.add.at(table, (signatures, qec.popcount(errors['x'] | errors['z'])), 1)
+    return table
+
+def test_coset_weight_enumerators():
+    """
+    Test the enumerators against the signatures of all 4^n errors, for the Steane logical 0 state and the 5-qubit
+    code completed with its logical operators.
+    """
+    five_qubit = ['XZZX-', '-XZZX', 'X-XZZ', 'ZX-XZ']
+    test_cases = {'steane logical 0': STEANE_LOGICAL0, '5-qubit code': five_qubit,
+                  '5-qubit code syndrome': five_qubit}
+    def check(name):
+        enumerators, observables = coset_weight_enumerators(test_cases[name], complete='syndrome' not in name)
+        return len(observables), np.array_equal(enumerators, _brute_force_enumerators(observables))
+    answers = {'steane logical 0': (7, True), '5-qubit code': (6, True), '5-qubit code syndrome': (4, True)}
+    run_test(answers, check, 'coset_weight_enumerators')
+
+def test_error_weight_counts():
+    """
+    Test the error-weight tables against qec.lowest_weight_equivalent on all 4^n errors (5-qubit code), the all_probs
+    table of the figures_of_merit notebook (Steane logical 0) and the row sums for a 3x3 toric code (18 qubits).
+    """
+    five_qubit = ['XZZX-', '-XZZX', 'X-XZZ', 'ZX-XZ']
+    group = qec.compute_stabilizer_group([list(g) for g in five_qubit])
+    exhaustive = np.zeros((6, 6), dtype=np.int64)
+    for error in itertools.product('-XYZ', repeat=5):
+        exhaustive[qec.pauli_weight(error), qec.lowest_weight_equivalent(list(error), group)[1]] += 1
+    exhaustive = exhaustive[:, :exhaustive.any(0).nonzero()[0].max() + 1]
+    notebook = np.array([[1., 0., 0., 0.], [0., 1., 0., 0.], [0., 0.1111, 0.8889, 0.], [0.0074, 0.1333, 0.8, 0.0593],
+                         [0.0074, 0.163, 0.7506, 0.079], [0.0082, 0.1687, 0.7572, 0.0658],
+                         [0.0082, 0.1687, 0.7791, 0.0439], [0.0069, 0.1536, 0.7554, 0.0841]])
+    toric = error_weight_counts(gf2.toric_code(3))
+    test_cases = {
+        '5-qubit code': lambda: np.array_equal(error_weight_counts(five_qubit), exhaustive),
+        'steane notebook': lambda: np.array_equal(error_weight_probabilities(STEANE_LOGICAL0).round(4), notebook),
+        'toric 3x3 rows': lambda: [int(row.sum()) for row in toric] ==
+                                  [math.comb(18, i) * 3**i for i in range(19)],
+        'toric 3x3 weight 1': lambda: toric[1].tolist() == [0, 54] + [0]*7,
+    }
+    run_test([list(test_cases), [True]*len(test_cases)], lambda x: test_cases[x](), 'error_weight_counts')
+
+def test_all():
+
+    print(f'\nTesting functions in {os.path.basename(__file__)} ...\n')
+    test_coset_weight_enumerators()
+    test_error_weight_counts()
+    print()
+    print()
+
+
+if __name__ == "__main__":
+    test_all()